@@ -0,0 +1,108 @@
+"""
+Benchmark: time to first token and end-of-turn latency of one chat turn,
+sequential (build prompt -> request -> save) vs ChatPipeline + SessionWriter.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_chat_pipeline [turns] [prompt_ms] [latency_ms] [connect_ms]
+
+The stub server answers after latency_ms, streams one chunk every 5 ms and
+spends connect_ms setting up every new connection (TCP/TLS handshake).
+Building the system prompt (memory retrieval) is simulated with a sleep of
+prompt_ms. Sessions are saved with fsync="always". Every turn is treated as
+coming after an idle period longer than the keep-alive timeout: both modes
+start on a cold connection, the pipeline warms it up while the prompt is built.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from openai import OpenAI
+
+from core.chat_pipeline import ChatPipeline
+from core.llm_client import Endpoint, LLMClient
+from core.session_manager import LocalSessionManager
+from core.session_writer import SessionWriter
+from core.stub_server import StubServer
+
+QUESTION = " ".join(["token"] * 50)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def build_prompt(prompt_ms):
+    time.sleep(prompt_ms / 1000)
+    return "system prompt"
+
+
+def sequential(server, manager, session, turns, prompt_ms):
+    ttft, end = [], []
+    for _ in range(turns):
+        client = OpenAI(base_url=server.base_url, api_key="stub")
+        started = time.perf_counter()
+        prompt = build_prompt(prompt_ms)
+        messages = [{"role": "system", "content": prompt}, {"role": "user", "content": QUESTION}]
+        parts = []
+        for chunk in client.chat.completions.create(model="stub", messages=messages, stream=True):
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not parts:
+                    ttft.append((time.perf_counter() - started) * 1000)
+                parts.append(chunk.choices[0].delta.content)
+        session.conversation += [{"role": "user", "content": QUESTION},
+                                 {"role": "assistant", "content": "".join(parts)}]
+        manager.save(session)
+        end.append((time.perf_counter() - started) * 1000)
+        client.close()
+    return ttft, end
+
+
+def pipelined(server, manager, session, turns, prompt_ms):
+    endpoint = Endpoint("chat", base_url=server.base_url, api_key="stub", model="stub")
+    pipeline = ChatPipeline(LLMClient(endpoint))
+    writer = SessionWriter(manager)
+    for _ in range(turns):
+        # 空闲期间连接已被服务端关闭
+        pipeline.runner.submit(pipeline.llm.aclose()).result()
+        pipeline.llm = LLMClient(endpoint)
+        pipeline.llm.async_client  # 客户端的创建不计入这一轮
+        pipeline.last_request = 0.0
+        turn = pipeline.stream(lambda: build_prompt(prompt_ms), [{"role": "user", "content": QUESTION}])
+        list(turn)
+        session.conversation += [{"role": "user", "content": QUESTION},
+                                 {"role": "assistant", "content": turn.text}]
+        writer.submit(session)
+        turn.finish()
+    writer.close()
+    stats = pipeline.stats()
+    pipeline.close()
+    return ([m.ttft_ms for m in pipeline.history], [m.end_of_turn_ms for m in pipeline.history]), stats
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    prompt_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 80
+    latency_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 60
+    connect_ms = float(sys.argv[4]) if len(sys.argv) > 4 else 60
+    server = StubServer(latency=latency_ms / 1000, token_latency=0.005, connect_latency=connect_ms / 1000).start()
+    print(f"{turns} turns, prompt build {prompt_ms:.0f} ms, server latency {latency_ms:.0f} ms, "
+          f"connect {connect_ms:.0f} ms")
+    print(f"{'mode':<12}{'ttft p50':>10}{'ttft p95':>10}{'end p50':>10}{'end p95':>10}")
+    try:
+        for name, run in (("sequential", sequential), ("pipeline", pipelined)):
+            with tempfile.TemporaryDirectory() as root:
+                manager = LocalSessionManager(root, fsync="always")
+                session = manager.new({"session_name": name})
+                result = run(server, manager, session, turns, prompt_ms)
+                (ttft, end) = result[0] if name == "pipeline" else result
+                manager.close()
+            print(f"{name:<12}{percentile(ttft, .5):>10.1f}{percentile(ttft, .95):>10.1f}"
+                  f"{percentile(end, .5):>10.1f}{percentile(end, .95):>10.1f}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
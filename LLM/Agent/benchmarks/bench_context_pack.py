@@ -0,0 +1,65 @@
+"""
+Benchmark: memory block of the system prompt for one chat turn.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_context_pack [memories] [budget]
+
+A popular trigger used to append the full original_text of every matched
+memory. This compares the size of that block with the token-budgeted
+packer (full text -> summary fallback, near-duplicate removal) and the
+cost of packing with and without the per-version cache.
+"""
+import random
+import sys
+import time
+
+from core.context_packer import ContextPacker
+from core.memory import Memory
+from core.tokens import estimate_tokens
+
+
+def make_memories(n: int, rng: random.Random):
+    facts = ["用户每天早上喝一杯拿铁", "用户的咖啡机是三年前买的", "用户周末去打网球", "用户住在上海浦东",
+             "用户正在学习日语", "用户对花生过敏"]
+    memories = []
+    for i in range(n):
+        fact = rng.choice(facts)
+        # 约三分之一是几乎重复的记忆（同一件事被反思多次）
+        text = fact + "。" if i % 3 == 0 else fact + "，" + "对话中补充的细节。" * rng.randint(5, 40)
+        memories.append(Memory(id=i + 1, original_text=text, summary=fact, created_at="2024-01-01 00:00:00"))
+    return memories
+
+
+def legacy(memories):
+    context = ""
+    for memory in memories:
+        context += f"\ncreated at [{memory.created_at}]\nsummary:\n{memory.original_text}\n"
+    return context
+
+
+def timed(fn, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    budget = int(sys.argv[2]) if len(sys.argv) > 2 else 1500
+    memories = make_memories(n, random.Random(0))
+    packer = ContextPacker()
+
+    legacy_ms, old_block = timed(lambda: legacy(memories), 20)
+    pack_ms, new_block = timed(lambda: packer._pack(memories, budget), 20)
+    packer.pack(memories, budget, version=1)
+    cached_ms, _ = timed(lambda: packer.pack(memories, budget, version=1), 1000)
+
+    print(f"memories={n} budget={budget}")
+    print(f"legacy block:        {estimate_tokens(old_block):8d} tokens  {legacy_ms:8.3f} ms")
+    print(f"packed block:        {estimate_tokens(new_block):8d} tokens  {pack_ms:8.3f} ms")
+    print(f"packed (cache hit):  {'':>8}         {cached_ms:8.4f} ms")
+
+
+if __name__ == "__main__":
+    main()
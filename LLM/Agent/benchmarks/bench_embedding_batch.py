@@ -0,0 +1,71 @@
+"""
+Benchmark: embedding a reflection's worth of summaries.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_embedding_batch [summaries] [duplicate_ratio]
+
+Compares the old one-request-per-summary path (fresh client per call)
+with the pooled, batched and cached pipeline, both against the local stub
+server with a simulated 20 ms round trip. Reports requests, tokens
+saved and per-batch p50/p99 latency.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import openai
+
+from core.db import ConnectionPool
+from core.embedding import CachedEmbedding, OpenAIEmbedding
+from core.stub_server import StubServer
+
+
+def make_summaries(n: int, duplicate_ratio: float):
+    random.seed(0)
+    unique = [f"用户在第{i}次对话中提到了自己的爱好和习惯，编号 {i}" for i in range(n)]
+    return [random.choice(unique[:max(1, i)]) if random.random() < duplicate_ratio else unique[i]
+            for i in range(n)]
+
+
+def run_naive(server: StubServer, summaries):
+    start = time.perf_counter()
+    for text in summaries:
+        client = openai.OpenAI(base_url=server.base_url, api_key="stub")
+        client.embeddings.create(input=text, model="stub")
+    return time.perf_counter() - start
+
+
+def run_batched(server: StubServer, summaries, db_path: str):
+    backend = OpenAIEmbedding(base_url=server.base_url, api_key="stub")
+    pool = ConnectionPool(db_path)
+    cached = CachedEmbedding(backend, pool)
+    start = time.perf_counter()
+    cached.embed(summaries)   # 一次反思
+    cached.embed(summaries)   # 同样的总结再次出现，全部命中缓存
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return elapsed, cached.stats()
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    duplicate_ratio = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    summaries = make_summaries(n, duplicate_ratio)
+
+    with StubServer(latency=0.02) as server, tempfile.TemporaryDirectory() as tmp:
+        naive = run_naive(server, summaries * 2)
+        naive_requests = len(server.requests)
+        batched, stats = run_batched(server, summaries, os.path.join(tmp, "memory.db"))
+
+    print(f"summaries embedded: {2 * n} ({duplicate_ratio:.0%} duplicates, then repeated)")
+    print(f"naive:   {naive_requests:>4} requests  {naive:.3f}s")
+    print(f"batched: {stats['batches']:>4} requests  {batched:.3f}s")
+    print(f"texts sent {stats['requested_texts']}, cache hits {stats['cache_hits']}, "
+          f"tokens used {stats['tokens']}, tokens saved {stats['tokens_saved']}")
+    print(f"per batch latency p50 {stats['p50_ms']:.1f} ms  p99 {stats['p99_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
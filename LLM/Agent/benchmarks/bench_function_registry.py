@@ -0,0 +1,44 @@
+"""
+Benchmark: time to import the functions package in a fresh interpreter, with
+the lazy registry (manifest only) vs importing every tool module up front
+(the previous behaviour, reproduced with list_functions()), plus the cost of
+the first call that imports a module and of rebuilding the manifest.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_function_registry [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+import functions
+
+SETUP = "import time; started = time.perf_counter()\n"
+REPORT = "\nprint((time.perf_counter() - started) * 1000)"
+CASES = {
+    "lazy import": "import functions",
+    "eager import": "import functions; functions.list_functions()",
+    "lazy + 1st call": "import functions; functions.get_function('shell_operations.execute_shell_command')",
+    "cold manifest": f"import os; os.remove({functions.MANIFEST_PATH!r}); import functions",
+}
+
+
+def measure(code: str) -> float:
+    output = subprocess.run([sys.executable, "-c", SETUP + code + REPORT], capture_output=True, text=True,
+                            check=True, cwd=os.getcwd()).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+    print(f"{runs} fresh interpreters per case, {len(functions.function_registry)} functions")
+    print(f"{'case':<18}{'median ms':>10}{'min ms':>10}")
+    for name, code in CASES.items():
+        timings = [measure(code) for _ in range(runs)]
+        print(f"{name:<18}{statistics.median(timings):>10.1f}{min(timings):>10.1f}")
+    functions.load_manifest()  # 恢复缓存
+
+
+if __name__ == "__main__":
+    main()
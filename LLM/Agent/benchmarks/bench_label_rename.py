@@ -0,0 +1,67 @@
+"""
+Benchmark: rename one label that is attached to every memory.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_label_rename [sizes...]
+
+Before the write-through cache every touched memory triggered an INSERT plus
+a full reload, so the cost grew quadratically with the number of memories.
+Since labels live in the MemoryLabels junction table the database side is a
+single UPDATE on Labels; what remains is patching the in-memory cache.
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from core.embedding import LocalEmbedding
+from core.memory import MemoryManager
+
+
+def populate(db_path: str, n: int):
+    """Bulk insert n memories carrying the label `old`"""
+    manager = MemoryManager(db_path, embedder=LocalEmbedding())
+    handler = manager.handler
+    now = datetime.now()
+
+    def insert(conn):
+        conn.executemany(
+            "INSERT INTO Memory (original_text, summary, created_at, updated_at) VALUES (?, ?, ?, ?);",
+            [(f"text {i}", f"summary {i}", now, now) for i in range(n)]
+        )
+        old, common = handler.label_id(conn, "old"), handler.label_id(conn, "common")
+        conn.executemany(
+            "INSERT INTO MemoryLabels (memory_id, label_id, position) VALUES (?, ?, ?);",
+            [(i, label, pos) for i in range(1, n + 1) for pos, label in enumerate((old, common))]
+        )
+
+    handler.pool.write(insert)
+    manager.add_label("old", "label to rename")
+    handler.close()
+
+
+def run(n: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "memory.db")
+        populate(db_path, n)
+        manager = MemoryManager(db_path, embedder=LocalEmbedding())
+
+        start = time.perf_counter()
+        manager.update_label("old", "new")
+        elapsed = time.perf_counter() - start
+
+        manager.handler.close()
+        return elapsed
+
+
+def main():
+    sizes = [int(x) for x in sys.argv[1:]] or [10_000, 100_000]
+    print(f"{'memories':>10} {'rename (s)':>12} {'per memory (us)':>16}")
+    for n in sizes:
+        elapsed = run(n)
+        print(f"{n:>10} {elapsed:>12.3f} {elapsed / n * 1e6:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
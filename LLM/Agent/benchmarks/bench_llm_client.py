@@ -0,0 +1,80 @@
+"""
+Benchmark: request latency with a new client per request vs the shared,
+pooled LLMClient, and success rate under injected transient failures.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_llm_client [requests] [connect_ms] [failure_rate]
+
+The stub server spends connect_ms on every new connection (TCP/TLS
+handshake). In the failure run every request has a failure_rate chance of
+a 503 (injected with StubServer.fail_next), once without retries (the SDK's
+own retries are off) and once with the LLMClient's retries.
+"""
+import random
+import sys
+import time
+
+import openai
+
+from core.llm_client import Endpoint, LLMClient
+from core.stub_server import StubServer
+
+
+def embed(client):
+    return client.embeddings.create(input=["记忆检索"], model="stub")
+
+
+def timed(run, requests):
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        run()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], sum(latencies)
+
+
+def flaky(server, llm, requests, failure_rate, seed=0):
+    rng = random.Random(seed)
+    ok = 0
+    for _ in range(requests):
+        if rng.random() < failure_rate:
+            server.fail_next(1, status=503)
+        try:
+            llm.call(embed)
+            ok += 1
+        except openai.APIStatusError:
+            server.httpd.failures.clear()
+    return ok
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    connect_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    with StubServer(dimension=256, connect_latency=connect_ms / 1000) as server:
+        endpoint = Endpoint("embedding", base_url=server.base_url, api_key="stub")
+
+        def per_request():
+            client = openai.OpenAI(base_url=server.base_url, api_key="stub")
+            embed(client)
+            client.close()
+
+        shared = LLMClient(endpoint)
+        print(f"{requests} requests, connect {connect_ms:.0f} ms")
+        for name, run in (("new client per request", per_request), ("shared LLMClient", lambda: shared.call(embed))):
+            p50, total = timed(run, requests)
+            print(f"  {name:<24} p50 {p50:7.1f} ms  total {total:8.1f} ms")
+        shared.close()
+
+        print(f"failure rate {failure_rate:.0%}")
+        for name, retries in (("no retries", 0), ("LLMClient retries", 3)):
+            llm = LLMClient(Endpoint("embedding", base_url=server.base_url, api_key="stub", max_retries=retries))
+            ok = flaky(server, llm, requests, failure_rate)
+            stats = llm.stats()
+            print(f"  {name:<24} succeeded {ok}/{requests}  requests {stats['requests']}  retries {stats['retries']}")
+            llm.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark: wall-clock time and LLM round trips for a plan step with several
+independent tool calls, one action per think (sequential) vs one batch of
+actions per think (ToolExecutor).
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_parallel_tools [files] [commands] [llm_latency_ms]
+
+Each step reads `files` source files with read_file_segment and runs
+`commands` shell commands that take ~100 ms. The think round trip is a
+chat completion against the stub server with llm_latency_ms latency.
+"""
+import glob
+import sys
+import time
+
+from core.llm_client import Endpoint, LLMClient
+from core.stub_server import StubServer
+from core.tool_executor import ToolExecutor
+from functions import function_registry
+
+READ = "filesystem_operations.read_file_segment"
+SHELL = "shell_operations.execute_shell_command"
+
+
+def think(llm, content):
+    return llm.call(lambda client: client.chat.completions.create(
+        model="stub", messages=[{"role": "user", "content": content[:2000]}])).choices[0].message.content
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    commands = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    latency_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 300
+    paths = sorted(glob.glob("core/*.py"))[:files]
+    actions = [{"action_name": READ, "parameters": {"file_path": p}} for p in paths] + \
+        [{"action_name": SHELL, "parameters": {"command": f"sleep 0.1; echo {i}"}} for i in range(commands)]
+
+    with StubServer(latency=latency_ms / 1000) as server:
+        llm = LLMClient(Endpoint("chat", base_url=server.base_url, api_key="stub"))
+        executor = ToolExecutor(function_registry)
+        think(llm, "warmup")
+        print(f"{len(actions)} independent actions, think latency {latency_ms:.0f} ms")
+
+        started = time.perf_counter()
+        before = llm.stats()["requests"]
+        for action in actions:
+            result = executor.run([action])[0]
+            think(llm, result.describe())
+        sequential = time.perf_counter() - started, llm.stats()["requests"] - before
+
+        started = time.perf_counter()
+        before = llm.stats()["requests"]
+        results = executor.run(actions)
+        think(llm, "\n\n".join(r.describe() for r in results))
+        batched = time.perf_counter() - started, llm.stats()["requests"] - before
+
+        for name, (elapsed, round_trips) in (("one action per think", sequential), ("batched", batched)):
+            print(f"  {name:<22} {elapsed * 1000:8.1f} ms  {round_trips} LLM round trips")
+        executor.close()
+        llm.close()
+
+
+if __name__ == "__main__":
+    main()
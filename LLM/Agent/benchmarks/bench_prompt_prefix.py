@@ -0,0 +1,89 @@
+"""
+Benchmark: prompt-prefix reuse and system-prompt build time over a run_plan
+session, old layout (static, memories, plan; rebuilt on every call) vs
+PromptAssembler (static, tools, plan, memories; memoized segments).
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_prompt_prefix [steps] [reruns] [retrieval_ms]
+
+Each plan step has a different query; the retrieved memories change every
+third step (consecutive steps usually hit the same memories). Both layouts
+contain the same static text, tool list, plan and memories. The
+conversation grows by one exchange per step. Between steps the Streamlit
+script reruns `reruns` times with the same preview query. Memory retrieval
+is simulated with a sleep. The reusable prefix is the common prefix (in
+estimated tokens) of each request with the previous request, the same
+measure for both layouts.
+"""
+import os
+import sys
+import time
+
+from core.prompt_assembler import PromptAssembler
+from core.tokens import estimate_tokens
+
+STATIC = "你是一个诚实、稳健的AI助手，尽力完成用户的要求。\n" * 30 + "已知能力有：\n"
+TOOLS = "".join(f"- tool_{i}: 读取或修改第 {i} 类数据\n" for i in range(20))
+PLAN = "1. 读取库存\n2. 汇总销量\n3. 生成补货建议\n"
+
+
+def memories(query, retrieval_ms):
+    time.sleep(retrieval_ms / 1000)
+    topic = query if query == "preview" else int(query.split()[1]) // 3
+    return "\n# 和用户有关的记忆：\n" + "".join(f"summary: 主题 {topic} 相关记忆 {i}\n" for i in range(15))
+
+
+def old_layout(query, retrieval_ms):
+    return STATIC + TOOLS + memories(query, retrieval_ms) + f"\n\n当前正在执行的计划：\n{PLAN}\n"
+
+
+def new_layout(assembler, query, version, retrieval_ms):
+    return assembler.assemble([
+        assembler.segment("static", None, lambda: STATIC),
+        assembler.segment("tools", 20, lambda: TOOLS),
+        assembler.segment("plan", PLAN, lambda: f"\n当前正在执行的计划：\n{PLAN}\n"),
+        assembler.segment("memories", (version, query), lambda: memories(query, retrieval_ms)),
+    ]).text
+
+
+def common_prefix_tokens(a: str, b: str) -> int:
+    n = len(os.path.commonprefix([a, b]))
+    return estimate_tokens(a[:n])
+
+
+def run(build, steps, reruns):
+    conversation, previous = "", ""
+    prompt_tokens = prefix_tokens = 0
+    build_ms = 0.0
+    for step in range(steps):
+        for _ in range(reruns):  # app.py 每次重新运行都构建一次预览
+            started = time.perf_counter()
+            build("preview")
+            build_ms += (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        system = build(f"step {step} result")
+        build_ms += (time.perf_counter() - started) * 1000
+        request = system + conversation + f"user: step {step} result\n"
+        prompt_tokens += estimate_tokens(request)
+        prefix_tokens += common_prefix_tokens(request, previous)
+        previous = request
+        conversation += f"user: step {step} result\nassistant: next action {step}\n"
+    return prompt_tokens, prefix_tokens, build_ms
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    reruns = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    retrieval_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+    assembler = PromptAssembler()
+    print(f"{steps} plan steps, {reruns} reruns per step, retrieval {retrieval_ms:.0f} ms")
+    for name, build in (("old layout", lambda q: old_layout(q, retrieval_ms)),
+                        ("assembler", lambda q: new_layout(assembler, q, 1, retrieval_ms))):
+        prompt_tokens, prefix_tokens, build_ms = run(build, steps, reruns)
+        print(f"  {name:<12} reusable prefix {prefix_tokens / prompt_tokens:6.1%} "
+              f"({prefix_tokens}/{prompt_tokens} tokens)  build {build_ms:7.1f} ms")
+    print(f"  segment hit ratio {assembler.stats()['segment_hit_ratio']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark: wall-clock time and model requests when a plan's think steps are
+re-run, without the response cache, with a warm readwrite cache, and in
+replay mode (fresh process, disk tier only).
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_response_cache [steps] [latency_ms]
+
+Each step is one ChatPipeline turn against the stub server (latency_ms
+before the first chunk, 5 ms between chunks) with the conversation growing
+by one exchange per step.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from core.chat_pipeline import ChatPipeline
+from core.llm_client import Endpoint, LLMClient
+from core.response_cache import ResponseCache
+from core.stub_server import StubServer
+
+
+def run_plan(pipeline, steps):
+    conversation = []
+    started = time.perf_counter()
+    for step in range(steps):
+        content = f"`@plan_decide_next`\naction_name: step_{step}\nresult: ok"
+        turn = pipeline.stream("system prompt", conversation + [{"role": "user", "content": content}],
+                               use_cache=True)
+        reply = "".join(turn)
+        conversation += [{"role": "user", "content": content}, {"role": "assistant", "content": reply}]
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 300
+    with StubServer(latency=latency_ms / 1000, token_latency=0.005) as server, \
+            tempfile.TemporaryDirectory() as root:
+        endpoint = Endpoint("chat", base_url=server.base_url, api_key="stub", model="stub")
+        path = os.path.join(root, "cache.db")
+        print(f"{steps} think steps, model latency {latency_ms:.0f} ms")
+        cache = ResponseCache(path)
+        runs = (("no cache", None), ("readwrite, cold", cache), ("readwrite, warm", cache),
+                ("replay", ResponseCache(path, mode="replay")))
+        for name, run_cache in runs:
+            pipeline = ChatPipeline(LLMClient(endpoint), cache=run_cache, warmup=False)
+            before = len(server.requests)
+            elapsed = run_plan(pipeline, steps)
+            pipeline.close()
+            print(f"  {name:<18} {elapsed:8.1f} ms  {len(server.requests) - before:3d} model requests")
+        for _, run_cache in runs[2:]:
+            run_cache.close()
+
+if __name__ == "__main__":
+    main()
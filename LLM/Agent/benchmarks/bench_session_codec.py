@@ -0,0 +1,98 @@
+"""
+Benchmark: bytes on disk, save latency and load latency of LocalSessionManager per codec.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_session_codec [sessions] [turns] [message_chars]
+
+Each session is built turn by turn with save() (append path), then compacted
+(rewrite path, BLOCK_RECORDS records per block). "legacy" is the old
+indent=4 JSON file per session for reference. Load latency is a full get();
+"tail" reads the last 10 messages through read_messages().
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from core.codec import CODECS
+from core.session_manager import LocalSessionManager
+
+WORDS = ["库存", "门店", "销量", "补货", "促销", "价格", "SKU", "order", "forecast", "region", "weekly", "趋势"]
+
+
+def turn(rng: random.Random, i: int, chars: int):
+    text = lambda: " ".join(rng.choice(WORDS) for _ in range(chars // 4))
+    return [{"role": role, "time": str(datetime.now()), "content": text(), "id": f"{role[0]}_{i}_{rng.random()}"}
+            for role in ("user", "assistant")]
+
+
+def directory_bytes(root: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for name in os.listdir(root)
+               if name.endswith((".json", ".jsonl")))
+
+
+def run(codec: str, sessions: int, turns: int, chars: int):
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as root:
+        manager = LocalSessionManager(root, fsync="none", codec=codec)
+        ids, save_ms = [], []
+        for _ in range(sessions):
+            session = manager.new({"session_name": "bench"})
+            for i in range(turns):
+                session.conversation.extend(turn(rng, i, chars))
+                start = time.perf_counter()
+                manager.save(session)
+                save_ms.append((time.perf_counter() - start) * 1000)
+            ids.append(session.session_id)
+        appended = directory_bytes(root)
+        for session_id in ids:
+            manager.compact(session_id)
+        compacted = directory_bytes(root)
+
+        manager.close()
+        manager = LocalSessionManager(root, codec=codec)  # 冷缓存：LogState 需要重新扫描
+        start = time.perf_counter()
+        for session_id in ids:
+            manager.get({"session_id": session_id})
+        load_ms = (time.perf_counter() - start) * 1000 / sessions
+        start = time.perf_counter()
+        for session_id in ids:
+            manager.read_messages(session_id, -10)
+        tail_ms = (time.perf_counter() - start) * 1000 / sessions
+        manager.close()
+    save_ms.sort()
+    return appended, compacted, sum(save_ms) / len(save_ms), save_ms[int(len(save_ms) * 0.99)], load_ms, tail_ms
+
+
+def legacy_bytes(sessions: int, turns: int, chars: int):
+    rng = random.Random(0)
+    total = 0
+    for _ in range(sessions):
+        conversation = [m for i in range(turns) for m in turn(rng, i, chars)]
+        total += len(json.dumps({"conversation": conversation}, indent=4, ensure_ascii=False).encode("utf-8"))
+    return total
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    chars = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+    print(f"{sessions} sessions x {turns} turns, ~{chars} chars per message")
+    print(f"legacy indent=4 JSON: {legacy_bytes(sessions, turns, chars) / 1e6:.2f} MB")
+    print(f"{'codec':>6} {'appended MB':>12} {'compacted MB':>13} {'save ms':>8} {'save p99':>9}"
+          f" {'load ms':>8} {'tail ms':>8}")
+    for codec in ["none"] + list(CODECS):
+        try:
+            appended, compacted, save_avg, save_p99, load_ms, tail_ms = run(codec, sessions, turns, chars)
+        except ImportError as e:
+            print(f"{codec:>6} skipped: {e}")
+            continue
+        print(f"{codec:>6} {appended / 1e6:>12.2f} {compacted / 1e6:>13.2f} {save_avg:>8.3f} {save_p99:>9.3f}"
+              f" {load_ms:>8.2f} {tail_ms:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark: LocalSessionManager.list with many sessions on disk.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_session_list [sessions] [messages_per_session]
+
+"legacy" is the previous implementation: glob every *.json, stat each file
+and json.load the full session (conversation included) to read its name.
+"index" queries the SQLite session index; the first page is what
+init_streamlit and the session dialog actually need.
+"""
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+from core.session_manager import LocalSessionManager
+
+
+def populate(root: str, n: int, messages: int):
+    conversation = [{"role": "user" if i % 2 == 0 else "assistant", "content": "你好" * 50,
+                     "time": "2024-01-01 00:00:00", "id": str(i)} for i in range(messages)]
+    manager = LocalSessionManager(root)
+    now = time.time()
+
+    def insert(conn):
+        rows = []
+        for i in range(n):
+            session_id = str(uuid.uuid4())
+            with open(os.path.join(root, f"{session_id}.json"), "w", encoding="utf-8") as f:
+                json.dump({"session_id": session_id, "session_name": f"session {i}", "conversation": conversation,
+                           "session_path": root}, f, ensure_ascii=False)
+            rows.append((session_id, f"session {i}", now - i * 600, now))
+        conn.executemany("INSERT INTO Sessions (session_id, session_name, ctime, mtime) VALUES (?, ?, ?, ?);", rows)
+
+    manager.index.pool.write(insert)
+    return manager
+
+
+def legacy_list(root: str):
+    files = glob.glob(os.path.join(root, "*.json"))
+    files.sort(key=os.path.getctime, reverse=True)
+    sessions = []
+    for session_file in files:
+        with open(session_file, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("deleted"):
+            continue
+        sessions.append((data["session_id"], data["session_name"], os.path.getctime(session_file)))
+    return sessions
+
+
+def timed(fn, repeat: int = 1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with tempfile.TemporaryDirectory() as root:
+        manager = populate(root, n, messages)
+        legacy_ms, legacy = timed(lambda: legacy_list(root))
+        full_ms, full = timed(lambda: manager.list(), 3)
+        page_ms, page = timed(lambda: manager.list(limit=50), 100)
+        deep_ms, _ = timed(lambda: manager.list(offset=n - 50, limit=50), 20)
+        today_ms, today = timed(lambda: manager.list(period="Today", limit=50), 100)
+        manager.close()
+
+    print(f"sessions={n} messages_per_session={messages}")
+    print(f"legacy list (all):        {legacy_ms:10.1f} ms  ({len(legacy)} sessions)")
+    print(f"index list (all):         {full_ms:10.1f} ms  ({len(full)} sessions)")
+    print(f"index first page (50):    {page_ms:10.3f} ms")
+    print(f"index last page (50):     {deep_ms:10.3f} ms")
+    print(f"index Today, first page:  {today_ms:10.3f} ms  ({len(today)} sessions)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark: active-directory size, index size and list() latency as session history grows,
+with and without the retention policy.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_session_retention [days] [sessions_per_day]
+
+Every simulated day creates sessions of ~10 turns and deletes 10% of the
+previous day's sessions. Modification times are shifted back so that day
+d is d days old at the end. With retention, apply_retention runs once per
+day (archive after 30 days, tombstones purged after 7).
+"""
+import os
+import sys
+import tempfile
+import time
+
+from core.session_archive import RetentionPolicy
+from core.session_manager import LocalSessionManager
+
+DAY = 86400
+
+
+def active_bytes(root: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f)) for f in os.listdir(root) if f.endswith(".jsonl"))
+
+
+def run(days: int, per_day: int, retention: bool):
+    policy = RetentionPolicy(archive_after_days=30, max_active_bytes=0, tombstone_days=7)
+    with tempfile.TemporaryDirectory() as root:
+        manager = LocalSessionManager(root, fsync="none")
+        now = time.time()
+        previous = []
+        for day in range(days):
+            day_time = now - (days - day) * DAY
+            for session_id in previous[:per_day // 10]:
+                manager.delete(session_id)
+            ids = []
+            for i in range(per_day):
+                session = manager.new({"session_name": f"day {day} #{i}"})
+                session.conversation += [{"role": "user" if j % 2 == 0 else "assistant", "content": "库存查询 " * 40,
+                                          "id": f"m{j}"} for j in range(20)]
+                manager.save(session)
+                ids.append(session.session_id)
+            stamp = previous[:per_day // 10] + ids
+            manager.index.pool.write(lambda conn: conn.executemany(
+                "UPDATE Sessions SET mtime = ? WHERE session_id = ?;", [(day_time, i) for i in stamp]))
+            previous = ids
+            if retention:
+                while True:
+                    done = manager.apply_retention(policy, limit=1000, now=day_time + DAY)
+                    if max(done["purged"], done["archived"]) < 1000:
+                        break
+
+        rows = manager.index.pool.reader().execute("SELECT count(*) FROM Sessions;").fetchone()[0]
+        start = time.perf_counter()
+        for _ in range(20):
+            manager.list(limit=50)
+        list_ms = (time.perf_counter() - start) * 1000 / 20
+        start = time.perf_counter()
+        manager.list()
+        full_ms = (time.perf_counter() - start) * 1000
+        files = sum(f.endswith(".jsonl") for f in os.listdir(root))
+        result = (files, active_bytes(root), rows, manager.archive.stats()["bytes"], list_ms, full_ms)
+        manager.close()
+    return result
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    per_day = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"{days} days x {per_day} sessions/day")
+    print(f"{'retention':>9} {'files':>6} {'active MB':>10} {'index rows':>11} {'archive MB':>11}"
+          f" {'list(50) ms':>12} {'list() ms':>10}")
+    for retention in (False, True):
+        files, active, rows, archived, list_ms, full_ms = run(days, per_day, retention)
+        print(f"{str(retention):>9} {files:>6} {active / 1e6:>10.2f} {rows:>11} {archived / 1e6:>11.2f}"
+              f" {list_ms:>12.3f} {full_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
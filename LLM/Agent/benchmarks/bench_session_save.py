@@ -0,0 +1,76 @@
+"""
+Benchmark: bytes written and latency of LocalSessionManager.save per chat turn.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_session_save [turns] [message_chars]
+
+"legacy" rewrites the whole session JSON with indent=4 on every turn, as
+save() did before the append-only log. "log" is the current implementation.
+Write amplification = bytes written for the turn / bytes of the new messages.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from core.session_manager import LocalSessionManager, Session
+
+
+def turn(i: int, chars: int):
+    return [{"role": role, "time": str(datetime.now()), "content": "你好，" * (chars // 3), "id": f"{role[0]}_{i}"}
+            for role in ("user", "assistant")]
+
+
+def legacy_save(session: Session, path: str) -> int:
+    data = json.dumps(session.to_dict(), indent=4, ensure_ascii=False).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    chars = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    with tempfile.TemporaryDirectory() as root:
+        manager = LocalSessionManager(root)
+        session = manager.new({"session_name": "bench"})
+        legacy = Session.from_dict({**session.to_dict(), "conversation": []})
+        legacy_path = os.path.join(root, "legacy.json")
+
+        stats = {"legacy": [0, 0.0], "log": [0, 0.0]}
+        payload = 0
+        report_at = {turns // 10, turns // 2, turns}
+        print(f"{'turn':>6} {'legacy B/turn':>14} {'log B/turn':>12} {'legacy amp':>11} {'log amp':>9}"
+              f" {'legacy ms':>10} {'log ms':>8}")
+        for i in range(1, turns + 1):
+            messages = turn(i, chars)
+            new_bytes = sum(len(json.dumps(m, ensure_ascii=False).encode("utf-8")) for m in messages)
+            payload += new_bytes
+
+            legacy.conversation.extend(messages)
+            start = time.perf_counter()
+            written = legacy_save(legacy, legacy_path)
+            legacy_ms = (time.perf_counter() - start) * 1000
+            stats["legacy"][0] += written
+
+            session.conversation.extend(messages)
+            before = manager.counters["bytes_written"]
+            start = time.perf_counter()
+            manager.save(session)
+            log_ms = (time.perf_counter() - start) * 1000
+            log_written = manager.counters["bytes_written"] - before
+            stats["log"][0] += log_written
+
+            if i in report_at:
+                print(f"{i:>6} {written:>14} {log_written:>12} {written / new_bytes:>11.1f}"
+                      f" {log_written / new_bytes:>9.2f} {legacy_ms:>10.2f} {log_ms:>8.2f}")
+        manager.close()
+
+    print(f"total over {turns} turns: legacy {stats['legacy'][0] / 1e6:.1f} MB, log {stats['log'][0] / 1e6:.2f} MB"
+          f" (new message payload {payload / 1e6:.2f} MB)")
+
+
+if __name__ == "__main__":
+    main()
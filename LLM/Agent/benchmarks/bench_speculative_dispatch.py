@@ -0,0 +1,70 @@
+"""
+Benchmark: time from request to tool result for one plan step whose reply
+puts the action block first and keeps streaming reasoning after it, waiting
+for the whole reply before running the tool vs dispatching it as soon as the
+block closes (ToolCallParser + ToolExecutor.start).
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_speculative_dispatch [steps] [tail_words] [tool_ms]
+
+The stub server streams one word every 5 ms; the reply has tail_words words
+after the action block. The tool is a shell command that sleeps tool_ms, standing
+in for a slow read-only tool: in the app only PLAN_SPECULATIVE_TOOLS (read-only
+by default) are dispatched early.
+"""
+import sys
+import time
+
+from core.chat_pipeline import ChatPipeline
+from core.llm_client import Endpoint, LLMClient
+from core.stub_server import StubServer
+from core.tool_calls import ToolCallParser, parse_tool_calls
+from core.tool_executor import ToolExecutor
+from functions import function_registry
+
+SHELL = "shell_operations.execute_shell_command"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def step(pipeline, executor, reply, speculative):
+    started = time.perf_counter()
+    turn = pipeline.stream("system prompt", [{"role": "user", "content": reply}])
+    parser, batch = ToolCallParser(), None
+    for token in turn:
+        if speculative and batch is None and parser.feed(token) is not None:
+            batch = executor.start(parse_tool_calls(turn.text, function_registry))
+    turn.finish()
+    actions = parse_tool_calls(turn.text, function_registry)
+    results = executor.collect(batch) if batch else executor.run(actions)
+    assert not results[0].error, results[0].error
+    return (time.perf_counter() - started) * 1000, turn.metrics.total_ms
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    tail_words = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    tool_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 300
+    reply = (f'```json\n{{"action_name": "{SHELL}", "parameters": {{"command": "sleep {tool_ms / 1000}"}}}}\n```\n'
+             + " ".join(["reasoning"] * tail_words))
+
+    with StubServer(token_latency=0.005) as server:
+        pipeline = ChatPipeline(LLMClient(Endpoint("chat", base_url=server.base_url, api_key="stub", model="stub")))
+        executor = ToolExecutor(function_registry)
+        step(pipeline, executor, reply, False)
+        print(f"{steps} steps, {tail_words} words after the action block, tool {tool_ms:.0f} ms")
+        print(f"{'mode':<14}{'stream p50':>12}{'step p50':>10}{'step p95':>10}")
+        for name, speculative in (("after reply", False), ("early", True)):
+            timings = [step(pipeline, executor, reply, speculative) for _ in range(steps)]
+            totals, streams = [t for t, _ in timings], [s for _, s in timings]
+            print(f"{name:<14}{percentile(streams, .5):>12.1f}{percentile(totals, .5):>10.1f}"
+                  f"{percentile(totals, .95):>10.1f}")
+        executor.close()
+        pipeline.close()
+
+
+if __name__ == "__main__":
+    main()
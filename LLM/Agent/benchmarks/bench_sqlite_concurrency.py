@@ -0,0 +1,122 @@
+"""
+Benchmark: concurrent readers and writers on the memory database.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_sqlite_concurrency [readers] [writers] [seconds]
+
+"legacy" mirrors the previous MemoryHandler: every thread (browser session)
+opens its own connection in rollback-journal mode and commits after every
+statement. "pool" goes through MemoryHandler and its ConnectionPool: WAL,
+one reader connection per thread and a single writer thread that groups
+queued writes into one transaction.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from core import fts
+from core.memory import Memory, MemoryHandler
+
+
+def worker(fn, stop: threading.Event, counts: dict, key: str):
+    while not stop.is_set():
+        try:
+            fn()
+            counts[key] += 1
+        except sqlite3.OperationalError as e:
+            counts["errors"] += 1
+            counts.setdefault("messages", set()).add(str(e))
+
+
+def run(make_read, make_write, readers: int, writers: int, seconds: float):
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker, args=(make_read(), stop, counts, "reads")) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=(make_write(), stop, counts, "writes")) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+def seed(handler: MemoryHandler, n: int = 2000):
+    for i in range(n):
+        handler.insert_memory(Memory(id=-1, original_text=f"用户第 {i} 次提到咖啡", summary=f"summary {i}",
+                                     labels=["咖啡"] if i % 2 else ["茶"]))
+
+
+def legacy(db_path: str, readers: int, writers: int, seconds: float):
+    handler = MemoryHandler(db_path)
+    seed(handler)
+    handler.close()
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = DELETE;")
+    conn.close()
+
+    def connect():
+        conn = sqlite3.connect(db_path, timeout=1.0)
+        fts.register_functions(conn)
+        return conn
+
+    def make_read():
+        holder = {}
+
+        def read():
+            conn = holder.setdefault("conn", connect())
+            conn.execute("SELECT rowid FROM MemoryFTS WHERE MemoryFTS MATCH '\"咖 啡\"' "
+                         "ORDER BY bm25(MemoryFTS) LIMIT 20;").fetchall()
+        return read
+
+    def make_write():
+        holder = {}
+
+        def write():
+            conn = holder.setdefault("conn", connect())
+            conn.execute("INSERT INTO Memory (original_text, summary) VALUES ('新的记忆', 'new');")
+            conn.commit()
+        return write
+
+    return run(make_read, make_write, readers, writers, seconds)
+
+
+def pooled(db_path: str, readers: int, writers: int, seconds: float):
+    handler = MemoryHandler(db_path)
+    seed(handler)
+
+    def make_read():
+        return lambda: handler.search_fts(fts.build_match_query("咖啡"), 20)
+
+    def make_write():
+        return lambda: handler.insert_memory(Memory(id=-1, original_text="新的记忆", summary="new"))
+
+    counts = run(make_read, make_write, readers, writers, seconds)
+    counts["transactions"] = handler.pool.counters["transactions"]
+    handler.close()
+    return counts
+
+
+def main():
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+    print(f"readers={readers} writers={writers} seconds={seconds}")
+    for name, fn in (("legacy", legacy), ("pool", pooled)):
+        with tempfile.TemporaryDirectory() as tmp:
+            counts = fn(os.path.join(tmp, "memory.db"), readers, writers, seconds)
+        line = (f"{name:>6}: {counts['reads'] / seconds:10.0f} reads/s {counts['writes'] / seconds:10.0f} writes/s"
+                f" {counts['errors']:6d} errors")
+        if "transactions" in counts:
+            line += f"  ({counts['writes'] / max(counts['transactions'], 1):.1f} writes/transaction)"
+        print(line)
+        for message in counts.get("messages", ()):
+            print(f"        {message}")
+
+
+if __name__ == "__main__":
+    main()
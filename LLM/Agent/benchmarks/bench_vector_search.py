@@ -0,0 +1,58 @@
+"""
+Benchmark: vector top-k latency and recall of each VectorIndex tier.
+
+Run from LLM/Agent:
+    python -m benchmarks.bench_vector_search [n] [dimension] [tiers...]
+
+Clustered vectors are added under sparse ids (like SQLite rows after
+deletes). Every tier is promoted synchronously from the same flat index
+and measured against exact search, the same way background promotion
+decides whether to switch.
+"""
+import sys
+import time
+
+import numpy as np
+
+from core.vector_index import VectorIndex
+
+
+def clustered(n: int, dimension: int, clusters: int = 256):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)]
+    vectors += 0.5 * rng.standard_normal((n, dimension)).astype(np.float32)
+    return vectors
+
+
+def run(n: int, dimension: int, tier: str):
+    vectors = clustered(n, dimension)
+    ids = np.arange(n, dtype=np.int64) * 3 + 1
+
+    index = VectorIndex(dimension, ann=tier, auto_promote=False, min_recall=0.0)
+    index.add(ids, vectors)
+    if tier == "flat":
+        latencies = []
+        for q in vectors[:200]:
+            start = time.perf_counter()
+            index.search(q, 10)
+            latencies.append(time.perf_counter() - start)
+        return {"type": "flat", "recall": 1.0, "build_seconds": 0.0,
+                "latency_ms": float(np.percentile(np.array(latencies) * 1000, 50))}
+    index.promote(background=False)
+    return index.stats()
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    dimension = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    tiers = sys.argv[3:] or ["flat", "hnsw", "ivfpq"]
+    print(f"n={n} dimension={dimension}, recall@10 vs exact, p50 single-query latency")
+    print(f"{'tier':>6} {'build (s)':>10} {'recall':>8} {'p50 (ms)':>10}")
+    for tier in tiers:
+        stats = run(n, dimension, tier)
+        print(f"{stats['type']:>6} {stats['build_seconds']:>10.1f} {stats['recall']:>8.3f} {stats['latency_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
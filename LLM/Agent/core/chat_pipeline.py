@@ -0,0 +1,253 @@
+"""
+    chat_pipeline.py
+
+    基于 asyncio 和 AsyncOpenAI 的流式对话。
+
+    - 事件循环运行在一个后台线程中，Streamlit 的脚本线程通过同步迭代器逐个取得 token
+    - 请求经由 core.llm_client 的端点（共享连接池、并发限制、限流和重试）
+    - 系统提示词（记忆检索 + 拼装）在线程池中构建，同时向模型服务发一个预热请求建立连接，
+      两者重叠进行；之后的对话请求复用这个 keep-alive 连接
+    - 每一轮记录提示词构建、预热、首 token（TTFT）、最后一个 token 和整轮结束（界面可继续操作）的耗时
+    - 配置了 ResponseCache 时，use_cache=True 的请求在构建提示词之后先查缓存，命中则不请求模型
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from core.llm_client import LLMClient, message_tokens
+from core.response_cache import ResponseCache, cache_key
+
+# 距上一次请求超过这个时间时才预热，连接池中的连接可能已被服务端关闭
+WARMUP_IDLE_SECONDS = 30.0
+# 预热最多等待的时间，预热请求慢（或服务不支持 /models）时不拖慢对话
+WARMUP_TIMEOUT = 2.0
+_DONE = object()
+
+
+@dataclass
+class TurnMetrics:
+    """ 一轮对话的耗时（毫秒），均从这一轮开始时计时 """
+    prompt_ms: float = 0.0                  # 系统提示词构建完成
+    warmup_ms: Optional[float] = None       # 预热请求完成，未预热时为 None
+    ttft_ms: Optional[float] = None         # 第一个 token
+    total_ms: float = 0.0                   # 最后一个 token
+    end_of_turn_ms: Optional[float] = None  # 回复写入会话、界面可继续操作
+    chunks: int = 0
+    prompt_tokens: Optional[int] = None     # 服务端报告的用量（stream_usage 开启且服务端支持时）
+    cached_tokens: Optional[int] = None     # 其中命中服务端前缀缓存的 token 数
+    cache_hit: bool = False                 # 回复来自 ResponseCache
+
+
+class EventLoopThread:
+    """ 在后台线程中运行的事件循环 """
+
+    def __init__(self, name: str = "chat-event-loop"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def close(self):
+        # 先结束未迭代完的异步生成器（例如 SDK 在 [DONE] 之后没有读完的 SSE 生成器）
+        self.submit(self.loop.shutdown_asyncgens()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class ChatTurn:
+    """ 一轮对话的流式结果
+
+    迭代得到回复的各个分块；迭代结束后 text、reasoning 和 metrics 可用。
+    迭代中途放弃（例如 Streamlit 重新运行脚本）时取消请求。
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.tokens: "queue.Queue[Any]" = queue.Queue()
+        self.parts: List[str] = []
+        self.reasoning_parts: List[str] = []
+        self.metrics = TurnMetrics()
+        self.system_prompt = ""
+        self.future: Optional[Future] = None
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self.tokens.get()
+                if item is _DONE:
+                    break
+                yield item
+            self.future.result()  # 请求失败时在调用线程重新抛出异常
+        finally:
+            if not self.future.done():
+                self.future.cancel()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def reasoning(self) -> str:
+        return "".join(self.reasoning_parts)
+
+    def finish(self) -> TurnMetrics:
+        """调用方完成这一轮的收尾（例如提交会话保存）后调用，记录整轮耗时"""
+        self.metrics.end_of_turn_ms = self.elapsed_ms()
+        return self.metrics
+
+
+class ChatPipeline:
+    """ 流式对话管线
+
+    Args:
+        llm: 对话端点，异步客户端在事件循环线程中第一次使用时创建
+        model: 模型名称，缺省为端点配置的模型
+        warmup: 是否在构建提示词的同时预热连接
+        stream_usage: 请求在流的最后返回用量（stream_options.include_usage），用于统计前缀缓存命中
+        history_size: 保留最近多少轮的耗时用于统计（不包括缓存命中的轮次）
+        cache: 回复缓存，只用于 use_cache=True 的请求
+    """
+
+    def __init__(self, llm: LLMClient, model: str = None, runner: EventLoopThread = None,
+                 warmup: bool = True, history_size: int = 200, stream_usage: bool = True,
+                 cache: ResponseCache = None):
+        self.llm = llm
+        self.model = model or llm.endpoint.model
+        self.runner = runner or EventLoopThread()
+        self.warmup = warmup
+        self.stream_usage = stream_usage
+        self.cache = cache
+        self.last_request = 0.0
+        self.history: "deque[TurnMetrics]" = deque(maxlen=history_size)
+        self.counters = {"turns": 0, "warmups": 0, "failed_warmups": 0, "errors": 0, "cache_hits": 0}
+
+    def stream(self, system_prompt: Union[str, Callable[[], str]], messages: List[Dict], use_cache: bool = False,
+               **kwargs) -> ChatTurn:
+        """开始一轮对话，立即返回
+
+        Args:
+            system_prompt: 系统提示词，或构建它的函数（在线程池中执行，不能访问 st.session_state）
+            messages: 系统提示词之后的消息
+            use_cache: 是否使用回复缓存（未配置缓存时忽略）
+            kwargs: 传给 chat.completions.create 的其他参数
+        """
+        turn = ChatTurn()
+        cache = self.cache if use_cache else None
+        turn.future = self.runner.submit(self._run(turn, system_prompt, messages, kwargs, cache))
+        return turn
+
+    async def _run(self, turn: ChatTurn, system_prompt, messages, kwargs, cache: Optional[ResponseCache] = None):
+        try:
+            warmup = None
+            replay = cache is not None and cache.mode == "replay"  # 回放时不访问模型服务
+            if self.warmup and not replay and time.monotonic() - self.last_request > WARMUP_IDLE_SECONDS:
+                warmup = asyncio.ensure_future(self._warmup(turn))
+            system_prompt = await self._build_prompt(turn, system_prompt)
+            if warmup is not None:
+                await asyncio.wait({warmup}, timeout=WARMUP_TIMEOUT)
+
+            messages = [{"role": "system", "content": system_prompt}] + messages
+            key = None
+            if cache is not None:
+                key = cache_key(self.model, messages, kwargs.get("temperature"))
+                cached = await asyncio.to_thread(cache.get, key)
+                if cached is not None:
+                    turn.metrics.cache_hit = True
+                    self._emit(turn, cached)
+                    turn.metrics.total_ms = turn.elapsed_ms()
+                    self.counters["cache_hits"] += 1
+                    return
+            if self.stream_usage:
+                kwargs = {"stream_options": {"include_usage": True}, **kwargs}
+            stream = await self.llm.acall(
+                lambda client: client.chat.completions.create(
+                    model=self.model, messages=messages, stream=True, **kwargs),
+                tokens=message_tokens(messages))
+            try:
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None):
+                        self._record_usage(turn, chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    reasoning = getattr(delta, "reasoning_content", None)
+                    if reasoning:
+                        turn.reasoning_parts.append(reasoning)
+                    if delta.content:
+                        self._emit(turn, delta.content)
+            finally:
+                await stream.close()  # 取消时释放连接
+            turn.metrics.total_ms = turn.elapsed_ms()
+            self.last_request = time.monotonic()
+            self.counters["turns"] += 1
+            self.history.append(turn.metrics)
+            if key is not None and turn.text:
+                await asyncio.to_thread(cache.put, key, turn.text, self.model,
+                                        turn.metrics.total_ms - turn.metrics.prompt_ms)
+        except BaseException:
+            self.counters["errors"] += 1
+            raise
+        finally:
+            turn.tokens.put(_DONE)
+
+    @staticmethod
+    def _emit(turn: ChatTurn, content: str):
+        if turn.metrics.ttft_ms is None:
+            turn.metrics.ttft_ms = turn.elapsed_ms()
+        turn.metrics.chunks += 1
+        turn.parts.append(content)
+        turn.tokens.put(content)
+
+    async def _build_prompt(self, turn: ChatTurn, system_prompt) -> str:
+        if callable(system_prompt):
+            system_prompt = await asyncio.to_thread(system_prompt)
+        turn.system_prompt = system_prompt
+        turn.metrics.prompt_ms = turn.elapsed_ms()
+        return system_prompt
+
+    @staticmethod
+    def _record_usage(turn: ChatTurn, usage):
+        turn.metrics.prompt_tokens = usage.prompt_tokens
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None)
+        if cached is None:  # DeepSeek
+            cached = getattr(usage, "prompt_cache_hit_tokens", None)
+        turn.metrics.cached_tokens = cached
+
+    async def _warmup(self, turn: ChatTurn):
+        """请求 /models 建立连接；不经过限流和重试，失败不影响对话"""
+        try:
+            await self.llm.async_client.models.list()
+            self.counters["warmups"] += 1
+            self.last_request = time.monotonic()
+        except Exception as e:
+            self.counters["failed_warmups"] += 1
+            logging.debug(f"Chat connection warmup failed: {e}")
+        turn.metrics.warmup_ms = turn.elapsed_ms()
+
+    def stats(self) -> Dict[str, float]:
+        """最近若干轮 TTFT、最后一个 token 和整轮结束耗时的 p50 / p95（毫秒）"""
+        result: Dict[str, float] = dict(self.counters)
+        for name in ("ttft_ms", "total_ms", "end_of_turn_ms"):
+            values = sorted(v for v in (getattr(m, name) for m in self.history) if v is not None)
+            if values:
+                result[f"{name}_p50"] = values[len(values) // 2]
+                result[f"{name}_p95"] = values[min(int(len(values) * 0.95), len(values) - 1)]
+        return result
+
+    def close(self):
+        self.runner.submit(self.llm.aclose()).result()
+        self.runner.close()
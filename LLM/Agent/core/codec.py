@@ -0,0 +1,155 @@
+"""
+    codec.py
+
+    会话日志的压缩块格式。
+
+    未压缩的日志就是 JSON Lines，每行一条记录。压缩日志的格式为：
+        MAGIC (4 字节) + 版本 (1 字节) + 编码 id (1 字节)
+        块: 长度 (4 字节，大端) + 压缩后的若干行 JSON Lines
+        块: ...
+    追加时写入一个新块；重写时每 BLOCK_RECORDS 条记录一个块，读取一段消息只需解压它们所在的块。
+    JSON 文本不会以 MAGIC 开头，旧的未压缩文件不需要转换即可读取。
+
+    zstd 需要安装 zstandard，gzip 只使用标准库。
+"""
+
+import gzip
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b"SLG\x00"
+VERSION = 1
+HEADER_SIZE = len(MAGIC) + 2
+BLOCK_LENGTH = struct.Struct(">I")
+# 重写时每个块包含的记录数：越大压缩率越高，按范围读取时需要解压的数据也越多
+BLOCK_RECORDS = 64
+
+
+class Codec:
+    """ 块压缩算法 """
+    name = ""
+    id = 0
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+    id = 1
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    id = 2
+
+    def __init__(self, level: int = 3):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("The zstd session codec requires the zstandard package") from e
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.decompressor.decompress(data)
+
+
+CODECS = {codec.name: codec for codec in (GzipCodec, ZstdCodec)}
+_instances: Dict[str, Codec] = {}
+
+
+def get_codec(name: Optional[str]) -> Optional[Codec]:
+    """按名称返回编码实例，"none" / None 表示不压缩"""
+    if name in (None, "none"):
+        return None
+    if name not in CODECS:
+        raise ValueError(f"Invalid session codec: {name}")
+    if name not in _instances:
+        _instances[name] = CODECS[name]()
+    return _instances[name]
+
+
+def codec_by_id(codec_id: int) -> Codec:
+    for name, cls in CODECS.items():
+        if cls.id == codec_id:
+            return get_codec(name)
+    raise ValueError(f"Unknown session codec id: {codec_id}")
+
+
+def header(codec: Optional[Codec]) -> bytes:
+    return MAGIC + bytes([VERSION, codec.id]) if codec else b""
+
+
+def read_header(f: BinaryIO) -> Optional[Codec]:
+    """读取文件头并停在第一个块（或第一行）的开头，未压缩的文件返回 None"""
+    f.seek(0)
+    head = f.read(HEADER_SIZE)
+    if len(head) == HEADER_SIZE and head.startswith(MAGIC):
+        if head[len(MAGIC)] != VERSION:
+            raise ValueError(f"Unsupported session log version: {head[len(MAGIC)]}")
+        return codec_by_id(head[len(MAGIC) + 1])
+    f.seek(0)
+    return None
+
+
+def encode_records(lines: List[bytes], is_message: List[bool], codec: Optional[Codec],
+                   base: int) -> Tuple[bytes, List[int], int]:
+    """把已编码的记录行写成从偏移 base 开始的数据
+
+    Returns:
+        (数据, 每条消息记录所在块的起始偏移, 块数)；未压缩时每行是一个块
+    """
+    chunks, offsets = [], []
+    step = BLOCK_RECORDS if codec else 1
+    for i in range(0, len(lines), step):
+        data = b"".join(lines[i:i + step])
+        if codec:
+            payload = codec.compress(data)
+            data = BLOCK_LENGTH.pack(len(payload)) + payload
+        offsets += [base] * sum(is_message[i:i + step])
+        chunks.append(data)
+        base += len(data)
+    return b"".join(chunks), offsets, len(chunks)
+
+
+def iter_blocks(f: BinaryIO, codec: Optional[Codec], pos: int) -> Iterator[Tuple[int, int, Optional[bytes]]]:
+    """从偏移 pos 开始依次读取块，产出 (起始偏移, 结束偏移, 解压后的若干行)
+
+    块不完整（写入中途崩溃）时产出的数据为 None，之后停止。
+    """
+    f.seek(pos)
+    if codec is None:
+        for line in f:
+            start, pos = pos, pos + len(line)
+            yield start, pos, line if line.endswith(b"\n") else None
+        return
+    while True:
+        length = f.read(BLOCK_LENGTH.size)
+        if not length:
+            return
+        payload = f.read(BLOCK_LENGTH.unpack(length)[0]) if len(length) == BLOCK_LENGTH.size else b""
+        start, pos = pos, pos + len(length) + len(payload)
+        try:
+            if len(length) < BLOCK_LENGTH.size or len(payload) < BLOCK_LENGTH.unpack(length)[0]:
+                raise ValueError("incomplete block")
+            data = codec.decompress(payload)
+        except Exception:
+            yield start, pos, None
+            return
+        yield start, pos, data
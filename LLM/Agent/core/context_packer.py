@@ -0,0 +1,99 @@
+"""
+    context_packer.py
+
+    把检索到的记忆装进系统提示词中有限的 token 预算。
+
+    - 按相关度顺序贪心装入：放得下原文就用原文，放不下就退回 summary，仍放不下则跳过
+    - 与已装入的记忆几乎相同（字符 3-gram Jaccard 相似度超过阈值）的记忆直接跳过
+    - 结果按 (记忆 id 序列, 预算, 记忆版本) 缓存，同一组记忆在数据未变化时不重复拼装
+"""
+
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Set
+
+from core.tokens import estimate_tokens
+
+
+def shingles(text: str, n: int = 3) -> Set[str]:
+    """去掉空白后的字符 n-gram 集合"""
+    text = "".join(text.lower().split())
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextPacker:
+    """ 按 token 预算拼装记忆上下文 """
+
+    def __init__(self, similarity: float = 0.85, cache_size: int = 128):
+        self.similarity = similarity
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[Hashable, str]" = OrderedDict()
+        self.counters = {"packs": 0, "cache_hits": 0, "full": 0, "summary": 0, "duplicates": 0, "skipped": 0,
+                         "tokens_packed": 0, "tokens_unpacked": 0}
+
+    @staticmethod
+    def render(memory, text: str) -> str:
+        return f"\ncreated at [{memory.created_at}]\nsummary:\n{text}\n"
+
+    def pack(self, memories: List, budget: int, version: Hashable = None) -> str:
+        """把按相关度排序的记忆装入 budget 个 token 以内
+
+        Args:
+            memories: 按相关度从高到低排列的 Memory
+            budget: token 预算
+            version: 记忆库版本号，任何写操作后都应变化；为 None 时不使用缓存
+        """
+        key = (tuple(mem.id for mem in memories), budget, version)
+        if version is not None and key in self.cache:
+            self.cache.move_to_end(key)
+            self.counters["cache_hits"] += 1
+            return self.cache[key]
+
+        block = self._pack(memories, budget)
+        if version is not None:
+            self.cache[key] = block
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return block
+
+    def _pack(self, memories: List, budget: int) -> str:
+        self.counters["packs"] += 1
+        parts: List[str] = []
+        seen: List[Set[str]] = []
+        used = 0
+        for mem in memories:
+            full = self.render(mem, mem.original_text)
+            full_tokens = estimate_tokens(full)
+            self.counters["tokens_unpacked"] += full_tokens
+
+            entry, tokens, kind = full, full_tokens, "full"
+            if used + tokens > budget:
+                entry = self.render(mem, mem.summary)
+                tokens, kind = estimate_tokens(entry), "summary"
+            if used + tokens > budget:
+                self.counters["skipped"] += 1
+                continue
+
+            # 只对放得下的记忆做去重比较
+            grams = shingles(mem.summary + mem.original_text)
+            if any(jaccard(grams, other) >= self.similarity for other in seen):
+                self.counters["duplicates"] += 1
+                continue
+
+            parts.append(entry)
+            seen.append(grams)
+            used += tokens
+            self.counters[kind] += 1
+        self.counters["tokens_packed"] += used
+        return "".join(parts)
+
+    def stats(self) -> Dict[str, int]:
+        """拼装次数、缓存命中、原文/summary/去重/跳过的条数以及装入前后的 token 数"""
+        return dict(self.counters)
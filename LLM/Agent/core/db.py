@@ -0,0 +1,163 @@
+"""
+    db.py
+
+    SQLite 连接池：WAL 模式，每个线程一个只读连接，所有写操作交给唯一的写线程。
+
+    - WAL 模式下读不阻塞写、写不阻塞读，多个浏览器会话/Streamlit rerun 并发访问不会出现 "database is locked"
+    - 写操作以函数的形式放入队列，写线程把队列中已有的操作合并到同一个事务中提交（group commit），
+      每个操作包在 SAVEPOINT 里，一个操作失败只回滚它自己
+    - write() 在事务提交后才返回，调用线程随后的读取一定能看到这次写入
+    - 只读连接按所属线程记录，创建新连接时关闭已结束线程的连接（Streamlit 每次 rerun 都换一个脚本线程）
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+PRAGMAS = {
+    "synchronous": "NORMAL",       # WAL 下只在 checkpoint 时 fsync，断电最多丢失最后几个事务，不会损坏
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -16 * 1024,      # 负数单位为 KiB
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+    "busy_timeout": 5000,
+}
+
+
+class ConnectionPool:
+    """ 单写多读的 SQLite 连接池
+
+    Args:
+        path: 数据库文件
+        setup: 每个新连接创建后调用，例如注册自定义 SQL 函数
+        max_batch: 一个事务最多合并的写操作数
+    """
+
+    def __init__(self, path: str, setup: Callable[[sqlite3.Connection], None] = None, max_batch: int = 256):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.setup = setup
+        self.max_batch = max_batch
+        self.local = threading.local()
+        self.readers: Dict[threading.Thread, sqlite3.Connection] = {}
+        self.readers_lock = threading.Lock()
+        self.queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self.counters = {"writes": 0, "transactions": 0, "failed_writes": 0}
+        self.closed = False
+
+        self.writer = self.connect()
+        self.writer.execute("PRAGMA journal_mode = WAL;")
+        self.writer_thread = threading.Thread(target=self._write_loop, name="sqlite-writer", daemon=True)
+        self.writer_thread.start()
+
+    def connect(self) -> sqlite3.Connection:
+        # isolation_level=None：不使用 sqlite3 模块的隐式事务，由写线程显式 BEGIN/COMMIT
+        # 每个连接只在一个线程中使用，关闭时可能在其他线程，因此不做线程检查
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value};")
+        if self.setup:
+            self.setup(conn)
+        return conn
+
+    def reader(self) -> sqlite3.Connection:
+        """当前线程的只读连接（自动提交，每条语句读取最新的已提交数据）"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            self.local.conn = conn
+            with self.readers_lock:
+                self.prune_readers()
+                self.readers[threading.current_thread()] = conn
+        return conn
+
+    def prune_readers(self) -> int:
+        """关闭已结束线程的只读连接，返回关闭的个数；调用时需持有 self.readers_lock"""
+        dead = [thread for thread in self.readers if not thread.is_alive()]
+        for thread in dead:
+            self.readers.pop(thread).close()
+        return len(dead)
+
+    def submit(self, fn: Callable[[sqlite3.Connection], Any]) -> Future:
+        """把写操作放入队列，返回的 Future 在事务提交后完成"""
+        if self.closed:
+            raise RuntimeError("Connection pool is closed")
+        future = Future()
+        self.queue.put((fn, future))
+        return future
+
+    def write(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """执行写操作并等待提交，返回 fn 的返回值；fn 抛出的异常会在调用线程重新抛出"""
+        if threading.current_thread() is self.writer_thread:
+            return fn(self.writer)  # 写操作内部嵌套调用，已经在事务中
+        return self.submit(fn).result()
+
+    def _write_loop(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            batch = [job]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    job = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+            self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch):
+        conn = self.writer
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            for fn, future in batch:
+                conn.execute("SAVEPOINT job;")
+                try:
+                    results.append((future, fn(conn), None))
+                    conn.execute("RELEASE job;")
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO job;")
+                    conn.execute("RELEASE job;")
+                    results.append((future, None, e))
+            conn.execute("COMMIT;")
+        except Exception as e:
+            logging.error(f"SQLite write transaction failed: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            self.counters["failed_writes"] += len(batch)
+            return
+
+        self.counters["transactions"] += 1
+        for future, result, error in results:
+            if error is None:
+                self.counters["writes"] += 1
+                future.set_result(result)
+            else:
+                self.counters["failed_writes"] += 1
+                future.set_exception(error)
+
+    def close(self):
+        """等待队列中的写操作完成后关闭所有连接"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer_thread.join()
+        self.writer.close()
+        with self.readers_lock:
+            for conn in self.readers.values():
+                conn.close()
+            self.readers.clear()
@@ -0,0 +1,378 @@
+"""
+    embedding.py
+
+    文本向量化后端。MemoryManager 只依赖 `EmbeddingBackend` 接口，
+    通过环境变量 EMBEDDING_BACKEND 选择实现：
+      - openai: 调用 OpenAI 兼容的 embeddings 接口（默认）
+      - local:  纯本地的哈希向量，无需网络，用于测试和离线环境
+
+    所有后端都会把输入按服务端的批量上限切分成若干请求，并记录每批的耗时；
+    openai 后端的请求经由 core.llm_client 的共享客户端（连接池、限流和重试）；
+    `CoalescingEmbedding` 把多个调用方在短时间窗口内的请求（通常是检索时的单条查询）合并成一批；
+    `CachedEmbedding` 在外层按内容哈希缓存到 SQLite，相同文本不会重复向量化。
+"""
+
+import hashlib
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+import openai
+
+from core.db import ConnectionPool
+from core.llm_client import Endpoint, LLMClient, get_llm_client
+from core.tokens import estimate_tokens
+
+
+class EmbeddingBackend:
+    """ 向量化后端基类
+
+    子类实现 `_embed_batch`，基类负责按 max_batch_size / max_batch_tokens 合并请求并统计。
+    """
+    name: str = ""
+    dimension: int = 0
+    max_batch_size: int = 2048
+    max_batch_tokens: int = 300_000
+
+    def __init__(self):
+        self.batch_latencies = deque(maxlen=1000)  # 秒
+        self.counters = {"batches": 0, "texts": 0, "tokens": 0}
+
+    def _embed_batch(self, texts: List[str], timeout: float = None) -> Tuple[int, np.ndarray]:
+        """向量化一批不超过上限的文本，返回 (消耗的 token 数, 矩阵)；timeout 为请求的截止时间（秒）"""
+        raise NotImplementedError
+
+    def embed(self, texts: List[str], timeout: float = None) -> np.ndarray:
+        """将一组文本转换为 shape 为 (len(texts), dimension) 的 float32 矩阵
+
+        timeout: 每个请求的截止时间（秒），超时抛出异常且不重试；缺省使用后端自己的超时和重试
+        """
+        results = [self._timed_batch(batch, timeout) for batch in self.batches(texts)]
+        if not results:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.vstack(results)
+
+    def embed_one(self, text: str, timeout: float = None) -> np.ndarray:
+        """获取单条文本的向量"""
+        return self.embed([text], timeout)[0]
+
+    def batches(self, texts: List[str]):
+        """按条数和估算 token 数切分请求"""
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if batch and (len(batch) >= self.max_batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def _timed_batch(self, texts: List[str], timeout: float = None) -> np.ndarray:
+        start = time.perf_counter()
+        tokens, vectors = self._embed_batch(texts, timeout)
+        self.batch_latencies.append(time.perf_counter() - start)
+        self.counters["batches"] += 1
+        self.counters["texts"] += len(texts)
+        self.counters["tokens"] += tokens
+        return vectors
+
+    def close(self):
+        """释放后台线程等资源"""
+
+    def stats(self) -> Dict[str, float]:
+        """请求次数、文本数、消耗 token 以及每批耗时的 p50/p99（毫秒）"""
+        stats = dict(self.counters)
+        latencies = np.array(self.batch_latencies) * 1000
+        stats["p50_ms"] = float(np.percentile(latencies, 50)) if len(latencies) else 0.0
+        stats["p99_ms"] = float(np.percentile(latencies, 99)) if len(latencies) else 0.0
+        return stats
+
+
+class OpenAIEmbedding(EmbeddingBackend):
+    """ OpenAI 兼容接口的向量化后端
+
+    默认使用注册表中共享的 embedding 端点（连接池、并发限制、限流和重试）；
+    传入 base_url / api_key 时使用单独的端点。
+    """
+
+    def __init__(self, model: str = "text-embedding-ada-002", dimension: int = 1536,
+                 base_url: str = None, api_key: str = None):
+        super().__init__()
+        self.name = model
+        self.model = model
+        self.dimension = dimension  # OpenAI ada-002 embedding dimension
+        self.base_url = base_url
+        self.api_key = api_key
+        self._llm = None
+        self._llm_lock = threading.Lock()
+
+    @property
+    def llm(self) -> LLMClient:
+        if self._llm is None:
+            with self._llm_lock:
+                if self._llm is None:
+                    if self.base_url is None and self.api_key is None:
+                        self._llm = get_llm_client("embedding")
+                    else:
+                        self._llm = LLMClient(Endpoint.from_env("embedding", base_url=self.base_url,
+                                                                api_key=self.api_key))
+        return self._llm
+
+    @property
+    def client(self) -> openai.OpenAI:
+        return self.llm.client
+
+    def _embed_batch(self, texts: List[str], timeout: float = None):
+        response = self.llm.call(
+            lambda client: client.embeddings.create(input=texts, model=self.model),
+            tokens=sum(map(estimate_tokens, texts)), timeout=timeout)
+        data = sorted(response.data, key=lambda d: d.index)
+        tokens = response.usage.prompt_tokens if response.usage else sum(map(estimate_tokens, texts))
+        return tokens, np.array([d.embedding for d in data], dtype=np.float32)
+
+
+class LocalEmbedding(EmbeddingBackend):
+    """ 本地哈希向量
+
+    将字符 1-gram 和 2-gram 通过 crc32 哈希到固定维度（对中文同样有效），
+    再做 L2 归一化。结果在不同进程之间稳定，可以持久化到数据库。
+    """
+
+    def __init__(self, dimension: int = 256):
+        super().__init__()
+        self.name = "local"
+        self.dimension = dimension
+
+    def _embed_batch(self, texts: List[str], timeout: float = None):
+        return sum(map(estimate_tokens, texts)), local_vectors(texts, self.dimension)
+
+
+def local_vectors(texts: List[str], dimension: int) -> np.ndarray:
+    """LocalEmbedding 的实现，stub_server 也复用它"""
+    vectors = np.zeros((len(texts), dimension), dtype=np.float32)
+    for row, text in enumerate(texts):
+        text = text.lower()
+        grams = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+        for gram in grams:
+            h = zlib.crc32(gram.encode("utf-8"))
+            vectors[row, h % dimension] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vectors[row])
+        if norm > 0:
+            vectors[row] /= norm
+    return vectors
+
+
+class CoalescingEmbedding(EmbeddingBackend):
+    """ 跨调用方合并请求
+
+    embed 把文本放入队列后等待结果；收集线程从第一个请求到达起等待 window_ms（或凑满 max_batch_size 条），
+    把队列中的请求拼成一批交给后端，结果按请求拆分返回。批次在最多 concurrency 个线程中并发发送。
+    调用方的 timeout 是等待结果的截止时间，批次的请求超时取其中最晚的截止时间；
+    已经超时的请求不再发送。
+
+    Args:
+        backend: 实际发送请求的后端
+        window_ms: 收集窗口（毫秒）
+        concurrency: 同时发送的批次数
+    """
+
+    def __init__(self, backend: EmbeddingBackend, window_ms: float = 5.0, concurrency: int = 4):
+        super().__init__()
+        self.backend = backend
+        self.name = backend.name
+        self.dimension = backend.dimension
+        self.max_batch_size = backend.max_batch_size
+        self.max_batch_tokens = backend.max_batch_tokens
+        self.window = window_ms / 1000
+        self.condition = threading.Condition()
+        # (texts, 截止时间, future)
+        self.queue: deque = deque()
+        self.queued_texts = 0
+        self.closed = False
+        self.counters = {"texts": 0, "requests": 0, "batches": 0, "expired": 0}
+        self.senders = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embedding-batch")
+        self.thread = threading.Thread(target=self._run, name="embedding-coalescer", daemon=True)
+        self.thread.start()
+
+    def embed(self, texts: List[str], timeout: float = None) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        if len(texts) >= self.max_batch_size:
+            return self.backend.embed(texts, timeout)  # 已经是整批，不需要排队
+        future = Future()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Embedding coalescer is closed")
+            self.queue.append((list(texts), deadline, future))
+            self.queued_texts += len(texts)
+            self.counters["requests"] += 1
+            self.counters["texts"] += len(texts)
+            self.condition.notify_all()
+        return future.result(timeout)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.closed)
+                if not self.queue:
+                    return
+                self.condition.wait_for(lambda: self.closed or self.queued_texts >= self.max_batch_size,
+                                        self.window)
+                requests, size = [], 0
+                while self.queue and (not requests or size + len(self.queue[0][0]) <= self.max_batch_size):
+                    request = self.queue.popleft()
+                    requests.append(request)
+                    size += len(request[0])
+                self.queued_texts -= size
+            self.senders.submit(self._send, requests)
+
+    def _send(self, requests):
+        now = time.monotonic()
+        live = []
+        for texts, deadline, future in requests:
+            if deadline is not None and deadline <= now:
+                future.set_exception(TimeoutError("embedding request expired before it was sent"))
+                with self.condition:
+                    self.counters["expired"] += 1
+            elif future.set_running_or_notify_cancel():
+                live.append((texts, deadline, future))
+        if not live:
+            return
+        deadlines = [deadline for _, deadline, _ in live]
+        timeout = None if None in deadlines else max(deadlines) - now
+        try:
+            vectors = self.backend.embed([text for texts, _, _ in live for text in texts], timeout)
+        except Exception as e:
+            for _, _, future in live:
+                future.set_exception(e)
+            return
+        with self.condition:
+            self.counters["batches"] += 1
+        start = 0
+        for texts, _, future in live:
+            future.set_result(vectors[start:start + len(texts)])
+            start += len(texts)
+
+    def close(self):
+        """发送完队列中的请求后停止"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.senders.shutdown(wait=True)
+        self.backend.close()
+
+    def stats(self) -> Dict[str, float]:
+        stats = self.backend.stats()
+        stats.update({f"coalesced_{key}": value for key, value in self.counters.items()})
+        return stats
+
+
+class CachedEmbedding(EmbeddingBackend):
+    """ 以内容哈希为键、存储在 SQLite 中的向量缓存
+
+    同一批中的重复文本只请求一次，已缓存的文本不再请求；缓存键包含后端名称和维度，
+    切换模型不会取到旧向量。
+
+    使用调用方的 ConnectionPool（与 memory.db 的其他表共享唯一的写线程），不自己打开连接。
+    """
+
+    def __init__(self, backend: EmbeddingBackend, pool: ConnectionPool):
+        super().__init__()
+        self.backend = backend
+        self.name = backend.name
+        self.dimension = backend.dimension
+        self.pool = pool
+        self.pool.write(lambda conn: conn.execute("""
+            CREATE TABLE IF NOT EXISTS EmbeddingCache (
+                content_hash TEXT PRIMARY KEY,
+                model TEXT,
+                embedding BLOB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """))
+        self.counters = {"texts": 0, "cache_hits": 0, "tokens_saved": 0}
+
+    def content_hash(self, text: str) -> str:
+        key = f"{self.name}:{self.dimension}\n{text}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def embed(self, texts: List[str], timeout: float = None) -> np.ndarray:
+        hashes = [self.content_hash(text) for text in texts]
+        found = self._lookup(set(hashes))
+
+        # 去重后只请求缓存中没有的文本
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = text
+        if missing:
+            vectors = self.backend.embed(list(missing.values()), timeout)
+            fresh = dict(zip(missing, vectors))
+            self._store(fresh)
+            found.update(fresh)
+
+        # 除了每个缺失文本的第一次出现，其余都由缓存或批内去重提供
+        requested = set(missing)
+        saved = []
+        for h, text in zip(hashes, texts):
+            if h in requested:
+                requested.discard(h)
+            else:
+                saved.append(text)
+        self.counters["cache_hits"] += len(saved)
+        self.counters["tokens_saved"] += sum(map(estimate_tokens, saved))
+        self.counters["texts"] += len(texts)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.stack([found[h] for h in hashes])
+
+    def _lookup(self, hashes) -> Dict[str, np.ndarray]:
+        found = {}
+        hashes = list(hashes)
+        conn = self.pool.reader()
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            cursor = conn.execute(
+                f"SELECT content_hash, embedding FROM EmbeddingCache "
+                f"WHERE content_hash IN ({','.join('?' * len(chunk))});", chunk)
+            for h, blob in cursor:
+                found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _store(self, vectors: Dict[str, np.ndarray]):
+        rows = [(h, self.name, np.asarray(v, dtype=np.float32).tobytes()) for h, v in vectors.items()]
+        self.pool.write(lambda conn: conn.executemany(
+            "INSERT OR REPLACE INTO EmbeddingCache (content_hash, model, embedding) VALUES (?, ?, ?);", rows))
+
+    def close(self):
+        self.backend.close()
+
+    def stats(self) -> Dict[str, float]:
+        stats = self.backend.stats()
+        stats.update(self.counters)
+        stats["requested_texts"] = self.backend.counters["texts"]
+        return stats
+
+
+def get_embedding_backend() -> EmbeddingBackend:
+    """根据环境变量创建向量化后端"""
+    backend = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+    if backend == "local":
+        return LocalEmbedding(int(os.getenv("EMBEDDING_DIMENSION", "256")))
+    if backend == "openai":
+        embedding = OpenAIEmbedding(
+            model=os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002"),
+            dimension=int(os.getenv("EMBEDDING_DIMENSION", "1536"))
+        )
+        window_ms = float(os.getenv("EMBEDDING_COALESCE_MS", "5"))
+        return CoalescingEmbedding(embedding, window_ms) if window_ms > 0 else embedding
+    raise ValueError(f"Invalid embedding backend: {backend}")
@@ -0,0 +1,64 @@
+"""
+    fts.py
+
+    FTS5 全文检索的分词与查询构造。
+
+    unicode61 分词器会把连续的中文当成一个词，无法检索其中的子串。
+    写入 FTS 表之前用 `segment` 在每个中日韩字符两侧加空格（单字切分），
+    查询时中文词转换为相邻单字组成的短语，效果等价于子串匹配，同时仍可用 BM25 排序。
+"""
+
+import re
+import sqlite3
+
+_CJK = re.compile(r'([぀-ヿ㐀-䶿一-鿿가-힯豈-﫿])')
+_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def segment(text: str) -> str:
+    """中日韩字符单字切分，其余文本保持不变"""
+    if not text:
+        return ""
+    return _CJK.sub(r' \1 ', text)
+
+
+def register_functions(conn: sqlite3.Connection):
+    """注册 FTS 同步触发器里用到的 SQL 函数，所有写 Memory 表的连接都需要调用"""
+    conn.create_function("fts_segment", 1, segment, deterministic=True)
+
+
+def _phrase(text: str) -> str:
+    tokens = segment(text).split()
+    return '"' + " ".join(tokens).replace('"', '""') + '"' if tokens else ""
+
+
+def build_match_query(query: str, exact_match: bool = False, match_any: bool = False) -> str:
+    """把用户输入转换为 FTS5 MATCH 表达式
+
+    - exact_match: 整个输入作为一个短语
+    - "带引号的内容": 短语
+    - word*: 前缀匹配
+    - 其他英文词默认按前缀匹配，中文词按短语（子串）匹配
+    多个词之间为 AND 关系。
+    match_any=True 时改为 OR，中文词拆成相邻二元组，命中越多 BM25 越靠前（混合检索用）。
+    """
+    if exact_match:
+        return _phrase(query.replace('"', " "))
+
+    parts = []
+    for quoted, term in _TERM.findall(query):
+        if quoted:
+            phrase = _phrase(quoted)
+        elif _CJK.search(term) and match_any:
+            # 整句中文作为短语几乎不会命中，拆成相邻二元组分别匹配
+            tokens = segment(term.rstrip("*")).split()
+            grams = [" ".join(tokens[i:i + 2]) for i in range(max(len(tokens) - 1, 1))]
+            phrase = " OR ".join(dict.fromkeys(_phrase(gram) for gram in grams))
+        elif _CJK.search(term):
+            phrase = _phrase(term.rstrip("*"))
+        else:
+            phrase = _phrase(term.rstrip("*"))
+            phrase = phrase + "*" if phrase else ""
+        if phrase:
+            parts.append(phrase)
+    return (" OR " if match_any else " AND ").join(parts)
@@ -0,0 +1,392 @@
+"""
+    llm_client.py
+
+    共享的 LLM 客户端注册表。对话（chat）、反思（mem）和向量化（embedding）各是一个命名端点：
+    - 相同 base_url + api_key 的端点共用一个 OpenAI / AsyncOpenAI 客户端，HTTP keep-alive 连接池在各处复用
+    - 每个端点限制同时进行的请求数；流式响应读完或关闭之后才释放名额
+    - RPM / TPM 令牌桶：超出速率时在发送之前等待，而不是等服务端返回 429
+    - 连接错误、超时、408/409/429 和 5xx 由 tenacity 按带抖动的指数退避重试，服务端给出 Retry-After 时按它等待；
+      SDK 自身的重试关闭，避免两层重试叠加
+    - 请求、重试、失败、排队和限流等待等计数通过 stats() 查看
+
+    端点配置（PREFIX 为 CHAT、MEM 或 EMBEDDING）：
+        {PREFIX}_BASE_URL、{PREFIX}_API_KEY、{PREFIX}_MODEL
+        {PREFIX}_MAX_CONCURRENCY  同时进行的请求数，默认 8
+        {PREFIX}_RPM、{PREFIX}_TPM  每分钟请求数、token 数上限，0 表示不限制
+        {PREFIX}_MAX_RETRIES      最多重试次数，默认 3
+        {PREFIX}_TIMEOUT          单次请求超时（秒），默认 60
+"""
+
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import openai
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from core.tokens import estimate_tokens
+
+# 端点名称 -> 环境变量前缀
+ENDPOINTS = {"chat": "CHAT", "mem": "MEM", "embedding": "EMBEDDING"}
+RETRY_STATUS = (408, 409, 429)
+# 指数退避的基数和上限（秒），Retry-After 同样不超过上限
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+
+
+@dataclass
+class Endpoint:
+    """ 一个命名端点的连接和限流配置 """
+    name: str
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    model: Optional[str] = None
+    max_concurrency: int = 8
+    rpm: float = 0
+    tpm: float = 0
+    max_retries: int = 3
+    timeout: float = 60.0
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str = None, **overrides):
+        prefix = prefix or ENDPOINTS.get(name, name.upper())
+        env = lambda key, default=None: os.getenv(f"{prefix}_{key}", default)  # noqa: E731
+        config = dict(name=name, base_url=env("BASE_URL"), api_key=env("API_KEY"), model=env("MODEL"),
+                      max_concurrency=int(env("MAX_CONCURRENCY", cls.max_concurrency)),
+                      rpm=float(env("RPM", cls.rpm)), tpm=float(env("TPM", cls.tpm)),
+                      max_retries=int(env("MAX_RETRIES", cls.max_retries)),
+                      timeout=float(env("TIMEOUT", cls.timeout)))
+        config.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**config)
+
+
+class TokenBucket:
+    """ 令牌桶，容量为一分钟的配额
+
+    reserve 立即扣除令牌并返回需要等待的秒数：配额不足时余额为负，之后的调用依次排在后面，
+    由调用方决定同步 sleep 还是 await asyncio.sleep。
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float = 1) -> float:
+        with self.lock:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float):
+        """按实际用量修正之前的预估，amount 为正表示多扣、为负表示退还"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def is_retryable(e: BaseException) -> bool:
+    if isinstance(e, openai.APIConnectionError):  # 包括超时
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in RETRY_STATUS or e.status_code >= 500
+    return False
+
+
+def retry_after(e: BaseException) -> Optional[float]:
+    """服务端在 Retry-After 头中给出的等待秒数"""
+    response = getattr(e, "response", None)
+    try:
+        return max(0.0, float(response.headers.get("retry-after")))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def message_tokens(messages: List[Dict]) -> int:
+    """估算一组消息的 token 数，用于 TPM 限流"""
+    return sum(estimate_tokens(str(m.get("content") or "")) for m in messages)
+
+
+def create_client(endpoint: Endpoint, asynchronous: bool):
+    cls = openai.AsyncOpenAI if asynchronous else openai.OpenAI
+    return cls(base_url=endpoint.base_url, api_key=endpoint.api_key, max_retries=0, timeout=endpoint.timeout)
+
+
+class HeldStream:
+    """ 同步流式响应：读完、关闭或被回收时释放端点的并发名额 """
+
+    def __init__(self, stream, release: Callable[[], None]):
+        self.stream = stream
+        self._release = release
+
+    def __iter__(self):
+        try:
+            yield from self.stream
+        finally:
+            self.close()
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+            self.stream.close()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __del__(self):
+        if self._release is not None:
+            self._release()
+
+
+class AsyncHeldStream:
+    """ 异步流式响应：读完或关闭时释放端点的并发名额 """
+
+    def __init__(self, stream, release: Callable[[], None]):
+        self.stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.stream:
+                yield chunk
+        finally:
+            await self.close()
+
+    async def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+            await self.stream.close()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class LLMClient:
+    """ 一个端点的客户端：并发限制、限流和重试
+
+    Args:
+        endpoint: 端点配置
+        factory: factory(endpoint, asynchronous) 返回 OpenAI / AsyncOpenAI 客户端，注册表用它共享连接池
+    """
+
+    def __init__(self, endpoint: Endpoint, factory: Callable[[Endpoint, bool], Any] = create_client):
+        self.endpoint = endpoint
+        self.factory = factory
+        self._client = None
+        self._async_client = None
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(endpoint.max_concurrency)
+        self._async_slots = None  # 在事件循环中第一次使用时创建
+        self.rpm = TokenBucket(endpoint.rpm) if endpoint.rpm > 0 else None
+        self.tpm = TokenBucket(endpoint.tpm) if endpoint.tpm > 0 else None
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "rate_limited": 0, "tokens": 0,
+                         "in_flight": 0, "peak_in_flight": 0, "queued_ms": 0.0, "throttled_ms": 0.0}
+
+    @property
+    def client(self) -> openai.OpenAI:
+        if self._client is None:
+            with self.lock:
+                if self._client is None:
+                    self._client = self.factory(self.endpoint, False)
+        return self._client
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        if self._async_client is None:
+            with self.lock:
+                if self._async_client is None:
+                    self._async_client = self.factory(self.endpoint, True)
+        return self._async_client
+
+    def call(self, request: Callable[[openai.OpenAI], Any], tokens: int = 0, timeout: float = None):
+        """发送请求并在失败时重试
+
+        Args:
+            request: 接收 OpenAI 客户端并发出请求的函数，重试时再次调用
+            tokens: 预估的 token 数，用于 TPM 限流
+            timeout: 整个调用的截止时间（秒），等待并发名额、限流和请求本身都计算在内，给出时不重试；
+                缺省使用端点的 timeout 并按 max_retries 重试
+
+        Returns:
+            request 的结果；流式结果包装为 HeldStream，读完或关闭后才释放并发名额
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def attempt():
+            time.sleep(self._throttle(tokens))
+            self._count_request()
+            if deadline is None:
+                return request(self.client)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{self.endpoint.name}: deadline of {timeout:.2f}s exceeded")
+            return request(self.client.with_options(timeout=remaining))
+
+        started = time.perf_counter()
+        if not self.slots.acquire(timeout=timeout):
+            raise TimeoutError(f"{self.endpoint.name}: no free slot within {timeout:.2f}s")
+        self._enter(started)
+        options = self._retry_options()
+        if deadline is not None:
+            options["stop"] = stop_after_attempt(1)
+        try:
+            result = Retrying(**options)(attempt)
+        except BaseException:
+            self._exit(self.slots.release, failed=True)
+            raise
+        if isinstance(result, openai.Stream):
+            return HeldStream(result, lambda: self._exit(self.slots.release))
+        self._exit(self.slots.release)
+        self._charge_usage(result, tokens)
+        return result
+
+    async def acall(self, request: Callable[[openai.AsyncOpenAI], Awaitable[Any]], tokens: int = 0):
+        """call 的异步版本，在同一个事件循环中使用；流式结果包装为 AsyncHeldStream"""
+        async def attempt():
+            await asyncio.sleep(self._throttle(tokens))
+            self._count_request()
+            return await request(self.async_client)
+
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.endpoint.max_concurrency)
+        started = time.perf_counter()
+        await self._async_slots.acquire()
+        self._enter(started)
+        try:
+            result = await AsyncRetrying(**self._retry_options())(attempt)
+        except BaseException:
+            self._exit(self._async_slots.release, failed=True)
+            raise
+        if isinstance(result, openai.AsyncStream):
+            return AsyncHeldStream(result, lambda: self._exit(self._async_slots.release))
+        self._exit(self._async_slots.release)
+        self._charge_usage(result, tokens)
+        return result
+
+    def _retry_options(self) -> Dict[str, Any]:
+        return dict(stop=stop_after_attempt(self.endpoint.max_retries + 1), wait=self._wait,
+                    retry=retry_if_exception(is_retryable), before_sleep=self._before_retry, reraise=True)
+
+    @staticmethod
+    def _wait(retry_state) -> float:
+        delay = retry_after(retry_state.outcome.exception())
+        if delay is None:
+            return wait_random_exponential(multiplier=BACKOFF_BASE, max=BACKOFF_MAX)(retry_state)
+        return min(delay, BACKOFF_MAX)
+
+    def _before_retry(self, retry_state):
+        e = retry_state.outcome.exception()
+        with self.lock:
+            self.counters["retries"] += 1
+            if isinstance(e, openai.APIStatusError) and e.status_code == 429:
+                self.counters["rate_limited"] += 1
+
+    def _throttle(self, tokens: int) -> float:
+        """在令牌桶中预留这次请求，返回需要等待的秒数"""
+        delay = max(self.rpm.reserve(1) if self.rpm else 0.0,
+                    self.tpm.reserve(tokens) if self.tpm and tokens else 0.0)
+        if delay:
+            with self.lock:
+                self.counters["throttled_ms"] += delay * 1000
+        return delay
+
+    def _count_request(self):
+        with self.lock:
+            self.counters["requests"] += 1
+
+    def _enter(self, started: float):
+        with self.lock:
+            self.counters["queued_ms"] += (time.perf_counter() - started) * 1000
+            self.counters["in_flight"] += 1
+            self.counters["peak_in_flight"] = max(self.counters["peak_in_flight"], self.counters["in_flight"])
+
+    def _exit(self, release: Callable[[], None], failed: bool = False):
+        with self.lock:
+            self.counters["in_flight"] -= 1
+            self.counters["failures"] += failed
+        release()
+
+    def _charge_usage(self, result, estimated: int):
+        usage = getattr(result, "usage", None)
+        actual = getattr(usage, "total_tokens", None) or estimated
+        if self.tpm and actual != estimated:
+            self.tpm.adjust(actual - estimated)
+        with self.lock:
+            self.counters["tokens"] += actual
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            return dict(self.counters)
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+
+
+class LLMRegistry:
+    """ 按名称管理 LLMClient；未注册的名称从环境变量读取配置 """
+
+    def __init__(self, endpoints: List[Endpoint] = None):
+        self.endpoints = {endpoint.name: endpoint for endpoint in endpoints or []}
+        self.clients: Dict[str, LLMClient] = {}
+        self.shared: Dict[tuple, Any] = {}
+        self.lock = threading.RLock()
+
+    def get(self, name: str) -> LLMClient:
+        with self.lock:
+            if name not in self.clients:
+                endpoint = self.endpoints.get(name) or Endpoint.from_env(name)
+                self.clients[name] = LLMClient(endpoint, self._shared_client)
+            return self.clients[name]
+
+    def _shared_client(self, endpoint: Endpoint, asynchronous: bool):
+        """相同 base_url + api_key 共用一个 SDK 客户端，各端点按自己的超时派生"""
+        key = (endpoint.base_url, endpoint.api_key, asynchronous)
+        with self.lock:
+            if key not in self.shared:
+                self.shared[key] = create_client(endpoint, asynchronous)
+            return self.shared[key].with_options(timeout=endpoint.timeout)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {name: client.stats() for name, client in self.clients.items()}
+
+    def close(self):
+        """关闭同步客户端；异步客户端由使用它的事件循环通过 LLMClient.aclose 关闭"""
+        with self.lock:
+            for (_, _, asynchronous), client in self.shared.items():
+                if not asynchronous:
+                    client.close()
+
+
+_registry: Optional[LLMRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_llm_client(name: str) -> LLMClient:
+    """进程内共享的客户端，name 为 chat、mem、embedding 或其他以大写名称为前缀配置的端点"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = LLMRegistry()
+    return _registry.get(name)
+
+
+def llm_stats() -> Dict[str, Dict[str, float]]:
+    return _registry.stats() if _registry is not None else {}
@@ -0,0 +1,116 @@
+"""
+    locks.py
+
+    会话文件的锁：进程内的线程锁 + 跨进程的 fcntl 建议锁。
+
+    - LockTable 按 key 分配线程锁，空闲超过 idle_seconds 的条目在之后的获取中清理，会话再多锁表也不会一直增长
+    - FileLock 把 key 哈希到同一个锁文件中的一个字节（分段锁），用 fcntl.lockf 锁定这个字节，
+      多个 Streamlit 进程写不同会话时几乎不会互相等待，也不会为每个会话留下一个锁文件
+    - lockf 的锁属于进程而不是线程，同一进程内的线程先按分段获取 LockTable 中的线程锁，再获取文件锁
+    - 没有 fcntl 的平台（Windows）只使用进程内的锁
+"""
+
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Hashable
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class LockTable:
+    """ 按 key 分配的进程内锁表
+
+    Args:
+        idle_seconds: 无人持有且空闲超过这个时间的锁会被移除
+        sweep_every: 每获取多少次检查一次空闲条目
+    """
+
+    def __init__(self, idle_seconds: float = 300.0, sweep_every: int = 256):
+        self.idle_seconds = idle_seconds
+        self.sweep_every = sweep_every
+        self.mutex = threading.Lock()
+        # key -> [锁, 正在持有或等待的线程数, 最后一次释放的时间]
+        self.entries: Dict[Hashable, list] = {}
+        self.acquisitions = 0
+        self.evicted = 0
+
+    @contextmanager
+    def hold(self, key: Hashable):
+        with self.mutex:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [threading.Lock(), 0, 0.0]
+            entry[1] += 1
+            self.acquisitions += 1
+            if self.acquisitions % self.sweep_every == 0:
+                self._sweep(time.monotonic())
+        entry[0].acquire()
+        try:
+            yield
+        finally:
+            entry[0].release()
+            with self.mutex:
+                entry[1] -= 1
+                entry[2] = time.monotonic()
+
+    def _sweep(self, now: float):
+        """移除空闲条目，调用时需持有 mutex；等待中的条目 users > 0，不会被移除"""
+        idle = [key for key, (_, users, last_used) in self.entries.items()
+                if users == 0 and now - last_used >= self.idle_seconds]
+        for key in idle:
+            del self.entries[key]
+        self.evicted += len(idle)
+
+    def sweep(self):
+        with self.mutex:
+            self._sweep(time.monotonic())
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class FileLock:
+    """ 跨进程的分段建议锁
+
+    Args:
+        path: 锁文件，同一目录下的所有进程应使用同一个文件
+        slots: 分段数，不同 key 落在同一段时会互相等待
+    """
+
+    def __init__(self, path: str, slots: int = 1024, idle_seconds: float = 300.0):
+        self.path = path
+        self.slots = slots
+        self.table = LockTable(idle_seconds)
+        self.fd = None
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def slot(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % self.slots
+
+    @contextmanager
+    def hold(self, key: str):
+        """独占 key 所在的分段，不可重入"""
+        slot = self.slot(key)
+        with self.table.hold(slot):
+            if self.fd is None:
+                yield
+                return
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, slot)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, slot)
+
+    def close(self):
+        # 关闭文件会释放本进程在这个文件上的所有锁，调用前应确保没有线程持有锁
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
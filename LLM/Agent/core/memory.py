@@ -1,12 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor, wait
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Optional, Any, Dict
+from typing import List, Optional, Any, Dict, Iterable, Set
+import functools
 import json
+import logging
 import numpy as np
-import faiss
-import openai
 import os
-import sqlite3
+import threading
+
+from core import fts, retrieval
+from core.context_packer import ContextPacker
+from core.db import ConnectionPool
+from core.embedding import CachedEmbedding, EmbeddingBackend, get_embedding_backend
+from core.retrieval import ScoredMemory
+from core.trigger_matcher import TriggerMatcher
+from core.vector_index import VectorIndex
+
+DEFAULT_DB_PATH = "./data/memory/memory.db"
+# 每累计多少次向量写入持久化一次索引文件；未持久化的部分会在下次启动时增量修复
+INDEX_SAVE_INTERVAL = 50
+# 混合检索的单次查询时间预算（毫秒），超时的召回来源会被丢弃
+HYBRID_BUDGET_MS = float(os.getenv("MEMORY_SEARCH_BUDGET_MS", "500"))
+# 混合检索中只被向量召回的记忆，平方 L2 距离超过该值时丢弃（归一化向量下约为 2 - 2 * cos）
+VECTOR_MAX_DISTANCE = float(os.getenv("MEMORY_VECTOR_MAX_DISTANCE", "0.5"))
+# 混合检索线程池的上限
+SEARCH_THREADS = 8 * len(retrieval.SOURCES)
+# 后台补全向量时每批的记忆条数
+BACKFILL_BATCH = 256
 
 class Environment:
     """
@@ -45,32 +66,69 @@ class Memory:
             self.summary = new_summary
         self.updated_at = datetime.now()
 
+def synchronized(method):
+    """MemoryManager 的写方法：修改缓存和索引时持有实例锁（同一个实例在多个浏览器会话之间共享）"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class MemoryManager:
-    def __init__(self):
-        self.dimension = 1536  # OpenAI ada-002 embedding dimension
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.memory_data = []
+    closed = False
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, embedder: EmbeddingBackend = None):
+        self.handler = MemoryHandler(db_path)
+        embedder = embedder or get_embedding_backend()
+        if not isinstance(embedder, CachedEmbedding):
+            # 向量缓存和记忆表在同一个数据库中，共用连接池的写线程
+            embedder = CachedEmbedding(embedder, self.handler.pool)
+        self.embedder = embedder
+        self.dimension = self.embedder.dimension
+        self.index = VectorIndex(
+            self.dimension,
+            os.path.join(os.path.dirname(db_path), "index.faiss"),
+            ann=os.getenv("VECTOR_INDEX_ANN", "hnsw"),
+            promote_at=int(os.getenv("VECTOR_INDEX_PROMOTE_AT", "100000")),
+            min_recall=float(os.getenv("VECTOR_INDEX_MIN_RECALL", "0.9"))
+        )
+        self.pending_index_writes = 0
+        # 写操作之间互斥；检索只读缓存，不持有这把锁
+        self.lock = threading.RLock()
+        # 每次写操作递增，供上下文拼装等缓存判断数据是否变化
+        self.version = 0
+        self.context_packer = ContextPacker()
+        self.memory_data: List[Memory] = []
+        # id -> Memory，与 memory_data 共享同一批对象，写操作直接在缓存上打补丁
+        self.memory_by_id: Dict[int, Memory] = {}
         self.labels = set()
         self.triggers = set()
-        self.handler = MemoryHandler()
+        self.trigger_matcher = TriggerMatcher()
+        # trigger -> memory ids 倒排索引
+        self.trigger_index: Dict[str, Set[int]] = {}
+        # 混合检索中各来源并发执行。超出预算被丢弃的召回仍会执行到结束（向量召回的 embedding 请求以预算为截止时间），
+        # 线程池按多个查询的召回同时滞留来定大小，空闲线程会被复用，平时只有几个线程
+        self.search_pool = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="memory-search")
+        self.search_stats = {"queries": 0, "dropped": {source: 0 for source in retrieval.SOURCES}}
+        self.search_stats_lock = threading.Lock()
         self.load_memory()
  
-    def get_embedding(self, text: str) -> np.ndarray:
-        """获取文本的向量嵌入"""
-        client = openai.OpenAI(
-            base_url=os.getenv("EMBEDDING_BASE_URL"),
-            api_key=os.getenv("EMBEDDING_API_KEY")
-        )
-        response = client.embeddings.create(
-            input=text,
-            model="text-embedding-ada-002"
-        )
-        return np.array(response.data[0].embedding, dtype=np.float32)
+    def get_embedding(self, text: str, timeout: float = None) -> np.ndarray:
+        """获取文本的向量嵌入，timeout 为请求的截止时间（秒）"""
+        return self.embedder.embed_one(text, timeout)
+
+    def embed_or_none(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """写入记忆时使用：embedding 服务不可用时返回 None，记忆照常保存，向量由 backfill_embeddings 补全"""
+        try:
+            return list(self.embedder.embed(texts))
+        except Exception as e:
+            logging.warning(f"Failed to embed {len(texts)} memories, saving them without vectors: {e}")
+            return [None] * len(texts)
  
     def add_memory(self, memory_text: str, summary: str, labels: List[str] = None, trigger: str = None):
         """添加新的记忆"""
-        embedding = None  # self.get_embedding(summary)
-        # self.index.add(embedding.reshape(1, -1))
+        embedding = self.embed_or_none([summary])[0]
  
         memory = Memory(
             id=-1,
@@ -81,67 +139,163 @@ class MemoryManager:
             embedding=embedding
         )
         self.save_memory(memory)
+
+    def add_memories(self, memories: List[Dict[str, Any]]):
+        """批量添加记忆，所有 summary 合并成尽量少的 embedding 请求
+
+        Args:
+            memories: 与 add_memory 参数同名的字典列表，缺少 memory_text 时使用 summary
+        """
+        embeddings = self.embed_or_none([mem["summary"] for mem in memories])
+        for mem, embedding in zip(memories, embeddings):
+            self.save_memory(Memory(
+                id=-1,
+                original_text=mem.get("memory_text") or mem["summary"],
+                summary=mem["summary"],
+                labels=mem.get("labels") or [],
+                trigger=mem.get("trigger"),
+                embedding=embedding
+            ))
+
+    @synchronized
+    def close(self):
+        """持久化索引，等待排队的写操作提交后关闭数据库连接"""
+        self.closed = True
+        self.flush_index()
+        self.search_pool.shutdown(wait=False)
+        self.embedder.close()
+        self.handler.close()
+
+    def index_stats(self) -> Dict[str, Any]:
+        """向量索引状态：当前类型(flat/ivfpq/hnsw)、条数、升级时测得的 recall 与延迟"""
+        return self.index.stats()
+
+    def embedding_stats(self) -> Dict[str, float]:
+        """Embedding 请求统计：批次数、缓存命中、节省的 token、每批 p50/p99 耗时"""
+        return self.embedder.stats()
  
+    @synchronized
     def add_label(self, label: str, description: str):
         """添加新label"""
         self.handler.insert_label(label, description)
         self.labels.add(label)
  
+    @synchronized
     def add_trigger(self, trigger: str, description: str):
-        """添加新label"""
+        """添加新trigger"""
         self.handler.insert_trigger(trigger, description)
         self.triggers.add(trigger)
+        self.trigger_matcher.add(trigger)
+
+    def match_triggers(self, query: str) -> List[str]:
+        """找出查询中出现的触发词（一次扫描，最左最长匹配）"""
+        return self.trigger_matcher.match(query)
  
     def search_memory(self, query: str, labels: List[str] = None, k: int = 5, search_type: str = "vector",
-                      exact_match: bool = False) -> List[Memory]:
+                      exact_match: bool = False, offset: int = 0) -> List[Memory]:
         """Search memories using different methods
         
         Args:
             labels:
             query: The search query
             k: Number of results to return
-            search_type: One of "vector", "keyword", "label", or "trigger"
-            exact_match: For keyword search, whether to match exactly
+            search_type: One of "vector", "keyword", "label", "trigger" or "hybrid"
+            exact_match: For keyword search, match the whole query as one phrase
+            offset: For keyword search, number of ranked results to skip (pagination);
+                an empty keyword query lists the newest memories
             
         Returns:
             List of matching Memory objects
         """
-        if search_type == "vector":
-            query_embedding = None  # self.get_embedding(query)
-            distances, indices = self.index.search(query_embedding.reshape(1, -1), k)
- 
-            results = []
-            for idx in indices[0]:
-                if idx != -1 and idx < len(self.memory_data):
-                    results.append(self.memory_data[idx])
-            return results[::-1]  # Reverse the results
+        if search_type == "hybrid":
+            return [item.memory for item in self.hybrid_search(query, labels or None, k)]
+
+        elif search_type == "vector":
+            query_embedding = self.get_embedding(query)
+            hits = self.index.search(query_embedding, k)
+            # Nearest first
+            return [self.memory_by_id[i] for i, _ in hits if i in self.memory_by_id]
             
         elif search_type == "keyword":
-            if exact_match:
-                matches = [mem for mem in self.memory_data 
-                           if query in mem.original_text or query in mem.summary]
+            # FTS5 + BM25，排序和分页都在 SQL 中完成；空查询用于记忆页面的列表，按新的在前
+            if not query.strip():
+                ids = self.handler.query_recent_ids(k, offset)
             else:
-                query = query.lower()
-                matches = [mem for mem in self.memory_data 
-                           if query in mem.original_text.lower() or 
-                           query in mem.summary.lower()]
-            return matches[::-1][:k]  # Reverse and then take k items
+                ids = self.handler.search_fts(fts.build_match_query(query, exact_match), k, offset)
+            return [self.memory_by_id[i] for i in ids if i in self.memory_by_id]
         
         elif search_type == "trigger":
-            matches = [mem for mem in self.memory_data if mem.trigger == query]
-            return matches[::-1]  # Reverse the results
+            ids = sorted(self.trigger_index.get(query, ()), reverse=True)  # Newest first
+            return [self.memory_by_id[i] for i in ids]
         
         elif search_type == "label":
             if labels is None or not labels:
                 raise ValueError("labels must be provided when search_type='label'")
             if isinstance(labels, str):
                 labels = [labels]
-            matches = [mem for mem in self.memory_data if any(label in mem.labels for label in labels)]
-            return matches[::-1][:k]  # Reverse and then take k items
+            # 走 MemoryLabels 索引，newest first
+            ids = self.handler.query_memory_ids(labels=labels, limit=k)
+            return [self.memory_by_id[i] for i in ids if i in self.memory_by_id]
         
         else:
             raise ValueError(f"Invalid search type: {search_type}")
  
+    def hybrid_search(self, query: str, labels: List[str] = None, k: int = 5, budget_ms: float = None,
+                      sources: Iterable[str] = retrieval.SOURCES, weights: Dict[str, float] = None) -> List[ScoredMemory]:
+        """混合检索：向量、关键词、标签、触发词四路并发召回，RRF 融合并按新近度加权
+
+        Args:
+            query: 查询内容
+            labels: 标签过滤，缺省时使用查询中出现的已知标签
+            k: 返回条数
+            budget_ms: 时间预算，超时未返回的来源被丢弃（不影响其他来源），缺省为 HYBRID_BUDGET_MS
+            sources: 参与的来源
+            weights: 来源权重，见 retrieval.DEFAULT_WEIGHTS
+
+        Returns:
+            按得分从高到低的 ScoredMemory，sources 记录命中的来源及名次；查询为空时返回 []
+        """
+        if not query or not query.strip():
+            return []
+        budget = (HYBRID_BUDGET_MS if budget_ms is None else budget_ms) / 1000
+        depth = max(k * 4, 20)
+        if labels is None:
+            labels = [label for label in self.labels if label and label in query]
+        elif isinstance(labels, str):
+            labels = [labels]
+
+        recall = {
+            "vector": lambda: self.index.search(self.get_embedding(query, timeout=budget), depth),
+            "keyword": lambda: self.handler.search_fts(fts.build_match_query(query, match_any=True), depth),
+            "label": lambda: self.handler.query_memory_ids(labels=labels, limit=depth) if labels else [],
+            "trigger": lambda: [i for trigger in self.match_triggers(query)
+                                for i in sorted(self.trigger_index.get(trigger, ()), reverse=True)],
+        }
+        futures = {self.search_pool.submit(recall[source]): source for source in sources}
+        done, pending = wait(futures, timeout=budget)
+
+        ranked = {}
+        for future in done:
+            source = futures[future]
+            try:
+                ranked[source] = future.result()
+            except Exception as e:
+                logging.warning(f"Hybrid search source {source} failed: {e}")
+        with self.search_stats_lock:
+            self.search_stats["queries"] += 1
+            for future in pending:
+                self.search_stats["dropped"][futures[future]] += 1
+        for future in pending:
+            future.cancel()  # 还在排队的不再执行
+            logging.info(f"Hybrid search source {futures[future]} exceeded {budget * 1000:.0f} ms budget, dropped")
+
+        if "vector" in ranked:
+            # 最近邻总会返回结果，与查询无关的记忆只在距离足够近或被其他来源命中时保留
+            others = {i for source, ids in ranked.items() if source != "vector" for i in ids}
+            ranked["vector"] = [i for i, distance in ranked["vector"]
+                                if distance <= VECTOR_MAX_DISTANCE or i in others]
+        return retrieval.fuse(ranked, self.memory_by_id, k, weights)
+
     def update_memory(self, memory_id: int, new_text: str = None, new_summary: str = None,
                       new_labels: List[str] = None, new_trigger: str = None):
         """Update an existing memory
@@ -153,55 +307,174 @@ class MemoryManager:
             new_labels: New labels
             new_trigger: New trigger
         """
-        for mem in self.memory_data:
-            if mem.id == memory_id:
-                mem.update(new_text, new_summary)
-                if new_labels is not None:
-                    mem.labels = new_labels
-                if new_trigger is not None:
-                    mem.trigger = new_trigger
- 
-                # Update embedding if text changed
-                # if new_summary:
-                #     new_embedding = self.get_embedding(new_summary)
-                #     self.index.add(new_embedding.reshape(1, -1))
-                # self.save_memory(mem)
-                self.handler.upd_memory(memory_id, mem)
-                return
- 
-        raise ValueError(f"Memory with id {memory_id} not found")
+        if memory_id not in self.memory_by_id:
+            raise ValueError(f"Memory with id {memory_id} not found")
+        # Update embedding if summary changed (requested before taking the lock)
+        embedding = self.embed_or_none([new_summary])[0] if new_summary is not None else None
+
+        with self.lock:
+            mem = self.memory_by_id.get(memory_id)
+            if mem is None:
+                raise ValueError(f"Memory with id {memory_id} not found")
+
+            mem.update(new_text, new_summary)
+            if new_labels is not None:
+                mem.labels = new_labels
+            if new_trigger is not None:
+                self.unlink_trigger(mem)
+                mem.trigger = new_trigger
+                self.link_trigger(mem)
+            self.register_names(mem)
+
+            if new_summary is not None:
+                mem.embedding = embedding
+                self.index.remove([memory_id])
+                self.index_memory(mem)
+            self.handler.upd_memory(memory_id, mem)
+            self.version += 1
  
+    @synchronized
     def delete_memory(self, memory_id: str):
         """Delete a memory by ID
         
         Args:
             memory_id: ID of memory to delete
         """
-        for i, mem in enumerate(self.memory_data):
-            if mem.id == memory_id:
-                # Remove from FAISS index
-                self.index.remove_ids(np.array([i], dtype=np.int64))
-                # Remove from memory data
-                del self.memory_data[i]
-                # self.save_memory(mem)
-                self.handler.del_memory(memory_id)
-                return
- 
-        raise ValueError(f"Memory with id {memory_id} not found")
+        mem = self.memory_by_id.pop(memory_id, None)
+        if mem is None:
+            raise ValueError(f"Memory with id {memory_id} not found")
+
+        i = next(i for i, m in enumerate(self.memory_data) if m is mem)
+        # Remove from FAISS index
+        self.index.remove([memory_id])
+        self.pending_index_writes += 1
+        self.flush_index(force=False)
+        # Remove from memory data
+        del self.memory_data[i]
+        self.unlink_trigger(mem)
+        self.handler.del_memory(memory_id)
+        self.version += 1
  
+    @synchronized
     def save_memory(self, memory: Memory):
-        """保存记忆到Sqlite"""
-        self.handler.insert_memory(memory)
-        self.load_memory()
-        # faiss.write_index(self.index, './data/memory/index.faiss')
+        """保存记忆到Sqlite，并同步到内存缓存
+
+        新记忆（id == -1）插入后使用 SQLite 返回的行 id 追加到缓存；
+        已有记忆则原地更新对应的行，不会产生重复数据。
+        """
+        if memory.id == -1 or memory.id not in self.memory_by_id:
+            memory.id = self.handler.insert_memory(memory)
+            self.memory_data.append(memory)
+            self.memory_by_id[memory.id] = memory
+            self.link_trigger(memory)
+            self.index_memory(memory)
+        else:
+            self.handler.upd_memory(memory.id, memory)
+        self.register_names(memory)
+        self.version += 1
  
     def load_memory(self):
         """从Sqlite加载记忆"""
         self.memory_data = self.handler.query_memories()
+        self.memory_by_id = {mem.id: mem for mem in self.memory_data}
         self.labels = self.handler.query_labels()
         self.triggers = self.handler.query_triggers()
-        # self.index = faiss.read_index('./data/memory/index.faiss')
+        self.trigger_matcher = TriggerMatcher(self.triggers)
+        self.trigger_index = {}
+        for mem in self.memory_data:
+            self.link_trigger(mem)
+        self.sync_index()
+
+    def register_names(self, memory: Memory):
+        """记忆中新出现的标签/触发词在写入时已由数据库自动创建，这里同步到缓存和匹配器"""
+        self.labels.update(memory.labels)
+        if memory.trigger and memory.trigger not in self.triggers:
+            self.triggers.add(memory.trigger)
+            self.trigger_matcher.add(memory.trigger)
+
+    def link_trigger(self, memory: Memory):
+        """把记忆加入 trigger 倒排索引"""
+        if memory.trigger:
+            self.trigger_index.setdefault(memory.trigger, set()).add(memory.id)
+
+    def unlink_trigger(self, memory: Memory):
+        """把记忆从 trigger 倒排索引中移除"""
+        ids = self.trigger_index.get(memory.trigger)
+        if ids is not None:
+            ids.discard(memory.id)
+            if not ids:
+                del self.trigger_index[memory.trigger]
+
+    def index_memory(self, memory: Memory):
+        """将记忆的向量加入 FAISS 索引"""
+        if memory.embedding is None:
+            return
+        self.index.add([memory.id], memory.embedding)
+        self.pending_index_writes += 1
+        self.flush_index(force=False)
+
+    def flush_index(self, force: bool = True):
+        """持久化向量索引，force=False 时按 INDEX_SAVE_INTERVAL 节流"""
+        if force or self.pending_index_writes >= INDEX_SAVE_INTERVAL:
+            if self.index.dirty:
+                self.index.save()
+            self.pending_index_writes = 0
+
+    def sync_index(self):
+        """启动时让向量索引与数据库保持一致
+
+        只使用已有的向量，不请求 embedding 服务。缺少向量或者向量维度与当前后端不符（例如切换了 embedding 后端）
+        的记忆暂时不参与向量检索，由 backfill_embeddings 补全。
+        """
+        vectors = {}
+        for mem in self.memory_data:
+            if mem.embedding is not None and mem.embedding.shape == (self.dimension,):
+                vectors[mem.id] = mem.embedding
+            else:
+                mem.embedding = None
+        self.index.sync(vectors)
+
+    def backfill_embeddings(self) -> int:
+        """为缺少向量的记忆补全向量，写回数据库并加入索引，返回补全的条数
+
+        分批请求，批次之间不持有锁；请求期间被修改或删除的记忆跳过（修改时已经重新向量化）。
+        embedding 服务失败或实例已关闭时停止，剩下的等下次补全。
+        """
+        stale = [mem for mem in list(self.memory_data) if mem.embedding is None]
+        done = 0
+        for i in range(0, len(stale), BACKFILL_BATCH):
+            batch = stale[i:i + BACKFILL_BATCH]
+            summaries = [mem.summary for mem in batch]
+            try:
+                embeddings = self.embedder.embed(summaries)
+            except Exception as e:
+                logging.warning(f"Failed to embed {len(stale) - done} memories, vector search will skip them: {e}")
+                break
+            with self.lock:
+                if self.closed:
+                    break
+                filled = []
+                for mem, summary, embedding in zip(batch, summaries, embeddings):
+                    if self.memory_by_id.get(mem.id) is mem and mem.embedding is None and mem.summary == summary:
+                        mem.embedding = embedding
+                        filled.append(mem)
+                if filled:
+                    self.handler.upd_embeddings(filled)
+                    self.index.add([mem.id for mem in filled], np.stack([mem.embedding for mem in filled]))
+                    self.pending_index_writes += len(filled)
+                    self.flush_index(force=False)
+            done += len(batch)
+        if stale:
+            logging.info(f"Backfilled embeddings of {done}/{len(stale)} memories")
+        return done
 
+    def start_backfill(self) -> threading.Thread:
+        """在后台线程中执行 backfill_embeddings"""
+        thread = threading.Thread(target=self.backfill_embeddings, name="memory-backfill", daemon=True)
+        thread.start()
+        return thread
+
+    @synchronized
     def update_label(self, old_label: str, new_label: str, new_description: str = None):
         """Update a label and its description
         
@@ -215,18 +488,16 @@ class MemoryManager:
             self.labels.remove(old_label)
             self.labels.add(new_label)
             
-        # Update in database
+        # Update in database, memories reference the label by id so no row rewrite is needed
         self.handler.upd_label(old_label, new_label, new_description)
+        self.version += 1
         
-        # Update all memories that use this label
+        # Patch cached memories (merging keeps the first occurrence)
         for memory in self.memory_data:
             if old_label in memory.labels:
-                memory.labels = [new_label if l == old_label else l for l in memory.labels]
-                self.save_memory(memory)
-        
-        # Reload memory data to ensure consistency
-        self.load_memory()
+                memory.labels = list(dict.fromkeys(new_label if l == old_label else l for l in memory.labels))
 
+    @synchronized
     def delete_label(self, label: str):
         """Delete a label and remove it from all memories
         
@@ -237,15 +508,16 @@ class MemoryManager:
         if label in self.labels:
             self.labels.remove(label)
             
-        # Remove from database
+        # Remove from database, MemoryLabels rows cascade
         self.handler.del_label(label)
+        self.version += 1
         
-        # Remove from all memories that use this label
+        # Patch cached memories
         for memory in self.memory_data:
             if label in memory.labels:
                 memory.labels.remove(label)
-                self.save_memory(memory)
 
+    @synchronized
     def update_trigger(self, old_trigger: str, new_trigger: str, new_description: str = None):
         """Update a trigger and its description
         
@@ -258,16 +530,20 @@ class MemoryManager:
         if old_trigger in self.triggers:
             self.triggers.remove(old_trigger)
             self.triggers.add(new_trigger)
+            self.trigger_matcher.rename(old_trigger, new_trigger)
             
-        # Update in database
+        # Update in database, memories reference the trigger by id so no row rewrite is needed
         self.handler.upd_trigger(old_trigger, new_trigger, new_description)
+        self.version += 1
         
-        # Update all memories that use this trigger
-        for memory in self.memory_data:
-            if memory.trigger == old_trigger:
-                memory.trigger = new_trigger
-                self.save_memory(memory)
+        # Patch cached memories
+        ids = self.trigger_index.pop(old_trigger, set())
+        for i in ids:
+            self.memory_by_id[i].trigger = new_trigger
+        if ids:
+            self.trigger_index.setdefault(new_trigger, set()).update(ids)
 
+    @synchronized
     def delete_trigger(self, trigger: str):
         """Delete a trigger and remove it from all memories
         
@@ -277,27 +553,81 @@ class MemoryManager:
         # Remove from memory
         if trigger in self.triggers:
             self.triggers.remove(trigger)
+            self.trigger_matcher.remove(trigger)
             
-        # Remove from database
+        # Remove from database, Memory.trigger_id is set to NULL
         self.handler.del_trigger(trigger)
+        self.version += 1
         
-        # Remove from all memories that use this trigger
-        for memory in self.memory_data:
-            if memory.trigger == trigger:
-                memory.trigger = None
-                self.save_memory(memory)
+        # Patch cached memories
+        for i in self.trigger_index.pop(trigger, ()):
+            self.memory_by_id[i].trigger = None
+
+
+_managers: Dict[str, MemoryManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_memory_manager(db_path: str = DEFAULT_DB_PATH) -> MemoryManager:
+    """ 进程内共享的 MemoryManager，同一个数据库返回同一个实例（已关闭时重新创建）
+
+    每个浏览器会话都调用；各建一个实例会让每个标签页各有一个写线程、检索线程池和一份 FAISS 索引，
+    且互相看不到对方写入的缓存。创建时在后台补全缺少的向量，每个进程只补全一次。
+    """
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None or manager.closed:
+            manager = _managers[key] = MemoryManager(db_path)
+            manager.start_backfill()
+        return manager
+
+
+def writes(method):
+    """MemoryHandler 的写方法：交给连接池的写线程执行，调用方拿到的是事务提交后的返回值"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.pool.write(lambda conn: method(self, conn, *args, **kwargs))
+    return wrapper
 
 
 class MemoryHandler:
-    def __init__(self):
-        self.conn = self.connect_db()
-        self.create_table()
+    """Memory 相关表的读写
+
+    表结构通过 PRAGMA user_version 做版本管理，打开数据库时按顺序执行未应用的迁移：
+      1: Memory / Labels / Triggers 基础表
+      2: 标签改为 MemoryLabels(memory_id, label_id) 关联表，触发词改为 Memory.trigger_id，
+         Labels.label 和 Triggers.trigger 唯一
+    全文索引 MemoryFTS 不参与版本管理，每次打开时检查并按需重建。
+
+    连接由 ConnectionPool 管理：读操作使用当前线程的连接，@writes 方法交给写线程在事务中执行，
+    第一个参数 conn 由写线程传入，调用方不需要提供。
+    """
+    SCHEMA_VERSION = 2
+
+    def __init__(self, db_name=DEFAULT_DB_PATH):
+        self.pool = self.connect_db(db_name)
+        self.migrate()
+        self.create_fts()
  
     @staticmethod
-    def connect_db(db_name="./data/memory/memory.db"):
-        return sqlite3.connect(db_name)
+    def connect_db(db_name=DEFAULT_DB_PATH) -> ConnectionPool:
+        return ConnectionPool(db_name, setup=fts.register_functions)
+
+    def close(self):
+        self.pool.close()
+
+    @writes
+    def migrate(self, conn):
+        """执行所有未应用的迁移（同一个事务中，失败时整体回滚）"""
+        version = conn.execute("PRAGMA user_version;").fetchone()[0]
+        migrations = {1: self.create_table, 2: self.normalize_labels_and_triggers}
+        for target in range(version + 1, self.SCHEMA_VERSION + 1):
+            logging.info(f"Migrating memory database to version {target}")
+            migrations[target](conn)
+            conn.execute(f"PRAGMA user_version = {target};")
  
-    def create_table(self):
+    def create_table(self, conn):
         create_table_sql = """
             CREATE TABLE IF NOT EXISTS Memory (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -311,7 +641,7 @@ class MemoryHandler:
                 metadata TEXT
             );
             """
-        self.conn.execute(create_table_sql)
+        conn.execute(create_table_sql)
  
         create_label_sql = """
                 CREATE TABLE IF NOT EXISTS Labels (
@@ -320,7 +650,7 @@ class MemoryHandler:
                     description TEXT
                 );
                 """
-        self.conn.execute(create_label_sql)
+        conn.execute(create_label_sql)
  
         create_trigger_sql = """
                         CREATE TABLE IF NOT EXISTS Triggers (
@@ -329,44 +659,167 @@ class MemoryHandler:
                             description TEXT
                         );
                         """
-        self.conn.execute(create_trigger_sql)
-        self.conn.commit()
+        conn.execute(create_trigger_sql)
+
+    def normalize_labels_and_triggers(self, conn):
+        """迁移 2：逗号拼接的 labels 和文本 trigger 拆分到关联表，旧列删除"""
+        # 去重后才能加唯一约束，保留 id 最小的一条
+        conn.execute("DELETE FROM Labels WHERE label IS NULL OR id NOT IN (SELECT MIN(id) FROM Labels GROUP BY label);")
+        conn.execute("DELETE FROM Triggers WHERE trigger IS NULL OR id NOT IN (SELECT MIN(id) FROM Triggers GROUP BY trigger);")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_labels_label ON Labels(label);")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_triggers_trigger ON Triggers(trigger);")
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS MemoryLabels (
+                memory_id INTEGER NOT NULL REFERENCES Memory(id) ON DELETE CASCADE,
+                label_id INTEGER NOT NULL REFERENCES Labels(id) ON DELETE CASCADE,
+                position INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (memory_id, label_id)
+            ) WITHOUT ROWID;
+            """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_labels_label ON MemoryLabels(label_id, memory_id);")
+        conn.execute("ALTER TABLE Memory ADD COLUMN trigger_id INTEGER REFERENCES Triggers(id) ON DELETE SET NULL;")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_trigger_id ON Memory(trigger_id);")
+
+        rows = conn.execute("SELECT id, labels, trigger FROM Memory;").fetchall()
+        for memory_id, labels, trigger in rows:
+            self.set_memory_labels(conn, memory_id, labels.split(',') if labels else [])
+            conn.execute("UPDATE Memory SET trigger_id = ? WHERE id = ?;", (self.trigger_id(conn, trigger), memory_id))
+
+        conn.execute("ALTER TABLE Memory DROP COLUMN labels;")
+        conn.execute("ALTER TABLE Memory DROP COLUMN trigger;")
+
+    def label_id(self, conn, label: str) -> int:
+        """标签对应的 id，不存在时创建"""
+        conn.execute("INSERT OR IGNORE INTO Labels (label) VALUES (?);", (label,))
+        return conn.execute("SELECT id FROM Labels WHERE label = ?;", (label,)).fetchone()[0]
+
+    def trigger_id(self, conn, trigger: Optional[str]) -> Optional[int]:
+        """触发词对应的 id，不存在时创建"""
+        if not trigger:
+            return None
+        conn.execute("INSERT OR IGNORE INTO Triggers (trigger) VALUES (?);", (trigger,))
+        return conn.execute("SELECT id FROM Triggers WHERE trigger = ?;", (trigger,)).fetchone()[0]
+
+    def set_memory_labels(self, conn, memory_id: int, labels: List[str]):
+        """替换一条记忆的标签（保持顺序）"""
+        conn.execute("DELETE FROM MemoryLabels WHERE memory_id = ?;", (memory_id,))
+        labels = list(dict.fromkeys(label for label in labels if label))
+        conn.executemany(
+            "INSERT INTO MemoryLabels (memory_id, label_id, position) VALUES (?, ?, ?);",
+            [(memory_id, self.label_id(conn, label), position) for position, label in enumerate(labels)])
+
+    @writes
+    def create_fts(self, conn):
+        """全文索引：contentless FTS5 表，通过触发器与 Memory 表同步
+
+        写入的是 fts_segment 切分后的文本，删除/更新时用旧值生成 delete 命令。
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'MemoryFTS';").fetchone()
+        # executescript 会先提交当前事务，这里逐条执行
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS MemoryFTS USING fts5(
+                original_text, summary, content='', tokenize='unicode61 remove_diacritics 2'
+            );
+            """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS Memory_fts_insert AFTER INSERT ON Memory BEGIN
+                INSERT INTO MemoryFTS (rowid, original_text, summary)
+                VALUES (new.id, fts_segment(new.original_text), fts_segment(new.summary));
+            END;
+            """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS Memory_fts_delete AFTER DELETE ON Memory BEGIN
+                INSERT INTO MemoryFTS (MemoryFTS, rowid, original_text, summary)
+                VALUES ('delete', old.id, fts_segment(old.original_text), fts_segment(old.summary));
+            END;
+            """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS Memory_fts_update AFTER UPDATE OF original_text, summary ON Memory BEGIN
+                INSERT INTO MemoryFTS (MemoryFTS, rowid, original_text, summary)
+                VALUES ('delete', old.id, fts_segment(old.original_text), fts_segment(old.summary));
+                INSERT INTO MemoryFTS (rowid, original_text, summary)
+                VALUES (new.id, fts_segment(new.original_text), fts_segment(new.summary));
+            END;
+            """)
+        if not exists:
+            # 已有数据库第一次建立全文索引
+            conn.execute("""
+                INSERT INTO MemoryFTS (rowid, original_text, summary)
+                SELECT id, fts_segment(original_text), fts_segment(summary) FROM Memory;
+                """)
+
+    def search_fts(self, match: str, limit: int, offset: int = 0) -> List[int]:
+        """全文检索，按 BM25 排序（summary 权重更高），返回分页后的 Memory id；match 为空时没有结果"""
+        if not match:
+            return []
+        cursor = self.pool.reader().execute("""
+            SELECT rowid FROM MemoryFTS
+            WHERE MemoryFTS MATCH ?
+            ORDER BY bm25(MemoryFTS, 1.0, 2.0), rowid DESC
+            LIMIT ? OFFSET ?;
+            """, (match, limit, offset))
+        return [row[0] for row in cursor]
+
+    def query_recent_ids(self, limit: int, offset: int = 0) -> List[int]:
+        """最新的记忆 id（新的在前），用于记忆页面的列表"""
+        cursor = self.pool.reader().execute("SELECT id FROM Memory ORDER BY id DESC LIMIT ? OFFSET ?;",
+                                            (limit, offset))
+        return [row[0] for row in cursor]
  
-    def insert_memory(self, memory):
+    @writes
+    def insert_memory(self, conn, memory):
         insert_sql = """
-            INSERT INTO Memory (original_text, summary, created_at, updated_at, labels, trigger, embedding, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+            INSERT INTO Memory (original_text, summary, created_at, updated_at, trigger_id, embedding, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?);
             """
-        self.conn.execute(insert_sql, (
+        cursor = conn.execute(insert_sql, (
             memory.original_text,
             memory.summary,
             memory.created_at,
             memory.updated_at,
-            ','.join(memory.labels) if memory.labels else '',  # Join list into comma-separated string
-            memory.trigger,
-            memory.embedding,  # Assume already in binary format
+            self.trigger_id(conn, memory.trigger),
+            to_blob(memory.embedding),
             json.dumps(memory.metadata) if memory.metadata else None  # Serialize dictionary to JSON string
         ))
-        self.conn.commit()
+        self.set_memory_labels(conn, cursor.lastrowid, memory.labels)
+        return cursor.lastrowid
  
-    def insert_label(self, label, description):
+    @writes
+    def insert_label(self, conn, label, description):
         insert_sql = """
                 INSERT INTO Labels (label, description)
-                VALUES (?, ?);
+                VALUES (?, ?)
+                ON CONFLICT(label) DO UPDATE SET description = excluded.description;
                 """
-        self.conn.execute(insert_sql, (label, description))
-        self.conn.commit()
+        conn.execute(insert_sql, (label, description))
  
-    def insert_trigger(self, trigger, description):
+    @writes
+    def insert_trigger(self, conn, trigger, description):
         insert_sql = """
                 INSERT INTO Triggers (trigger, description)
-                VALUES (?, ?);
+                VALUES (?, ?)
+                ON CONFLICT(trigger) DO UPDATE SET description = excluded.description;
                 """
-        self.conn.execute(insert_sql, (trigger, description))
-        self.conn.commit()
+        conn.execute(insert_sql, (trigger, description))
  
     def query_memories(self):
-        cursor = self.conn.execute("SELECT * FROM Memory;")
+        conn = self.pool.reader()
+        labels = {}
+        cursor = conn.execute("""
+            SELECT ml.memory_id, l.label
+            FROM MemoryLabels ml JOIN Labels l ON l.id = ml.label_id
+            ORDER BY ml.memory_id, ml.position;
+            """)
+        for memory_id, label in cursor:
+            labels.setdefault(memory_id, []).append(label)
+
+        cursor = conn.execute("""
+            SELECT m.id, m.original_text, m.summary, m.created_at, m.updated_at, t.trigger, m.embedding, m.metadata
+            FROM Memory m LEFT JOIN Triggers t ON t.id = m.trigger_id
+            ORDER BY m.id;
+            """)
         memories = []
         for row in cursor:
             memory = Memory(
@@ -375,90 +828,155 @@ class MemoryHandler:
                 summary=row[2],
                 created_at=row[3],
                 updated_at=row[4],
-                labels=row[5].split(',') if row[5] else [],  # Split comma-separated labels
-                trigger=row[6],
-                embedding=row[7],  # If embedding is stored as binary, handle appropriately
-                metadata=json.loads(row[8]) if row[8] else None  # Assuming metadata is stored as JSON
+                labels=labels.get(row[0], []),
+                trigger=row[5],
+                embedding=from_blob(row[6]),
+                metadata=json.loads(row[7]) if row[7] else None  # Assuming metadata is stored as JSON
             )
             memories.append(memory)
-            # print(memory)  # 打印每个 Memory 实例
  
         return memories
+
+    def query_memory_ids(self, labels: List[str] = None, trigger: str = None, limit: int = -1) -> List[int]:
+        """按标签（任一命中）或触发词过滤，走索引，按 id 倒序（新的在前）"""
+        conn = self.pool.reader()
+        if labels:
+            sql = f"""
+                SELECT DISTINCT ml.memory_id
+                FROM Labels l JOIN MemoryLabels ml ON ml.label_id = l.id
+                WHERE l.label IN ({','.join('?' * len(labels))})
+                ORDER BY ml.memory_id DESC LIMIT ?;
+                """
+            params = (*labels, limit)
+        else:
+            sql = """
+                SELECT m.id
+                FROM Triggers t JOIN Memory m ON m.trigger_id = t.id
+                WHERE t.trigger = ?
+                ORDER BY m.id DESC LIMIT ?;
+                """
+            params = (trigger, limit)
+        return [row[0] for row in conn.execute(sql, params)]
  
     def query_labels(self):
-        cursor = self.conn.execute("SELECT * FROM Labels;")
+        conn = self.pool.reader()
+        cursor = conn.execute("SELECT * FROM Labels;")
         labels = set()
         for row in cursor:
             labels.add(row[1])
         return labels
  
     def query_triggers(self):
-        cursor = self.conn.execute("SELECT * FROM Triggers;")
+        conn = self.pool.reader()
+        cursor = conn.execute("SELECT * FROM Triggers;")
         triggers = set()
         for row in cursor:
             triggers.add(row[1])
         return triggers
  
-    def upd_memory(self, memory_id, mem):
+    @writes
+    def upd_memory(self, conn, memory_id, mem):
         update_sql = """
             UPDATE Memory
-            SET original_text = ?, summary = ?, labels = ?, trigger = ?, updated_at = ?
+            SET original_text = ?, summary = ?, trigger_id = ?, embedding = ?, updated_at = ?
             WHERE id = ?;
             """
-        self.conn.execute(update_sql,
-                          (mem.original_text, mem.summary, ','.join(mem.labels), mem.trigger, datetime.now(),
-                           memory_id))
-        self.conn.commit()
+        conn.execute(update_sql,
+                          (mem.original_text, mem.summary, self.trigger_id(conn, mem.trigger),
+                           to_blob(mem.embedding), datetime.now(), memory_id))
+        self.set_memory_labels(conn, memory_id, mem.labels)
+
+    @writes
+    def upd_embeddings(self, conn, memories):
+        """Write back embeddings of many memories in a single transaction"""
+        conn.executemany("UPDATE Memory SET embedding = ? WHERE id = ?;",
+                              [(to_blob(mem.embedding), mem.id) for mem in memories])
  
-    def del_memory(self, memory_id):
+    @writes
+    def del_memory(self, conn, memory_id):
         delete_sql = "DELETE FROM Memory WHERE id = ?;"
-        self.conn.execute(delete_sql, (memory_id,))
-        self.conn.commit()
+        conn.execute(delete_sql, (memory_id,))
 
-    def upd_label(self, old_label: str, new_label: str, new_description: str = None):
-        """Update a label in the database"""
+    @writes
+    def upd_label(self, conn, old_label: str, new_label: str, new_description: str = None):
+        """Update a label in the database
+
+        关联表引用的是 label id，改名只需要一条 UPDATE；新名字已存在时合并到已有标签。
+        """
+        if old_label != new_label and conn.execute(
+                "SELECT 1 FROM Labels WHERE label = ?;", (new_label,)).fetchone():
+            new_id, old_id = self.label_id(conn, new_label), self.label_id(conn, old_label)
+            conn.execute("""
+                INSERT OR IGNORE INTO MemoryLabels (memory_id, label_id, position)
+                SELECT memory_id, ?, position FROM MemoryLabels WHERE label_id = ?;
+                """, (new_id, old_id))
+            conn.execute("DELETE FROM Labels WHERE id = ?;", (old_id,))
+            old_label = new_label
         if new_description is not None:
             update_sql = """
                 UPDATE Labels
                 SET label = ?, description = ?
                 WHERE label = ?;
                 """
-            self.conn.execute(update_sql, (new_label, new_description, old_label))
+            conn.execute(update_sql, (new_label, new_description, old_label))
         else:
             update_sql = """
                 UPDATE Labels
                 SET label = ?
                 WHERE label = ?;
                 """
-            self.conn.execute(update_sql, (new_label, old_label))
-        self.conn.commit()
+            conn.execute(update_sql, (new_label, old_label))
 
-    def del_label(self, label: str):
-        """Delete a label from the database"""
+    @writes
+    def del_label(self, conn, label: str):
+        """Delete a label from the database, MemoryLabels rows cascade"""
         delete_sql = "DELETE FROM Labels WHERE label = ?;"
-        self.conn.execute(delete_sql, (label,))
-        self.conn.commit()
+        conn.execute(delete_sql, (label,))
+
+    @writes
+    def upd_trigger(self, conn, old_trigger: str, new_trigger: str, new_description: str = None):
+        """Update a trigger in the database
 
-    def upd_trigger(self, old_trigger: str, new_trigger: str, new_description: str = None):
-        """Update a trigger in the database"""
+        Memory 通过 trigger_id 引用，改名只需要一条 UPDATE；新名字已存在时合并到已有触发词。
+        """
+        if old_trigger != new_trigger and conn.execute(
+                "SELECT 1 FROM Triggers WHERE trigger = ?;", (new_trigger,)).fetchone():
+            new_id, old_id = self.trigger_id(conn, new_trigger), self.trigger_id(conn, old_trigger)
+            conn.execute("UPDATE Memory SET trigger_id = ? WHERE trigger_id = ?;", (new_id, old_id))
+            conn.execute("DELETE FROM Triggers WHERE id = ?;", (old_id,))
+            old_trigger = new_trigger
         if new_description is not None:
             update_sql = """
                 UPDATE Triggers
                 SET trigger = ?, description = ?
                 WHERE trigger = ?;
                 """
-            self.conn.execute(update_sql, (new_trigger, new_description, old_trigger))
+            conn.execute(update_sql, (new_trigger, new_description, old_trigger))
         else:
             update_sql = """
                 UPDATE Triggers
                 SET trigger = ?
                 WHERE trigger = ?;
                 """
-            self.conn.execute(update_sql, (new_trigger, old_trigger))
-        self.conn.commit()
+            conn.execute(update_sql, (new_trigger, old_trigger))
 
-    def del_trigger(self, trigger: str):
-        """Delete a trigger from the database"""
+    @writes
+    def del_trigger(self, conn, trigger: str):
+        """Delete a trigger from the database, Memory.trigger_id is set to NULL"""
         delete_sql = "DELETE FROM Triggers WHERE trigger = ?;"
-        self.conn.execute(delete_sql, (trigger,))
-        self.conn.commit()
+        conn.execute(delete_sql, (trigger,))
+
+
+
+def to_blob(embedding: Optional[np.ndarray]) -> Optional[bytes]:
+    """向量以 float32 的原始字节存储在 embedding 列"""
+    if embedding is None:
+        return None
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def from_blob(blob: Optional[bytes]) -> Optional[np.ndarray]:
+    """还原 float32 向量，无法解析的旧数据返回 None，由 sync_index 重新向量化"""
+    if not blob or len(blob) % 4:
+        return None
+    return np.frombuffer(blob, dtype=np.float32)
@@ -0,0 +1,147 @@
+"""
+    prompt_assembler.py
+
+    按固定顺序拼装提示词，让各轮之间相同的内容始终在最前面：
+        静态前缀 → 工具列表 → 当前计划 → 记忆 → 对话消息
+    服务端的前缀缓存（OpenAI / DeepSeek 的 prompt caching、vLLM / SGLang 的 prefix caching）按前缀匹配，
+    越稳定的内容越靠前，每一轮能复用的前缀越长。
+
+    - segment 按 (段名, 键) 记忆段的文本：键不变（例如查询、记忆库版本未变）时不再重新生成，
+      Streamlit 每次重新运行脚本、run_plan 的每一步都可以复用
+    - 每段文本取 sha256，前缀指纹是各段哈希的链；最近出现过的前缀指纹按 LRU 保存，
+      record 时找出与它们相同的最长前缀，按段估算服务端可以复用的 token 数
+    - 每轮记录段的复用情况、估算的可复用前缀 token 数，以及服务端报告的缓存 token 数（如果有）
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Hashable, List, Optional
+
+from core.tokens import estimate_tokens
+
+
+@dataclass
+class Segment:
+    """ 提示词中的一段 """
+    name: str
+    text: str
+    digest: str
+    tokens: int
+    reused: bool = False
+
+
+@dataclass
+class AssembledPrompt:
+    text: str
+    segments: List[Segment]
+
+    @property
+    def tokens(self) -> int:
+        return sum(segment.tokens for segment in self.segments)
+
+
+@dataclass
+class PromptUsage:
+    """ 一轮请求的提示词统计 """
+    prompt_tokens: int                     # 估算的提示词 token 数（系统提示词 + 对话消息）
+    prefix_tokens: int                     # 与最近的请求相同的前缀，估算的可复用 token 数
+    segments: int
+    reused_segments: int                   # 没有重新生成的段
+    cached_tokens: Optional[int] = None    # 服务端报告的缓存命中 token 数
+
+
+def digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PromptAssembler:
+    """ 提示词拼装器
+
+    Args:
+        cache_size: 记忆的段文本条数
+        prefix_size: 保存的最近前缀指纹条数
+        history_size: 保留最近多少轮的统计
+    """
+
+    def __init__(self, cache_size: int = 256, prefix_size: int = 4096, history_size: int = 200):
+        self.cache_size = cache_size
+        self.prefix_size = prefix_size
+        self.segments: "OrderedDict[tuple, Segment]" = OrderedDict()
+        self.prefixes: "OrderedDict[str, None]" = OrderedDict()
+        # 最近拼装的系统提示词 -> 它的各段，record 时按段比较前缀
+        self.assembled: "OrderedDict[str, List[Segment]]" = OrderedDict()
+        self.history: Deque[PromptUsage] = deque(maxlen=history_size)
+        self.lock = threading.Lock()
+        self.counters = {"segments": 0, "segment_hits": 0, "turns": 0, "prompt_tokens": 0, "prefix_tokens": 0,
+                         "cached_tokens": 0}
+
+    def segment(self, name: str, key: Hashable, build: Callable[[], str]) -> Segment:
+        """返回名为 name 的段，键与之前相同时复用之前的文本，否则调用 build 生成"""
+        with self.lock:
+            self.counters["segments"] += 1
+            cached = self.segments.get((name, key))
+            if cached is not None:
+                self.segments.move_to_end((name, key))
+                self.counters["segment_hits"] += 1
+                return Segment(cached.name, cached.text, cached.digest, cached.tokens, reused=True)
+        text = build()
+        segment = Segment(name, text, digest(text), estimate_tokens(text))
+        with self.lock:
+            self.segments[(name, key)] = segment
+            while len(self.segments) > self.cache_size:
+                self.segments.popitem(last=False)
+        return segment
+
+    def assemble(self, segments: List[Segment]) -> AssembledPrompt:
+        """按给定顺序拼接各段，调用方应把越稳定的段放在越前面"""
+        prompt = AssembledPrompt("".join(segment.text for segment in segments), list(segments))
+        with self.lock:
+            key = digest(prompt.text)
+            self.assembled[key] = prompt.segments
+            self.assembled.move_to_end(key)
+            while len(self.assembled) > self.cache_size:
+                self.assembled.popitem(last=False)
+        return prompt
+
+    def record(self, system_prompt: str, messages: List[Dict], cached_tokens: Optional[int] = None) -> PromptUsage:
+        """记录一次请求（系统提示词 + 之后的消息），返回这一轮的统计"""
+        with self.lock:
+            segments = self.assembled.get(digest(system_prompt))
+            if segments is None:  # 不是由本拼装器生成的提示词，整体作为一段
+                segments = [Segment("system", system_prompt, digest(system_prompt), estimate_tokens(system_prompt))]
+            parts = [(s.digest, s.tokens) for s in segments if s.text] + \
+                [(digest(f"{m['role']}\n{m.get('content') or ''}"), estimate_tokens(str(m.get("content") or "")))
+                 for m in messages]
+
+            chain, prompt_tokens, prefix_tokens, matching = "", 0, 0, True
+            for part_digest, tokens in parts:
+                chain = digest(chain + part_digest)
+                prompt_tokens += tokens
+                if matching and chain in self.prefixes:
+                    prefix_tokens += tokens
+                    self.prefixes.move_to_end(chain)
+                else:
+                    matching = False
+                    self.prefixes[chain] = None
+            while len(self.prefixes) > self.prefix_size:
+                self.prefixes.popitem(last=False)
+
+            usage = PromptUsage(prompt_tokens, prefix_tokens, len(segments),
+                                sum(1 for s in segments if s.reused), cached_tokens)
+            self.history.append(usage)
+            self.counters["turns"] += 1
+            self.counters["prompt_tokens"] += prompt_tokens
+            self.counters["prefix_tokens"] += prefix_tokens
+            self.counters["cached_tokens"] += cached_tokens or 0
+        return usage
+
+    def stats(self) -> Dict[str, float]:
+        """段复用率、可复用前缀占提示词 token 的比例，以及服务端报告的缓存比例"""
+        with self.lock:
+            stats: Dict[str, float] = dict(self.counters)
+        stats["segment_hit_ratio"] = stats["segment_hits"] / stats["segments"] if stats["segments"] else 0.0
+        stats["prefix_ratio"] = stats["prefix_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        stats["cached_ratio"] = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        return stats
@@ -0,0 +1,208 @@
+"""
+    response_cache.py
+
+    对话回复的缓存（需显式开启），用于重复执行计划、在 CI 中对本地桩模型做回归。
+
+    - 键为 (模型, temperature, 规范化后的消息) 的 sha256：消息只保留 role 和 content，content 首尾空白去掉、
+      连续空白合并为一个空格，消息的 id、时间等元数据不影响命中
+    - 两级：进程内 LRU + SQLite 文件（多个进程共享，重启后仍然有效）
+    - 条目超过 ttl_seconds 后失效；文件中的数据超过 max_bytes 时从最久未使用的条目开始淘汰
+    - 模式：
+        readwrite  先查缓存，未命中时请求并写入（默认）
+        record     总是请求并覆盖缓存，用于刷新回归基线
+        replay     只读缓存，未命中抛出 ResponseCacheMiss，不会访问模型服务
+
+    配置：RESPONSE_CACHE（off / readwrite / record / replay）、RESPONSE_CACHE_PATH、RESPONSE_CACHE_TTL_HOURS、
+    RESPONSE_CACHE_MAX_MB、RESPONSE_CACHE_MEMORY_ENTRIES
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from core.db import ConnectionPool
+
+MODES = ("readwrite", "record", "replay")
+# 每写入多少条检查一次 TTL 和大小
+EVICT_EVERY = 64
+_WHITESPACE = re.compile(r"\s+")
+
+
+class ResponseCacheMiss(KeyError):
+    """ replay 模式下没有缓存的回复 """
+
+
+def normalize_messages(messages: List[Dict]) -> List[List[str]]:
+    return [[m.get("role", ""), _WHITESPACE.sub(" ", str(m.get("content") or "")).strip()] for m in messages]
+
+
+def cache_key(model: Optional[str], messages: List[Dict], temperature: Optional[float] = None) -> str:
+    payload = json.dumps([model, temperature, normalize_messages(messages)], ensure_ascii=False,
+                         separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """ 对话回复的两级缓存
+
+    Args:
+        path: SQLite 文件，为 None 时只使用内存
+        mode: readwrite、record 或 replay
+        memory_entries: 内存 LRU 的条数
+        ttl_seconds: 条目的有效期，<= 0 表示不过期
+        max_bytes: 文件中回复文本的总大小上限，<= 0 表示不限制
+    """
+
+    def __init__(self, path: Optional[str] = None, mode: str = "readwrite", memory_entries: int = 256,
+                 ttl_seconds: float = 7 * 86400, max_bytes: int = 64 * 1024 * 1024):
+        if mode not in MODES:
+            raise ValueError(f"Invalid response cache mode: {mode}")
+        self.mode = mode
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (回复, 写入时间, 原请求耗时)
+        self.lock = threading.Lock()
+        self.pool = ConnectionPool(path) if path else None
+        if self.pool:
+            self.pool.write(self.create_table)
+        self.puts = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "expired": 0, "evicted": 0,
+                         "saved_ms": 0.0}
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """RESPONSE_CACHE 为 off（默认）时返回 None"""
+        mode = os.getenv("RESPONSE_CACHE", "off").lower()
+        if mode == "off":
+            return None
+        return cls(os.getenv("RESPONSE_CACHE_PATH", "./data/response_cache.db"), mode=mode,
+                   memory_entries=int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "256")),
+                   ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "168")) * 3600,
+                   max_bytes=int(float(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024))
+
+    @staticmethod
+    def create_table(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ResponseCache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                latency_ms REAL NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_accessed ON ResponseCache(accessed);")
+
+    def expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        """查找回复；record 模式总是返回 None，replay 模式未命中时抛出 ResponseCacheMiss"""
+        if self.mode == "record":
+            return None
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and self.expired(entry[1], now):
+                del self.memory[key]
+                self.counters["expired"] += 1
+                entry = None
+            if entry is not None:
+                self.memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                self.counters["saved_ms"] += entry[2]
+                return entry[0]
+
+        row = None
+        if self.pool:
+            row = self.pool.reader().execute(
+                "SELECT response, created, latency_ms FROM ResponseCache WHERE key = ?;", (key,)).fetchone()
+        if row is not None and not self.expired(row[1], now):
+            self.pool.submit(lambda conn: conn.execute(
+                "UPDATE ResponseCache SET accessed = ? WHERE key = ?;", (now, key)))
+            with self.lock:
+                self._remember(key, tuple(row))
+                self.counters["disk_hits"] += 1
+                self.counters["saved_ms"] += row[2]
+            return row[0]
+
+        with self.lock:
+            self.counters["misses"] += 1
+            self.counters["expired"] += row is not None
+        if self.mode == "replay":
+            raise ResponseCacheMiss(key)
+        return None
+
+    def put(self, key: str, response: str, model: str = None, latency_ms: float = 0.0):
+        """写入回复；replay 模式不写入"""
+        if self.mode == "replay":
+            return
+        now = time.time()
+        with self.lock:
+            self._remember(key, (response, now, latency_ms))
+            self.counters["stores"] += 1
+            self.puts += 1
+            evict = self.puts % EVICT_EVERY == 0
+        if self.pool:
+            self.pool.write(lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO ResponseCache (key, model, response, size, latency_ms, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?);",
+                (key, model, response, len(response.encode("utf-8")), latency_ms, now, now)))
+            if evict:
+                self.evict(now)
+
+    def _remember(self, key: str, entry: tuple):
+        """写入内存 LRU，调用时需持有 self.lock"""
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def evict(self, now: float = None) -> int:
+        """删除文件中过期的条目，再按最久未使用淘汰到 max_bytes 以内，返回删除的条数"""
+        if not self.pool:
+            return 0
+        now = time.time() if now is None else now
+
+        def evict(conn):
+            removed = 0
+            if self.ttl_seconds > 0:
+                removed += conn.execute("DELETE FROM ResponseCache WHERE created < ?;",
+                                        (now - self.ttl_seconds,)).rowcount
+            if self.max_bytes > 0:
+                total = conn.execute("SELECT coalesce(sum(size), 0) FROM ResponseCache;").fetchone()[0]
+                excess = total - self.max_bytes
+                if excess > 0:
+                    victims, freed = [], 0
+                    for key, size in conn.execute("SELECT key, size FROM ResponseCache ORDER BY accessed;"):
+                        if freed >= excess:
+                            break
+                        victims.append((key,))
+                        freed += size
+                    conn.executemany("DELETE FROM ResponseCache WHERE key = ?;", victims)
+                    removed += len(victims)
+            return removed
+
+        removed = self.pool.write(evict)
+        with self.lock:
+            self.counters["evicted"] += removed
+        return removed
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            stats: Dict[str, float] = dict(self.counters)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        if self.pool:
+            self.pool.close()
@@ -0,0 +1,75 @@
+"""
+    retrieval.py
+
+    混合检索的打分：多路召回结果用 Reciprocal Rank Fusion (RRF) 融合，再按时间做衰减加权。
+
+    RRF 只看名次不看原始分数，向量距离和 BM25 分数无需归一化即可合并：
+        score(m) = Σ_source weight[source] / (RRF_K + rank_source(m))
+    再乘以新近度加成：
+        score *= 1 + recency_weight * 0.5 ** (age_days / half_life_days)
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+RRF_K = 60
+SOURCES = ("vector", "keyword", "label", "trigger")
+DEFAULT_WEIGHTS = {"vector": 1.0, "keyword": 1.0, "label": 0.5, "trigger": 1.5}
+
+
+@dataclass
+class ScoredMemory:
+    memory: Any  # core.memory.Memory
+    score: float
+    sources: Dict[str, int] = field(default_factory=dict)  # 来源 -> 在该来源中的名次（从 1 开始）
+
+
+def to_datetime(value) -> Optional[datetime]:
+    """Memory 中的时间可能是 datetime，也可能是从 SQLite 读出的字符串"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return None
+
+
+def recency_boost(memory, now: datetime, half_life_days: float, weight: float) -> float:
+    """按 created_at / updated_at 中较新的一个计算加成系数，取值范围 [1, 1 + weight]"""
+    times = [t for t in (to_datetime(memory.created_at), to_datetime(memory.updated_at)) if t is not None]
+    if not times or weight <= 0 or half_life_days <= 0:
+        return 1.0
+    age_days = max((now - max(times)).total_seconds(), 0.0) / 86400
+    return 1.0 + weight * 0.5 ** (age_days / half_life_days)
+
+
+def fuse(ranked: Dict[str, List[int]], memories: Dict[int, Any], k: int,
+         weights: Dict[str, float] = None, half_life_days: float = 30.0, recency_weight: float = 0.2,
+         now: datetime = None) -> List[ScoredMemory]:
+    """融合各来源的排序结果
+
+    Args:
+        ranked: 来源 -> 按相关度排好序的 memory id 列表
+        memories: id -> Memory
+        k: 返回条数
+        weights: 来源权重，缺省使用 DEFAULT_WEIGHTS
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    now = now or datetime.now()
+    scored: Dict[int, ScoredMemory] = {}
+    for source, ids in ranked.items():
+        weight = weights.get(source, 1.0)
+        for rank, memory_id in enumerate(dict.fromkeys(ids), 1):
+            memory = memories.get(memory_id)
+            if memory is None:
+                continue
+            item = scored.setdefault(memory_id, ScoredMemory(memory, 0.0))
+            item.score += weight / (RRF_K + rank)
+            item.sources[source] = rank
+
+    for item in scored.values():
+        item.score *= recency_boost(item.memory, now, half_life_days, recency_weight)
+    return sorted(scored.values(), key=lambda item: (-item.score, -item.memory.id))[:k]
@@ -0,0 +1,202 @@
+"""
+    session_archive.py
+
+    冷会话归档：不再活跃的会话日志原样（保留压缩编码）追加到打包文件 archive/pack-NNNNNN.pack，
+    会话目录中只留下活跃会话，目录大小和扫描成本不随历史增长。
+
+    打包文件由若干条目组成，每个条目为：
+        ENTRY_MAGIC (4 字节) + session_id 长度 (2 字节) + 日志长度 (4 字节) + session_id + 日志
+    条目的位置记录在 index.db 的 Archive 表中；索引丢失时可以顺序扫描打包文件重建（同一会话以最后一个条目为准）。
+    会话被恢复或删除后只删除索引行，打包文件中的空间由 compact 在存活比例过低时回收。
+
+    RetentionPolicy 描述何时归档、何时回收已删除的会话，由 LocalSessionManager.apply_retention 执行。
+"""
+
+import os
+import re
+import struct
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Tuple
+
+from core.db import ConnectionPool
+from core.locks import FileLock
+
+ENTRY = struct.Struct(">4sHI")
+ENTRY_MAGIC = b"SPK\x00"
+# 当前打包文件超过这个大小后新建一个
+PACK_BYTES = 64 * 1024 * 1024
+_PACK_NAME = re.compile(r"pack-(\d{6})\.pack$")
+
+
+@dataclass
+class RetentionPolicy:
+    """ 会话保留策略
+
+    Attributes:
+        archive_after_days: 超过这么多天没有修改的会话归档，<= 0 表示不按时间归档
+        max_active_bytes: 会话目录中日志的总大小上限，超出时从最久未修改的会话开始归档，<= 0 表示不限制
+        tombstone_days: 标记删除超过这么多天的会话被彻底删除（包括归档）
+        min_live_ratio: 打包文件中仍被引用的数据低于这个比例时重写
+    """
+    archive_after_days: float = 30
+    max_active_bytes: int = 512 * 1024 * 1024
+    tombstone_days: float = 7
+    min_live_ratio: float = 0.5
+
+    @classmethod
+    def from_env(cls):
+        return cls(archive_after_days=float(os.getenv("SESSION_ARCHIVE_AFTER_DAYS", cls.archive_after_days)),
+                   max_active_bytes=int(float(os.getenv("SESSION_MAX_ACTIVE_MB", "512")) * 1024 * 1024),
+                   tombstone_days=float(os.getenv("SESSION_TOMBSTONE_DAYS", cls.tombstone_days)))
+
+
+class SessionArchive:
+    """ 会话归档的打包文件和索引
+
+    Args:
+        root: 打包文件目录
+        pool: index.db 的连接池，Archive 表与会话索引在同一个数据库中
+        fsync: 写入打包文件后是否 fsync
+    """
+
+    def __init__(self, root: str, pool: ConnectionPool, fsync: bool = True, pack_bytes: int = PACK_BYTES):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.pool = pool
+        self.fsync = fsync
+        self.pack_bytes = pack_bytes
+        # 打包文件的追加、读取和重写在进程间互斥；使用单独的锁文件，与会话锁不会落在同一分段
+        self.lock = FileLock(os.path.join(root, "archive.lock"), slots=1)
+        self.pool.write(self.create_table)
+
+    @staticmethod
+    def create_table(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS Archive (
+                session_id TEXT PRIMARY KEY,
+                pack INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_archive_pack ON Archive(pack);")
+
+    def pack_path(self, pack: int) -> str:
+        return os.path.join(self.root, f"pack-{pack:06d}.pack")
+
+    def packs(self):
+        return sorted(int(m.group(1)) for m in map(_PACK_NAME.match, os.listdir(self.root)) if m)
+
+    def _append(self, session_id: str, data: bytes) -> Tuple[int, int]:
+        """追加一个条目，返回 (打包文件编号, 日志在文件中的偏移)；调用时需持有 self.lock"""
+        packs = self.packs()
+        pack = packs[-1] if packs else 1
+        if packs and os.path.getsize(self.pack_path(pack)) >= self.pack_bytes:
+            pack += 1
+        key = session_id.encode("utf-8")
+        with open(self.pack_path(pack), "ab") as f:
+            offset = f.tell() + ENTRY.size + len(key)
+            f.write(ENTRY.pack(ENTRY_MAGIC, len(key), len(data)) + key + data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        return pack, offset
+
+    def put(self, session_id: str, data: bytes):
+        """归档一个会话日志，已归档的旧条目被替换"""
+        with self.lock.hold("archive"):
+            pack, offset = self._append(session_id, data)
+            # 先写数据再写索引：中途崩溃只会留下没有索引的条目，由 compact 回收。
+            # 索引在持锁期间写入：否则 compact 可能在两者之间把这个打包文件当作存活条目不足的旧文件重写并删除
+            self.pool.write(lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO Archive (session_id, pack, offset, length) VALUES (?, ?, ?, ?);",
+                (session_id, pack, offset, len(data))))
+
+    def read(self, session_id: str) -> Optional[bytes]:
+        row = self.pool.reader().execute("SELECT pack, offset, length FROM Archive WHERE session_id = ?;",
+                                         (session_id,)).fetchone()
+        if row is None:
+            return None
+        with self.lock.hold("archive"):
+            # compact 可能在查询之后移动了条目，持锁后重新查询
+            row = self.pool.reader().execute("SELECT pack, offset, length FROM Archive WHERE session_id = ?;",
+                                             (session_id,)).fetchone()
+            if row is None:
+                return None
+            with open(self.pack_path(row[0]), "rb") as f:
+                f.seek(row[1])
+                return f.read(row[2])
+
+    def contains(self, session_id: str) -> bool:
+        return self.pool.reader().execute("SELECT 1 FROM Archive WHERE session_id = ?;",
+                                          (session_id,)).fetchone() is not None
+
+    def remove(self, session_id: str):
+        self.pool.write(lambda conn: conn.execute("DELETE FROM Archive WHERE session_id = ?;", (session_id,)))
+
+    def scan(self, pack: int) -> Iterator[Tuple[str, int, int]]:
+        """顺序读取打包文件中的条目 (session_id, 偏移, 长度)，遇到不完整的条目时停止"""
+        path = self.pack_path(pack)
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            pos = 0
+            while pos + ENTRY.size <= size:
+                magic, key_length, length = ENTRY.unpack(f.read(ENTRY.size))
+                offset = pos + ENTRY.size + key_length
+                if magic != ENTRY_MAGIC or offset + length > size:
+                    return
+                session_id = f.read(key_length).decode("utf-8")
+                f.seek(length, os.SEEK_CUR)
+                yield session_id, offset, length
+                pos = offset + length
+
+    def rebuild(self) -> Dict[str, Tuple[int, int, int]]:
+        """扫描所有打包文件重建 Archive 表，返回 session_id -> (打包文件编号, 偏移, 长度)"""
+        entries = {}
+        with self.lock.hold("archive"):
+            for pack in self.packs():
+                for session_id, offset, length in self.scan(pack):
+                    entries[session_id] = (pack, offset, length)
+
+        def write(conn):
+            conn.execute("DELETE FROM Archive;")
+            conn.executemany("INSERT INTO Archive (session_id, pack, offset, length) VALUES (?, ?, ?, ?);",
+                             [(session_id, *entry) for session_id, entry in entries.items()])
+        self.pool.write(write)
+        return entries
+
+    def compact(self, min_live_ratio: float = 0.5, limit: int = 1) -> int:
+        """重写存活比例低于 min_live_ratio 的打包文件（当前正在追加的除外），返回回收的字节数"""
+        reclaimed = 0
+        with self.lock.hold("archive"):
+            packs = self.packs()
+            live = dict(self.pool.reader().execute("SELECT pack, sum(length) FROM Archive GROUP BY pack;").fetchall())
+            for pack in packs[:-1]:
+                if limit <= 0:
+                    break
+                size = os.path.getsize(self.pack_path(pack))
+                if size and live.get(pack, 0) >= min_live_ratio * size:
+                    continue
+                rows = self.pool.reader().execute(
+                    "SELECT session_id, offset, length FROM Archive WHERE pack = ?;", (pack,)).fetchall()
+                moved = []
+                with open(self.pack_path(pack), "rb") as f:
+                    for session_id, offset, length in rows:
+                        f.seek(offset)
+                        moved.append((session_id, *self._append(session_id, f.read(length)), length))
+                self.pool.write(lambda conn: conn.executemany(
+                    "UPDATE Archive SET pack = ?, offset = ? WHERE session_id = ? AND pack = ?;",
+                    [(new_pack, offset, session_id, pack) for session_id, new_pack, offset, _ in moved]))
+                os.remove(self.pack_path(pack))
+                reclaimed += size - sum(length for *_, length in moved)
+                limit -= 1
+        return reclaimed
+
+    def stats(self) -> Dict[str, int]:
+        packs = self.packs()
+        live = self.pool.reader().execute("SELECT count(*), coalesce(sum(length), 0) FROM Archive;").fetchone()
+        return {"packs": len(packs), "bytes": sum(os.path.getsize(self.pack_path(p)) for p in packs),
+                "sessions": live[0], "live_bytes": live[1]}
+
+    def close(self):
+        self.lock.close()
@@ -1,16 +1,54 @@
 """
     session_manager.py
+
+    会话以追加写的 JSON Lines 日志保存（<session_id>.jsonl），每行一条记录：
+      {"type": "session", "data": {...}}   会话属性（不含 conversation），日志的第一行
+      {"type": "message", "data": {...}}   一条对话消息
+      {"type": "meta", "data": {...}}      会话属性变化后的完整属性
+    save 只追加新消息和变化的属性，每轮对话写入的字节数与历史长度无关；
+    对话被修改（不是单纯追加）、属性记录过多或日志尾部不完整时整体重写（压缩）。
+    旧的 <session_id>.json 仍可读取，第一次保存时转换为日志。
+
+    超过保留期限的会话移入归档打包文件（core.session_archive），标记删除的会话在宽限期后被回收，
+    由 apply_retention 分批执行（可在后台线程中定期执行），每次只持有一个会话的锁。
+
+    日志可以按块压缩（core.codec，gzip 或 zstd），文件头的 MAGIC 区分压缩与未压缩的日志，
+    追加时沿用文件已有的编码；编码不同或小块过多的日志由 recompress（可在后台线程中定期执行）重写。
+
+    多个进程可以同时读写同一个会话目录：
+    - 读写一个会话时持有该会话的跨进程锁（core.locks.FileLock，锁文件为目录下的 sessions.lock）
+    - 重写先写临时文件再 os.replace，崩溃时只会留下旧文件或新文件；追加时崩溃最多留下不完整的尾行，读取时忽略
+    - 缓存的 LogState 记录了文件的 inode、大小和修改时间，文件被其他进程改动后重新扫描
+    - fsync 策略：none 交给操作系统；rewrite（默认）重写时同步文件和目录；always 每次追加也同步
 """
 
 import abc
+import bisect
+import logging
 import os
 import json
 import glob
+import io
+import tempfile
 import threading
 import time
 import uuid
 from datetime import datetime, timedelta
 
+from core import codec as codecs
+from core.db import ConnectionPool
+from core.locks import FileLock
+from core.session_archive import RetentionPolicy, SessionArchive
+
+PERIODS = ("Today", "ThisWeek", "ThisMonth", "ThisYear", "Earlier")
+# 日志中的 meta 记录超过这个数量时压缩
+COMPACT_META_RECORDS = 64
+FSYNC_POLICIES = ("none", "rewrite", "always")
+# 超过这个时间的临时文件视为崩溃遗留，打开目录时删除
+STALE_TMP_SECONDS = 3600
+# 后台重新压缩只处理超过这个时间没有修改的会话，避免与正在进行的对话争用锁
+RECOMPRESS_MIN_IDLE_SECONDS = 600
+
 class Session:
     """ Session类，表示一个会话 """
     def __init__(self, session_id, conversation, session_path, session_name, **kwargs):
@@ -41,12 +79,229 @@ class Session:
         """ 从字典创建Session对象 """
         return cls(**session_dict)
 
-class LocalSessionManager:
-    """ LocalSessionManager，管理本地会话 """
-    def __init__(self, path="./data/sessions"):
+class SessionIndex:
+    """ 会话索引：session_id、名称、创建时间和删除标记，保存在会话目录下的 index.db
+
+    列表、分页、按时间段过滤和按名称查找都只查询索引，不再打开会话文件。
+    """
+    def __init__(self, root):
+        self.pool = ConnectionPool(os.path.join(root, "index.db"))
+        self.pool.write(self.create_table)
+
+    @staticmethod
+    def create_table(conn):
+        create_sessions_table(conn)
+
+    def is_empty(self):
+        return self.pool.reader().execute("SELECT 1 FROM Sessions LIMIT 1;").fetchone() is None
+
+    def upsert(self, session_id, session_name, deleted=False, ctime=None, size=None, archived=False, mtime=None):
+        """新增或更新一条索引，未指定 ctime / size 时保留原值"""
+        now = time.time()
+        self.pool.write(lambda conn: conn.execute("""
+            INSERT INTO Sessions (session_id, session_name, ctime, mtime, deleted, size, archived)
+            VALUES (:id, :name, coalesce(:ctime, :now), :mtime, :deleted, coalesce(:size, 0), :archived)
+            ON CONFLICT(session_id) DO UPDATE SET
+                session_name = excluded.session_name, mtime = excluded.mtime, deleted = excluded.deleted,
+                ctime = coalesce(:ctime, ctime), size = coalesce(:size, size), archived = excluded.archived;
+            """, {"id": session_id, "name": session_name, "ctime": ctime, "now": now, "mtime": mtime or now,
+                  "deleted": int(bool(deleted)), "size": size, "archived": int(bool(archived))}))
+
+    def set_archived(self, session_id, archived):
+        self.pool.write(lambda conn: conn.execute(
+            "UPDATE Sessions SET archived = ? WHERE session_id = ?;", (int(bool(archived)), session_id)))
+
+    def tombstones(self, before, limit):
+        """ 在 before 之前被标记删除的会话 """
+        return [row[0] for row in self.pool.reader().execute(
+            "SELECT session_id FROM Sessions WHERE deleted = 1 AND mtime < ? ORDER BY mtime LIMIT ?;",
+            (before, limit))]
+
+    def least_recent(self, before=None, limit=100):
+        """ 未归档的会话按修改时间从旧到新，before 为修改时间上界 """
+        return self.pool.reader().execute("""
+            SELECT session_id, size FROM Sessions
+            WHERE deleted = 0 AND archived = 0 AND mtime < ? ORDER BY mtime LIMIT ?;
+            """, (float("inf") if before is None else before, limit)).fetchall()
+
+    def active_bytes(self):
+        """ 会话目录中（未归档）日志的总大小，包括尚未回收的已删除会话 """
+        return self.pool.reader().execute("SELECT coalesce(sum(size), 0) FROM Sessions WHERE archived = 0;").fetchone()[0]
+
+    def remove(self, session_id):
+        self.pool.write(lambda conn: conn.execute("DELETE FROM Sessions WHERE session_id = ?;", (session_id,)))
+
+    def list(self, start=None, end=None, offset=0, limit=None, name_prefix=None, include_deleted=False):
+        """按创建时间倒序返回 (session_id, session_name, ctime)，start/end 为时间戳区间 [start, end)"""
+        return list_sessions(self.pool.reader(), start, end, offset, limit, name_prefix, include_deleted)
+
+    def count(self):
+        return self.pool.reader().execute("SELECT COUNT(*) FROM Sessions WHERE deleted = 0;").fetchone()[0]
+
+    def find_by_name(self, session_name):
+        """名称匹配的会话 id，按创建时间倒序"""
+        return find_by_name(self.pool.reader(), session_name)
+
+    def close(self):
+        self.pool.close()
+
+
+class SessionManager(abc.ABC):
+    """ 会话管理接口
+
+    子类实现 new/save/get 以及按创建时间倒序列出会话的 list_rows，list() 的时间段划分和显示格式由基类统一处理。
+    """
+    closed = False
+    close_callbacks = ()
+
+    @abc.abstractmethod
+    def new(self, control_params):
+        """ 创建新的会话 """
+
+    @abc.abstractmethod
+    def save(self, session):
+        """ 保存会话 """
+
+    @abc.abstractmethod
+    def get(self, control_params):
+        """ 通过 session_id 或 session_name 获取会话，不存在或已删除时返回 None """
+
+    @abc.abstractmethod
+    def list_rows(self, start=None, end=None, offset=0, limit=None, name_prefix=None):
+        """ 按创建时间倒序返回未删除会话的 (session_id, session_name, ctime) """
+
+    @abc.abstractmethod
+    def count(self):
+        """ 未删除的会话数 """
+
+    def close(self):
+        """ 释放数据库连接等资源；子类先调用 run_close_callbacks """
+        self.run_close_callbacks()
+
+    def on_close(self, callback):
+        """ 注册在 close 开始时（资源释放之前）执行的回调，例如先写完后台写线程中排队的会话 """
+        self.close_callbacks = (*self.close_callbacks, callback)
+
+    def run_close_callbacks(self):
+        callbacks, self.close_callbacks = self.close_callbacks, ()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Session manager close callback failed: {e}", exc_info=True)
+
+    def delete(self, session_id):
+        """ 标记删除会话，返回会话是否存在；空间由各实现的回收机制释放 """
+        session = self.get({"session_id": session_id})
+        if session is None:
+            return False
+        session.deleted = True
+        self.save(session)
+        return True
+
+    def message_count(self, session_id):
+        """ 会话中的消息条数 """
+        session = self.get({"session_id": session_id})
+        return len(session.conversation) if session else 0
+
+    def read_messages(self, session_id, start=0, end=None, preview_chars=None):
+        """ 读取第 [start, end) 条消息，子类应只读取这个范围
+
+        Args:
+            preview_chars: 只返回 content 的前若干个字符，被截断的消息带 "truncated": True
+        """
+        session = self.get({"session_id": session_id})
+        messages = session.conversation[start:end] if session else []
+        return [preview_message(m, preview_chars) for m in messages]
+
+    def list(self, period=None, offset=0, limit=None, name_prefix=None):
+        """ 列出会话，按创建时间倒序
+
+        Args:
+            period: 只列出某个时间段（PERIODS 之一）创建的会话
+            offset: 分页偏移
+            limit: 最多返回的条数，None 表示全部
+            name_prefix: 只列出名称以此开头的会话
+        """
+        today, start_of_week, start_of_month, start_of_year = get_start_of_day_week_month_year()
+        start, end = period_range(period, today, start_of_week, start_of_month, start_of_year)
+        
+        sessions = []
+        for session_id, session_name, ctime in self.list_rows(start, end, offset, limit, name_prefix):
+            create_time = datetime.fromtimestamp(ctime)
+            consultation_period = calc_consultation_period(
+                create_time, today, start_of_week, start_of_month, start_of_year)
+            
+            sessions.append({
+                "session_id": session_id,
+                "session_name": session_name + ": " + session_id[:4],
+                "consultation_period": consultation_period,
+                "create_time": create_time.strftime('%Y-%m-%d %H:%M')
+            })
+        
+        return sessions
+
+
+class LocalSessionManager(SessionManager):
+    """ LocalSessionManager，管理本地会话
+
+    Args:
+        path: 会话目录
+        fsync: fsync 策略，FSYNC_POLICIES 之一
+        codec: 新日志和重写日志使用的压缩编码，"none"、"gzip" 或 "zstd"
+    """
+    def __init__(self, path="./data/sessions", fsync="rewrite", codec="none"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy: {fsync}")
         self.root = path
-        self.locks = {}
+        self.fsync = fsync
+        self.codec = codecs.get_codec(codec)
+        # session_id -> 已写入日志的状态，用于判断 save 时需要追加的内容
+        self.logs = {}
+        self.counters = {"appends": 0, "rewrites": 0, "bytes_written": 0, "fsyncs": 0, "rescans": 0,
+                         "recompressed": 0}
+        self.stop_event = threading.Event()
+        self.workers = {}
+        os.makedirs(self.root, exist_ok=True)
+        self.file_lock = FileLock(os.path.join(self.root, "sessions.lock"))
+        self.remove_stale_tmp()
+        self.index = SessionIndex(self.root)
+        self.archive = SessionArchive(os.path.join(self.root, "archive"), self.index.pool, fsync=fsync != "none")
+        if self.index.is_empty():
+            self.reindex()
+
+    def reindex(self):
+        """扫描会话文件重建索引（索引不存在时自动执行一次）"""
+        files = glob.glob(os.path.join(self.root, "*.json")) + glob.glob(os.path.join(self.root, "*.jsonl"))
+        for session_file in files:
+            session_data = self.read_file(session_file)
+            if session_data is None:
+                continue
+            self.index.upsert(
+                session_data.get("session_id") or os.path.basename(session_file).split(".")[0],
+                session_data.get("session_name", ""),
+                deleted=session_data.get("deleted", False),
+                ctime=os.path.getctime(session_file), size=os.path.getsize(session_file),
+                mtime=os.path.getmtime(session_file))
+        # 归档中的会话（会话目录中已有同名日志的除外）
+        active = {os.path.basename(f).split(".")[0] for f in files}
+        for session_id in self.archive.rebuild():
+            if session_id in active:
+                continue
+            session_data = self.read_archived(session_id)
+            if session_data is not None:
+                self.index.upsert(session_id, session_data.get("session_name", ""),
+                                  deleted=session_data.get("deleted", False), archived=True)
     
+    def remove_stale_tmp(self):
+        """ 删除崩溃时遗留的临时文件；较新的可能是其他进程正在写入的，保留 """
+        for tmp_path in glob.glob(os.path.join(self.root, "*.jsonl.*.tmp")):
+            try:
+                if time.time() - os.path.getmtime(tmp_path) > STALE_TMP_SECONDS:
+                    os.remove(tmp_path)
+            except OSError:
+                pass
+
     def new(self, control_params):
         """ 创建新的会话 """
         session_data = {**control_params}
@@ -62,20 +317,166 @@ class LocalSessionManager:
         return session
     
     def save(self, session):
-        """ 保存会话 """
-        session_path = os.path.join(session.session_path, f"{session.session_id}.json")
-        
-        # 获取或创建锁
-        if session_path not in self.locks:
-            self.locks[session_path] = threading.Lock()
-        lock = self.locks[session_path]
+        """ 保存会话：只追加上次保存之后的新消息和变化的属性 """
+        session_path = os.path.join(session.session_path, f"{session.session_id}.jsonl")
         
-        lock.acquire()
+        with self.lock(session.session_id):
+            meta = {k: v for k, v in session.to_dict().items() if k != "conversation"}
+            conversation = session.conversation
+            state = self.log_state(session.session_id, session_path)
+            if state is None and not os.path.exists(session_path) and self.archive.contains(session.session_id):
+                # 归档的会话再次保存时恢复到会话目录，归档中的条目随之失效
+                self.archive.remove(session.session_id)
+            if state is None or not state.appendable(conversation):
+                state = self.rewrite_log(session_path, meta, conversation)
+            else:
+                records = []
+                if meta != state.meta:
+                    records.append({"type": "meta", "data": meta})
+                records += [{"type": "message", "data": m} for m in conversation[state.messages:]]
+                offsets, blocks = self.append_log(session_path, records, codecs.get_codec(state.codec))
+                state.update(meta, conversation, sum(r["type"] == "meta" for r in records), offsets, blocks)
+                state.stamp = file_stamp(session_path)
+                if state.meta_records > COMPACT_META_RECORDS:
+                    state = self.rewrite_log(session_path, meta, conversation)
+            self.logs[session.session_id] = state
+        self.index.upsert(session.session_id, session.session_name, deleted=getattr(session, "deleted", False),
+                          size=state.stamp[1] if state.stamp else None)
+
+    def compact(self, session_id):
+        """ 把会话日志重写为 session 记录 + 消息记录 """
+        session = self.get({"session_id": session_id})
+        if session is not None:
+            meta = {k: v for k, v in session.to_dict().items() if k != "conversation"}
+            with self.lock(session_id):
+                self.logs[session_id] = self.rewrite_log(
+                    os.path.join(session.session_path, f"{session_id}.jsonl"), meta, session.conversation)
+
+    def lock(self, session_id):
+        """ 会话的跨进程锁（同时互斥本进程内的线程），不可重入 """
+        return self.file_lock.hold(session_id)
+
+    def sync(self, fd):
+        os.fsync(fd)
+        self.counters["fsyncs"] += 1
+
+    def sync_dir(self, path):
+        """ 同步目录项，使 rename 在断电后仍然有效（Windows 不支持打开目录） """
+        if os.name != "posix":
+            return
+        fd = os.open(path, os.O_RDONLY)
         try:
-            with open(session_path, "w", encoding='utf-8') as f:
-                json.dump(session.to_dict(), f, indent=4, ensure_ascii=False)
+            self.sync(fd)
         finally:
-            lock.release()
+            os.close(fd)
+
+    def append_log(self, path, records, codec=None):
+        """ 以文件已有的编码追加记录，返回 (消息记录所在块的偏移, 块数) """
+        data, offsets, blocks = b"", [], 0
+        if records:
+            with open(path, "ab") as f:
+                data, offsets, blocks = encode_records(records, codec, f.tell())
+                f.write(data)
+                if self.fsync == "always":
+                    f.flush()
+                    self.sync(f.fileno())
+        self.counters["appends"] += 1
+        self.counters["bytes_written"] += len(data)
+        return offsets, blocks
+
+    def rewrite_log(self, path, meta, conversation, codec=None):
+        """ 整体重写日志（先写临时文件再替换），旧的 .json 文件随之删除
+
+        Args:
+            codec: 压缩编码的名称，缺省使用 self.codec
+        """
+        codec = self.codec if codec is None else codecs.get_codec(codec)
+        records = [{"type": "session", "data": meta}] + [{"type": "message", "data": m} for m in conversation]
+        head = codecs.header(codec)
+        data, offsets, blocks = encode_records(records, codec, len(head))
+        data = head + data
+        directory = os.path.dirname(path) or "."
+        # 临时文件名唯一，多个进程/线程的临时文件不会互相覆盖
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                if self.fsync != "none":
+                    f.flush()
+                    self.sync(f.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self.fsync != "none":
+            self.sync_dir(directory)
+        legacy_path = path[:-len(".jsonl")] + ".json"
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        self.counters["rewrites"] += 1
+        self.counters["bytes_written"] += len(data)
+        state = LogState(meta, conversation, offsets=offsets, codec=codec.name if codec else "none", blocks=blocks)
+        state.stamp = file_stamp(path)
+        return state
+
+    @staticmethod
+    def scan_log(path):
+        """ 读取会话日志，返回 (属性, 对话, LogState)；日志尾部不完整时 LogState 为 None，下次保存会重写 """
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            meta, conversation, state, pos = LocalSessionManager.scan_stream(f, path)
+        if state is not None:
+            # 按实际读到的长度记录大小，扫描期间文件被追加时下次使用前会重新扫描
+            state.stamp = (stat.st_ino, pos, stat.st_mtime_ns)
+        return meta, conversation, state
+
+    @staticmethod
+    def scan_stream(f, name):
+        """ 读取已打开的日志（文件或归档中的字节），返回 (属性, 对话, LogState, 最后一个完整块的结束偏移) """
+        meta, conversation, meta_records, torn = None, [], 0, False
+        offsets, blocks = [], 0
+        codec = codecs.read_header(f)
+        pos = f.tell()
+        for block_start, block_end, data in codecs.iter_blocks(f, codec, pos):
+            try:
+                if data is None:
+                    raise ValueError("incomplete record")
+                records = [json.loads(line) for line in data.splitlines()]
+            except ValueError:
+                torn = True  # 写入中途崩溃留下的半行/半个块，之后不应再有有效记录
+                break
+            for record in records:
+                if record["type"] == "message":
+                    conversation.append(record["data"])
+                    offsets.append(block_start)
+                elif record["type"] == "session":
+                    meta = record["data"]
+                else:
+                    meta = record["data"]
+                    meta_records += 1
+            pos = block_end
+            blocks += 1
+        if meta is None:
+            raise ValueError(f"{name} has no session record")
+        state = None if torn else LogState(meta, conversation, meta_records, offsets,
+                                           codec.name if codec else "none", blocks)
+        return meta, conversation, state, pos
+
+    def read_file(self, session_file):
+        """ 读取会话文件（日志或旧的 JSON），返回包含 conversation 的字典，失败返回 None """
+        try:
+            if session_file.endswith(".jsonl"):
+                meta, conversation, state = self.scan_log(session_file)
+                if state is not None:
+                    self.logs[meta["session_id"]] = state
+                return {**meta, "conversation": conversation}
+            with open(session_file, encoding='utf-8') as file:
+                return json.load(file)
+        except Exception as e:
+            print(f"JSON error in {session_file} with error: {str(e)}")
+            return None
     
     def get(self, control_params):
         """ 获取会话 """
@@ -83,66 +484,523 @@ class LocalSessionManager:
         session_name = control_params.get("session_name")
         
         if session_id:
-            # 通过session_id获取会话
-            session_json = os.path.join(self.root, f"{session_id}.json")
-            if not os.path.exists(session_json):
+            # 通过session_id获取会话，优先读取日志
+            with self.lock(session_id):
+                session_file = os.path.join(self.root, f"{session_id}.jsonl")
+                if not os.path.exists(session_file):
+                    session_file = os.path.join(self.root, f"{session_id}.json")
+                if os.path.exists(session_file):
+                    session_data = self.read_file(session_file)
+                else:
+                    session_data = self.read_archived(session_id)
+            # 检查是否被删除
+            if session_data is None or session_data.get("deleted"):
                 return None
+            # 创建Session对象
+            return Session.from_dict(session_data)
+        elif session_name:
+            # 通过session_name获取会话，可能有多个匹配，取最新的一个
+            for session_id in self.index.find_by_name(session_name):
+                session = self.get({"session_id": session_id})
+                if session is not None:
+                    return session
+            return None
+        else:
+            return None
+    
+    def read_archived(self, session_id):
+        """ 从归档中读取会话，返回包含 conversation 的字典，不在归档中或读取失败返回 None """
+        data = self.archive.read(session_id)
+        if data is None:
+            return None
+        try:
+            meta, conversation, _, _ = self.scan_stream(io.BytesIO(data), f"archive:{session_id}")
+        except Exception as e:
+            print(f"JSON error in archived session {session_id} with error: {str(e)}")
+            return None
+        return {**meta, "session_path": self.root, "conversation": conversation}
+
+    def log_state(self, session_id, path=None):
+        """ 会话日志的 LogState，调用时需持有会话的锁
+
+        尚未读取过或文件已被其他进程修改时重新扫描；没有日志或尾部不完整时返回 None。
+        """
+        path = path or os.path.join(self.root, f"{session_id}.jsonl")
+        state = self.logs.get(session_id)
+        if state is not None and state.stamp != file_stamp(path):
+            self.counters["rescans"] += 1
+            del self.logs[session_id]
+            state = None
+        if state is None and os.path.exists(path):
             try:
-                with open(session_json, encoding='utf-8') as file:
-                    session_data = json.load(file)
-                    # 检查是否被删除
-                    if session_data.get("deleted"):
-                        return None
-                    # 创建Session对象
-                    return Session.from_dict(session_data)
+                state = self.scan_log(path)[2]
             except Exception as e:
-                print(f"JSON error in {session_json} with error: {str(e)}")
+                print(f"JSON error in {path} with error: {str(e)}")
                 return None
-        elif session_name:
-            # 通过session_name获取会话，可能有多个匹配
-            user_sessions_path = os.path.join(self.root, "*.json")
-            files = glob.glob(user_sessions_path)
-            matching_sessions = []
-            for session_file in files:
+            if state is not None:
+                self.logs[session_id] = state
+        return state
+
+    def message_count(self, session_id):
+        with self.lock(session_id):
+            state = self.log_state(session_id)
+            if state is not None:
+                return 0 if state.meta.get("deleted") else state.messages
+        return super().message_count(session_id)
+
+    def read_messages(self, session_id, start=0, end=None, preview_chars=None):
+        """ 按 LogState 中记录的偏移直接定位到第 start 条消息，只读取需要的记录 """
+        path = os.path.join(self.root, f"{session_id}.jsonl")
+        with self.lock(session_id):
+            state = self.log_state(session_id)
+            if state is not None:
+                if state.meta.get("deleted"):
+                    return []
+                start, end, _ = slice(start, end).indices(state.messages)
+                messages = []
+                if start < end:
+                    first = state.offsets[start]
+                    # 同一个块中排在 start 之前的消息需要跳过
+                    skip = start - bisect.bisect_left(state.offsets, first)
+                    with open(path, "rb") as f:
+                        for _, _, data in codecs.iter_blocks(f, codecs.get_codec(state.codec), first):
+                            for line in data.splitlines():
+                                record = json.loads(line)
+                                if record["type"] != "message":
+                                    continue
+                                if skip:
+                                    skip -= 1
+                                    continue
+                                messages.append(preview_message(record["data"], preview_chars))
+                            if len(messages) >= end - start:
+                                break
+                return messages[:end - start]
+        # 旧的 .json 或日志损坏，整体读取
+        return super().read_messages(session_id, start, end, preview_chars)
+
+    def list_rows(self, start=None, end=None, offset=0, limit=None, name_prefix=None):
+        return self.index.list(start, end, offset, limit, name_prefix)
+
+    def count(self):
+        """ 未删除的会话数 """
+        return self.index.count()
+
+    def needs_recompress(self, state):
+        """ 编码与 self.codec 不同，或者压缩日志中追加产生的小块超过重写后块数的两倍 """
+        if state.codec != (self.codec.name if self.codec else "none"):
+            return True
+        records = 1 + state.meta_records + state.messages
+        return self.codec is not None and state.blocks > 2 * -(-records // codecs.BLOCK_RECORDS)
+
+    def recompress(self, min_idle_seconds=0, stop=None):
+        """ 把需要重新压缩的日志（以及旧的 .json）用 self.codec 重写，返回重写的会话数
+
+        每次只持有一个会话的锁，其他会话的读写不受影响。
+        """
+        files = glob.glob(os.path.join(self.root, "*.jsonl")) + glob.glob(os.path.join(self.root, "*.json"))
+        rewritten = 0
+        for path in files:
+            if stop is not None and stop.is_set():
+                break
+            session_id = os.path.basename(path).rsplit(".", 1)[0]
+            try:
+                if time.time() - os.path.getmtime(path) < min_idle_seconds:
+                    continue
+            except FileNotFoundError:
+                continue  # .json 已被转换或会话已删除
+            with self.lock(session_id):
+                if path.endswith(".jsonl"):
+                    state = self.log_state(session_id, path)
+                    if state is None or not self.needs_recompress(state):
+                        continue
+                elif os.path.exists(path[:-len(".json")] + ".jsonl"):
+                    continue
+                session_data = self.read_file(path)
+                if session_data is None:
+                    continue
+                conversation = session_data.pop("conversation")
+                self.logs[session_id] = self.rewrite_log(
+                    os.path.join(self.root, f"{session_id}.jsonl"), session_data, conversation)
+            rewritten += 1
+            self.counters["recompressed"] += 1
+        return rewritten
+
+    def archive_session(self, session_id):
+        """ 把会话日志移入归档，返回是否归档成功；日志尾部不完整的会话留到下次保存修复后再归档 """
+        path = os.path.join(self.root, f"{session_id}.jsonl")
+        with self.lock(session_id):
+            if not os.path.exists(path):
+                legacy_path = os.path.join(self.root, f"{session_id}.json")
+                session_data = self.read_file(legacy_path) if os.path.exists(legacy_path) else None
+                if session_data is None:
+                    return False
+                conversation = session_data.pop("conversation")
+                self.rewrite_log(path, session_data, conversation)
+            if self.log_state(session_id, path) is None:
+                return False
+            with open(path, "rb") as f:
+                data = f.read()
+            self.archive.put(session_id, data)
+            self.index.set_archived(session_id, True)
+            os.remove(path)
+            self.logs.pop(session_id, None)
+        return True
+
+    def purge(self, session_id):
+        """ 彻底删除会话：日志、归档条目和索引 """
+        with self.lock(session_id):
+            for ext in (".jsonl", ".json"):
+                path = os.path.join(self.root, session_id + ext)
+                if os.path.exists(path):
+                    os.remove(path)
+            self.logs.pop(session_id, None)
+            self.archive.remove(session_id)
+            self.index.remove(session_id)
+
+    def apply_retention(self, policy=None, limit=100, now=None):
+        """ 执行一批保留策略，每一项最多处理 limit 个会话，返回各项处理的数量
+
+        1. 回收标记删除超过 tombstone_days 的会话
+        2. 归档超过 archive_after_days 未修改的会话
+        3. 会话目录超过 max_active_bytes 时从最久未修改的会话开始归档
+        4. 重写存活比例过低的一个打包文件
+        """
+        policy = policy or RetentionPolicy()
+        now = now or time.time()
+        done = {"purged": 0, "archived": 0, "archived_for_size": 0, "reclaimed_bytes": 0}
+
+        for session_id in self.index.tombstones(now - policy.tombstone_days * 86400, limit):
+            self.purge(session_id)
+            done["purged"] += 1
+
+        if policy.archive_after_days > 0:
+            for session_id, _ in self.index.least_recent(now - policy.archive_after_days * 86400, limit):
+                done["archived"] += self.archive_session(session_id)
+
+        if policy.max_active_bytes > 0:
+            excess = self.index.active_bytes() - policy.max_active_bytes
+            if excess > 0:
+                for session_id, size in self.index.least_recent(limit=limit):
+                    if excess <= 0:
+                        break
+                    if self.archive_session(session_id):
+                        done["archived_for_size"] += 1
+                        excess -= size
+
+        done["reclaimed_bytes"] = self.archive.compact(policy.min_live_ratio)
+        return done
+
+    def run_periodically(self, name, job, interval):
+        """ 在后台线程中反复执行 job，job 返回真值表示还有待处理的工作，稍后立即再次执行；close() 时停止 """
+        if name in self.workers:
+            return self.workers[name]
+
+        def run():
+            while not self.stop_event.is_set():
+                more = False
                 try:
-                    with open(session_file, encoding='utf-8') as f:
-                        session_data = json.load(f)
-                        if session_name.startswith(session_data.get("session_name", "")) and not session_data.get("deleted"):
-                            matching_sessions.append(Session.from_dict(session_data))
+                    more = job()
                 except Exception as e:
-                    print(f"JSON error in {session_file} with error: {str(e)}")
-            return matching_sessions[0]
-        else:
+                    logging.error(f"{name} failed: {e}")
+                self.stop_event.wait(0.05 if more else interval)
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        self.workers[name] = thread
+        thread.start()
+        return thread
+
+    def start_recompression(self, interval=3600, min_idle_seconds=RECOMPRESS_MIN_IDLE_SECONDS):
+        """ 启动后台线程，每隔 interval 秒执行一次 recompress """
+        def step():
+            self.recompress(min_idle_seconds, self.stop_event)
+        return self.run_periodically("session-recompress", step, interval)
+
+    def start_retention(self, policy=None, interval=600, batch=50):
+        """ 启动后台线程分批执行 apply_retention：一批处理满时接着处理下一批，否则等待 interval 秒 """
+        policy = policy or RetentionPolicy()
+
+        def step():
+            done = self.apply_retention(policy, batch)
+            return max(done["purged"], done["archived"], done["archived_for_size"]) >= batch
+        return self.run_periodically("session-retention", step, interval)
+
+    def close(self):
+        self.run_close_callbacks()
+        self.closed = True
+        self.stop_event.set()
+        for thread in self.workers.values():
+            thread.join()
+        self.index.close()
+        self.archive.close()
+        self.file_lock.close()
+
+
+class LogState:
+    """ 一个会话日志已写入的内容：属性、消息条数、每条消息记录的字节偏移和最后一条消息的指纹 """
+    def __init__(self, meta, conversation, meta_records=0, offsets=None, codec="none", blocks=0):
+        self.meta_records = meta_records
+        self.codec = codec
+        self.blocks = blocks
+        self.offsets = []
+        # 最后一次写入或扫描后文件的 (inode, 大小, 修改时间)，与当前不一致说明文件被其他进程改动过
+        self.stamp = None
+        self.update(meta, conversation, new_offsets=offsets or [])
+
+    def update(self, meta, conversation, new_meta_records=0, new_offsets=(), new_blocks=0):
+        self.meta = meta
+        self.messages = len(conversation)
+        self.last = message_fingerprint(conversation[-1]) if conversation else None
+        self.meta_records += new_meta_records
+        self.offsets.extend(new_offsets)
+        self.blocks += new_blocks
+
+    def appendable(self, conversation):
+        """ 已写入的消息仍是对话的前缀（只检查最后一条），可以只追加新消息 """
+        if len(conversation) < self.messages:
+            return False
+        return self.messages == 0 or message_fingerprint(conversation[self.messages - 1]) == self.last
+
+
+def message_fingerprint(message):
+    return json.dumps(message, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def file_stamp(path):
+    """ 文件的 (inode, 大小, 修改时间)，文件不存在时为 None """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def encode_records(records, codec, base):
+    """ 把记录编码为从文件偏移 base 开始写入的数据，返回 (数据, 消息记录所在块的偏移, 块数) """
+    lines = [(json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8") for r in records]
+    return codecs.encode_records(lines, [r["type"] == "message" for r in records], codec, base)
+
+
+def preview_message(message, preview_chars=None):
+    """ 截断 content 用于列表显示，截断后的消息带 "truncated": True """
+    content = message.get("content")
+    if preview_chars is None or not isinstance(content, str) or len(content) <= preview_chars:
+        return message
+    return {**message, "content": content[:preview_chars], "truncated": True}
+
+
+class SqliteSessionManager(SessionManager):
+    """ 会话和消息保存在 SQLite 中
+
+    Sessions 与 SessionIndex 的表结构相同，另外用 meta 列保存其他会话属性；
+    Messages(session_id, seq) 为主键，保存时只插入新消息，每次保存是一个事务。
+    """
+    def __init__(self, path="./data/sessions.db"):
+        self.root = os.path.dirname(path) or "."
+        self.pool = ConnectionPool(path)
+        self.pool.write(self.create_table)
+
+    @staticmethod
+    def create_table(conn):
+        create_sessions_table(conn)
+        if "meta" not in [row[1] for row in conn.execute("PRAGMA table_info(Sessions);")]:
+            conn.execute("ALTER TABLE Sessions ADD COLUMN meta TEXT NOT NULL DEFAULT '{}';")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS Messages (
+                session_id TEXT NOT NULL REFERENCES Sessions(session_id) ON DELETE CASCADE,
+                seq INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            ) WITHOUT ROWID;
+            """)
+
+    def new(self, control_params):
+        """ 创建新的会话 """
+        session_data = {**control_params}
+        session_data["session_id"] = generate_session_id()
+        session_data["conversation"] = []
+        session_data["session_path"] = self.root
+        session_data.setdefault("session_name", "Default Session")  # 设置默认值
+        session = Session.from_dict(session_data)
+        self.save(session)
+        return session
+
+    def save(self, session, ctime=None):
+        """ 保存会话：新消息追加插入，对话被修改时整体替换；ctime 仅用于导入已有会话 """
+        meta = {k: v for k, v in session.to_dict().items()
+                if k not in ("conversation", "session_id", "session_name", "deleted")}
+        conversation = session.conversation
+        dump = lambda message: json.dumps(message, ensure_ascii=False)
+        now = time.time()
+
+        def write(conn):
+            conn.execute("""
+                INSERT INTO Sessions (session_id, session_name, ctime, mtime, deleted, meta)
+                VALUES (:id, :name, coalesce(:ctime, :now), :now, :deleted, :meta)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    session_name = excluded.session_name, mtime = excluded.mtime, deleted = excluded.deleted,
+                    meta = excluded.meta, ctime = coalesce(:ctime, ctime);
+                """, {"id": session.session_id, "name": session.session_name, "ctime": ctime, "now": now,
+                      "deleted": int(bool(getattr(session, "deleted", False))), "meta": json.dumps(meta)})
+            last = conn.execute("SELECT seq, data FROM Messages WHERE session_id = ? ORDER BY seq DESC LIMIT 1;",
+                                (session.session_id,)).fetchone()
+            stored = 0 if last is None else last[0] + 1
+            # 只比较已保存的最后一条消息，一致则只需插入之后的消息
+            if stored > len(conversation) or (stored and dump(conversation[stored - 1]) != last[1]):
+                conn.execute("DELETE FROM Messages WHERE session_id = ?;", (session.session_id,))
+                stored = 0
+            conn.executemany("INSERT INTO Messages (session_id, seq, data) VALUES (?, ?, ?);",
+                             [(session.session_id, seq, dump(conversation[seq]))
+                              for seq in range(stored, len(conversation))])
+
+        self.pool.write(write)
+
+    def get(self, control_params):
+        """ 获取会话 """
+        session_id = control_params.get("session_id")
+        session_name = control_params.get("session_name")
+        conn = self.pool.reader()
+        if not session_id and session_name:
+            ids = find_by_name(conn, session_name)
+            session_id = ids[0] if ids else None
+        if not session_id:
             return None
-    
-    def list(self):
-        """ 列出所有会话 """
-        user_sessions_path = os.path.join(self.root, "*.json")
-        files = glob.glob(user_sessions_path)
-        files.sort(key=os.path.getctime, reverse=True)
-        
-        today, start_of_week, start_of_month, start_of_year = get_start_of_day_week_month_year()
-        
-        sessions = []
-        for session_file in files:
-            session_id = os.path.basename(session_file).split(".")[0]
-            session = self.get({"session_id": session_id})
-            if session is None:
-                continue
-            
-            session_name = session.session_name
-            create_time = datetime.fromtimestamp(os.path.getctime(session_file))
-            consultation_period = calc_consultation_period(
-                create_time, today, start_of_week, start_of_month, start_of_year)
-            
-            sessions.append({
-                "session_id": session_id,
-                "session_name": session_name + ": " + session_id[:4],
-                "consultation_period": consultation_period,
-                "create_time": create_time.strftime('%Y-%m-%d %H:%M')
-            })
-        
-        return sessions
+
+        row = conn.execute("SELECT session_name, deleted, meta FROM Sessions WHERE session_id = ?;",
+                           (session_id,)).fetchone()
+        if row is None or row[1]:
+            return None
+        conversation = [json.loads(data) for (data,) in conn.execute(
+            "SELECT data FROM Messages WHERE session_id = ? ORDER BY seq;", (session_id,))]
+        meta = json.loads(row[2])
+        meta.setdefault("session_path", self.root)
+        return Session(session_id=session_id, session_name=row[0], conversation=conversation, **meta)
+
+    def message_count(self, session_id):
+        row = self.pool.reader().execute("""
+            SELECT coalesce(max(seq) + 1, 0) FROM Messages
+            WHERE session_id = ? AND NOT EXISTS (SELECT 1 FROM Sessions WHERE session_id = ? AND deleted);
+            """, (session_id, session_id)).fetchone()
+        return row[0]
+
+    def read_messages(self, session_id, start=0, end=None, preview_chars=None):
+        """ (session_id, seq) 主键上的范围查询 """
+        if start < 0 or (end is not None and end < 0):
+            count = self.message_count(session_id)
+            start, end, _ = slice(start, end).indices(count)
+        sql = "SELECT data FROM Messages WHERE session_id = ? AND seq >= ?"
+        params = [session_id, start]
+        if end is not None:
+            sql += " AND seq < ?"
+            params.append(end)
+        sql += " AND NOT EXISTS (SELECT 1 FROM Sessions WHERE session_id = ? AND deleted) ORDER BY seq;"
+        rows = self.pool.reader().execute(sql, params + [session_id])
+        return [preview_message(json.loads(data), preview_chars) for (data,) in rows]
+
+    def list_rows(self, start=None, end=None, offset=0, limit=None, name_prefix=None):
+        return list_sessions(self.pool.reader(), start, end, offset, limit, name_prefix)
+
+    def count(self):
+        return self.pool.reader().execute("SELECT COUNT(*) FROM Sessions WHERE deleted = 0;").fetchone()[0]
+
+    def close(self):
+        self.run_close_callbacks()
+        self.closed = True
+        self.pool.close()
+
+
+def create_sessions_table(conn):
+    """ SessionIndex 和 SqliteSessionManager 共用的 Sessions 表 """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Sessions (
+            session_id TEXT PRIMARY KEY,
+            session_name TEXT NOT NULL,
+            ctime REAL NOT NULL,
+            mtime REAL NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
+        );
+        """)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(Sessions);")]
+    # size: 日志文件大小；archived: 已移入归档（LocalSessionManager 的保留策略使用）
+    if "size" not in columns:
+        conn.execute("ALTER TABLE Sessions ADD COLUMN size INTEGER NOT NULL DEFAULT 0;")
+    if "archived" not in columns:
+        conn.execute("ALTER TABLE Sessions ADD COLUMN archived INTEGER NOT NULL DEFAULT 0;")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_ctime ON Sessions(deleted, ctime DESC);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_mtime ON Sessions(deleted, mtime);")
+    conn.execute("DROP INDEX IF EXISTS idx_sessions_name;")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_name_id ON Sessions(session_name, session_id);")
+
+
+def list_sessions(conn, start=None, end=None, offset=0, limit=None, name_prefix=None, include_deleted=False):
+    """ 按创建时间倒序返回 (session_id, session_name, ctime)，start/end 为时间戳区间 [start, end) """
+    sql = "SELECT session_id, session_name, ctime FROM Sessions WHERE deleted IN (0, ?)"
+    params = [int(include_deleted)]
+    if start is not None:
+        sql += " AND ctime >= ?"
+        params.append(start)
+    if end is not None:
+        sql += " AND ctime < ?"
+        params.append(end)
+    if name_prefix:
+        # 范围条件可以使用 session_name 上的索引，LIKE 则不行
+        sql += " AND session_name >= ? AND session_name < ?"
+        params += [name_prefix, name_prefix + "\U0010ffff"]
+    sql += " ORDER BY ctime DESC LIMIT ? OFFSET ?;"
+    params += [-1 if limit is None else limit, offset]
+    return conn.execute(sql, params).fetchall()
+
+
+def find_by_name(conn, session_name):
+    """ 名称匹配的未删除会话 id，按创建时间倒序
+
+    先按名称精确查找；没有结果时按 list() 的显示名 "名称: id前4位" 解析，用名称和 id 前缀查找。
+    两种查询都走 (session_name, session_id) 索引。
+    """
+    ids = [row[0] for row in conn.execute(
+        "SELECT session_id FROM Sessions WHERE session_name = ? AND deleted = 0 ORDER BY ctime DESC;",
+        (session_name,))]
+    name, sep, id_prefix = session_name.rpartition(": ")
+    if ids or not sep or not id_prefix:
+        return ids
+    return [row[0] for row in conn.execute("""
+        SELECT session_id FROM Sessions
+        WHERE session_name = ? AND session_id >= ? AND session_id < ? AND deleted = 0
+        ORDER BY ctime DESC;
+        """, (name, id_prefix, id_prefix + "\U0010ffff"))]
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_session_manager():
+    """ 进程内共享的会话管理器，同样的配置返回同一个实例（已关闭时重新创建）
+
+    每个浏览器会话都调用一次；各建一个实例会重复启动保留期和重新压缩的后台线程，
+    重复打开索引连接和文件锁，且都不会被关闭。
+    """
+    key = tuple(os.getenv(name, "") for name in ("SESSION_BACKEND", "SESSION_PATH", "SESSION_FSYNC", "SESSION_CODEC"))
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None or manager.closed:
+            manager = _managers[key] = create_session_manager()
+        return manager
+
+
+def create_session_manager():
+    """ 根据环境变量 SESSION_BACKEND（local/sqlite）和 SESSION_PATH 创建会话管理器 """
+    backend = os.getenv("SESSION_BACKEND", "local").lower()
+    if backend == "local":
+        manager = LocalSessionManager(os.getenv("SESSION_PATH", "./data/sessions"),
+                                      fsync=os.getenv("SESSION_FSYNC", "rewrite"),
+                                      codec=os.getenv("SESSION_CODEC", "none"))
+        if manager.codec is not None:
+            manager.start_recompression()
+        manager.start_retention(RetentionPolicy.from_env())
+        return manager
+    if backend == "sqlite":
+        return SqliteSessionManager(os.getenv("SESSION_PATH", "./data/sessions.db"))
+    raise ValueError(f"Invalid session backend: {backend}")
 
 
 def generate_session_id():
@@ -186,6 +1044,25 @@ def calc_consultation_period(create_time, today, start_of_week, start_of_month,
 
     return consultation_period
 
+def period_range(period, today, start_of_week, start_of_month, start_of_year):
+    """ 时间段对应的创建时间区间 [start, end)（时间戳），与 calc_consultation_period 的划分一致
+
+    calc_consultation_period 按顺序取第一个满足的时间段，所以某个时间段的上界是它之前所有时间段起点的最小值。
+    """
+    if period is None:
+        return None, None
+    if period not in PERIODS:
+        raise ValueError(f"Invalid period: {period}")
+    to_ts = lambda d: datetime.combine(d, datetime.min.time()).timestamp()
+    lowers = [to_ts(today), to_ts(start_of_week), to_ts(start_of_month), to_ts(start_of_year), None]
+    i = PERIODS.index(period)
+    start = lowers[i]
+    end = min(lowers[:i]) if i else None
+    if start is not None and end is not None and start > end:
+        start = end  # 空区间
+    return start, end
+
+
 if __name__ == "__main__":
     # 创建会话管理器
     manager = LocalSessionManager(path="./data/sessions")
@@ -200,10 +1077,9 @@ if __name__ == "__main__":
     session_by_id = manager.get({"session_id": new_session.session_id})
     print(session_by_id.session_name)  # 输出会话名称
 
-    # 通过session_name获取会话
-    sessions_by_name = manager.get({"session_name": "会话1"})
-    for session in sessions_by_name:
-        print(session.session_id, session.session_name)
+    # 通过session_name获取会话（多个同名会话时返回最新的）
+    session_by_name = manager.get({"session_name": "会话1"})
+    print(session_by_name.session_id, session_by_name.session_name)
 
     # 列出所有会话
     all_sessions = manager.list()
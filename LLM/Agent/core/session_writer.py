@@ -0,0 +1,102 @@
+"""
+    session_writer.py
+
+    后台保存会话：submit 复制会话后立即返回，写线程调用 SessionManager.save。
+
+    同一会话在写线程忙时多次提交，只保存最后一次的快照（save 本身是增量的，不会丢失中间的消息）。
+    需要读取已保存内容的地方（例如从存储中分页读取历史）先调用 flush 等待写入完成。
+    get_session_writer 为进程内共享的会话管理器提供唯一的写线程，管理器关闭时先写完排队的会话。
+"""
+
+import logging
+import threading
+from typing import Dict, Optional
+
+from core.session_manager import Session, SessionManager, get_session_manager
+
+
+class SessionWriter:
+    """ 会话的后台写入线程 """
+
+    def __init__(self, manager: SessionManager):
+        self.manager = manager
+        self.condition = threading.Condition()
+        self.pending: Dict[str, Session] = {}
+        self.writing: Optional[str] = None
+        self.closed = False
+        self.counters = {"submitted": 0, "saved": 0, "coalesced": 0, "failed": 0}
+        self.thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, session: Session):
+        """提交会话的快照（浅拷贝对话列表），之后对 session 的修改不影响这次保存"""
+        snapshot = Session.from_dict({**session.to_dict(), "conversation": list(session.conversation)})
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Session writer is closed")
+            if session.session_id in self.pending:
+                self.counters["coalesced"] += 1
+            self.pending[session.session_id] = snapshot
+            self.counters["submitted"] += 1
+            self.condition.notify_all()
+
+    def flush(self, session_id: str = None, timeout: float = None) -> bool:
+        """等待 session_id（缺省为全部）的保存完成，超时返回 False"""
+        def done():
+            if session_id is None:
+                return not self.pending and self.writing is None
+            return session_id not in self.pending and self.writing != session_id
+        with self.condition:
+            return self.condition.wait_for(done, timeout)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if not self.pending:
+                    return
+                session_id = next(iter(self.pending))
+                session = self.pending.pop(session_id)
+                self.writing = session_id
+            try:
+                self.manager.save(session)
+                self.counters["saved"] += 1
+            except Exception as e:
+                self.counters["failed"] += 1
+                logging.error(f"Background save of session {session_id} failed: {e}", exc_info=True)
+            finally:
+                with self.condition:
+                    self.writing = None
+                    self.condition.notify_all()
+
+    def close(self):
+        """保存所有待写入的会话后停止写线程"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+_writers: Dict[SessionManager, SessionWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_session_writer(manager: SessionManager = None) -> SessionWriter:
+    """ 进程内共享的后台写线程，每个会话管理器一个（缺省为 get_session_manager()）
+
+    每个浏览器会话各建一个会让写线程随会话数增长且从不关闭；共享的写线程在管理器 close 时先写完并停止。
+    """
+    manager = manager or get_session_manager()
+    with _writers_lock:
+        writer = _writers.get(manager)
+        if writer is None or writer.closed:
+            writer = _writers[manager] = SessionWriter(manager)
+            manager.on_close(lambda: close_writer(manager, writer))
+        return writer
+
+
+def close_writer(manager: SessionManager, writer: SessionWriter):
+    with _writers_lock:
+        if _writers.get(manager) is writer:
+            del _writers[manager]
+    writer.close()
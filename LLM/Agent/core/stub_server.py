@@ -0,0 +1,188 @@
+"""
+    stub_server.py
+
+    本地的 OpenAI 兼容桩服务，用于测试和基准，不需要网络和 API key。
+
+    当前支持:
+      - POST /v1/embeddings        使用 LocalEmbedding 相同的哈希向量
+      - POST /v1/chat/completions  回显最后一条用户消息（"echo: ..."），stream=true 时按词以 SSE 分块返回
+      - GET  /v1/models            只返回一个 stub 模型，用于连接预热
+    fail_next 让之后的若干个 POST 请求返回错误状态（可带 Retry-After），用于测试重试。
+
+    用法:
+        python -m core.stub_server --port 8001
+    或在测试中:
+        with StubServer() as server:
+            OpenAIEmbedding(base_url=server.base_url, api_key="stub")
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from core.embedding import local_vectors
+from core.tokens import estimate_tokens
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ 处理 OpenAI 兼容的请求 """
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive
+    disable_nagle_algorithm = True  # 响应头和响应体分开写入，避免 keep-alive 连接上的 Nagle + 延迟 ACK 等待
+
+    def setup(self):
+        super().setup()
+        if self.server.connect_latency:
+            time.sleep(self.server.connect_latency)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.server.requests.append((self.path, body))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            failure = self.server.failures.pop(0) if self.server.failures else None
+        if failure:
+            status, retry_after = failure
+            headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+            self._send(status, {"error": {"message": f"Injected failure {status}"}}, headers)
+            return
+
+        if self.path.endswith("/embeddings"):
+            self._send(200, self._embeddings(body))
+        elif self.path.endswith("/chat/completions"):
+            self._chat(body)
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_GET(self):
+        self.server.requests.append((self.path, None))
+        if self.path.endswith("/models"):
+            self._send(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _chat(self, body):
+        messages = body.get("messages", [])
+        last = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        reply = "echo: " + last
+        prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(reply),
+                 "total_tokens": prompt_tokens + estimate_tokens(reply)}
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": body.get("model") or "stub"}
+        if not body.get("stream"):
+            self._send(200, {**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": reply}}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")  # 分块传输，流结束后连接仍可复用
+        self.end_headers()
+        # 按空白切分，保留空白，拼接后与 reply 完全一致
+        pieces = [piece for piece in reply.replace(" ", " \0").split("\0") if piece]
+        for i, piece in enumerate(pieces):
+            if i and self.server.token_latency:
+                time.sleep(self.server.token_latency)
+            delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+            self._event({**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        self._event({**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._event({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _event(self, payload):
+        self._chunk(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _embeddings(self, body):
+        texts = body.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        vectors = local_vectors(texts, self.server.dimension)
+        tokens = sum(map(estimate_tokens, texts))
+        return {
+            "object": "list",
+            "model": body.get("model", "stub"),
+            "data": [{"object": "embedding", "index": i, "embedding": v.tolist()} for i, v in enumerate(vectors)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """ 在后台线程中运行的桩服务 """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, dimension: int = 1536, latency: float = 0.0,
+                 token_latency: float = 0.0, connect_latency: float = 0.0):
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.dimension = dimension
+        self.httpd.latency = latency  # 模拟网络/推理延迟（秒），流式对话中即首 token 延迟
+        self.httpd.token_latency = token_latency  # 流式对话中相邻两个分块之间的延迟（秒）
+        self.httpd.connect_latency = connect_latency  # 每个新连接的建立延迟（秒），模拟 TCP/TLS 握手
+        self.httpd.requests = []
+        self.httpd.failures = []
+        self.httpd.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self):
+        """收到的 (path, body) 列表"""
+        return self.httpd.requests
+
+    def fail_next(self, count: int = 1, status: int = 503, retry_after: float = None):
+        """之后的 count 个 POST 请求返回 status"""
+        with self.httpd.lock:
+            self.httpd.failures += [(status, retry_after)] * count
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--dimension", type=int, default=1536)
+    args = parser.parse_args()
+    server = StubServer(args.host, args.port, args.dimension)
+    print(f"Stub server listening on {server.base_url}")
+    server.httpd.serve_forever()
@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+
+from core.chat_pipeline import ChatPipeline
+from core.llm_client import Endpoint, LLMClient
+from core.stub_server import StubServer
+
+
+class TestChatPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(latency=0.05, token_latency=0.005).start()
+        self.llm = LLMClient(Endpoint("chat", base_url=self.server.base_url, api_key="stub", model="stub"))
+        self.pipeline = ChatPipeline(self.llm)
+
+    def tearDown(self):
+        self.pipeline.close()
+        self.server.stop()
+
+    def test_streams_tokens_and_records_metrics(self):
+        turn = self.pipeline.stream("system", [{"role": "user", "content": "库存 还 有 多少"}])
+        chunks = list(turn)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), "echo: 库存 还 有 多少")
+        self.assertEqual(turn.text, "echo: 库存 还 有 多少")
+
+        metrics = turn.finish()
+        self.assertLessEqual(metrics.prompt_ms, metrics.ttft_ms)
+        self.assertLess(metrics.ttft_ms, metrics.total_ms)
+        self.assertLessEqual(metrics.total_ms, metrics.end_of_turn_ms)
+        self.assertEqual(metrics.chunks, len(chunks))
+        self.assertEqual(self.pipeline.stats()["turns"], 1)
+
+        body = [body for path, body in self.server.requests if path.endswith("/chat/completions")][0]
+        self.assertEqual(body["messages"][0], {"role": "system", "content": "system"})
+        self.assertTrue(body["stream"])
+        self.assertEqual(body["stream_options"], {"include_usage": True})
+        self.assertGreater(metrics.prompt_tokens, 0)
+
+    def test_prompt_built_while_connection_warms_up(self):
+        threads = []
+
+        def build():
+            threads.append(threading.current_thread())
+            time.sleep(0.1)
+            return "built"
+
+        turn = self.pipeline.stream(build, [{"role": "user", "content": "hi"}])
+        list(turn)
+        self.assertEqual(turn.system_prompt, "built")
+        self.assertIsNot(threads[0], threading.current_thread())
+        # /models 预热与构建提示词同时进行，在提示词完成之前已经结束
+        self.assertEqual(self.server.requests[0][0], "/v1/models")
+        self.assertLess(turn.metrics.warmup_ms, turn.metrics.prompt_ms)
+        self.assertEqual(self.pipeline.counters["warmups"], 1)
+
+        # 刚请求过，连接仍在连接池中，不再预热
+        list(self.pipeline.stream("s", [{"role": "user", "content": "again"}]))
+        self.assertEqual(self.pipeline.counters["warmups"], 1)
+
+    def test_errors_raised_in_caller(self):
+        def broken():
+            raise ValueError("no memories")
+
+        turn = self.pipeline.stream(broken, [{"role": "user", "content": "hi"}])
+        with self.assertRaises(ValueError):
+            list(turn)
+        self.assertEqual(self.pipeline.counters["errors"], 1)
+
+    def test_abandoned_stream_cancelled(self):
+        turn = self.pipeline.stream("s", [{"role": "user", "content": " ".join(["word"] * 200)}])
+        iterator = iter(turn)
+        next(iterator)
+        iterator.close()
+        with self.assertRaises(Exception):
+            turn.future.result(timeout=5)
+        self.assertTrue(turn.future.cancelled())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from core.context_packer import ContextPacker
+from core.memory import Memory
+from core.tokens import estimate_tokens
+
+
+def memory(memory_id, text, summary):
+    return Memory(id=memory_id, original_text=text, summary=summary, created_at="2024-01-01")
+
+
+class TestContextPacker(unittest.TestCase):
+
+    def setUp(self):
+        self.packer = ContextPacker()
+        self.long = memory(1, "用户的咖啡机是三年前买的，" * 20, "咖啡机用了三年")
+        self.short = memory(2, "用户喜欢拿铁", "喜欢拿铁")
+        self.other = memory(3, "user plays tennis every weekend", "tennis")
+
+    def test_everything_fits(self):
+        block = self.packer.pack([self.long, self.short], budget=10_000)
+        self.assertIn(self.long.original_text, block)
+        self.assertIn(self.short.original_text, block)
+        self.assertLess(block.index(self.long.original_text), block.index(self.short.original_text))
+
+    def test_falls_back_to_summary_within_budget(self):
+        budget = 60
+        block = self.packer.pack([self.long, self.short, self.other], budget)
+        self.assertLessEqual(estimate_tokens(block), budget)
+        self.assertNotIn(self.long.original_text, block)
+        self.assertIn("咖啡机用了三年", block)
+        self.assertIn(self.short.original_text, block)
+        self.assertEqual(self.packer.stats()["summary"], 1)
+
+    def test_skips_when_even_summary_does_not_fit(self):
+        block = self.packer.pack([self.long, self.short], budget=1)
+        self.assertEqual(block, "")
+        self.assertEqual(self.packer.stats()["skipped"], 2)
+
+    def test_near_duplicates_removed(self):
+        dup = memory(4, self.short.original_text + "。", self.short.summary)
+        block = self.packer.pack([self.short, dup, self.other], budget=10_000)
+        self.assertEqual(block.count("用户喜欢拿铁"), 1)
+        self.assertIn("tennis", block)
+        self.assertEqual(self.packer.stats()["duplicates"], 1)
+
+    def test_cache_keyed_on_version(self):
+        first = self.packer.pack([self.short], 100, version=1)
+        self.short.original_text = "用户改喝美式"
+        self.assertEqual(self.packer.pack([self.short], 100, version=1), first)
+        self.assertIn("美式", self.packer.pack([self.short], 100, version=2))
+        self.assertEqual(self.packer.stats()["cache_hits"], 1)
+        self.assertEqual(self.packer.stats()["packs"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
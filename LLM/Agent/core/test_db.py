@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from core.db import ConnectionPool
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(os.path.join(self.test_dir.name, 'test.db'))
+        self.pool.write(lambda conn: conn.execute("CREATE TABLE t (x INTEGER UNIQUE);"))
+
+    def tearDown(self):
+        self.pool.close()
+        self.test_dir.cleanup()
+
+    def count(self):
+        return self.pool.reader().execute("SELECT COUNT(*) FROM t;").fetchone()[0]
+
+    def test_wal_and_pragmas(self):
+        conn = self.pool.reader()
+        self.assertEqual(conn.execute("PRAGMA journal_mode;").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("PRAGMA synchronous;").fetchone()[0], 1)  # NORMAL
+        self.assertEqual(conn.execute("PRAGMA foreign_keys;").fetchone()[0], 1)
+
+    def test_write_visible_to_reader_after_return(self):
+        self.assertEqual(self.pool.write(lambda conn: conn.execute("INSERT INTO t VALUES (1);").lastrowid), 1)
+        self.assertEqual(self.count(), 1)
+
+    def test_queued_writes_are_grouped(self):
+        # 写线程被占住时排队的写操作会合并到同一个事务
+        gate = threading.Event()
+        first = self.pool.submit(lambda conn: gate.wait())
+        futures = [self.pool.submit(lambda conn, i=i: conn.execute("INSERT INTO t VALUES (?);", (i,)))
+                   for i in range(100)]
+        transactions = self.pool.counters["transactions"]
+        gate.set()
+        for future in [first] + futures:
+            future.result()
+        self.assertEqual(self.count(), 100)
+        self.assertLessEqual(self.pool.counters["transactions"] - transactions, 2)
+
+    def test_failed_write_rolls_back_only_itself(self):
+        gate = threading.Event()
+        self.pool.submit(lambda conn: gate.wait())
+        ok = self.pool.submit(lambda conn: conn.execute("INSERT INTO t VALUES (1);"))
+        bad = self.pool.submit(lambda conn: (conn.execute("INSERT INTO t VALUES (2);"),
+                                             conn.execute("INSERT INTO t VALUES (1);")))
+        gate.set()
+        ok.result()
+        with self.assertRaises(sqlite3.IntegrityError):
+            bad.result()
+        self.assertEqual(self.pool.reader().execute("SELECT x FROM t;").fetchall(), [(1,)])
+
+    def test_nested_write_runs_inline(self):
+        def outer(conn):
+            conn.execute("INSERT INTO t VALUES (1);")
+            return self.pool.write(lambda c: c.execute("INSERT INTO t VALUES (2);").rowcount)
+        self.assertEqual(self.pool.write(outer), 1)
+        self.assertEqual(self.count(), 2)
+
+    def test_each_thread_has_its_own_reader(self):
+        readers = []
+        thread = threading.Thread(target=lambda: readers.append(self.pool.reader()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(readers[0], self.pool.reader())
+        self.assertIs(self.pool.reader(), self.pool.reader())
+
+    def test_readers_of_finished_threads_are_closed(self):
+        readers = []
+        for _ in range(5):  # 每次 rerun 一个新的脚本线程
+            thread = threading.Thread(target=lambda: readers.append(self.pool.reader()))
+            thread.start()
+            thread.join()
+        self.assertLessEqual(len(self.pool.readers), 2)
+        self.pool.reader()
+        self.assertEqual(list(self.pool.readers), [threading.current_thread()])
+        for conn in readers:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1;")
+
+    def test_close_drains_queue(self):
+        futures = [self.pool.submit(lambda conn, i=i: conn.execute("INSERT INTO t VALUES (?);", (i,)))
+                   for i in range(10)]
+        self.pool.close()
+        self.assertTrue(all(f.done() and f.exception() is None for f in futures))
+        with self.assertRaises(RuntimeError):
+            self.pool.submit(lambda conn: None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import openai
+
+from core.db import ConnectionPool
+from core.embedding import CachedEmbedding, CoalescingEmbedding, LocalEmbedding, OpenAIEmbedding
+from core.stub_server import StubServer
+
+
+class TestOpenAIEmbedding(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(dimension=32).start()
+        self.backend = OpenAIEmbedding(dimension=32, base_url=self.server.base_url, api_key="stub")
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_batches_respect_provider_limit(self):
+        self.backend.max_batch_size = 4
+        vectors = self.backend.embed([f"text {i}" for i in range(10)])
+        self.assertEqual(vectors.shape, (10, 32))
+        self.assertEqual([len(body["input"]) for _, body in self.server.requests], [4, 4, 2])
+        self.assertEqual(self.backend.stats()["batches"], 3)
+
+    def test_matches_local_backend_and_reuses_client(self):
+        first = self.backend.embed_one("记忆")
+        client = self.backend.client
+        second = self.backend.embed_one("记忆")
+        self.assertIs(self.backend.client, client)
+        np.testing.assert_allclose(first, second)
+        np.testing.assert_allclose(first, LocalEmbedding(32).embed_one("记忆"), rtol=1e-5)
+
+    def test_timeout_is_a_deadline_without_retries(self):
+        self.server.httpd.latency = 0.5
+        started = time.perf_counter()
+        with self.assertRaises((openai.APITimeoutError, TimeoutError)):
+            self.backend.embed_one("记忆", timeout=0.1)
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertEqual(self.backend.llm.stats()["requests"], 1)
+
+
+class RecordingEmbedding(LocalEmbedding):
+    """ 记录每批的大小，每批模拟 20 ms 的往返 """
+
+    def __init__(self):
+        super().__init__(32)
+        self.sizes = []
+
+    def _embed_batch(self, texts, timeout=None):
+        self.sizes.append(len(texts))
+        time.sleep(0.02)
+        return super()._embed_batch(texts, timeout)
+
+
+class TestCoalescingEmbedding(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = RecordingEmbedding()
+        self.coalescer = CoalescingEmbedding(self.backend, window_ms=20)
+        self.addCleanup(self.coalescer.close)
+
+    def test_concurrent_single_texts_share_batches(self):
+        texts = [f"查询 {i}" for i in range(16)]
+        results = {}
+        threads = [threading.Thread(target=lambda t=t: results.__setitem__(t, self.coalescer.embed_one(t)))
+                   for t in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(self.backend.sizes), 16)
+        self.assertLess(len(self.backend.sizes), 4)
+        expected = LocalEmbedding(32).embed(texts)
+        for text, vector in zip(texts, expected):
+            np.testing.assert_allclose(results[text], vector, rtol=1e-5)
+
+    def test_batch_limit_and_errors(self):
+        self.backend.max_batch_size = self.coalescer.max_batch_size = 4
+        self.assertEqual(self.coalescer.embed([f"t{i}" for i in range(6)]).shape, (6, 32))
+        self.assertEqual(self.backend.sizes, [4, 2])  # 整批直接发送
+
+        with mock.patch.object(self.backend, "_embed_batch", side_effect=ConnectionError("down")):
+            with self.assertRaises(ConnectionError):
+                self.coalescer.embed_one("x")
+
+    def test_timeout_bounds_the_wait(self):
+        started = time.perf_counter()
+        with self.assertRaises(TimeoutError):
+            self.coalescer.embed_one("x", timeout=0.005)
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+
+class TestCachedEmbedding(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.test_dir.name, 'memory.db')
+        self.backend = LocalEmbedding(16)
+        self.pool = ConnectionPool(self.db_path)
+        self.cached = CachedEmbedding(self.backend, self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        self.test_dir.cleanup()
+
+    def test_duplicates_and_cached_texts_not_reembedded(self):
+        vectors = self.cached.embed(["a", "b", "a"])
+        np.testing.assert_allclose(vectors[0], vectors[2])
+        self.assertEqual(self.backend.counters["texts"], 2)
+
+        # 新建实例模拟重启，缓存来自 SQLite
+        self.pool.close()
+        self.pool = ConnectionPool(self.db_path)
+        cached = CachedEmbedding(self.backend, self.pool)
+        cached.embed(["a", "b", "c"])
+        self.assertEqual(self.backend.counters["texts"], 3)
+        self.assertEqual(cached.stats()["cache_hits"], 2)
+        self.assertGreater(cached.stats()["tokens_saved"], 0)
+
+    def test_cache_key_includes_dimension(self):
+        self.cached.embed(["a"])
+        other = CachedEmbedding(LocalEmbedding(8), self.pool)
+        self.assertEqual(other.embed(["a"]).shape, (1, 8))
+
+    def test_writes_go_through_the_pool_writer(self):
+        before = self.pool.counters["writes"]
+        self.cached.embed(["x", "y"])
+        self.assertEqual(self.pool.counters["writes"], before + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
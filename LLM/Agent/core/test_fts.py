@@ -0,0 +1,30 @@
+import unittest
+
+from core.fts import build_match_query, segment
+
+
+class TestFts(unittest.TestCase):
+
+    def test_segment_splits_cjk_only(self):
+        self.assertEqual(segment("用户likes咖啡").split(), ["用", "户", "likes", "咖", "啡"])
+        self.assertEqual(segment(""), "")
+
+    def test_cjk_terms_become_phrases(self):
+        self.assertEqual(build_match_query("咖啡"), '"咖 啡"')
+
+    def test_latin_terms_are_prefix_queries(self):
+        self.assertEqual(build_match_query("cof tea*"), '"cof"* AND "tea"*')
+
+    def test_quoted_phrase(self):
+        self.assertEqual(build_match_query('"plays tennis" 上海'), '"plays tennis" AND "上 海"')
+
+    def test_exact_match_is_one_phrase(self):
+        self.assertEqual(build_match_query('住在 "上海"', exact_match=True), '"住 在 上 海"')
+
+    def test_quotes_escaped_and_empty(self):
+        self.assertEqual(build_match_query('a"b'), '"a""b"*')
+        self.assertEqual(build_match_query("   "), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
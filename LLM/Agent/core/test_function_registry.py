@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import functions
+from functions import FunctionRegistry, load_manifest
+
+SHELL = "shell_operations.execute_shell_command"
+
+
+class TestFunctionRegistry(unittest.TestCase):
+
+    def test_package_import_does_not_import_tool_modules(self):
+        code = ("import sys, functions; assert 'shell_operations.execute_shell_command' in functions.function_registry; "
+                "print([m for m in sys.modules if m.startswith('functions.')])")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_describe_without_import_and_lookup_imports(self):
+        registry = FunctionRegistry()
+        registry.add_manifest(load_manifest(os.path.join(tempfile.mkdtemp(), "manifest.json")))
+        info = registry.describe(SHELL)
+        self.assertEqual(info.signature, "(command: str, timeout: Optional[float]=None) -> Dict[str, str]")
+        self.assertTrue(info.summary.startswith("Execute a shell command"))
+        self.assertEqual(registry.loaded(), [])
+        self.assertEqual(registry[SHELL]("echo hi")["output"], "hi\n")
+        self.assertEqual(registry.loaded(), [SHELL])
+        self.assertIs(registry[SHELL], sys.modules["functions.shell_operations"].execute_shell_command)
+
+    def test_only_functions_defined_in_modules_are_listed(self):
+        names = set(functions.function_registry)
+        self.assertIn("filesystem_operations.read_file_segment", names)
+        self.assertFalse(any(name.endswith(("Optional", "Dict")) for name in names))
+
+    def test_registered_functions_and_unknown_names(self):
+        registry = FunctionRegistry()
+        registry.add_manifest(load_manifest(os.path.join(tempfile.mkdtemp(), "manifest.json")))
+
+        def think(content: str) -> str:
+            """LLM 调用"""
+            return content
+
+        registry["think"] = think
+        self.assertEqual(list(registry)[-1], "think")
+        self.assertEqual(len(registry), len(set(registry)))
+        self.assertEqual(registry.describe("think").signature, "(content: str) -> str")
+        self.assertIsNone(registry.get("missing"))
+        self.assertNotIn("missing", registry)
+
+    def test_manifest_is_cached_by_mtime_and_size(self):
+        path = os.path.join(tempfile.mkdtemp(), "manifest.json")
+        first = load_manifest(path)
+        with mock.patch("functions.scan_module") as scan:
+            self.assertEqual(load_manifest(path), first)
+            scan.assert_not_called()
+
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest["files"]["shell_operations.py"]["key"] = [0, 0]  # 文件已修改
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        with mock.patch("functions.scan_module", wraps=functions.scan_module) as scan:
+            self.assertEqual(load_manifest(path), first)
+            self.assertEqual(scan.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+import openai
+
+from core.llm_client import Endpoint, LLMClient, LLMRegistry, TokenBucket
+from core.stub_server import StubServer
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def chat(client, **kwargs):
+    return client.chat.completions.create(model="stub", messages=MESSAGES, **kwargs)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_waits_only_beyond_capacity(self):
+        bucket = TokenBucket(60)  # 每秒 1 个
+        self.assertEqual(bucket.reserve(60), 0.0)
+        self.assertAlmostEqual(bucket.reserve(2), 2.0, delta=0.05)
+        # 排在前面的预留之后
+        self.assertAlmostEqual(bucket.reserve(1), 3.0, delta=0.05)
+
+    def test_adjust_refunds_overestimate(self):
+        bucket = TokenBucket(60)
+        bucket.reserve(60)
+        bucket.adjust(-30)
+        self.assertEqual(bucket.reserve(30), 0.0)
+
+
+@mock.patch("core.llm_client.BACKOFF_BASE", 0.01)
+class TestLLMClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer().start()
+        self.llm = self.client()
+
+    def tearDown(self):
+        self.llm.close()
+        self.server.stop()
+
+    def client(self, **config):
+        return LLMClient(Endpoint("chat", base_url=self.server.base_url, api_key="stub", **config))
+
+    def test_retries_transient_errors(self):
+        self.server.fail_next(2, status=503)
+        response = self.llm.call(chat, tokens=5)
+        self.assertEqual(response.choices[0].message.content, "echo: hello")
+        stats = self.llm.stats()
+        self.assertEqual((stats["requests"], stats["retries"], stats["failures"]), (3, 2, 0))
+        self.assertEqual(stats["tokens"], response.usage.total_tokens)
+
+    def test_honours_retry_after(self):
+        self.server.fail_next(1, status=429, retry_after=0.2)
+        started = time.perf_counter()
+        self.llm.call(chat)
+        self.assertGreaterEqual(time.perf_counter() - started, 0.2)
+        self.assertEqual(self.llm.stats()["rate_limited"], 1)
+
+    def test_client_errors_not_retried(self):
+        self.server.fail_next(1, status=400)
+        with self.assertRaises(openai.BadRequestError):
+            self.llm.call(chat)
+        self.assertEqual((self.llm.stats()["requests"], self.llm.stats()["failures"]), (1, 1))
+
+    def test_gives_up_after_max_retries(self):
+        llm = self.client(max_retries=1)
+        self.server.fail_next(3, status=500)
+        with self.assertRaises(openai.InternalServerError):
+            llm.call(chat)
+        self.assertEqual(llm.stats()["requests"], 2)
+        self.assertEqual(llm.stats()["in_flight"], 0)
+
+    def test_concurrency_limited_per_endpoint(self):
+        self.server.httpd.latency = 0.05
+        llm = self.client(max_concurrency=2)
+        threads = [threading.Thread(target=llm.call, args=(chat,)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = llm.stats()
+        self.assertEqual(stats["requests"], 6)
+        self.assertEqual(stats["peak_in_flight"], 2)
+        self.assertGreater(stats["queued_ms"], 0)
+
+    def test_stream_holds_slot_until_consumed(self):
+        llm = self.client(max_concurrency=1)
+        stream = llm.call(lambda client: chat(client, stream=True))
+        self.assertEqual(llm.stats()["in_flight"], 1)
+        text = "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+        self.assertEqual(text, "echo: hello")
+        self.assertEqual(llm.stats()["in_flight"], 0)
+
+    def test_rpm_throttles_before_sending(self):
+        llm = self.client(rpm=600)  # 每 0.1 秒 1 个
+        llm.rpm.tokens = 0
+        started = time.perf_counter()
+        llm.call(chat)
+        self.assertGreaterEqual(time.perf_counter() - started, 0.09)
+        self.assertGreater(llm.stats()["throttled_ms"], 90)
+
+    def test_async_call_retries_and_streams(self):
+        self.server.fail_next(1, status=502)
+
+        async def run():
+            stream = await self.llm.acall(lambda client: chat(client, stream=True))
+            self.assertEqual(self.llm.stats()["in_flight"], 1)
+            parts = [chunk.choices[0].delta.content async for chunk in stream
+                     if chunk.choices and chunk.choices[0].delta.content]
+            await self.llm.aclose()
+            return "".join(parts)
+
+        self.assertEqual(asyncio.run(run()), "echo: hello")
+        self.assertEqual(self.llm.stats()["retries"], 1)
+        self.assertEqual(self.llm.stats()["in_flight"], 0)
+
+
+class TestLLMRegistry(unittest.TestCase):
+
+    def test_endpoints_share_connection_pool(self):
+        with StubServer() as server:
+            registry = LLMRegistry([Endpoint("chat", base_url=server.base_url, api_key="stub", timeout=30),
+                                    Endpoint("mem", base_url=server.base_url, api_key="stub", max_concurrency=1),
+                                    Endpoint("other", base_url=server.base_url, api_key="other")])
+            chat_llm, mem_llm = registry.get("chat"), registry.get("mem")
+            self.assertIs(registry.get("chat"), chat_llm)
+            self.assertIs(chat_llm.client._client, mem_llm.client._client)
+            self.assertIsNot(registry.get("other").client._client, chat_llm.client._client)
+            self.assertEqual(chat_llm.client.timeout, 30)
+            self.assertEqual(chat_llm.client.max_retries, 0)
+
+            chat_llm.call(chat)
+            mem_llm.call(chat)
+            self.assertEqual({name: stats["requests"] for name, stats in registry.stats().items()},
+                             {"chat": 1, "mem": 1, "other": 0})
+            registry.close()
+
+    def test_endpoint_from_env(self):
+        env = {"MEM_BASE_URL": "http://mem/v1", "MEM_MODEL": "m", "MEM_RPM": "30", "MEM_MAX_CONCURRENCY": "2"}
+        with mock.patch.dict("os.environ", env):
+            endpoint = Endpoint.from_env("mem")
+        self.assertEqual((endpoint.base_url, endpoint.model, endpoint.rpm, endpoint.max_concurrency),
+                         ("http://mem/v1", "m", 30.0, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
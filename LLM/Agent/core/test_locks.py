@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from core import locks
+from core.locks import FileLock, LockTable
+
+
+def hold_lock(path, key, held, seconds):
+    lock = FileLock(path)
+    with lock.hold(key):
+        held.set()
+        time.sleep(seconds)
+    lock.close()
+
+
+class TestLockTable(unittest.TestCase):
+
+    def test_mutual_exclusion(self):
+        table = LockTable()
+        active, overlaps = [0], []
+
+        def worker():
+            for _ in range(200):
+                with table.hold("k"):
+                    active[0] += 1
+                    overlaps.append(active[0])
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(max(overlaps), 1)
+
+    def test_idle_entries_evicted(self):
+        table = LockTable(idle_seconds=0, sweep_every=1000)
+        for i in range(100):
+            with table.hold(i):
+                pass
+        self.assertEqual(len(table), 100)
+        table.sweep()
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.evicted, 100)
+
+    def test_held_entries_kept(self):
+        table = LockTable(idle_seconds=0)
+        with table.hold("busy"):
+            table.sweep()
+            self.assertEqual(len(table), 1)
+
+
+@unittest.skipIf(locks.fcntl is None, "fcntl not available")
+class TestFileLock(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.test_dir.name, 'test.lock')
+        self.lock = FileLock(self.path)
+
+    def tearDown(self):
+        self.lock.close()
+        self.test_dir.cleanup()
+
+    def acquire_while_child_holds(self, child_key, key):
+        ctx = multiprocessing.get_context("fork")
+        held = ctx.Event()
+        child = ctx.Process(target=hold_lock, args=(self.path, child_key, held, 0.3))
+        child.start()
+        self.assertTrue(held.wait(5))
+        start = time.perf_counter()
+        with self.lock.hold(key):
+            waited = time.perf_counter() - start
+        child.join()
+        return waited
+
+    def test_excludes_other_processes(self):
+        self.assertGreater(self.acquire_while_child_holds("session", "session"), 0.15)
+
+    def test_other_slots_not_blocked(self):
+        other = next(k for k in map(str, range(100)) if self.lock.slot(k) != self.lock.slot("session"))
+        self.assertLess(self.acquire_while_child_holds("session", other), 0.15)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,467 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from core.embedding import LocalEmbedding
+from core.memory import MemoryHandler, MemoryManager, get_memory_manager
+
+
+class TestMemoryManagerCache(unittest.TestCase):
+
+    def setUp(self):
+        # 每个用例使用独立的临时数据库
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.test_dir.name, 'memory.db')
+        self.manager = MemoryManager(self.db_path, embedder=LocalEmbedding())
+
+    def tearDown(self):
+        self.manager.handler.close()
+        self.test_dir.cleanup()
+
+    def reload(self):
+        # 重新从数据库加载，用于校验缓存与数据库一致
+        return MemoryManager(self.db_path, embedder=LocalEmbedding())
+
+    def test_add_memory_uses_sqlite_row_id(self):
+        self.manager.add_memory("text a", "summary a", labels=["x"])
+        self.manager.add_memory("text b", "summary b")
+        ids = [mem.id for mem in self.manager.memory_data]
+        self.assertEqual(ids, [1, 2])
+        self.assertIs(self.manager.memory_by_id[2], self.manager.memory_data[1])
+
+    def test_update_label_does_not_duplicate_rows(self):
+        self.manager.add_label("old", "desc")
+        for i in range(3):
+            self.manager.add_memory(f"text {i}", f"summary {i}", labels=["old", "other"])
+
+        self.manager.update_label("old", "new")
+
+        # "other" 在写入记忆时自动创建
+        self.assertEqual(self.manager.labels, {"new", "other"})
+        for mem in self.manager.memory_data:
+            self.assertEqual(mem.labels, ["new", "other"])
+
+        reloaded = self.reload()
+        self.assertEqual(len(reloaded.memory_data), 3)
+        self.assertEqual([mem.labels for mem in reloaded.memory_data], [["new", "other"]] * 3)
+
+    def test_delete_label_and_trigger(self):
+        self.manager.add_label("l", "desc")
+        self.manager.add_trigger("t", "desc")
+        self.manager.add_memory("text", "summary", labels=["l"], trigger="t")
+
+        self.manager.delete_label("l")
+        self.manager.delete_trigger("t")
+
+        reloaded = self.reload()
+        self.assertEqual(len(reloaded.memory_data), 1)
+        self.assertEqual(reloaded.memory_data[0].labels, [])
+        self.assertIsNone(reloaded.memory_data[0].trigger)
+        self.assertEqual(reloaded.labels, set())
+        self.assertEqual(reloaded.triggers, set())
+
+    def test_update_trigger(self):
+        self.manager.add_trigger("t", "desc")
+        self.manager.add_memory("text", "summary", trigger="t")
+
+        self.manager.update_trigger("t", "t2")
+
+        self.assertEqual(self.manager.search_memory("t2", search_type="trigger")[0].summary, "summary")
+        self.assertEqual(self.reload().memory_data[0].trigger, "t2")
+
+    def test_trigger_matching_and_inverted_index(self):
+        self.manager.add_trigger("咖啡", "desc")
+        self.manager.add_trigger("咖啡机", "desc")
+        self.manager.add_memory("text a", "summary a", trigger="咖啡")
+        self.manager.add_memory("text b", "summary b", trigger="咖啡机")
+        self.manager.add_memory("text c", "summary c", trigger="咖啡机")
+
+        self.assertEqual(self.manager.match_triggers("我的咖啡机坏了"), ["咖啡机"])
+        self.assertEqual([m.id for m in self.manager.search_memory("咖啡机", search_type="trigger")], [3, 2])
+
+        self.manager.update_memory(3, new_trigger="咖啡")
+        self.manager.update_trigger("咖啡机", "茶")
+        self.assertEqual(self.manager.match_triggers("我的咖啡机坏了"), ["咖啡"])
+        self.assertEqual([m.id for m in self.manager.search_memory("咖啡", search_type="trigger")], [3, 1])
+        self.assertEqual([m.id for m in self.manager.search_memory("茶", search_type="trigger")], [2])
+
+        self.manager.delete_memory(1)
+        self.manager.delete_trigger("茶")
+        self.assertEqual(self.manager.match_triggers("喝茶"), [])
+        self.assertEqual(self.manager.trigger_index, {"咖啡": {3}})
+
+    def test_version_changes_on_every_write(self):
+        versions = [self.manager.version]
+        self.manager.add_memory("text", "summary", labels=["l"], trigger="t")
+        versions.append(self.manager.version)
+        self.manager.update_memory(1, new_text="changed")
+        versions.append(self.manager.version)
+        self.manager.update_label("l", "l2")
+        versions.append(self.manager.version)
+        self.manager.delete_trigger("t")
+        versions.append(self.manager.version)
+        self.manager.delete_memory(1)
+        versions.append(self.manager.version)
+        self.assertEqual(len(set(versions)), len(versions))
+
+    def test_update_and_delete_memory(self):
+        self.manager.add_memory("text a", "summary a")
+        self.manager.add_memory("text b", "summary b")
+
+        self.manager.update_memory(1, new_summary="changed")
+        self.manager.delete_memory(2)
+
+        self.assertNotIn(2, self.manager.memory_by_id)
+        reloaded = self.reload()
+        self.assertEqual([mem.summary for mem in reloaded.memory_data], ["changed"])
+        with self.assertRaises(ValueError):
+            self.manager.delete_memory(2)
+
+
+class TestSharedManager(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+        self.db_path = os.path.join(self.test_dir.name, 'memory.db')
+        patcher = mock.patch.dict(os.environ, {"EMBEDDING_BACKEND": "local"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_manager_shared_per_process_and_db(self):
+        first = get_memory_manager(self.db_path)
+        self.assertIs(get_memory_manager(os.path.join(self.test_dir.name, '.', 'memory.db')), first)
+        other = get_memory_manager(os.path.join(self.test_dir.name, 'other.db'))
+        self.assertIsNot(other, first)
+        other.close()
+        first.close()
+        second = get_memory_manager(self.db_path)
+        self.assertIsNot(second, first)
+        second.close()
+
+    def test_concurrent_writes_keep_cache_consistent(self):
+        manager = get_memory_manager(self.db_path)
+        self.addCleanup(manager.close)
+        threads = [threading.Thread(target=lambda t=t: [manager.add_memory(f"text {t} {i}", f"summary {t} {i}",
+                                                                           trigger=f"t{t}") for i in range(20)])
+                   for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(manager.memory_by_id), list(range(1, 81)))
+        self.assertEqual(len(manager.memory_data), 80)
+        self.assertEqual(sum(map(len, manager.trigger_index.values())), 80)
+        self.assertEqual(manager.index.ntotal, 80)
+
+
+class TestNormalizedSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.test_dir.name, 'memory.db')
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def open(self):
+        return MemoryManager(self.db_path, embedder=LocalEmbedding())
+
+    def test_legacy_database_migrated(self):
+        # 版本 0 的数据库：labels 为逗号拼接字符串，Labels 表有重复行
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            CREATE TABLE Memory (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, original_text TEXT NOT NULL, summary TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                labels TEXT, trigger TEXT, embedding BLOB, metadata TEXT);
+            CREATE TABLE Labels (id INTEGER PRIMARY KEY AUTOINCREMENT, label TEXT, description TEXT);
+            CREATE TABLE Triggers (id INTEGER PRIMARY KEY AUTOINCREMENT, trigger TEXT, description TEXT);
+            INSERT INTO Labels (label, description) VALUES ('a', 'first'), ('a', 'dup'), ('b', NULL);
+            INSERT INTO Triggers (trigger, description) VALUES ('t', NULL);
+            INSERT INTO Memory (original_text, summary, labels, trigger) VALUES ('x', 'sx', 'a,b', 't');
+            INSERT INTO Memory (original_text, summary, labels, trigger) VALUES ('y', 'sy', 'c', 'new');
+            INSERT INTO Memory (original_text, summary, labels, trigger) VALUES ('z', 'sz', '', NULL);
+            """)
+        conn.commit()
+        conn.close()
+
+        manager = self.open()
+        conn = manager.handler.pool.reader()
+        self.assertEqual(conn.execute("PRAGMA user_version;").fetchone()[0], MemoryHandler.SCHEMA_VERSION)
+        self.assertEqual([m.labels for m in manager.memory_data], [["a", "b"], ["c"], []])
+        self.assertEqual([m.trigger for m in manager.memory_data], ["t", "new", None])
+        self.assertEqual(manager.labels, {"a", "b", "c"})
+        self.assertEqual(conn.execute("SELECT description FROM Labels WHERE label = 'a';").fetchall(), [("first",)])
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(Memory);")]
+        self.assertNotIn("labels", columns)
+        self.assertEqual(manager.match_triggers("a new day"), ["new"])
+
+        # 再次打开不会重复迁移
+        manager.handler.close()
+        self.assertEqual([m.labels for m in self.open().memory_data], [["a", "b"], ["c"], []])
+
+    def test_label_with_comma_round_trips(self):
+        manager = self.open()
+        manager.add_memory("text", "summary", labels=["a,b", "c"])
+        self.assertEqual(self.open().memory_data[0].labels, ["a,b", "c"])
+        self.assertEqual([m.id for m in manager.search_memory("", labels=["a,b"], search_type="label")], [1])
+        self.assertEqual(manager.search_memory("", labels=["a"], search_type="label"), [])
+
+    def test_label_search_newest_first(self):
+        manager = self.open()
+        for i in range(4):
+            manager.add_memory(f"text {i}", f"summary {i}", labels=["even" if i % 2 == 0 else "odd", "all"])
+        search = lambda labels, k=5: [m.id for m in manager.search_memory("", labels=labels, k=k, search_type="label")]
+        self.assertEqual(search(["even"]), [3, 1])
+        self.assertEqual(search(["even", "odd"]), [4, 3, 2, 1])
+        self.assertEqual(search("all", k=2), [4, 3])
+
+    def test_rename_is_single_row_update(self):
+        manager = self.open()
+        for i in range(3):
+            manager.add_memory(f"text {i}", f"summary {i}", labels=["old"], trigger="t")
+        total_changes = lambda: manager.handler.pool.write(lambda conn: conn.total_changes)
+        before = total_changes()
+        manager.update_label("old", "new")
+        self.assertEqual(total_changes() - before, 1)
+        before = total_changes()
+        manager.update_trigger("t", "t2")
+        self.assertEqual(total_changes() - before, 1)
+
+        reloaded = self.open()
+        self.assertEqual([m.labels for m in reloaded.memory_data], [["new"]] * 3)
+        self.assertEqual([m.trigger for m in reloaded.memory_data], ["t2"] * 3)
+
+    def test_rename_onto_existing_merges(self):
+        manager = self.open()
+        manager.add_memory("a", "a", labels=["x", "y"], trigger="t1")
+        manager.add_memory("b", "b", labels=["x"], trigger="t2")
+        manager.update_label("x", "y")
+        manager.update_trigger("t1", "t2")
+
+        self.assertEqual([m.labels for m in manager.memory_data], [["y"], ["y"]])
+        reloaded = self.open()
+        self.assertEqual([m.labels for m in reloaded.memory_data], [["y"], ["y"]])
+        self.assertEqual(reloaded.labels, {"y"})
+        self.assertEqual(reloaded.triggers, {"t2"})
+        self.assertEqual([m.id for m in reloaded.search_memory("t2", search_type="trigger")], [2, 1])
+
+    def test_deleting_memory_cascades_to_junction(self):
+        manager = self.open()
+        manager.add_memory("a", "a", labels=["x"])
+        manager.delete_memory(1)
+        count = manager.handler.pool.reader().execute("SELECT COUNT(*) FROM MemoryLabels;").fetchone()[0]
+        self.assertEqual(count, 0)
+
+
+class TestKeywordSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.test_dir.name, 'memory.db')
+        self.manager = MemoryManager(self.db_path, embedder=LocalEmbedding())
+        self.manager.add_memory("用户说他每天早上都喝咖啡", "喜欢咖啡")
+        self.manager.add_memory("The user plays tennis on weekends", "sports")
+        self.manager.add_memory("咖啡机坏了，需要维修", "设备维修")
+        self.manager.add_memory("用户住在上海浦东", "住址")
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def keyword(self, query, **kwargs):
+        return [mem.id for mem in self.manager.search_memory(query, search_type="keyword", **kwargs)]
+
+    def test_cjk_substring_and_bm25_ranking(self):
+        # summary 中出现的权重更高
+        self.assertEqual(self.keyword("咖啡"), [1, 3])
+        self.assertEqual(self.keyword("浦东"), [4])
+        self.assertEqual(self.keyword("咖啡 维修"), [3])
+
+    def test_prefix_phrase_and_exact(self):
+        self.assertEqual(self.keyword("TENN"), [2])
+        self.assertEqual(self.keyword('"plays tennis"'), [2])
+        self.assertEqual(self.keyword('"tennis plays"'), [])
+        self.assertEqual(self.keyword("喝咖啡", exact_match=True), [1])
+        self.assertEqual(self.keyword("咖啡喝", exact_match=True), [])
+
+    def test_pagination_in_sql(self):
+        self.assertEqual(self.keyword("咖啡", k=1), [1])
+        self.assertEqual(self.keyword("咖啡", k=1, offset=1), [3])
+        self.assertEqual(self.keyword("", k=2), [4, 3])
+
+    def test_index_follows_update_and_delete(self):
+        self.manager.update_memory(4, new_text="用户搬到了北京")
+        self.assertEqual(self.keyword("上海"), [])
+        self.assertEqual(self.keyword("北京"), [4])
+        self.manager.delete_memory(1)
+        self.assertEqual(self.keyword("咖啡"), [3])
+
+    def test_existing_database_backfilled(self):
+        def drop_fts(conn):
+            for sql in ("DROP TRIGGER Memory_fts_insert;", "DROP TRIGGER Memory_fts_delete;",
+                        "DROP TRIGGER Memory_fts_update;", "DROP TABLE MemoryFTS;"):
+                conn.execute(sql)
+        self.manager.handler.pool.write(drop_fts)
+        reloaded = MemoryManager(self.db_path, embedder=LocalEmbedding())
+        self.assertEqual([m.id for m in reloaded.search_memory("上海", search_type="keyword")], [4])
+
+
+class SlowEmbedding(LocalEmbedding):
+
+    def _embed_batch(self, texts, timeout=None):
+        time.sleep(0.5)  # 不理会 timeout，模拟卡住的 embedding 端点
+        return super()._embed_batch(texts, timeout)
+
+
+class FailingEmbedding(LocalEmbedding):
+
+    def __init__(self):
+        super().__init__()
+        self.failing = True
+
+    def _embed_batch(self, texts, timeout=None):
+        if self.failing:
+            raise ConnectionError("embedding endpoint unavailable")
+        return super()._embed_batch(texts, timeout)
+
+
+class TestHybridSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.test_dir.name, 'memory.db')
+        self.manager = MemoryManager(self.db_path, embedder=LocalEmbedding())
+        self.manager.add_trigger("咖啡机", "desc")
+        self.manager.add_memory("用户每天早上喝咖啡", "用户喜欢咖啡", labels=["饮食"])
+        self.manager.add_memory("咖啡机上周坏了", "咖啡机故障", trigger="咖啡机")
+        self.manager.add_memory("the user plays tennis", "tennis", labels=["运动"])
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_sources_are_fused_and_attributed(self):
+        results = self.manager.hybrid_search("我的咖啡机坏了", k=3)
+        self.assertEqual(results[0].memory.id, 2)
+        self.assertEqual(set(results[0].sources), {"vector", "keyword", "trigger"})
+        self.assertTrue(all(a.score >= b.score for a, b in zip(results, results[1:])))
+
+    def test_labels_in_query_are_used(self):
+        results = self.manager.hybrid_search("运动", k=3)
+        self.assertIn("label", next(r for r in results if r.memory.id == 3).sources)
+        self.assertEqual([m.id for m in self.manager.search_memory("运动", search_type="hybrid", k=1)], [3])
+
+    def test_blank_or_unrelated_query_packs_nothing(self):
+        for query in ("", "   ", "？！", "quantum chromodynamics"):
+            self.assertEqual(self.manager.hybrid_search(query, k=3), [], query)
+            self.assertEqual(self.manager.search_memory(query, search_type="hybrid"), [], query)
+        # 记忆页面的列表仍按新的在前
+        self.assertEqual([m.id for m in self.manager.search_memory("", k=2, search_type="keyword")], [3, 2])
+
+    def test_slow_source_is_dropped(self):
+        slow = MemoryManager(self.db_path, embedder=SlowEmbedding())
+        start = time.perf_counter()
+        results = slow.hybrid_search("咖啡机 repair", k=3, budget_ms=100)
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual(results[0].memory.id, 2)
+        self.assertTrue(all("vector" not in r.sources for r in results))
+        self.assertEqual(slow.search_stats["dropped"]["vector"], 1)
+
+    def test_abandoned_recalls_do_not_starve_later_queries(self):
+        slow = MemoryManager(self.db_path, embedder=SlowEmbedding())
+        for i in range(12):
+            results = slow.hybrid_search(f"咖啡机 repair {i}", k=3, budget_ms=50)
+            self.assertEqual(results[0].memory.id, 2, i)
+        self.assertEqual(slow.search_stats["queries"], 12)
+
+
+class TestVectorSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.test_dir.name, 'memory.db')
+        self.index_path = os.path.join(self.test_dir.name, 'index.faiss')
+        self.manager = MemoryManager(self.db_path, embedder=LocalEmbedding())
+        self.manager.add_memory("用户喜欢喝咖啡", "用户喜欢喝咖啡")
+        self.manager.add_memory("用户住在上海", "用户住在上海")
+        self.manager.add_memory("the user plays tennis", "the user plays tennis")
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def search_ids(self, manager, query, k=1):
+        return [mem.id for mem in manager.search_memory(query, k=k, search_type="vector")]
+
+    def test_vector_search_returns_nearest_first(self):
+        self.assertEqual(self.search_ids(self.manager, "喜欢咖啡"), [1])
+        self.assertEqual(self.search_ids(self.manager, "tennis"), [3])
+        self.assertEqual(len(self.search_ids(self.manager, "上海", k=10)), 3)
+
+    def test_embedding_stored_as_float32_blob(self):
+        blob = self.manager.handler.pool.reader().execute("SELECT embedding FROM Memory WHERE id = 1;").fetchone()[0]
+        self.assertEqual(len(blob), self.manager.dimension * 4)
+
+    def test_delete_and_update_use_memory_id(self):
+        self.manager.delete_memory(1)
+        self.assertNotIn(1, self.search_ids(self.manager, "喜欢咖啡", k=10))
+
+        self.manager.update_memory(2, new_summary="the user likes coffee")
+        self.assertEqual(self.search_ids(self.manager, "coffee"), [2])
+        self.assertEqual(sorted(self.manager.index.ids().tolist()), [2, 3])
+
+    def test_index_persisted_and_synced_on_startup(self):
+        self.manager.flush_index()
+        self.assertTrue(os.path.exists(self.index_path))
+
+        # 数据库在索引落盘后发生变化，启动时应增量修复
+        self.manager.add_memory("用户养了一只猫", "用户养了一只猫")
+        self.manager.handler.del_memory(2)
+
+        reloaded = MemoryManager(self.db_path, embedder=LocalEmbedding())
+        self.assertEqual(sorted(reloaded.index.ids().tolist()), [1, 3, 4])
+        self.assertEqual(self.search_ids(reloaded, "猫"), [4])
+
+    def test_embeddings_backfilled_when_backend_changes(self):
+        reloaded = MemoryManager(self.db_path, embedder=LocalEmbedding(dimension=64))
+        # 构造时不请求 embedding 服务，旧维度的向量不参与检索
+        self.assertEqual(reloaded.index.ntotal, 0)
+        self.assertEqual(reloaded.embedding_stats()["texts"], 0)
+        self.assertEqual(reloaded.backfill_embeddings(), 3)
+        self.assertEqual(reloaded.index.ntotal, 3)
+        self.assertEqual(reloaded.memory_data[0].embedding.shape, (64,))
+        self.assertEqual(MemoryManager(self.db_path, embedder=LocalEmbedding(dimension=64)).index.ntotal, 3)
+
+    def test_writes_succeed_when_embedding_fails(self):
+        failing = FailingEmbedding()
+        manager = MemoryManager(self.db_path, embedder=failing)
+        manager.add_memory("用户养了一只猫", "用户养了一只猫")
+        manager.add_memories([{"summary": "用户喜欢狗"}])
+        manager.update_memory(1, new_summary="用户喜欢喝茶")
+        self.assertEqual([m.embedding for m in manager.memory_data[-2:]], [None, None])
+        self.assertEqual(sorted(manager.index.ids().tolist()), [2, 3])
+        self.assertEqual(manager.backfill_embeddings(), 0)
+
+        failing.failing = False
+        self.assertEqual(manager.backfill_embeddings(), 3)
+        self.assertEqual(self.search_ids(manager, "猫"), [4])
+        self.assertEqual(self.search_ids(manager, "喝茶"), [1])
+        self.assertEqual(sorted(MemoryManager(self.db_path, embedder=LocalEmbedding()).index.ids().tolist()),
+                         [1, 2, 3, 4, 5])
+
+    def test_add_memories_embeds_in_one_batch(self):
+        before = self.manager.embedding_stats()["batches"]
+        self.manager.add_memories([
+            {"summary": "用户喜欢猫", "labels": ["reflection"], "trigger": "猫"},
+            {"summary": "用户喜欢狗", "memory_text": "原文"},
+        ])
+        self.assertEqual(self.manager.embedding_stats()["batches"], before + 1)
+        self.assertEqual(self.manager.memory_data[-1].original_text, "原文")
+        self.assertEqual(self.search_ids(self.manager, "猫"), [4])
+
+
+if __name__ == "__main__":
+    unittest.main()
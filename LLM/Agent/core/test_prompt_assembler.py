@@ -0,0 +1,70 @@
+import unittest
+
+from core.prompt_assembler import PromptAssembler
+
+STATIC = "你是一个诚实、稳健的AI助手。" * 20
+TOOLS = "- read_file_segment\n- execute_shell_command\n" * 5
+
+
+class TestPromptAssembler(unittest.TestCase):
+
+    def setUp(self):
+        self.assembler = PromptAssembler()
+        self.builds = []
+
+    def build(self, text):
+        def build():
+            self.builds.append(text)
+            return text
+        return build
+
+    def system_prompt(self, memories_key, memories):
+        return self.assembler.assemble([
+            self.assembler.segment("static", None, self.build(STATIC)),
+            self.assembler.segment("tools", ("read", "shell"), self.build(TOOLS)),
+            self.assembler.segment("memories", memories_key, self.build(memories)),
+        ])
+
+    def test_segments_memoized_by_key(self):
+        first = self.system_prompt(("q", 1), "memory A")
+        second = self.system_prompt(("q", 1), "memory A")
+        self.assertEqual(first.text, STATIC + TOOLS + "memory A")
+        self.assertEqual(second.text, first.text)
+        self.assertEqual(self.builds, [STATIC, TOOLS, "memory A"])
+        self.assertTrue(all(segment.reused for segment in second.segments))
+
+        self.system_prompt(("q", 2), "memory B")  # 记忆库版本变化
+        self.assertEqual(self.builds[-1], "memory B")
+        self.assertAlmostEqual(self.assembler.stats()["segment_hit_ratio"], 5 / 9)
+
+    def test_shared_prefix_measured_across_turns(self):
+        first = self.system_prompt(("q1", 1), "memory A")
+        usage = self.assembler.record(first.text, [{"role": "user", "content": "hi"}])
+        self.assertEqual(usage.prefix_tokens, 0)
+
+        # 记忆变化：静态前缀和工具列表仍可复用
+        second = self.system_prompt(("q2", 1), "memory B")
+        usage = self.assembler.record(second.text, [{"role": "user", "content": "hi"}])
+        shared = first.segments[0].tokens + first.segments[1].tokens
+        self.assertEqual(usage.prefix_tokens, shared)
+        self.assertEqual((usage.segments, usage.reused_segments), (3, 2))
+
+        # 同一个系统提示词上继续对话：之前的消息也在前缀中
+        history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+        usage = self.assembler.record(second.text, history + [{"role": "user", "content": "next"}], cached_tokens=7)
+        self.assertEqual(usage.prefix_tokens, second.tokens + 1)
+        self.assertEqual(usage.prompt_tokens, second.tokens + 1 + 2 + 1)
+
+        stats = self.assembler.stats()
+        self.assertEqual(stats["turns"], 3)
+        self.assertEqual(stats["cached_tokens"], 7)
+        self.assertGreater(stats["prefix_ratio"], 0.5)
+
+    def test_unknown_prompt_is_one_segment(self):
+        self.assembler.record("plain prompt", [])
+        usage = self.assembler.record("plain prompt", [])
+        self.assertEqual((usage.segments, usage.prefix_tokens), (1, usage.prompt_tokens))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from core.chat_pipeline import ChatPipeline
+from core.llm_client import Endpoint, LLMClient
+from core.response_cache import ResponseCache, ResponseCacheMiss, cache_key
+from core.stub_server import StubServer
+
+MESSAGES = [{"role": "system", "content": "plan"}, {"role": "user", "content": "`@plan_decide_next`  开始执行第一步"}]
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.test_dir.name, 'cache.db')
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        self.test_dir.cleanup()
+
+    def cache(self, **kwargs):
+        cache = ResponseCache(self.path, **kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def test_key_ignores_whitespace_and_metadata(self):
+        noisy = [{"role": "system", "content": " plan\n", "id": "s"},
+                 {"role": "user", "content": "`@plan_decide_next`\n开始执行第一步", "time": "now"}]
+        self.assertEqual(cache_key("m", MESSAGES), cache_key("m", noisy))
+        self.assertNotEqual(cache_key("m", MESSAGES), cache_key("other", MESSAGES))
+        self.assertNotEqual(cache_key("m", MESSAGES), cache_key("m", MESSAGES, temperature=0.7))
+
+    def test_memory_and_disk_tiers(self):
+        cache = self.cache()
+        key = cache_key("m", MESSAGES)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, "reply", "m", latency_ms=120)
+        self.assertEqual(cache.get(key), "reply")
+
+        other = self.cache()  # 另一个进程：内存中没有，从文件读取
+        self.assertEqual(other.get(key), "reply")
+        self.assertEqual(other.get(key), "reply")
+        stats = other.stats()
+        self.assertEqual((stats["disk_hits"], stats["memory_hits"]), (1, 1))
+        self.assertEqual(stats["saved_ms"], 240)
+        self.assertEqual(cache.stats()["hit_ratio"], 0.5)
+
+    def test_entries_expire(self):
+        cache = self.cache(ttl_seconds=60)
+        cache.put("k", "reply")
+        with mock.patch("core.response_cache.time.time", return_value=cache.memory["k"][1] + 61):
+            self.assertIsNone(cache.get("k"))
+            self.assertIsNone(self.cache(ttl_seconds=60).get("k"))
+            self.assertEqual(cache.evict(), 1)
+        self.assertGreaterEqual(cache.stats()["expired"], 1)
+
+    def test_least_recently_used_evicted_beyond_max_bytes(self):
+        cache = self.cache(max_bytes=25, memory_entries=1)
+        for i, key in enumerate("abc"):
+            with mock.patch("core.response_cache.time.time", return_value=1000.0 + i):
+                cache.put(key, "x" * 10)
+        with mock.patch("core.response_cache.time.time", return_value=1010.0):
+            cache.get("a")  # a 成为最近使用
+            cache.pool.write(lambda conn: None)  # 等待访问时间写入
+            self.assertEqual(cache.evict(), 1)
+        remaining = {row[0] for row in cache.pool.reader().execute("SELECT key FROM ResponseCache;")}
+        self.assertEqual(remaining, {"a", "c"})
+
+    def test_replay_and_record_modes(self):
+        self.cache().put("k", "old")
+        replay = self.cache(mode="replay")
+        self.assertEqual(replay.get("k"), "old")
+        with self.assertRaises(ResponseCacheMiss):
+            replay.get("missing")
+        replay.put("missing", "ignored")
+        with self.assertRaises(ResponseCacheMiss):
+            replay.get("missing")
+
+        record = self.cache(mode="record")
+        self.assertIsNone(record.get("k"))
+        record.put("k", "new")
+        self.assertEqual(self.cache().get("k"), "new")
+
+
+class TestPipelineCache(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.test_dir.name, 'cache.db')
+        self.server = StubServer().start()
+        self.llm = LLMClient(Endpoint("chat", base_url=self.server.base_url, api_key="stub", model="stub"))
+
+    def tearDown(self):
+        self.server.stop()
+        self.test_dir.cleanup()
+
+    def chat_requests(self):
+        return sum(1 for path, _ in self.server.requests if path.endswith("/chat/completions"))
+
+    def run_turn(self, pipeline, use_cache=True):
+        turn = pipeline.stream("plan", [{"role": "user", "content": "next step"}], use_cache=use_cache)
+        return "".join(turn), turn
+
+    def test_cached_reply_skips_request(self):
+        cache = ResponseCache(self.path)
+        pipeline = ChatPipeline(self.llm, cache=cache, warmup=False)
+        try:
+            first, _ = self.run_turn(pipeline)
+            second, turn = self.run_turn(pipeline)
+            self.assertEqual(first, second)
+            self.assertTrue(turn.metrics.cache_hit)
+            self.assertEqual(self.chat_requests(), 1)
+            self.run_turn(pipeline, use_cache=False)
+            self.assertEqual(self.chat_requests(), 2)
+        finally:
+            pipeline.close()
+            cache.close()
+
+        replay = ResponseCache(self.path, mode="replay")
+        pipeline = ChatPipeline(self.llm, cache=replay)
+        try:
+            self.assertEqual(self.run_turn(pipeline)[0], first)
+            with self.assertRaises(ResponseCacheMiss):
+                list(pipeline.stream("plan", [{"role": "user", "content": "unseen"}], use_cache=True))
+            self.assertEqual(self.chat_requests(), 2)
+            self.assertEqual(len(self.server.requests), 2)  # 回放时也不预热
+        finally:
+            pipeline.close()
+            replay.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from datetime import datetime, timedelta
+
+from core.memory import Memory
+from core.retrieval import RRF_K, fuse, recency_boost
+
+
+def memory(memory_id, days_ago=0, now=datetime(2024, 1, 31)):
+    created = now - timedelta(days=days_ago)
+    return Memory(id=memory_id, original_text="", summary="", created_at=created, updated_at=created)
+
+
+class TestFuse(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime(2024, 1, 31)
+        self.memories = {i: memory(i) for i in range(1, 6)}
+
+    def test_rrf_sums_ranks_across_sources(self):
+        ranked = {"vector": [1, 2, 3], "keyword": [3, 1], "trigger": [4]}
+        weights = {"vector": 1.0, "keyword": 1.0, "trigger": 1.0}
+        results = fuse(ranked, self.memories, k=10, weights=weights, recency_weight=0, now=self.now)
+
+        self.assertEqual([r.memory.id for r in results], [1, 3, 4, 2])
+        self.assertAlmostEqual(results[0].score, 1 / (RRF_K + 1) + 1 / (RRF_K + 2))
+        self.assertEqual(results[1].sources, {"vector": 3, "keyword": 1})
+
+    def test_weights_and_unknown_ids(self):
+        ranked = {"vector": [1], "trigger": [2, 99]}
+        results = fuse(ranked, self.memories, k=10, weights={"vector": 1.0, "trigger": 2.0},
+                       recency_weight=0, now=self.now)
+        self.assertEqual([r.memory.id for r in results], [2, 1])
+
+    def test_recency_breaks_ties(self):
+        memories = {1: memory(1, days_ago=90), 2: memory(2, days_ago=0)}
+        results = fuse({"vector": [1], "keyword": [2]}, memories, k=2, now=self.now)
+        self.assertEqual([r.memory.id for r in results], [2, 1])
+
+    def test_recency_boost_accepts_sqlite_strings(self):
+        mem = memory(1)
+        mem.created_at = "2024-01-01 00:00:00"
+        mem.updated_at = "2024-01-31 00:00:00.000001"
+        self.assertAlmostEqual(recency_boost(mem, self.now, half_life_days=30, weight=0.2), 1.2, places=3)
+        mem.updated_at = mem.created_at
+        self.assertAlmostEqual(recency_boost(mem, self.now, half_life_days=30, weight=0.2), 1.1, places=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from core.db import ConnectionPool
+from core.session_archive import SessionArchive
+
+
+class TestSessionArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(os.path.join(self.test_dir.name, 'index.db'))
+        self.root = os.path.join(self.test_dir.name, 'archive')
+        self.archive = SessionArchive(self.root, self.pool, fsync=False, pack_bytes=1000)
+
+    def tearDown(self):
+        self.archive.close()
+        self.pool.close()
+        self.test_dir.cleanup()
+
+    def test_put_read_replace_remove(self):
+        self.archive.put("a", b"first")
+        self.archive.put("b", b"other")
+        self.archive.put("a", b"second")
+        self.assertEqual(self.archive.read("a"), b"second")
+        self.assertEqual(self.archive.read("b"), b"other")
+        self.archive.remove("a")
+        self.assertIsNone(self.archive.read("a"))
+        self.assertFalse(self.archive.contains("a"))
+        self.assertTrue(self.archive.contains("b"))
+
+    def test_packs_roll_over(self):
+        for i in range(5):
+            self.archive.put(f"s{i}", bytes(400))
+        self.assertEqual(len(self.archive.packs()), 2)  # 超过 pack_bytes 之后才新建
+        self.assertEqual(self.archive.stats()["live_bytes"], 2000)
+
+    def test_compact_reclaims_dead_entries(self):
+        for i in range(5):
+            self.archive.put(f"s{i}", bytes([i]) * 400)
+        for i in range(4):
+            self.archive.remove(f"s{i}")
+        self.archive.put("s1", b"restored")  # 旧条目仍在第一个打包文件中
+        before = self.archive.stats()["bytes"]
+        reclaimed = self.archive.compact(limit=10)
+        self.assertGreater(reclaimed, 0)
+        self.assertEqual(self.archive.stats()["bytes"], before - reclaimed)
+        self.assertEqual(self.archive.read("s4"), bytes([4]) * 400)
+        self.assertEqual(self.archive.read("s1"), b"restored")
+
+    def test_compact_during_put_keeps_new_entry(self):
+        for i in range(2):
+            self.archive.put(f"s{i}", bytes(400))
+            self.archive.remove(f"s{i}")
+        write = self.pool.write
+        racer = threading.Thread(target=lambda: (self.archive.put("y", bytes(400)), self.archive.compact(limit=10)))
+
+        def index_write(fn):
+            # put("x") 已追加到第一个打包文件、尚未写索引时，另一个线程新建打包文件并压缩
+            if not racer.is_alive() and racer.ident is None:
+                racer.start()
+                racer.join(0.3)
+            return write(fn)
+
+        with mock.patch.object(self.pool, "write", side_effect=index_write):
+            self.archive.put("x", b"x" * 300)
+        racer.join()
+        self.assertEqual(self.archive.read("x"), b"x" * 300)
+        self.assertEqual(self.archive.read("y"), bytes(400))
+
+    def test_rebuild_index_from_packs(self):
+        self.archive.put("a", b"one")
+        self.archive.put("b", b"two")
+        self.archive.put("a", b"three")
+        with open(self.archive.pack_path(self.archive.packs()[-1]), "ab") as f:
+            f.write(b"SPK\x00\x00")  # 写入中途崩溃留下的不完整条目
+        self.pool.write(lambda conn: conn.execute("DELETE FROM Archive;"))
+        self.assertEqual(set(self.archive.rebuild()), {"a", "b"})
+        self.assertEqual(self.archive.read("a"), b"three")
+        self.assertEqual(self.archive.read("b"), b"two")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,623 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from unittest import mock
+
+from core import codec as codecs
+from core import locks
+from core.session_archive import RetentionPolicy
+from core.session_manager import (COMPACT_META_RECORDS, LocalSessionManager, SqliteSessionManager,
+                                  get_session_manager, get_start_of_day_week_month_year, period_range)
+from tmp.migrate_sessions_to_sqlite import migrate_sessions
+
+
+class TestSessionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.test_dir.name, 'sessions')
+        self.manager = LocalSessionManager(self.root)
+
+    def tearDown(self):
+        self.manager.close()
+        self.test_dir.cleanup()
+
+    def test_list_is_newest_first_and_paginated(self):
+        ids = [self.manager.new({"session_name": f"s{i}"}).session_id for i in range(5)]
+        listed = [s["session_id"] for s in self.manager.list()]
+        self.assertEqual(listed, ids[::-1])
+        self.assertEqual([s["session_id"] for s in self.manager.list(offset=1, limit=2)], ids[3:1:-1])
+        self.assertEqual(self.manager.list(limit=1)[0]["session_name"], f"s4: {ids[4][:4]}")
+        self.assertEqual(self.manager.count(), 5)
+
+    def test_save_updates_name_and_deleted_flag(self):
+        session = self.manager.new({"session_name": "old"})
+        session.session_name = "new"
+        self.manager.save(session)
+        self.assertEqual(self.manager.list()[0]["session_name"], f"new: {session.session_id[:4]}")
+
+        session.deleted = True
+        self.manager.save(session)
+        self.assertEqual(self.manager.list(), [])
+        self.assertIsNone(self.manager.get({"session_name": "new"}))
+
+    def test_period_filter(self):
+        old = self.manager.new({"session_name": "old"})
+        recent = self.manager.new({"session_name": "recent"})
+        self.manager.index.upsert(old.session_id, "old", ctime=(datetime.now() - timedelta(days=800)).timestamp())
+
+        self.assertEqual([s["session_id"] for s in self.manager.list(period="Today")], [recent.session_id])
+        self.assertEqual([s["session_id"] for s in self.manager.list(period="Earlier")], [old.session_id])
+        with self.assertRaises(ValueError):
+            self.manager.list(period="Tomorrow")
+
+    def test_period_ranges_partition_time(self):
+        bounds = get_start_of_day_week_month_year()
+        ranges = [period_range(p, *bounds) for p in ("Today", "ThisWeek", "ThisMonth", "ThisYear", "Earlier")]
+        self.assertIsNone(ranges[0][1])
+        self.assertIsNone(ranges[-1][0])
+        for (start, _), (_, end) in zip(ranges, ranges[1:]):
+            self.assertEqual(start, end)
+
+    def test_get_by_name_prefers_matching_id(self):
+        first = self.manager.new({"session_name": "same"})
+        second = self.manager.new({"session_name": "same"})
+        self.assertEqual(self.manager.get({"session_name": "same"}).session_id, second.session_id)
+        display = f"same: {first.session_id[:4]}"
+        self.assertEqual(self.manager.get({"session_name": display}).session_id, first.session_id)
+
+    def test_existing_sessions_indexed_on_first_open(self):
+        root = os.path.join(self.test_dir.name, 'legacy')
+        os.makedirs(root)
+        for i, deleted in enumerate([False, True, False]):
+            with open(os.path.join(root, f"id{i}.json"), "w", encoding="utf-8") as f:
+                json.dump({"session_id": f"id{i}", "session_name": f"n{i}", "conversation": [],
+                           "session_path": root, "deleted": deleted}, f)
+            time.sleep(0.01)
+        with open(os.path.join(root, "broken.json"), "w") as f:
+            f.write("{")
+
+        manager = LocalSessionManager(root)
+        self.assertEqual([s["session_id"] for s in manager.list()], ["id2", "id0"])
+        manager.close()
+
+
+
+def message(i):
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": f"消息 {i}", "id": f"m{i}"}
+
+
+class TestAppendOnlyLog(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.test_dir.name, 'sessions')
+        self.manager = LocalSessionManager(self.root)
+        self.session = self.manager.new({"session_name": "log"})
+        self.path = os.path.join(self.root, f"{self.session.session_id}.jsonl")
+
+    def tearDown(self):
+        self.manager.close()
+        self.test_dir.cleanup()
+
+    def reopen(self):
+        self.manager.close()
+        self.manager = LocalSessionManager(self.root)
+        return self.manager.get({"session_id": self.session.session_id})
+
+    def lines(self):
+        with open(self.path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_save_appends_only_new_messages(self):
+        for i in range(10):
+            self.session.conversation.append(message(i))
+            before = os.path.getsize(self.path)
+            written = self.manager.counters["bytes_written"]
+            self.manager.save(self.session)
+            self.assertEqual(self.manager.counters["bytes_written"] - written, os.path.getsize(self.path) - before)
+        self.assertEqual(self.manager.counters["rewrites"], 1)  # 只有 new() 时的一次
+        self.assertEqual([r["type"] for r in self.lines()], ["session"] + ["message"] * 10)
+        self.assertEqual(self.reopen().conversation, [message(i) for i in range(10)])
+
+    def test_meta_changes_are_appended(self):
+        self.session.session_name = "renamed"
+        self.manager.save(self.session)
+        self.assertEqual(self.lines()[-1]["type"], "meta")
+        reloaded = self.reopen()
+        self.assertEqual(reloaded.session_name, "renamed")
+
+        # 重新打开后继续追加，不会重写
+        reloaded.conversation.append(message(0))
+        self.manager.save(reloaded)
+        self.assertEqual(self.manager.counters["rewrites"], 0)
+        self.assertEqual(len(self.lines()), 3)
+
+    def test_edited_conversation_is_rewritten(self):
+        self.session.conversation += [message(0), message(1)]
+        self.manager.save(self.session)
+        self.session.conversation[1] = {**message(1), "content": "edited"}
+        self.manager.save(self.session)
+        self.assertEqual([r["type"] for r in self.lines()], ["session", "message", "message"])
+        self.assertEqual(self.reopen().conversation[1]["content"], "edited")
+
+    def test_meta_records_compacted(self):
+        for i in range(COMPACT_META_RECORDS + 1):
+            self.session.session_name = f"name {i}"
+            self.manager.save(self.session)
+        self.assertEqual([r["type"] for r in self.lines()], ["session"])
+        self.assertEqual(self.reopen().session_name, f"name {COMPACT_META_RECORDS}")
+
+    def test_torn_tail_is_ignored_and_repaired(self):
+        self.session.conversation.append(message(0))
+        self.manager.save(self.session)
+        with open(self.path, "ab") as f:
+            f.write(b'{"type": "message", "data": {"rol')
+
+        reloaded = self.reopen()
+        self.assertEqual(reloaded.conversation, [message(0)])
+        reloaded.conversation.append(message(1))
+        self.manager.save(reloaded)
+        self.assertEqual(self.reopen().conversation, [message(0), message(1)])
+
+    def test_legacy_json_read_and_converted(self):
+        legacy = os.path.join(self.root, "legacy.json")
+        with open(legacy, "w", encoding="utf-8") as f:
+            json.dump({"session_id": "legacy", "session_name": "old", "conversation": [message(0)],
+                       "session_path": self.root}, f, indent=4, ensure_ascii=False)
+        session = self.manager.get({"session_id": "legacy"})
+        self.assertEqual(session.conversation, [message(0)])
+
+        session.conversation.append(message(1))
+        self.manager.save(session)
+        self.assertFalse(os.path.exists(legacy))
+        self.assertEqual(self.manager.get({"session_id": "legacy"}).conversation, [message(0), message(1)])
+
+    def test_read_messages_range(self):
+        for i in range(6):
+            self.session.conversation.append(message(i))
+            self.session.session_name = f"name {i}"  # 消息之间夹着 meta 记录
+            self.manager.save(self.session)
+        session_id = self.session.session_id
+        self.assertEqual(self.manager.message_count(session_id), 6)
+        self.assertEqual(self.manager.read_messages(session_id, 2, 4), [message(2), message(3)])
+        self.assertEqual(self.manager.read_messages(session_id, -2), [message(4), message(5)])
+
+        # 重新打开后从扫描得到的偏移读取；整体重写后偏移重新计算
+        self.reopen()
+        self.assertEqual(self.manager.read_messages(session_id, 1, 3), [message(1), message(2)])
+        self.session.conversation[5] = {**message(5), "content": "x" * 200}
+        self.manager.save(self.session)
+        self.assertEqual(self.manager.read_messages(session_id, 3, 5), [message(3), message(4)])
+
+        preview = self.manager.read_messages(session_id, 4, preview_chars=10)
+        self.assertEqual(preview[0], message(4))
+        self.assertEqual(preview[1]["content"], "x" * 10)
+        self.assertTrue(preview[1]["truncated"])
+
+    def test_read_messages_legacy_json(self):
+        with open(os.path.join(self.root, "legacy.json"), "w", encoding="utf-8") as f:
+            json.dump({"session_id": "legacy", "session_name": "old", "conversation": [message(0), message(1)],
+                       "session_path": self.root}, f)
+        self.assertEqual(self.manager.message_count("legacy"), 2)
+        self.assertEqual(self.manager.read_messages("legacy", 1), [message(1)])
+
+
+def append_messages(root, session_id, shared_id, worker, n):
+    manager = LocalSessionManager(root, fsync="none")
+    for i in range(n):
+        for sid in (session_id, shared_id):
+            session = manager.get({"session_id": sid})
+            session.conversation.append({"role": "user", "content": f"{worker}-{i}", "id": f"{worker}-{i}"})
+            manager.save(session)
+    manager.close()
+
+
+class TestCrashSafety(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.test_dir.name, 'sessions')
+        self.manager = LocalSessionManager(self.root)
+        self.session = self.manager.new({"session_name": "safe"})
+        self.path = os.path.join(self.root, f"{self.session.session_id}.jsonl")
+
+    def tearDown(self):
+        self.manager.close()
+        self.test_dir.cleanup()
+
+    def test_failed_rewrite_keeps_old_file(self):
+        self.session.conversation.append(message(0))
+        self.manager.save(self.session)
+        with open(self.path, "rb") as f:
+            before = f.read()
+
+        self.session.conversation[0] = message(1)
+        with mock.patch("core.session_manager.os.replace", side_effect=OSError("disk full")):
+            self.assertRaises(OSError, self.manager.save, self.session)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), before)
+        self.assertEqual([f for f in os.listdir(self.root) if f.endswith(".tmp")], [])
+
+    def test_fsync_policies(self):
+        for policy, expected in (("none", 0), ("rewrite", 2), ("always", 3)):
+            manager = LocalSessionManager(self.root, fsync=policy)
+            session = manager.new({})  # 重写：文件 + 目录
+            session.conversation.append(message(0))
+            manager.save(session)  # 追加
+            self.assertEqual(manager.counters["fsyncs"], expected, policy)
+            manager.close()
+        self.assertRaises(ValueError, LocalSessionManager, self.root, fsync="sometimes")
+
+    def test_stale_state_rescanned_after_other_writer(self):
+        other = LocalSessionManager(self.root)
+        session = other.get({"session_id": self.session.session_id})
+        session.conversation.append(message(0))
+        other.save(session)
+        other.close()
+
+        # self.manager 缓存的 LogState 已过期，不能在其基础上追加
+        self.assertEqual(self.manager.read_messages(self.session.session_id), [message(0)])
+        self.assertEqual(self.manager.counters["rescans"], 1)
+        self.session.conversation = [message(0), message(1)]
+        self.manager.save(self.session)
+        self.assertEqual(self.manager.get({"session_id": self.session.session_id}).conversation,
+                         [message(0), message(1)])
+
+    @unittest.skipIf(locks.fcntl is None, "fcntl not available")
+    def test_concurrent_processes(self):
+        shared = self.manager.new({"session_name": "shared"})
+        ids = [self.manager.new({"session_name": f"w{w}"}).session_id for w in range(4)]
+        ctx = multiprocessing.get_context("fork")
+        workers = [ctx.Process(target=append_messages, args=(self.root, ids[w], shared.session_id, w, 20))
+                   for w in range(4)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        for w, session_id in enumerate(ids):
+            self.assertEqual([m["id"] for m in self.manager.get({"session_id": session_id}).conversation],
+                             [f"{w}-{i}" for i in range(20)])
+        # 同一会话并发的 get/save 之间可能覆盖彼此的新消息，但日志始终完整
+        meta, conversation, state = LocalSessionManager.scan_log(
+            os.path.join(self.root, f"{shared.session_id}.jsonl"))
+        self.assertIsNotNone(state)
+        self.assertTrue(conversation)
+        self.assertEqual(len({m["id"] for m in conversation}), len(conversation))
+
+    def test_stale_tmp_removed(self):
+        stale = self.path + ".abc.tmp"
+        fresh = self.path + ".def.tmp"
+        for tmp_path in (stale, fresh):
+            open(tmp_path, "w").close()
+        old = time.time() - 2 * 3600
+        os.utime(stale, (old, old))
+        LocalSessionManager(self.root).close()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+
+
+class TestCompressedLog(unittest.TestCase):
+    codec = "gzip"
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.test_dir.name, 'sessions')
+        self.manager = LocalSessionManager(self.root, codec=self.codec)
+        self.session = self.manager.new({"session_name": "zip"})
+        self.path = os.path.join(self.root, f"{self.session.session_id}.jsonl")
+
+    def tearDown(self):
+        self.manager.close()
+        self.test_dir.cleanup()
+
+    def reopen(self, codec=None):
+        self.manager.close()
+        self.manager = LocalSessionManager(self.root, codec=codec or self.codec)
+        return self.manager.get({"session_id": self.session.session_id})
+
+    def header(self):
+        with open(self.path, "rb") as f:
+            return f.read(codecs.HEADER_SIZE)
+
+    def test_round_trip_and_range_reads(self):
+        self.assertEqual(self.header(), codecs.header(codecs.get_codec(self.codec)))
+        n = codecs.BLOCK_RECORDS * 2 + 5
+        self.session.conversation += [message(i) for i in range(n)]
+        self.manager.save(self.session)  # 追加一个块
+        self.session.conversation.append(message(n))
+        self.manager.save(self.session)
+        self.assertEqual(self.reopen().conversation, [message(i) for i in range(n + 1)])
+
+        self.manager.compact(self.session.session_id)  # 重写为多个块
+        session_id = self.session.session_id
+        for start, end in ((0, 3), (60, 70), (n - 2, None), (-1, None)):
+            expected = [message(i) for i in range(n + 1)][start:end]
+            self.assertEqual(self.manager.read_messages(session_id, start, end), expected)
+        self.reopen()
+        self.assertEqual(self.manager.read_messages(session_id, 62, 66), [message(i) for i in range(62, 66)])
+
+    def test_compressed_smaller_than_plain(self):
+        self.session.conversation += [message(i) for i in range(200)]
+        self.manager.save(self.session)
+        self.manager.compact(self.session.session_id)
+        compressed = os.path.getsize(self.path)
+        plain = self.reopen("gzip")
+        self.manager.rewrite_log(self.path, {k: v for k, v in plain.to_dict().items() if k != "conversation"},
+                                 plain.conversation, codec="none")
+        self.assertLess(compressed * 3, os.path.getsize(self.path))
+
+    def test_plain_log_readable_and_recompressed(self):
+        self.manager.close()
+        plain = LocalSessionManager(self.root)
+        session = plain.new({"session_name": "plain"})
+        session.conversation += [message(0), message(1)]
+        plain.save(session)
+        plain.close()
+        path = os.path.join(self.root, f"{session.session_id}.jsonl")
+
+        self.manager = LocalSessionManager(self.root, codec=self.codec)
+        loaded = self.manager.get({"session_id": session.session_id})
+        loaded.conversation.append(message(2))
+        self.manager.save(loaded)  # 沿用文件已有的编码追加
+        with open(path, "rb") as f:
+            self.assertTrue(f.read(1) == b"{")
+
+        self.assertEqual(self.manager.recompress(), 1)
+        self.assertEqual(self.manager.recompress(), 0)
+        with open(path, "rb") as f:
+            self.assertTrue(f.read().startswith(codecs.MAGIC))
+        self.assertEqual(self.manager.get({"session_id": session.session_id}).conversation,
+                         [message(0), message(1), message(2)])
+
+    def test_fragmented_log_recompressed(self):
+        for i in range(10):
+            self.session.conversation.append(message(i))
+            self.manager.save(self.session)
+        self.assertEqual(self.manager.recompress(), 1)
+        self.assertEqual(self.manager.logs[self.session.session_id].blocks, 1)
+        self.assertEqual(self.reopen().conversation, [message(i) for i in range(10)])
+
+    def test_torn_block_ignored_and_repaired(self):
+        self.session.conversation.append(message(0))
+        self.manager.save(self.session)
+        with open(self.path, "ab") as f:
+            f.write(codecs.BLOCK_LENGTH.pack(100) + b"partial")
+        reloaded = self.reopen()
+        self.assertEqual(reloaded.conversation, [message(0)])
+        reloaded.conversation.append(message(1))
+        self.manager.save(reloaded)
+        self.assertEqual(self.reopen().conversation, [message(0), message(1)])
+
+    def test_background_recompression(self):
+        self.manager.close()
+        plain = LocalSessionManager(self.root)
+        plain.compact(self.session.session_id)
+        plain.close()
+        self.manager = LocalSessionManager(self.root, codec=self.codec)
+        self.manager.start_recompression(min_idle_seconds=0)
+        deadline = time.time() + 5
+        while self.manager.counters["recompressed"] < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.header()[:len(codecs.MAGIC)], codecs.MAGIC)
+
+    def test_invalid_codec(self):
+        self.assertRaises(ValueError, LocalSessionManager, self.root, codec="lz4")
+
+
+try:
+    import zstandard  # noqa: F401
+except ImportError:
+    zstandard = None
+
+
+@unittest.skipIf(zstandard is None, "zstandard not installed")
+class TestZstdLog(TestCompressedLog):
+    codec = "zstd"
+
+
+class TestRetention(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.test_dir.name, 'sessions')
+        self.manager = LocalSessionManager(self.root, fsync="none")
+        self.sessions = []
+        for i in range(4):
+            session = self.manager.new({"session_name": f"s{i}"})
+            session.conversation += [message(0), message(1)]
+            self.manager.save(session)
+            self.sessions.append(session)
+
+    def tearDown(self):
+        self.manager.close()
+        self.test_dir.cleanup()
+
+    def active_files(self):
+        return sorted(f for f in os.listdir(self.root) if f.endswith(".jsonl"))
+
+    def test_tombstones_purged_after_grace(self):
+        session_id = self.sessions[0].session_id
+        self.assertTrue(self.manager.delete(session_id))
+        self.assertIsNone(self.manager.get({"session_id": session_id}))
+        self.assertEqual(self.manager.count(), 3)
+
+        policy = RetentionPolicy(archive_after_days=0, max_active_bytes=0, tombstone_days=7)
+        self.assertEqual(self.manager.apply_retention(policy)["purged"], 0)
+        done = self.manager.apply_retention(policy, now=time.time() + 8 * 86400)
+        self.assertEqual(done["purged"], 1)
+        self.assertEqual(len(self.active_files()), 3)
+        self.assertEqual(len(self.manager.index.list(include_deleted=True)), 3)
+
+    def test_cold_sessions_archived_and_restored(self):
+        policy = RetentionPolicy(archive_after_days=30, max_active_bytes=0)
+        done = self.manager.apply_retention(policy, now=time.time() + 31 * 86400)
+        self.assertEqual(done["archived"], 4)
+        self.assertEqual(self.active_files(), [])
+
+        # 归档后仍然可以列出和读取
+        session_id = self.sessions[1].session_id
+        self.assertEqual(len(self.manager.list()), 4)
+        self.assertEqual(self.manager.get({"session_name": "s1"}).conversation, [message(0), message(1)])
+        self.assertEqual(self.manager.read_messages(session_id, 1), [message(1)])
+
+        # 再次保存时恢复到会话目录
+        session = self.manager.get({"session_id": session_id})
+        session.conversation.append(message(2))
+        self.manager.save(session)
+        self.assertEqual(self.active_files(), [f"{session_id}.jsonl"])
+        self.assertFalse(self.manager.archive.contains(session_id))
+        self.assertEqual(self.manager.get({"session_id": session_id}).conversation, [message(i) for i in range(3)])
+
+    def test_size_policy_archives_least_recent(self):
+        size = os.path.getsize(os.path.join(self.root, self.active_files()[0]))
+        policy = RetentionPolicy(archive_after_days=0, max_active_bytes=int(size * 2.5))
+        self.assertEqual(self.manager.apply_retention(policy)["archived_for_size"], 2)
+        self.assertEqual(self.active_files(), sorted(f"{s.session_id}.jsonl" for s in self.sessions[2:]))
+        self.assertLessEqual(self.manager.index.active_bytes(), policy.max_active_bytes)
+
+    def test_archived_sessions_reindexed(self):
+        policy = RetentionPolicy(archive_after_days=1, max_active_bytes=0)
+        self.manager.apply_retention(policy, now=time.time() + 2 * 86400)
+        self.manager.close()
+        os.remove(os.path.join(self.root, "index.db"))
+        self.manager = LocalSessionManager(self.root)
+        self.assertEqual(self.manager.count(), 4)
+        self.assertEqual(self.manager.get({"session_name": "s3"}).conversation, [message(0), message(1)])
+
+    def test_background_retention(self):
+        self.manager.delete(self.sessions[0].session_id)
+        self.manager.start_retention(RetentionPolicy(archive_after_days=0, max_active_bytes=0, tombstone_days=0),
+                                     interval=60)
+        deadline = time.time() + 5
+        while len(self.active_files()) > 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.active_files()), 3)
+
+
+class TestSqliteSessionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.test_dir.name, 'sessions.db')
+        self.manager = SqliteSessionManager(self.path)
+
+    def tearDown(self):
+        self.manager.close()
+        self.test_dir.cleanup()
+
+    def messages(self, session_id):
+        return self.manager.pool.reader().execute(
+            "SELECT seq FROM Messages WHERE session_id = ? ORDER BY seq;", (session_id,)).fetchall()
+
+    def test_round_trip(self):
+        session = self.manager.new({"session_name": "会话", "model": "gpt"})
+        session.conversation += [message(0), message(1)]
+        self.manager.save(session)
+        self.manager.close()
+
+        self.manager = SqliteSessionManager(self.path)
+        loaded = self.manager.get({"session_id": session.session_id})
+        self.assertEqual(loaded.conversation, [message(0), message(1)])
+        self.assertEqual((loaded.session_name, loaded.model), ("会话", "gpt"))
+
+    def test_append_and_edit(self):
+        session = self.manager.new({"session_name": "s"})
+        session.conversation += [message(0), message(1)]
+        self.manager.save(session)
+        session.conversation.append(message(2))
+        self.manager.save(session)
+        self.assertEqual(len(self.messages(session.session_id)), 3)
+
+        session.conversation = [message(0), {**message(1), "content": "edited"}]
+        self.manager.save(session)
+        loaded = self.manager.get({"session_id": session.session_id})
+        self.assertEqual(loaded.conversation[1]["content"], "edited")
+        self.assertEqual(len(self.messages(session.session_id)), 2)
+
+    def test_read_messages_range(self):
+        session = self.manager.new({"session_name": "s"})
+        session.conversation += [message(i) for i in range(5)]
+        self.manager.save(session)
+        self.assertEqual(self.manager.message_count(session.session_id), 5)
+        self.assertEqual(self.manager.read_messages(session.session_id, 1, 3), [message(1), message(2)])
+        self.assertEqual(self.manager.read_messages(session.session_id, -2), [message(3), message(4)])
+        self.assertTrue(self.manager.read_messages(session.session_id, 0, 1, preview_chars=2)[0]["truncated"])
+
+        session.deleted = True
+        self.manager.save(session)
+        self.assertEqual(self.manager.message_count(session.session_id), 0)
+        self.assertEqual(self.manager.read_messages(session.session_id), [])
+
+    def test_list_lookup_and_delete(self):
+        ids = [self.manager.new({"session_name": name}).session_id for name in ("alpha", "beta", "alpine")]
+        self.assertEqual([s["session_id"] for s in self.manager.list()], ids[::-1])
+        self.assertEqual([s["session_id"] for s in self.manager.list(name_prefix="alp")], [ids[2], ids[0]])
+        self.assertEqual(self.manager.get({"session_name": "beta"}).session_id, ids[1])
+        self.assertEqual(self.manager.get({"session_name": f"alpha: {ids[0][:4]}"}).session_id, ids[0])
+
+        session = self.manager.get({"session_id": ids[1]})
+        session.deleted = True
+        self.manager.save(session)
+        self.assertIsNone(self.manager.get({"session_id": ids[1]}))
+        self.assertEqual(self.manager.count(), 2)
+
+    def test_period_filter(self):
+        old = self.manager.new({"session_name": "old"})
+        self.manager.save(old, ctime=time.time() - 400 * 86400)
+        new = self.manager.new({"session_name": "new"})
+        self.assertEqual([s["session_id"] for s in self.manager.list(period="Today")], [new.session_id])
+        self.assertEqual([s["session_id"] for s in self.manager.list(period="Earlier")], [old.session_id])
+
+    def test_backend_selected_by_env(self):
+        with mock.patch.dict(os.environ, {"SESSION_BACKEND": "sqlite", "SESSION_PATH": self.path}):
+            manager = get_session_manager()
+        self.assertIsInstance(manager, SqliteSessionManager)
+        manager.close()
+        with mock.patch.dict(os.environ, {"SESSION_BACKEND": "redis"}):
+            self.assertRaises(ValueError, get_session_manager)
+
+    def test_manager_shared_per_process(self):
+        root = os.path.join(self.test_dir.name, 'shared')
+        with mock.patch.dict(os.environ, {"SESSION_BACKEND": "local", "SESSION_PATH": root}):
+            first = get_session_manager()
+            workers = threading.active_count()
+            self.assertIs(get_session_manager(), first)  # 另一个浏览器会话
+            self.assertEqual(threading.active_count(), workers)
+            first.close()
+            second = get_session_manager()
+        self.assertIsNot(second, first)
+        second.close()
+
+    def test_migrate_local_sessions(self):
+        root = os.path.join(self.test_dir.name, 'local')
+        local = LocalSessionManager(root)
+        kept = local.new({"session_name": "kept"})
+        kept.conversation += [message(0), message(1)]
+        local.save(kept)
+        gone = local.new({"session_name": "gone"})
+        gone.deleted = True
+        local.save(gone)
+        ctime = local.index.list()[0][2]
+        local.close()
+
+        target = os.path.join(self.test_dir.name, 'migrated.db')
+        self.assertEqual(migrate_sessions(root, target), (2, 0, 0))
+        self.assertEqual(migrate_sessions(root, target), (0, 2, 0))
+        migrated = SqliteSessionManager(target)
+        self.assertEqual(migrated.get({"session_id": kept.session_id}).conversation, [message(0), message(1)])
+        self.assertIsNone(migrated.get({"session_id": gone.session_id}))
+        self.assertEqual(migrated.list_rows(), [(kept.session_id, "kept", ctime)])
+        migrated.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from core.session_manager import LocalSessionManager
+from core.session_writer import SessionWriter, get_session_writer
+
+
+class BlockingManager(LocalSessionManager):
+    """ 写线程中的保存阻塞，直到测试放行 """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.gate = threading.Event()
+        self.saves = []
+
+    def save(self, session):
+        if threading.current_thread().name == "session-writer":
+            self.gate.wait(5)
+            self.saves.append(len(session.conversation))
+        super().save(session)
+
+
+class TestSessionWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.manager = BlockingManager(os.path.join(self.test_dir.name, 'sessions'))
+        self.writer = SessionWriter(self.manager)
+
+    def tearDown(self):
+        self.manager.gate.set()
+        self.writer.close()
+        self.manager.close()
+        self.test_dir.cleanup()
+
+    def add_turn(self, session, i):
+        session.conversation.append({"role": "user", "content": f"q{i}"})
+        session.conversation.append({"role": "assistant", "content": f"a{i}"})
+
+    def test_submit_returns_before_save_and_flush_waits(self):
+        session = self.manager.new({"session_name": "s"})
+        self.add_turn(session, 0)
+        self.writer.submit(session)
+        self.assertFalse(self.writer.flush(session.session_id, timeout=0.05))
+
+        self.manager.gate.set()
+        self.assertTrue(self.writer.flush(session.session_id, timeout=5))
+        self.assertEqual(self.manager.message_count(session.session_id), 2)
+
+    def test_pending_saves_of_same_session_coalesce(self):
+        session = self.manager.new({"session_name": "s"})
+        other = self.manager.new({"session_name": "o"})
+        self.add_turn(other, 0)
+        self.writer.submit(other)  # 占住写线程
+        for i in range(3):
+            self.add_turn(session, i)
+            self.writer.submit(session)
+
+        self.manager.gate.set()
+        self.assertTrue(self.writer.flush(timeout=5))
+        self.assertEqual(self.manager.saves, [2, 6])
+        self.assertEqual(self.writer.counters["coalesced"], 2)
+        self.assertEqual(len(self.manager.get({"session_id": session.session_id}).conversation), 6)
+
+    def test_snapshot_is_isolated_from_later_changes(self):
+        session = self.manager.new({"session_name": "s"})
+        self.add_turn(session, 0)
+        self.writer.submit(session)
+        self.add_turn(session, 1)
+
+        self.manager.gate.set()
+        self.writer.flush(timeout=5)
+        self.assertEqual(self.manager.saves, [2])
+
+    def test_close_drains_pending_saves(self):
+        session = self.manager.new({"session_name": "s"})
+        self.add_turn(session, 0)
+        self.writer.submit(session)
+        self.manager.gate.set()
+        self.writer.close()
+        self.assertEqual(self.manager.message_count(session.session_id), 2)
+        with self.assertRaises(RuntimeError):
+            self.writer.submit(session)
+
+
+class TestSharedSessionWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+        self.manager = LocalSessionManager(os.path.join(self.test_dir.name, 'sessions'))
+
+    def test_one_writer_per_manager_closed_with_it(self):
+        writer = get_session_writer(self.manager)
+        threads = threading.active_count()
+        self.assertIs(get_session_writer(self.manager), writer)  # 另一个浏览器会话
+        self.assertEqual(threading.active_count(), threads)
+
+        session = self.manager.new({"session_name": "s"})
+        session.conversation.append({"role": "user", "content": "q"})
+        writer.submit(session)
+        self.manager.close()  # 先写完排队的会话
+        self.assertTrue(writer.closed)
+        self.assertFalse(writer.thread.is_alive())
+
+        reopened = LocalSessionManager(os.path.join(self.test_dir.name, 'sessions'))
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.message_count(session.session_id), 1)
+        self.assertIsNot(get_session_writer(reopened), writer)
+
+
+if __name__ == "__main__":
+    unittest.main()
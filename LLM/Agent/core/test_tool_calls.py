@@ -0,0 +1,165 @@
+import unittest
+from typing import List, Optional
+
+from core.tool_calls import (Speculation, ToolCallError, ToolCallParser, function_schema, parse_tool_calls,
+                             repair_prompt)
+from core.tool_executor import ToolExecutor
+
+
+def write_to_file(file_path: str, content: str, append: bool = False) -> str:
+    return file_path
+
+
+def read_file_segment(file_path, line_range=(1, 200), include_line_numbers=True):
+    return file_path
+
+
+def search(query: str, tags: Optional[List[str]] = None, environment: dict = None, **options):
+    return query
+
+
+def think(content: str, environment: dict) -> str:
+    return content
+
+
+CALLS = []
+
+
+def record(name: str) -> str:
+    CALLS.append(name)
+    return name
+
+
+REGISTRY = {"write_to_file": write_to_file, "read_file_segment": read_file_segment, "search": search, "think": think,
+            "record": record}
+
+
+class TestToolCallParser(unittest.TestCase):
+
+    def feed_all(self, chunks):
+        parser = ToolCallParser()
+        for i, chunk in enumerate(chunks):
+            block = parser.feed(chunk)
+            if block is not None:
+                return block, i
+        return parser.close(), None
+
+    def test_block_closes_before_fence_and_end_of_reply(self):
+        text = 'Reading.\n```json\n{"action_name": "think", "parameters": {"content": "a}"}}\n```\nmore text'
+        chunks = [text[i:i + 3] for i in range(0, len(text), 3)]
+        block, index = self.feed_all(chunks)
+        self.assertEqual(block, '{"action_name": "think", "parameters": {"content": "a}"}}')
+        self.assertLess(index, len(chunks) - 1)
+
+    def test_fence_split_across_chunks_and_escaped_quotes(self):
+        block, _ = self.feed_all(["x ``", "`js", 'on [{"a": "q\\"]', '"}]', " tail"])
+        self.assertEqual(block, '[{"a": "q\\"]"}]')
+
+    def test_unterminated_block_returned_on_close(self):
+        block, index = self.feed_all(['```json\n{"action_name": "think"'])
+        self.assertIsNone(index)
+        self.assertEqual(block, '{"action_name": "think"')
+
+    def test_no_block(self):
+        self.assertEqual(self.feed_all(["plain reply, finished"]), (None, None))
+
+
+class TestFunctionSchema(unittest.TestCase):
+
+    def test_annotations_defaults_and_injected_parameters(self):
+        schema = function_schema(search)
+        self.assertEqual(schema["required"], ["query"])
+        self.assertEqual(schema["properties"]["query"], {"type": "string"})
+        self.assertNotIn("environment", schema["properties"])
+        self.assertTrue(schema["additionalProperties"])
+
+    def test_type_from_default_value(self):
+        schema = function_schema(read_file_segment)
+        self.assertEqual(schema["properties"]["line_range"], {"type": "array"})
+        self.assertEqual(schema["properties"]["include_line_numbers"], {"type": "boolean"})
+        self.assertEqual(schema["properties"]["file_path"], {})
+        self.assertFalse(schema["additionalProperties"])
+
+
+class TestParseToolCalls(unittest.TestCase):
+
+    def test_single_and_list(self):
+        calls = parse_tool_calls('```json\n{"function_name": "think", "parameters": {"content": "hi"}}\n```',
+                                 REGISTRY)
+        self.assertEqual(calls, [{"action_name": "think", "parameters": {"content": "hi"}}])
+        calls = parse_tool_calls('```json\n[{"action_name": "read_file_segment", "parameters": {"file_path": "a", '
+                                 '"line_range": [1, 5]}}, {"action_name": "search", "parameters": {"query": "q", '
+                                 '"limit": 3}}]\n```', REGISTRY)
+        self.assertEqual([c["action_name"] for c in calls], ["read_file_segment", "search"])
+
+    def test_no_action(self):
+        self.assertEqual(parse_tool_calls("All steps finished.", REGISTRY), [])
+
+    def test_errors_are_collected(self):
+        text = ('```json\n[{"action_name": "write_to_file", "parameters": {"file_path": 1, "extra": true}}, '
+                '{"action_name": "wirte_to_file"}]\n```')
+        with self.assertRaises(ToolCallError) as cm:
+            parse_tool_calls(text, REGISTRY)
+        errors = cm.exception.errors
+        self.assertTrue(any("'content' is a required property" in e for e in errors))
+        self.assertTrue(any("file_path" in e and "string" in e for e in errors))
+        self.assertTrue(any("extra" in e for e in errors))
+        self.assertTrue(any("did you mean write_to_file" in e for e in errors))
+        self.assertIn("wirte_to_file", repair_prompt(cm.exception))
+
+    def test_invalid_json(self):
+        with self.assertRaises(ToolCallError) as cm:
+            parse_tool_calls('```json\n{"action_name": "think", }\n```', REGISTRY)
+        self.assertIn("Invalid JSON", cm.exception.errors[0])
+
+
+class TestSpeculation(unittest.TestCase):
+
+    def setUp(self):
+        CALLS.clear()
+        self.executor = ToolExecutor(REGISTRY)
+        self.addCleanup(self.executor.close)
+
+    def block(self, name):
+        return f'{{"action_name": "{name}", "parameters": {{"{"name" if name == "record" else "content"}": "x"}}}}'
+
+    def test_tool_not_in_allowlist_waits_for_final_parse(self):
+        speculation = Speculation(self.executor, REGISTRY, frozenset({"read_file_segment"}))
+        speculation(self.block("record"))
+        self.assertIsNone(speculation.batch)
+        self.executor.threads.shutdown(wait=True)  # 确认没有任何调用被提交
+        self.assertEqual(CALLS, [])
+
+        actions = parse_tool_calls(f"```json\n{self.block('record')}\n```", REGISTRY)
+        self.assertIsNone(speculation.take(actions))
+        self.assertEqual(CALLS, [])
+        executor = ToolExecutor(REGISTRY)
+        self.addCleanup(executor.close)
+        self.assertEqual(executor.run(actions)[0].result, "x")
+        self.assertEqual(CALLS, ["x"])
+
+    def test_allowlisted_tool_runs_early_and_is_reused(self):
+        speculation = Speculation(self.executor, REGISTRY, frozenset({"record"}))
+        speculation(self.block("record"))
+        actions = parse_tool_calls(f"```json\n{self.block('record')}\n```", REGISTRY)
+        batch = speculation.take(actions)
+        self.assertIsNotNone(batch)
+        self.assertEqual(self.executor.collect(batch)[0].result, "x")
+        self.assertEqual(CALLS, ["x"])
+
+    def test_changed_action_is_discarded(self):
+        speculation = Speculation(self.executor, REGISTRY, frozenset({"record"}))
+        speculation(self.block("record"))
+        batch = speculation.batch
+        self.assertIsNone(speculation.take([]))
+        self.assertTrue(batch.cancelled)
+
+    def test_excluded_and_empty_allowlist(self):
+        for allowed, exclude in ((frozenset({"*"}), frozenset({"think"})), (frozenset(), frozenset())):
+            speculation = Speculation(self.executor, REGISTRY, allowed, exclude)
+            speculation(self.block("think"))
+            self.assertIsNone(speculation.batch)
+
+
+if __name__ == "__main__":
+    unittest.main()
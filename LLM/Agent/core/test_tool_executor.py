@@ -0,0 +1,94 @@
+import os
+import time
+import unittest
+
+from core.tool_executor import ToolExecutor
+
+
+def slow(seconds=0.2, value=None):
+    time.sleep(seconds)
+    return value
+
+
+def fail():
+    raise ValueError("broken tool")
+
+
+def pid():
+    return os.getpid()
+
+
+def wait(timeout=None):
+    return timeout
+
+
+REGISTRY = {"slow": slow, "fail": fail, "pid": pid, "wait": wait}
+
+
+class TestToolExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ToolExecutor(REGISTRY, max_workers=4, process_tools=["pid"], timeouts={"wait": 5})
+
+    def tearDown(self):
+        self.executor.close()
+
+    def test_independent_actions_run_concurrently_in_order(self):
+        started = time.perf_counter()
+        results = self.executor.run([{"action_name": "slow", "parameters": {"value": i}} for i in range(4)])
+        elapsed = time.perf_counter() - started
+        self.assertEqual([r.result for r in results], [0, 1, 2, 3])
+        self.assertLess(elapsed, 0.6)
+        stats = self.executor.stats()
+        self.assertEqual((stats["batches"], stats["calls"]), (1, 4))
+        self.assertGreater(stats["busy_ms"], stats["wall_ms"])
+
+    def test_errors_and_unknown_tools_are_isolated(self):
+        results = self.executor.run([{"action_name": "fail"}, {"action_name": "missing"},
+                                     {"action_name": "slow", "parameters": {"seconds": 0, "value": "ok"}}])
+        self.assertEqual(results[0].error, "ValueError: broken tool")
+        self.assertIn("Unknown function", results[1].error)
+        self.assertEqual(results[2].result, "ok")
+        self.assertIn("error: ValueError: broken tool", results[0].describe())
+        self.assertEqual(self.executor.stats()["errors"], 2)
+
+    def test_per_tool_timeout(self):
+        self.executor.timeouts["slow"] = 0.1
+        started = time.perf_counter()
+        results = self.executor.run([{"action_name": "slow", "parameters": {"seconds": 0.5}},
+                                     {"action_name": "wait"}])
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertTrue(results[0].timed_out)
+        self.assertIn("Timed out", results[0].error)
+        self.assertEqual(self.executor.stats()["timeouts"], 1)
+
+    def test_timeout_passed_to_tools_that_accept_it(self):
+        results = self.executor.run([{"action_name": "wait"}, {"action_name": "wait", "parameters": {"timeout": 1}}])
+        self.assertEqual([r.result for r in results], [5, 1])
+
+    def test_started_batch_runs_before_collect(self):
+        batch = self.executor.start([{"action_name": "slow", "parameters": {"seconds": 0.2, "value": "early"}}])
+        time.sleep(0.25)  # 模型继续输出
+        started = time.perf_counter()
+        results = self.executor.collect(batch)
+        self.assertLess(time.perf_counter() - started, 0.1)
+        self.assertEqual(results[0].result, "early")
+
+    def test_cancelled_batch_skips_pending_calls(self):
+        executor = ToolExecutor(REGISTRY, max_workers=1)
+        self.addCleanup(executor.close)
+        batch = executor.start([{"action_name": "slow", "parameters": {"seconds": 0.2}},
+                                {"action_name": "slow", "parameters": {"seconds": 0.2}}])
+        batch.cancel()
+        self.assertTrue(batch.pending[1][1].cancelled())
+        with self.assertRaises(RuntimeError):
+            executor.collect(batch)
+
+    def test_process_tools_run_in_another_process(self):
+        result = self.executor.run([{"action_name": "pid"}])[0]
+        self.assertIsNone(result.error)
+        self.assertNotEqual(result.result, os.getpid())
+
+
+if __name__ == "__main__":
+    unittest.main()
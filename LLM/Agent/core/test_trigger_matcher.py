@@ -0,0 +1,57 @@
+import unittest
+
+from core.trigger_matcher import TriggerMatcher
+
+
+class TestTriggerMatcher(unittest.TestCase):
+
+    def test_longest_match_first(self):
+        matcher = TriggerMatcher(["咖啡", "咖啡机", "机器"])
+        self.assertEqual(matcher.match("我的咖啡机坏了"), ["咖啡机"])
+        self.assertEqual(matcher.match("喝咖啡"), ["咖啡"])
+
+    def test_overlapping_matches_are_resolved_left_to_right(self):
+        matcher = TriggerMatcher(["ab", "bcd", "cd"])
+        self.assertEqual(matcher.match("abcd"), ["ab", "cd"])
+        self.assertEqual(matcher.match("xbcd"), ["bcd"])
+
+    def test_suffix_patterns_found_through_failure_links(self):
+        matcher = TriggerMatcher(["she", "he", "hers"])
+        self.assertEqual(sorted(p for _, _, p in matcher.find_all("ushers")), ["he", "hers", "she"])
+
+    def test_duplicates_returned_once_in_order(self):
+        matcher = TriggerMatcher(["a_b", "c"])
+        self.assertEqual(matcher.match("c a_b c"), ["c", "a_b"])
+
+    def test_incremental_add_remove_rename(self):
+        matcher = TriggerMatcher(["bc"])
+        self.assertEqual(matcher.match("abcd"), ["bc"])
+
+        # 新增的模式让已有节点的失配指针发生变化
+        matcher.add("abcd")
+        self.assertEqual(matcher.match("abcd"), ["abcd"])
+
+        matcher.remove("abcd")
+        self.assertEqual(matcher.match("abcd"), ["bc"])
+        self.assertNotIn("abcd", matcher)
+
+        matcher.rename("bc", "cd")
+        self.assertEqual(matcher.match("abcd"), ["cd"])
+        self.assertEqual(len(matcher), 1)
+
+    def test_delta_merged_into_main(self):
+        matcher = TriggerMatcher(["base"])
+        for i in range(100):
+            matcher.add(f"t{i:03d}")
+        self.assertLess(len(matcher.delta), 65)
+        self.assertEqual(matcher.match("t000 t099 base"), ["t000", "t099", "base"])
+
+    def test_empty(self):
+        matcher = TriggerMatcher()
+        self.assertEqual(matcher.match("anything"), [])
+        matcher.add("")
+        self.assertEqual(len(matcher), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import faiss
+import numpy as np
+
+from core.vector_index import VectorIndex, measure, perturbed_queries, timed_search
+
+
+def clustered(n, dimension, seed=0):
+    # 带聚类结构的数据，更接近真实的文本向量分布
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((32, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, 32, n)] + 0.3 * rng.standard_normal((n, dimension)).astype(np.float32)
+    return vectors.astype(np.float32)
+
+
+class TestVectorIndexTiers(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.test_dir.name, 'index.faiss')
+        self.vectors = clustered(3000, 32)
+        self.ids = np.arange(1, 3001)
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_stays_flat_below_threshold(self):
+        index = VectorIndex(32, self.path, promote_at=5000)
+        index.add(self.ids, self.vectors)
+        self.assertEqual(index.stats()["type"], "flat")
+
+    def test_promotes_to_hnsw_in_background(self):
+        index = VectorIndex(32, self.path, ann="hnsw", promote_at=2000)
+        index.add(self.ids[:2000], self.vectors[:2000])
+        index.add(self.ids[2000:], self.vectors[2000:])  # 升级期间的写入会被重放
+        index.wait_for_promotion()
+
+        stats = index.stats()
+        self.assertEqual(stats["type"], "hnsw")
+        self.assertGreaterEqual(stats["recall"], 0.9)
+        self.assertIn("latency_ms", stats)
+        self.assertEqual(index.ntotal, 3000)
+        self.assertEqual(index.search(self.vectors[2500], 1)[0][0], 2501)
+
+    def test_hnsw_remove_and_readd(self):
+        index = VectorIndex(32, self.path, ann="hnsw", promote_at=100)
+        index.add(self.ids, self.vectors)
+        index.wait_for_promotion()
+
+        index.remove([5])
+        self.assertNotIn(5, [i for i, _ in index.search(self.vectors[4], 10)])
+        index.add([5], self.vectors[100:101])
+        self.assertIn(index.search(self.vectors[100], 2)[0][0], (5, 101))
+        self.assertEqual(index.ntotal, 3000)
+
+        # 失效条目随索引一起持久化
+        index.save()
+        reloaded = VectorIndex(32, self.path)
+        self.assertTrue(reloaded.load())
+        self.assertEqual(reloaded.stats()["type"], "hnsw")
+        self.assertEqual(reloaded.ntotal, 3000)
+        self.assertEqual(sorted(reloaded.ids().tolist()), self.ids.tolist())
+
+    def test_ivfpq_promotion_and_remove(self):
+        index = VectorIndex(32, self.path, ann="ivfpq", promote_at=100, min_recall=0.0)
+        index.add(self.ids, self.vectors)
+        index.wait_for_promotion()
+
+        self.assertEqual(index.stats()["type"], "ivfpq")
+        self.assertGreater(index.stats()["recall"], 0.0)
+        index.remove([1, 2])
+        self.assertEqual(index.ntotal, 2998)
+        self.assertNotIn(1, index.ids().tolist())
+
+    def test_low_recall_keeps_flat(self):
+        index = VectorIndex(32, self.path, ann="ivfpq", promote_at=100, min_recall=1.01)
+        index.add(self.ids, self.vectors)
+        index.wait_for_promotion()
+        self.assertEqual(index.stats()["type"], "flat")
+        self.assertEqual(index.stats()["rejected"], "ivfpq")
+        index.add([5000], self.vectors[:1])
+        self.assertFalse(index.stats()["promoting"])
+
+
+    def test_rejected_candidate_leaves_flat_index_and_file_unchanged(self):
+        index = VectorIndex(32, self.path, ann="ivfpq", promote_at=10 ** 9, min_recall=1.01)
+        index.add(self.ids[:500], self.vectors[:500])
+        index.save()
+        flat, stat = index.index, os.stat(self.path)
+        with open(self.path, "rb") as f:
+            saved = f.read()
+
+        index.promote(background=False)
+        self.assertEqual(index.stats()["rejected"], "ivfpq")
+        self.assertIs(index.index, flat)
+        self.assertEqual(index.stats()["type"], "flat")
+        self.assertEqual(index.ntotal, 500)
+        self.assertEqual(os.stat(self.path).st_mtime_ns, stat.st_mtime_ns)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), saved)
+
+        # 构建候选索引失败时同样不写文件
+        with mock.patch.object(index, "_build", side_effect=RuntimeError("out of memory")):
+            index.promote(background=False)
+        self.assertIs(index.index, flat)
+        self.assertEqual(os.stat(self.path).st_mtime_ns, stat.st_mtime_ns)
+
+    def test_promotion_measures_against_live_flat_index(self):
+        index = VectorIndex(32, self.path, ann="hnsw", promote_at=10 ** 9)
+        index.add(self.ids, self.vectors)
+        # 不再为基准额外建一份 IndexFlatL2
+        with mock.patch("core.vector_index.faiss.IndexFlatL2", wraps=faiss.IndexFlatL2) as flat:
+            index.promote(background=False)
+        flat.assert_not_called()
+        self.assertEqual(index.stats()["type"], "hnsw")
+        self.assertGreaterEqual(index.stats()["recall"], 0.9)
+
+    def test_queries_are_perturbed(self):
+        queries = perturbed_queries(self.vectors)
+        distances, _ = faiss.knn(queries, self.vectors, 1)
+        self.assertTrue((distances[:, 0] > 1e-3).all())
+        exact = faiss.IndexIDMap(faiss.IndexFlatL2(32))
+        exact.add_with_ids(self.vectors, self.ids)
+        truth, _ = timed_search(exact, queries)
+        self.assertEqual(measure(exact, queries, truth)["recall"], 1.0)
+
+    def test_save_does_not_hold_lock_while_writing(self):
+        index = VectorIndex(32, self.path)
+        index.add(self.ids, self.vectors)
+        searched = []
+
+        def replace(src, dst):
+            # 写文件期间其他线程仍可检索
+            thread = threading.Thread(target=lambda: searched.append(index.search(self.vectors[0], 1)))
+            thread.start()
+            thread.join(timeout=2)
+            os.rename(src, dst)
+
+        with mock.patch("core.vector_index.os.replace", side_effect=replace):
+            index.save()
+        self.assertEqual(searched, [[(1, 0.0)]])
+        self.assertFalse(index.dirty)
+        reloaded = VectorIndex(32, self.path)
+        self.assertTrue(reloaded.load())
+        self.assertEqual(reloaded.ntotal, 3000)
+
+
+if __name__ == "__main__":
+    unittest.main()
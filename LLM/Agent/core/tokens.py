@@ -0,0 +1,18 @@
+"""
+    tokens.py
+
+    不依赖 tokenizer 的 token 数估算：中日韩字符按 1 个 token 计，
+    其余字符按 4 个字符 1 个 token 计。只用于预算和统计，不要求精确。
+"""
+
+import re
+
+_CJK = re.compile(r'[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]')
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
@@ -0,0 +1,260 @@
+"""
+    tool_calls.py
+
+    从模型回复中解析工具调用，并按函数签名生成的 JSON Schema 校验。
+
+    - ToolCallParser 增量扫描流式回复：找到第一个 ```json 代码块后跟踪括号深度（忽略字符串中的括号），
+      顶层 JSON 值一闭合就得到完整的动作，不需要等待代码块结束或整个回复结束
+    - function_schema 按参数的类型注解（没有注解时按默认值的类型）生成 schema，没有默认值的参数为必填；
+      由调用方注入的参数（environment）不出现在 schema 中
+    - parse_tool_calls 解析并校验一个对象或对象数组，所有问题汇总在 ToolCallError 中，
+      repair_prompt 把它们写成让模型修正的提示
+    - Speculation 在动作代码块闭合时（模型可能还在输出）提前执行白名单中的工具；
+      回复尚未结束，动作可能被放弃，所以白名单中只应有只读、可以重复执行的工具
+"""
+
+import difflib
+import inspect
+import json
+import logging
+import typing
+from functools import lru_cache
+from typing import AbstractSet, Any, Callable, Dict, List, Mapping, Optional
+
+from jsonschema import Draft7Validator
+
+from core.tool_executor import ToolBatch, ToolExecutor
+
+FENCE = "```json"
+CLOSE_FENCE = "```"
+# 由调用方注入、不由模型给出的参数
+INJECTED_PARAMETERS = frozenset({"environment"})
+_SIMPLE_TYPES = ((bool, "boolean"), (int, "integer"), (float, "number"), (str, "string"),
+                 (dict, "object"), (list, "array"), (tuple, "array"))
+
+
+class ToolCallError(ValueError):
+    """ 回复中的动作无法解析或不符合 schema """
+
+    def __init__(self, errors: List[str], block: str = ""):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+        self.block = block
+
+
+class ToolCallParser:
+    """ 增量解析回复中的第一个 ```json 代码块
+
+    feed 每次传入新到达的文本，代码块中的顶层 JSON 值闭合时返回它的文本（只返回一次）；
+    回复结束时调用 close，代码块没有闭合时返回已收到的部分（解析时报错，交给修正流程）。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.scanned = 0           # 已扫描到的位置
+        self.start: Optional[int] = None  # JSON 值的起始位置
+        self.fence_end: Optional[int] = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.block: Optional[str] = None
+
+    @property
+    def closed(self) -> bool:
+        return self.block is not None
+
+    def feed(self, text: str) -> Optional[str]:
+        if self.closed:
+            return None
+        self.buffer += text
+        if self.fence_end is None:
+            index = self.buffer.find(FENCE, max(0, self.scanned - len(FENCE)))
+            if index < 0:
+                self.scanned = len(self.buffer)
+                return None
+            self.fence_end = self.scanned = index + len(FENCE)
+        return self._scan()
+
+    def _scan(self) -> Optional[str]:
+        buffer = self.buffer
+        i = self.scanned
+        while i < len(buffer):
+            c = buffer[i]
+            if self.start is None:
+                if c in "{[":
+                    self.start, self.depth = i, 1
+                elif buffer.startswith(CLOSE_FENCE, i):
+                    self.block = ""  # 空代码块
+                    return self.block
+                elif not c.isspace() and c != "`":
+                    self.block = buffer[self.fence_end:].strip()  # 不是对象或数组，交给解析报错
+                    return self.block
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in "{[":
+                self.depth += 1
+            elif c in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.block = buffer[self.start:i + 1]
+                    return self.block
+            elif buffer.startswith(CLOSE_FENCE, i):
+                self.block = buffer[self.start:i]  # 代码块在 JSON 闭合之前结束
+                return self.block
+            i += 1
+        self.scanned = i
+        return None
+
+    def close(self) -> Optional[str]:
+        """回复结束：返回第一个代码块（可能不完整），没有代码块时返回 None"""
+        if not self.closed and self.fence_end is not None:
+            self.block = self.buffer[self.start if self.start is not None else self.fence_end:]
+        return self.block
+
+
+def type_schema(annotation: Any) -> Dict[str, Any]:
+    """把类型注解转换为 JSON Schema，无法表示的类型返回 {}（任意值）"""
+    if annotation is inspect.Parameter.empty or annotation is Any:
+        return {}
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        options = [type_schema(arg) for arg in typing.get_args(annotation)]
+        return {} if {} in options else {"anyOf": options}
+    if annotation is type(None):
+        return {"type": "null"}
+    for cls, name in _SIMPLE_TYPES:
+        if annotation is cls or origin is cls:
+            return {"type": name}
+    return {}
+
+
+@lru_cache(maxsize=None)
+def function_schema(func: Callable) -> Dict[str, Any]:
+    """按函数签名生成参数的 JSON Schema"""
+    try:
+        hints = typing.get_type_hints(func)
+    except Exception:
+        hints = {}
+    properties, required, extra = {}, [], False
+    for name, parameter in inspect.signature(func).parameters.items():
+        if parameter.kind == parameter.VAR_KEYWORD:
+            extra = True
+            continue
+        if parameter.kind == parameter.VAR_POSITIONAL or name in INJECTED_PARAMETERS:
+            continue
+        schema = type_schema(hints.get(name, parameter.annotation))
+        if not schema and parameter.default not in (inspect.Parameter.empty, None):
+            schema = type_schema(type(parameter.default))
+        properties[name] = schema
+        if parameter.default is inspect.Parameter.empty:
+            required.append(name)
+    return {"type": "object", "properties": properties, "required": required, "additionalProperties": extra}
+
+
+def validate_call(call: Any, registry: Mapping[str, Callable]) -> List[str]:
+    """校验一个动作，返回问题列表"""
+    if not isinstance(call, dict):
+        return [f"Action must be an object, got {type(call).__name__}"]
+    name = call.get("action_name")
+    if not isinstance(name, str) or not name:
+        return ['Missing "action_name"']
+    if name not in registry:
+        close = difflib.get_close_matches(name, list(registry), n=3)
+        return [f"Unknown function {name!r}" + (f", did you mean {', '.join(close)}?" if close else "")]
+    parameters = call.get("parameters", {})
+    if not isinstance(parameters, dict):
+        return [f'{name}: "parameters" must be an object']
+    validator = Draft7Validator(function_schema(registry[name]))
+    return [f"{name}: {'.'.join(map(str, e.absolute_path)) or 'parameters'}: {e.message}"
+            for e in validator.iter_errors(parameters)]
+
+
+def normalize_call(call: Any) -> Any:
+    """旧的系统提示词使用 function_name，两种键都接受"""
+    if isinstance(call, dict) and "action_name" not in call and "function_name" in call:
+        call = {**call, "action_name": call["function_name"]}
+        del call["function_name"]
+    return call
+
+
+def parse_block(block: str, registry: Mapping[str, Callable]) -> List[Dict[str, Any]]:
+    """解析并校验一个代码块中的动作（一个对象或对象数组）"""
+    try:
+        value = json.loads(block)
+    except json.JSONDecodeError as e:
+        raise ToolCallError([f"Invalid JSON: {e}"], block)
+    calls = [normalize_call(call) for call in (value if isinstance(value, list) else [value])]
+    if not calls:
+        raise ToolCallError(["Empty action list"], block)
+    errors = [error for call in calls for error in validate_call(call, registry)]
+    if errors:
+        raise ToolCallError(errors, block)
+    return [{"action_name": call["action_name"], "parameters": call.get("parameters", {})} for call in calls]
+
+
+def parse_tool_calls(text: str, registry: Mapping[str, Callable]) -> List[Dict[str, Any]]:
+    """从完整的回复中解析动作，没有 ```json 代码块时返回 []"""
+    parser = ToolCallParser()
+    block = parser.feed(text)
+    if block is None:
+        block = parser.close()
+    return [] if block is None else parse_block(block, registry)
+
+
+def repair_prompt(error: ToolCallError) -> str:
+    """让模型修正动作的提示"""
+    problems = "\n".join(f"- {e}" for e in error.errors)
+    return (f"上一次输出的动作无法执行：\n{problems}\n"
+            f"请只输出修正后的 ```json 代码块（一个对象或对象数组，包含 action_name 和 parameters）。")
+
+
+class Speculation:
+    """ 投机执行：回复中动作代码块一闭合（模型可能还在输出后面的文字），就在执行器中开始执行
+
+    回复结束后用 take 取回：完整回复解析出的动作与提前执行的相同时使用这批调用的结果，否则取消或丢弃它。
+    已经开始的调用无法撤销，所以只有 allowed 中的工具（只读工具）会提前执行，"*" 表示全部；
+    其他工具要等完整回复解析、校验通过之后才执行。
+
+    Args:
+        executor: 执行工具的 ToolExecutor
+        registry: 工具名 -> 函数，用于校验动作
+        allowed: 可以提前执行的工具名
+        exclude: 即使在 allowed 中也不提前执行的工具名（例如需要特定线程的动作）
+    """
+
+    def __init__(self, executor: ToolExecutor, registry: Mapping[str, Callable], allowed: AbstractSet[str],
+                 exclude: AbstractSet[str] = frozenset()):
+        self.executor = executor
+        self.registry = registry
+        self.allowed = allowed
+        self.exclude = exclude
+        self.actions: Optional[List[Dict[str, Any]]] = None
+        self.batch: Optional[ToolBatch] = None
+
+    def __call__(self, block: str):
+        if self.batch is not None or not self.allowed:
+            return
+        try:
+            actions = parse_block(block, self.registry)
+        except ToolCallError:
+            return  # 交给完整回复的解析和修正流程
+        names = {a["action_name"] for a in actions}
+        if names & self.exclude or ("*" not in self.allowed and not names <= self.allowed):
+            return
+        self.actions, self.batch = actions, self.executor.start(actions)
+
+    def take(self, actions: List[Dict[str, Any]]) -> Optional[ToolBatch]:
+        """返回与 actions 相同的提前执行的调用；不同时放弃提前执行的调用并返回 None"""
+        batch, self.batch = self.batch, None
+        if batch is not None and actions != self.actions:
+            batch.cancel()
+            logging.info(f"Discarded early dispatch of {[a['action_name'] for a in self.actions]}")
+            return None
+        return batch
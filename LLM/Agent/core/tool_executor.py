@@ -0,0 +1,173 @@
+"""
+    tool_executor.py
+
+    并行执行一组互不依赖的工具调用。
+
+    - 默认在线程池中执行：文件读写、shell 命令等大部分时间在等待 IO 或子进程
+    - process_tools 中的工具在进程池中执行，绕开 GIL；它们必须是模块级函数，参数和结果可以 pickle
+    - 每个调用有超时（timeouts 按工具名配置，缺省为 default_timeout）。工具的参数中有 timeout 且调用方没有指定时，
+      把超时传给工具，让它自己停止（例如终止子进程）；线程无法被强制停止，超时的调用被放弃，结果到达后丢弃
+    - 结果按输入顺序返回，单个工具的异常或超时不影响其他调用
+    - start 只提交不等待，调用方可以在模型还在输出时提前开始执行（投机执行），之后用 collect 取结果，
+      不再需要时用 ToolBatch.cancel 放弃：尚未开始的调用被取消，已开始的调用结果被丢弃
+"""
+
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+
+
+@dataclass
+class ToolResult:
+    """ 一个工具调用的结果 """
+    name: str
+    parameters: Dict[str, Any] = field(default_factory=dict)
+    result: Any = None
+    error: Optional[str] = None
+    elapsed_ms: float = 0.0
+    timed_out: bool = False
+
+    def describe(self) -> str:
+        """反馈给模型的文本"""
+        outcome = f"error: {self.error}" if self.error else f"result: {self.result}"
+        return f"action_name: {self.name}\nparameters: {json.dumps(self.parameters, ensure_ascii=False)}\n{outcome}"
+
+
+@dataclass
+class ToolBatch:
+    """ 已提交的一组工具调用 """
+    actions: List[Dict[str, Any]]
+    pending: List[tuple]  # (ToolResult, Future 或 None, 截止时间)
+    started: float
+    cancelled: bool = False
+
+    def cancel(self):
+        self.cancelled = True
+        for _, future, _ in self.pending:
+            if future is not None:
+                future.cancel()
+
+
+def _call(func: Callable, parameters: Dict[str, Any]):
+    """在工作线程或进程中执行，返回 (耗时毫秒, 结果)"""
+    started = time.perf_counter()
+    result = func(**parameters)
+    return (time.perf_counter() - started) * 1000, result
+
+
+class ToolExecutor:
+    """ 工具调用的执行器
+
+    Args:
+        registry: 工具名 -> 函数，按引用保存，之后注册的工具同样可用
+        max_workers: 线程池大小
+        process_tools: 在进程池中执行的工具名
+        timeouts: 工具名 -> 超时（秒）
+        default_timeout: 其他工具的超时（秒）
+    """
+
+    def __init__(self, registry: Mapping[str, Callable], max_workers: int = 8, process_tools: Iterable[str] = (),
+                 timeouts: Dict[str, float] = None, default_timeout: float = 60.0):
+        self.registry = registry
+        self.max_workers = max_workers
+        self.process_tools = set(process_tools)
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+        self.threads = ThreadPoolExecutor(max_workers, thread_name_prefix="tool")
+        self._processes = None
+        self.lock = threading.Lock()
+        self.counters = {"batches": 0, "calls": 0, "errors": 0, "timeouts": 0, "busy_ms": 0.0, "wall_ms": 0.0}
+
+    @classmethod
+    def from_env(cls, registry: Mapping[str, Callable]):
+        process_tools = [name.strip() for name in os.getenv("TOOL_PROCESS_POOL", "").split(",") if name.strip()]
+        return cls(registry, max_workers=int(os.getenv("TOOL_MAX_WORKERS", "8")), process_tools=process_tools,
+                   default_timeout=float(os.getenv("TOOL_TIMEOUT", "60")))
+
+    @property
+    def processes(self) -> ProcessPoolExecutor:
+        # spawn：Streamlit 进程中有很多线程，fork 出的子进程可能继承被持有的锁
+        with self.lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(self.max_workers,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+        return self._processes
+
+    def timeout(self, name: str) -> float:
+        return self.timeouts.get(name, self.default_timeout)
+
+    def submit(self, name: str, parameters: Dict[str, Any]) -> Future:
+        func = self.registry.get(name)
+        if func is None:
+            raise KeyError(f"Unknown function: {name}")
+        parameters = dict(parameters)
+        if "timeout" not in parameters and "timeout" in inspect.signature(func).parameters:
+            parameters["timeout"] = self.timeout(name)
+        pool = self.processes if name in self.process_tools else self.threads
+        return pool.submit(_call, func, parameters)
+
+    def start(self, actions: List[Dict[str, Any]]) -> ToolBatch:
+        """提交 actions（{"action_name": ..., "parameters": {...}}），不等待结果"""
+        started = time.perf_counter()
+        pending = []
+        for action in actions:
+            result = ToolResult(action.get("action_name", ""), action.get("parameters") or {})
+            try:
+                future = self.submit(result.name, result.parameters)
+            except Exception as e:
+                result.error = str(e)
+                future = None
+            pending.append((result, future, started + self.timeout(result.name)))
+        return ToolBatch(list(actions), pending, started)
+
+    def collect(self, batch: ToolBatch) -> List[ToolResult]:
+        """等待 start 提交的调用，按输入顺序返回结果；超时从提交时开始计算"""
+        if batch.cancelled:
+            raise RuntimeError("Tool batch was cancelled")
+        waiting = time.perf_counter()
+        for result, future, deadline in batch.pending:
+            if future is None:
+                continue
+            try:
+                result.elapsed_ms, result.result = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+            except FutureTimeoutError:
+                future.cancel()  # 尚未开始的调用不再执行
+                result.timed_out = True
+                result.error = f"Timed out after {self.timeout(result.name):g}s"
+                result.elapsed_ms = (time.perf_counter() - batch.started) * 1000
+            except Exception as e:
+                result.error = f"{type(e).__name__}: {e}"
+            if result.error:
+                logging.error(f"Error executing {result.name}: {result.error}")
+
+        results = [result for result, _, _ in batch.pending]
+        with self.lock:
+            self.counters["batches"] += 1
+            self.counters["calls"] += len(results)
+            self.counters["errors"] += sum(1 for r in results if r.error and not r.timed_out)
+            self.counters["timeouts"] += sum(1 for r in results if r.timed_out)
+            self.counters["busy_ms"] += sum(r.elapsed_ms for r in results)
+            self.counters["wall_ms"] += (time.perf_counter() - waiting) * 1000
+        return results
+
+    def run(self, actions: List[Dict[str, Any]]) -> List[ToolResult]:
+        """同时执行 actions，按输入顺序返回结果"""
+        return self.collect(self.start(actions))
+
+    def stats(self) -> Dict[str, float]:
+        """busy_ms 为各调用耗时之和，wall_ms 为各批实际等待的时间之和"""
+        with self.lock:
+            return dict(self.counters)
+
+    def close(self):
+        self.threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,165 @@
+"""
+    trigger_matcher.py
+
+    Aho–Corasick 多模式匹配，用一次扫描找出查询中出现的所有触发词。
+
+    - 新增触发词先进入一个小的增量自动机，只重建这个小自动机；
+      增量部分超过 sqrt(总数) 时才合并进主自动机，新增的均摊代价很小
+    - 删除触发词只清除节点上的输出，不需要重建
+    - 匹配结果按“最左最长”且互不重叠的规则选取：
+      同时出现 "咖啡" 和 "咖啡机" 时只命中 "咖啡机"
+"""
+
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class Automaton:
+    """ Aho–Corasick 自动机 """
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self.children: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Optional[str]] = [None]   # 以该节点结尾的触发词
+        self.dict_link: List[int] = [0]            # 失配链上最近的有输出的节点，0 表示没有
+        self.size = 0
+        self.dirty = False
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, pattern: str) -> bool:
+        node = self._find(pattern)
+        return node is not None and self.output[node] is not None
+
+    def add(self, pattern: str):
+        """加入一个触发词"""
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self.children[node].get(ch)
+            if nxt is None:
+                nxt = len(self.children)
+                self.children.append({})
+                self.fail.append(0)
+                self.output.append(None)
+                self.dict_link.append(0)
+                self.children[node][ch] = nxt
+                self.dirty = True
+            node = nxt
+        if self.output[node] is None:
+            self.size += 1
+            self.dirty = True
+        self.output[node] = pattern
+
+    def remove(self, pattern: str):
+        """删除一个触发词，节点保留在树中"""
+        node = self._find(pattern)
+        if node is not None and self.output[node] is not None:
+            self.output[node] = None
+            self.size -= 1
+
+    def _find(self, pattern: str) -> Optional[int]:
+        node = 0
+        for ch in pattern:
+            node = self.children[node].get(ch)
+            if node is None:
+                return None
+        return node
+
+    def build(self):
+        """按层（BFS）重建失配指针和输出链接"""
+        queue = deque()
+        for child in self.children[0].values():
+            self.fail[child] = 0
+            self.dict_link[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.children[node].items():
+                f = self.fail[node]
+                while f and ch not in self.children[f]:
+                    f = self.fail[f]
+                f = self.children[f].get(ch, 0)
+                if f == child:
+                    f = 0
+                self.fail[child] = f
+                self.dict_link[child] = f if self.output[f] is not None else self.dict_link[f]
+                queue.append(child)
+        self.dirty = False
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """扫描一次文本，返回所有 (start, end, trigger)，可能重叠"""
+        if self.dirty:
+            self.build()
+        matches = []
+        node = 0
+        children, fail, output, dict_link = self.children, self.fail, self.output, self.dict_link
+        for end, ch in enumerate(text, 1):
+            while node and ch not in children[node]:
+                node = fail[node]
+            node = children[node].get(ch, 0)
+            out = node
+            while out:
+                pattern = output[out]
+                if pattern is not None:
+                    matches.append((end - len(pattern), end, pattern))
+                out = dict_link[out]
+        return matches
+
+
+class TriggerMatcher:
+    """ 触发词匹配器：主自动机 + 增量自动机 """
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self.patterns = set(p for p in patterns if p)
+        self.main = Automaton(self.patterns)
+        self.delta = Automaton()
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __contains__(self, pattern: str) -> bool:
+        return pattern in self.patterns
+
+    def add(self, pattern: str):
+        """加入一个触发词"""
+        if not pattern or pattern in self.patterns:
+            return
+        self.patterns.add(pattern)
+        self.delta.add(pattern)
+        if len(self.delta) > max(64, int(len(self.patterns) ** 0.5)):
+            self.main = Automaton(self.patterns)
+            self.delta = Automaton()
+
+    def remove(self, pattern: str):
+        """删除一个触发词"""
+        if pattern in self.patterns:
+            self.patterns.discard(pattern)
+            self.main.remove(pattern)
+            self.delta.remove(pattern)
+
+    def rename(self, old: str, new: str):
+        self.remove(old)
+        self.add(new)
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """返回所有 (start, end, trigger)，可能重叠"""
+        matches = self.main.find_all(text)
+        if len(self.delta):
+            matches.extend(self.delta.find_all(text))
+        return matches
+
+    def match(self, text: str) -> List[str]:
+        """最左最长、互不重叠的匹配结果，按在文本中出现的顺序返回（去重）"""
+        matches = sorted(self.find_all(text), key=lambda m: (m[0], m[0] - m[1]))
+        selected = []
+        position = 0
+        for start, end, pattern in matches:
+            if start >= position:
+                selected.append(pattern)
+                position = end
+        return list(dict.fromkeys(selected))
@@ -0,0 +1,386 @@
+"""
+    vector_index.py
+
+    FAISS 向量索引，向量 id 直接使用 Memory.id（SQLite 行 id），
+    索引文件保存在 memory.db 旁边，启动时与数据库比对并增量修复。
+
+    索引分层：
+      - flat:  IndexIDMap(IndexFlatL2)，精确检索，条数少于 promote_at 时使用
+      - ivfpq: IndexIVFPQ，倒排 + 乘积量化，内存占用小
+      - hnsw:  IndexIDMap2(IndexHNSWFlat)，图索引，延迟低；HNSW 不支持删除，
+               删除时把 id_map 中对应位置置为 -1，检索时被过滤，失效条目过多时后台重建
+
+    条数达到 promote_at 后在后台线程训练/构建近似索引，并以正在使用的 flat 索引的精确结果为基准测量 recall，
+    recall 达标才会切换。构建期间的写入会记录下来并在切换前重放。
+    升级期间除了正在使用的索引，只多出一份快照（构建完成即释放）和候选索引本身；
+    测量用的查询是抽样向量加噪声，不是已索引的向量本身。
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivfpq", "hnsw")
+MEASURE_K = 10  # 升级时测量 recall@k
+
+
+class VectorIndex:
+    """ 以 Memory.id 为键的分层 FAISS 索引 """
+
+    def __init__(self, dimension: int, path: str = None, ann: str = "hnsw", promote_at: int = 100_000,
+                 min_recall: float = 0.9, auto_promote: bool = True):
+        if ann not in INDEX_TYPES:
+            raise ValueError(f"Invalid index type: {ann}")
+        self.dimension = dimension
+        self.path = path
+        self.ann = ann  # 达到阈值后使用的近似索引，flat 表示永不升级
+        self.promote_at = promote_at  # recall 不达标时翻倍，避免每次写入都重试
+        self.min_recall = min_recall
+        self.auto_promote = auto_promote
+
+        self.lock = threading.RLock()
+        self.save_lock = threading.Lock()  # 串行化写文件，写文件时不持有 self.lock
+        self.index = self._new_index()
+        self.index_type = "flat"
+        self.dead = 0  # hnsw 中已删除但仍在图里的条目数
+        self.dirty = False
+
+        self.promotion: Optional[threading.Thread] = None
+        self.pending_ops: Optional[List[Tuple[str, np.ndarray, Optional[np.ndarray]]]] = None
+        self.metrics: Dict[str, float] = {}
+
+    def _new_index(self):
+        return faiss.IndexIDMap(faiss.IndexFlatL2(self.dimension))
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal - self.dead
+
+    def ids(self) -> np.ndarray:
+        """索引中所有的 id"""
+        with self.lock:
+            if self.index_type == "ivfpq":
+                return ivf_ids(self.index)
+            ids = faiss.vector_to_array(self.index.id_map)
+            return ids[ids != -1] if self.dead else ids
+
+    def add(self, ids: List[int], vectors: np.ndarray):
+        """添加向量，ids 与 vectors 按行对应"""
+        if len(ids) == 0:
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(ids), self.dimension)
+        with self.lock:
+            self.index.add_with_ids(vectors, ids)
+            if self.pending_ops is not None:
+                self.pending_ops.append(("add", ids, vectors))
+            self.dirty = True
+        self.maybe_promote()
+
+    def remove(self, ids: List[int]):
+        """按 id 删除向量"""
+        if len(ids) == 0:
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        with self.lock:
+            if self.index_type == "hnsw":
+                self.dead += mark_dead(self.index, ids)
+            else:
+                self.index.remove_ids(ids)
+            if self.pending_ops is not None:
+                self.pending_ops.append(("remove", ids, None))
+            self.dirty = True
+        if self.index_type == "hnsw" and self.dead > max(1000, self.ntotal // 10):
+            # 失效条目过多，后台重建图索引
+            self.promote(background=True)
+
+    def search(self, vector: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """返回距离最近的 k 个 (id, distance)，按距离升序"""
+        query = np.ascontiguousarray(vector, dtype=np.float32).reshape(1, self.dimension)
+        with self.lock:
+            if self.ntotal <= 0:
+                return []
+            # hnsw 中失效条目返回 -1，多取一些补足 k 个
+            distances, ids = self.index.search(query, k + min(self.dead, 4 * k))
+        hits = [(int(i), float(d)) for i, d in zip(ids[0], distances[0]) if i != -1]
+        return hits[:k]
+
+    def stats(self) -> Dict[str, float]:
+        """当前索引类型、条数，以及最近一次升级时测得的 recall 和延迟"""
+        with self.lock:
+            stats = {
+                "type": self.index_type,
+                "ntotal": self.ntotal,
+                "promoting": self.promotion is not None and self.promotion.is_alive(),
+            }
+        stats.update(self.metrics)
+        return stats
+
+    # ---------------------------------------------------------------- 分层升级
+
+    def maybe_promote(self):
+        """条数达到阈值时在后台启动升级（hnsw 重建也走这条路径）"""
+        if (self.auto_promote and self.ann != "flat" and self.index_type == "flat"
+                and self.ntotal >= self.promote_at):
+            self.promote(background=True)
+
+    def promote(self, background: bool = True):
+        """构建近似索引，recall 达标后替换 flat 索引"""
+        with self.lock:
+            if self.promotion is not None and self.promotion.is_alive():
+                return
+            if self.index_type == "ivfpq":
+                raise ValueError("ivfpq index does not keep raw vectors")
+            self.promotion = threading.Thread(target=self._promote, daemon=True)
+        if background:
+            self.promotion.start()
+        else:
+            self.promotion.run()
+
+    def wait_for_promotion(self, timeout: float = None):
+        if self.promotion is not None and self.promotion.is_alive():
+            self.promotion.join(timeout)
+
+    def _promote(self):
+        promoted = False
+        try:
+            with self.lock:
+                ids, vectors = self._snapshot()
+                self.pending_ops = []
+                live_flat = self.index_type == "flat"
+            queries = perturbed_queries(vectors)
+            start = time.perf_counter()
+            candidate = self._build(self.ann, ids, vectors)
+            build_seconds = time.perf_counter() - start
+            if live_flat:
+                vectors = None  # 快照只用于构建，基准是正在使用的 flat 索引
+                with self.lock:
+                    # 候选索引先追上构建期间的写入，两者内容一致时再取精确结果
+                    dead = self._replay(candidate)
+                    truth, flat_latency = timed_search(self.index, queries)
+            else:
+                # 重建 hnsw 时没有 flat 索引，在快照上暴力检索（不再建一份 flat 索引）
+                start = time.perf_counter()
+                _, positions = faiss.knn(queries, vectors, MEASURE_K)
+                truth = np.where(positions >= 0, ids[positions], -1)
+                flat_latency = (time.perf_counter() - start) * 1000 / len(queries)
+                vectors = None
+                with self.lock:
+                    dead = self._replay(candidate)
+            metrics = measure(candidate, queries, truth)
+            metrics["flat_latency_ms"] = flat_latency
+            metrics["build_seconds"] = build_seconds
+            logging.info(f"Vector index {self.ann} candidate: {metrics}")
+
+            with self.lock:
+                if metrics["recall"] < self.min_recall:
+                    self.metrics = {**metrics, "rejected": self.ann}
+                    self.promote_at = max(self.promote_at, len(ids)) * 2
+                    logging.warning(f"Recall {metrics['recall']:.3f} < {self.min_recall}, keep flat index; "
+                                    f"next promotion attempt at {self.promote_at} vectors")
+                    return
+                dead += self._replay(candidate)
+                self.index = candidate
+                self.index_type = self.ann
+                self.dead = dead
+                self.metrics = metrics
+                self.dirty = True
+                promoted = True
+        except Exception as e:
+            logging.error(f"Vector index promotion failed: {e}", exc_info=True)
+        finally:
+            with self.lock:
+                self.pending_ops = None
+        # 只持久化升级后的索引；被拒绝或失败时 flat 索引和磁盘上的文件保持不变
+        if promoted:
+            self.save()
+
+    def _replay(self, candidate) -> int:
+        """把记录下来的写入应用到候选索引并清空记录（需持有 self.lock），返回新增的失效条目数"""
+        dead = 0
+        for op, op_ids, op_vectors in self.pending_ops:
+            if op == "add":
+                candidate.add_with_ids(op_vectors, op_ids)
+            elif self.ann == "hnsw":
+                dead += mark_dead(candidate, op_ids)
+            else:
+                candidate.remove_ids(op_ids)
+        self.pending_ops = []
+        return dead
+
+    def _snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """取出当前索引中所有存活的 (ids, vectors)"""
+        ids = faiss.vector_to_array(self.index.id_map)
+        vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+        if self.dead:
+            keep = ids != -1
+            ids, vectors = ids[keep], vectors[keep]
+        return ids, vectors
+
+    def _build(self, index_type: str, ids: np.ndarray, vectors: np.ndarray):
+        d = self.dimension
+        if index_type == "flat":
+            index = self._new_index()
+        elif index_type == "hnsw":
+            hnsw = faiss.IndexHNSWFlat(d, 32)
+            hnsw.hnsw.efConstruction = 80
+            hnsw.hnsw.efSearch = 64
+            index = faiss.IndexIDMap2(hnsw)
+        else:
+            n = len(ids)
+            nlist = int(min(max(4 * np.sqrt(n), 16), 65536))
+            m = max(x for x in range(1, d // 4 + 1) if d % x == 0)
+            index = faiss.IndexIVFPQ(faiss.IndexFlatL2(d), d, nlist, m, 8)
+            train = vectors[np.random.default_rng(0).choice(n, min(n, nlist * 64), replace=False)]
+            index.train(train)
+            index.nprobe = max(8, nlist // 16)
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        return index
+
+    # ---------------------------------------------------------------- 持久化
+
+    def save(self):
+        """持久化索引文件
+
+        持有 self.lock 时只在内存中序列化（检索和写入只等待一次内存拷贝），写磁盘在锁外进行。
+        """
+        if not self.path:
+            return
+        with self.save_lock:
+            with self.lock:
+                data = faiss.serialize_index(self.index)
+                self.dirty = False
+            tmp_path = self.path + ".tmp"
+            try:
+                data.tofile(tmp_path)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                with self.lock:
+                    self.dirty = True
+                raise
+
+    def load(self) -> bool:
+        """从磁盘读取索引，维度不一致或文件损坏时返回 False"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            index = faiss.read_index(self.path)
+        except Exception as e:
+            logging.warning(f"Failed to read vector index {self.path}: {e}")
+            return False
+        if index.d != self.dimension:
+            logging.warning(f"Vector index dimension {index.d} != {self.dimension}, rebuilding")
+            return False
+        with self.lock:
+            self.index = index_with_params(index)
+            self.index_type = index_type_of(self.index)
+            self.dead = 0
+            if self.index_type == "hnsw":
+                self.dead = int((faiss.vector_to_array(self.index.id_map) == -1).sum())
+            self.dirty = False
+        return True
+
+    def sync(self, vectors: Dict[int, np.ndarray]):
+        """加载磁盘索引并与数据库中的向量比对
+
+        只补充缺失的 id、删除多余的 id；只有读取失败时才全量重建。
+        有改动时写回磁盘。
+        """
+        if not self.load():
+            with self.lock:
+                self.index = self._new_index()
+                self.index_type = "flat"
+                self.dead = 0
+                self.dirty = True
+
+        indexed = set(self.ids().tolist())
+        expected = set(vectors)
+        missing = [i for i in vectors if i not in indexed]
+        extra = list(indexed - expected)
+
+        self.remove(extra)
+        if missing:
+            self.add(missing, np.stack([vectors[i] for i in missing]))
+        if self.dirty:
+            logging.info(f"Vector index synced: +{len(missing)} -{len(extra)}, total {self.ntotal}")
+            self.save()
+        self.maybe_promote()
+
+
+def index_type_of(index) -> str:
+    """根据 FAISS 索引对象判断层级"""
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            return "hnsw"
+    return "flat"
+
+
+def index_with_params(index):
+    """read_index 不保存检索参数，读取后重新设置"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            inner.hnsw.efSearch = 64
+    if isinstance(index, faiss.IndexIVFPQ):
+        index.nprobe = max(8, index.nlist // 16)
+    return index
+
+
+def perturbed_queries(vectors: np.ndarray, queries: int = 200, noise: float = 0.1) -> np.ndarray:
+    """测量 recall 用的查询：抽样已索引的向量并加入高斯噪声（噪声范数约为向量平均范数的 noise 倍）
+
+    直接用已索引的向量查询时，第一个近邻总是它自己，会高估 recall。
+    """
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), min(queries, len(vectors)), replace=False)]
+    scale = noise * float(np.linalg.norm(sample, axis=1).mean()) / np.sqrt(vectors.shape[1])
+    return (sample + rng.normal(0.0, scale, sample.shape)).astype(np.float32)
+
+
+def timed_search(index, queries: np.ndarray, k: int = MEASURE_K) -> Tuple[np.ndarray, float]:
+    """一次批量检索，返回 id 矩阵和摊到每条查询的耗时（毫秒）"""
+    start = time.perf_counter()
+    _, labels = index.search(queries, k)
+    return labels, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def measure(candidate, queries: np.ndarray, truth: np.ndarray) -> Dict[str, float]:
+    """以精确检索的结果 truth（每行为一条查询的近邻 id）为基准测量候选索引的 recall@k 和单条查询延迟"""
+    found, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        _, labels = candidate.search(q.reshape(1, -1), truth.shape[1])
+        latencies.append(time.perf_counter() - start)
+        found.append(labels[0])
+
+    expected = sum(int((t != -1).sum()) for t in truth)
+    hits = sum(len(set(t[t != -1].tolist()) & set(f.tolist())) for t, f in zip(truth, found))
+    return {
+        "recall": hits / float(max(expected, 1)),
+        "latency_ms": float(np.percentile(np.array(latencies) * 1000, 50)),
+    }
+
+
+def mark_dead(index, ids: np.ndarray) -> int:
+    """把 IndexIDMap 中这些 id 所在的位置置为 -1，返回命中的条目数"""
+    id_map = faiss.rev_swig_ptr(index.id_map.data(), index.ntotal)
+    mask = np.isin(id_map, ids)
+    id_map[mask] = -1
+    return int(mask.sum())
+
+
+def ivf_ids(index) -> np.ndarray:
+    """IVF 索引直接保存 id，按倒排表取出"""
+    invlists = index.invlists
+    ids = [faiss.rev_swig_ptr(invlists.get_ids(i), invlists.list_size(i)).copy()
+           for i in range(index.nlist) if invlists.list_size(i)]
+    return np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
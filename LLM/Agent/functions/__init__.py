@@ -1,46 +1,180 @@
 """
 Function registry system for dynamically loading functions from this directory.
+
+Modules are not imported when the package is imported. The public module-level
+functions of every module are listed in a manifest (name, signature, docstring,
+module path) built by parsing the source with ast, and cached in
+__pycache__/function_manifest.json keyed on each file's mtime and size. A
+module is imported the first time one of its functions is looked up in
+function_registry; names, signatures and docstrings (e.g. for the system
+prompt) come from the manifest via describe_function without importing.
+Keep the imports here light: they are paid by every process that imports the package.
 """
 import importlib
+import json
 import os
-import inspect
-from typing import Dict, Any, Callable
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Iterator, List, NamedTuple
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_PATH = os.path.join(PACKAGE_DIR, "__pycache__", "function_manifest.json")
+MANIFEST_VERSION = 1
+
+
+class FunctionInfo(NamedTuple):
+    """Metadata of a registered function."""
+    name: str        # registry name, "module.function"
+    module: str      # module name in this package ("" for functions registered directly)
+    function: str    # attribute name in the module
+    signature: str   # "(path: str, content: str) -> str"
+    doc: str
+    path: str = ""   # source file
+
+    @property
+    def summary(self) -> str:
+        """First line of the docstring."""
+        doc = self.doc.strip()
+        return doc.splitlines()[0].strip() if doc else ""
+
+
+class FunctionRegistry(MutableMapping):
+    """Registry name -> function; functions listed in the manifest are imported on first lookup."""
+
+    def __init__(self):
+        self._functions: Dict[str, Callable] = {}
+        self._manifest: Dict[str, FunctionInfo] = {}
+
+    def add_manifest(self, entries: List[FunctionInfo]) -> None:
+        for info in entries:
+            self._manifest[info.name] = info
+
+    def __getitem__(self, name: str) -> Callable:
+        func = self._functions.get(name)
+        if func is None:
+            info = self._manifest[name]
+            module = importlib.import_module(f".{info.module}", package=__package__)
+            func = self._functions[name] = getattr(module, info.function)
+        return func
+
+    def __setitem__(self, name: str, func: Callable) -> None:
+        self._functions[name] = func
+        self._manifest.pop(name, None)
+
+    def __delitem__(self, name: str) -> None:
+        if name not in self:
+            raise KeyError(name)
+        self._functions.pop(name, None)
+        self._manifest.pop(name, None)
+
+    def __contains__(self, name) -> bool:
+        return name in self._functions or name in self._manifest
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(dict.fromkeys([*self._manifest, *self._functions])))
+
+    def __len__(self) -> int:
+        return len(set(self._manifest) | set(self._functions))
+
+    def loaded(self) -> List[str]:
+        """Names whose functions have been imported or registered directly."""
+        return list(self._functions)
+
+    def describe(self, name: str) -> FunctionInfo:
+        """Metadata of a function, without importing it if it comes from the manifest."""
+        info = self._manifest.get(name)
+        if info is not None:
+            return info
+        import inspect
+        func = self._functions[name]
+        try:
+            signature = str(inspect.signature(func))
+        except (TypeError, ValueError):
+            signature = "(...)"
+        return FunctionInfo(name, "", getattr(func, "__name__", name), signature, inspect.getdoc(func) or "")
+
+
+def scan_module(path: str) -> List[FunctionInfo]:
+    """List the public functions defined at module level in a source file."""
+    import ast
+
+    def signature(node) -> str:
+        args = f"({ast.unparse(node.args)})"
+        return f"{args} -> {ast.unparse(node.returns)}" if node.returns else args
+
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    return [FunctionInfo(f"{module_name}.{node.name}", module_name, node.name, signature(node),
+                         ast.get_docstring(node) or "", path)
+            for node in tree.body
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and not node.name.startswith("_")]
+
+
+def _module_files() -> List[str]:
+    return sorted(os.path.join(PACKAGE_DIR, filename) for filename in os.listdir(PACKAGE_DIR)
+                  if filename.endswith('.py') and not filename.startswith('test_') and filename != '__init__.py')
+
+
+def load_manifest(manifest_path: str = MANIFEST_PATH) -> List[FunctionInfo]:
+    """Build the manifest of all modules, rescanning only files whose mtime or size changed."""
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("version") != MANIFEST_VERSION:
+            cached = {}
+    except (OSError, ValueError):
+        cached = {}
+    cached_files = cached.get("files", {})
+
+    files, entries, changed = {}, [], False
+    for path in _module_files():
+        filename = os.path.basename(path)
+        stat = os.stat(path)
+        key = [stat.st_mtime_ns, stat.st_size]
+        entry = cached_files.get(filename)
+        if entry is None or entry["key"] != key:
+            entry = {"key": key, "functions": [info._asdict() for info in scan_module(path)]}
+            changed = True
+        files[filename] = entry
+        entries.extend(FunctionInfo(**{**info, "path": path}) for info in entry["functions"])
+
+    if changed or set(files) != set(cached_files):
+        try:
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": MANIFEST_VERSION, "files": files}, f, ensure_ascii=False)
+            os.replace(temp_path, manifest_path)
+        except OSError:
+            pass  # read-only checkout: scan again next time
+    return entries
+
 
 # Global registry to store all functions
-function_registry: Dict[str, Callable] = {}
+function_registry = FunctionRegistry()
 
 def register_function(name: str, func: Callable) -> None:
     """Register a function in the global registry."""
     function_registry[name] = func
 
 def get_function(name: str) -> Callable:
-    """Get a function from the registry."""
+    """Get a function from the registry, importing its module if needed."""
     return function_registry.get(name)
 
+def describe_function(name: str) -> FunctionInfo:
+    """Get the name, signature and docstring of a registered function without importing it."""
+    return function_registry.describe(name)
+
 def list_functions() -> Dict[str, Callable]:
-    """List all registered functions."""
-    return function_registry.copy()
+    """List all registered functions (imports every module)."""
+    return dict(function_registry)
 
 def auto_register_functions() -> None:
     """
-    Automatically discover and register all functions in this directory.
-    Looks for functions that have a specific decorator or naming convention.
+    Discover the public functions in this directory and register them lazily.
+    Only functions defined in a module are registered, not the helpers it imports.
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # Get all Python files in the directory
-    for filename in os.listdir(current_dir):
-        if filename.endswith('.py') and not filename.startswith('test_') and filename != '__init__.py':
-            module_name = filename[:-3]  # Remove .py extension
-            
-            # Import the module
-            module = importlib.import_module(f'.{module_name}', package=__package__)
-            
-            # Look for all functions in the module
-            for name, obj in inspect.getmembers(module):
-                # Register only functions that don't start with underscore
-                if inspect.isfunction(obj) and not name.startswith('_'):
-                    register_function(f"{module_name}.{name}", obj)
+    function_registry.add_manifest(load_manifest())
 
 # Automatically register all functions when this package is imported
 auto_register_functions()
@@ -1,12 +1,13 @@
 import subprocess
-from typing import Dict
+from typing import Dict, Optional
 
-def execute_shell_command(command: str) -> Dict[str, str]:
+def execute_shell_command(command: str, timeout: Optional[float] = None) -> Dict[str, str]:
     """
     Execute a shell command and capture its standard output and standard error.
 
     Args:
         command (str): The shell command to execute.
+        timeout (float, optional): Seconds to wait before the command is killed, defaults to no limit.
 
     Returns:
         Dict[str, str]: A dictionary with keys 'output' and 'error' capturing
@@ -27,10 +28,14 @@ def execute_shell_command(command: str) -> Dict[str, str]:
             shell=True, 
             text=True, 
             capture_output=True, 
-            check=False
+            check=False,
+            timeout=timeout
         )
         output = result.stdout
         error = result.stderr
+    except subprocess.TimeoutExpired as e:
+        output = e.stdout.decode() if isinstance(e.stdout, bytes) else (e.stdout or '')
+        error = f'Command timed out after {timeout} seconds'
     except Exception as e:
         output = ''
         error = f'Exception occurred: {str(e)}'
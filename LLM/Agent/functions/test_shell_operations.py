@@ -38,6 +38,12 @@ class TestExecuteShellCommand(unittest.TestCase):
         result = execute_shell_command(command)
         self.assertEqual(result, expected_output, f'Expected {expected_output}, but got {result}')
 
+    def test_command_timeout(self):
+        # Test a command that runs longer than the timeout
+        result = execute_shell_command('echo start; sleep 5', timeout=0.5)
+        self.assertEqual(result['output'], 'start\n')
+        self.assertIn('timed out', result['error'])
+
 # This allows the tests to be run if this file is executed directly
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
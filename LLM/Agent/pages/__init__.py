@@ -1,19 +1,24 @@
 from dotenv import load_dotenv
 import streamlit as st
-from core.session_manager import LocalSessionManager as SessionManager
+from core.session_manager import get_session_manager
+from core.session_writer import get_session_writer
 
 # 加载环境变量
 load_dotenv()
 
 def init_streamlit():
-    # 初始化对话管理
+    # 初始化对话管理（会话管理器在进程内共享，后台线程只启动一次）
     if 'session_manager' not in st.session_state:
-        st.session_state.session_manager = SessionManager()
-        if len(st.session_state.session_manager.list()) < 1:
+        st.session_state.session_manager = get_session_manager()
+        if st.session_state.session_manager.count() < 1:
             st.session_state.session_manager.new({})
 
+    if 'session_writer' not in st.session_state:
+        # 与会话管理器一样进程内共享，管理器关闭时一起关闭
+        st.session_state.session_writer = get_session_writer(st.session_state.session_manager)
+
     if 'session' not in st.session_state:
-        session_info = st.session_state.session_manager.list()[0]
+        session_info = st.session_state.session_manager.list(limit=1)[0]
         st.session_state.session = st.session_state.session_manager.get(session_info)
 
     if 'quoted_history' not in st.session_state:
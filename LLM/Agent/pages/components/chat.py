@@ -2,23 +2,47 @@ import os
 import json
 import logging
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple, Union
 from uuid import UUID, uuid4
 
 import streamlit as st
-from openai import OpenAI
 
-from core.memory import Memory, MemoryManager
-from functions.re_exact import json_exact
-from functions import function_registry, register_function
+from core.chat_pipeline import ChatPipeline
+from core.llm_client import get_llm_client
+from core.tool_executor import ToolBatch, ToolExecutor, ToolResult
+from core.memory import Memory, MemoryManager, get_memory_manager as shared_memory_manager
+from core.prompt_assembler import PromptAssembler
+from core.response_cache import ResponseCache
+from core.tool_calls import Speculation, ToolCallError, ToolCallParser, parse_tool_calls, repair_prompt
+from functions import describe_function, function_registry, register_function
 from .history import clear_quotes
 from .interactive import interactive
 
-# 初始化 OpenAI Chat 客户端
-chat_client = OpenAI(
-    base_url=os.getenv("CHAT_BASE_URL"),
-    api_key=os.getenv("CHAT_API_KEY")
-)
+# 系统提示词中记忆部分的 token 预算，以及参与拼装的候选记忆条数
+MEMORY_CONTEXT_TOKENS = int(os.getenv("MEMORY_CONTEXT_TOKENS", "1500"))
+MEMORY_CONTEXT_CANDIDATES = int(os.getenv("MEMORY_CONTEXT_CANDIDATES", "20"))
+
+# 初始化流式对话管线，使用共享的 chat 端点（CHAT_* 配置）；服务端不支持 stream_options 时设置 CHAT_STREAM_USAGE=0
+# think 的回复可以缓存（RESPONSE_CACHE，默认关闭），重复执行计划或回放回归时不再请求模型
+response_cache = ResponseCache.from_env()
+chat_pipeline = ChatPipeline(get_llm_client("chat"), stream_usage=os.getenv("CHAT_STREAM_USAGE", "1") != "0",
+                             cache=response_cache)
+
+# 系统提示词按 静态前缀 → 工具列表 → 计划 → 记忆 的顺序拼装，各段按键复用
+prompt_assembler = PromptAssembler()
+
+# 同时执行互不依赖的工具调用（TOOL_* 配置）；think / run_plan 需要 Streamlit 脚本线程，不进入线程池
+tool_executor = ToolExecutor.from_env(function_registry)
+SCRIPT_THREAD_ACTIONS = {"think", "run_plan"}
+
+# run_plan 的步数上限，以及动作格式错误时让模型修正的次数
+PLAN_MAX_STEPS = int(os.getenv("PLAN_MAX_STEPS", "20"))
+PLAN_MAX_REPAIRS = int(os.getenv("PLAN_MAX_REPAIRS", "2"))
+# 模型还在输出时，动作代码块一闭合就提前执行的工具（逗号分隔的工具名，留空关闭）。
+# 提前执行的动作可能被放弃，默认只有只读工具；有副作用的工具需要显式加入
+PLAN_SPECULATIVE_TOOLS = frozenset(
+    name.strip() for name in os.getenv("PLAN_SPECULATIVE_TOOLS", "filesystem_operations.read_file_segment").split(",")
+    if name.strip())
 
 april_prompt = """
 你是一个诚实、稳健的AI助手，尽力完成用户的要求。
@@ -26,11 +50,11 @@ april_prompt = """
 你有很多能力，或者说工具，当你输出
 ```json
 {
-    "function_name": "xxx",
+    "action_name": "xxx",
     "parameters": {}
 }
 ```
-时，可以调用相关的能力
+时，可以调用相关的能力。多个互不依赖的调用（例如读取多个文件）可以放在一个 JSON 数组中一次输出，它们会同时执行
 
 注意：
 1. 请参考相关记忆
@@ -43,31 +67,31 @@ april_prompt = """
 
 """
 
-def get_relevant_memories(query: str) -> List[Memory]:
+def get_memory_manager() -> MemoryManager:
+    """进程内共享的 MemoryManager，同时记在 st.session_state 中供其他页面使用，只能在 Streamlit 脚本线程中调用"""
+    memory_manager = shared_memory_manager()
+    st.session_state.memory_manager = memory_manager
+    return memory_manager
+
+def get_relevant_memories(query: str, k: int = 5, memory_manager: MemoryManager = None) -> List[Memory]:
     """获取与查询相关的记忆
     
     Args:
         query: 查询内容
-        search_type: 搜索类型，可选 "vector"（向量搜索）、"keyword"（关键词搜索）、"trigger"（触发器搜索）
-        exact_match: 是否精确匹配（仅对关键词搜索有效）
+        k: 返回的记忆条数
+        memory_manager: 在脚本线程之外调用时需要传入
         
     Returns:
-        相关的记忆列表
+        相关的记忆列表，按相关度从高到低
     """
-    memory_manager = st.session_state.get('memory_manager')
-    if not memory_manager:
-        memory_manager = MemoryManager()
-        st.session_state.memory_manager = memory_manager
+    memory_manager = memory_manager or get_memory_manager()
     
-    relevant_memories = []
-    # Maybe: triggers 需要进行排序，字符越长越靠前，保证后面有最长字符优先匹配的特性
     # Idea: label 可以用在匹配后填充上，填充到 prompt 的不同位置，或者 function_call 里
-    for trigger in memory_manager.triggers:
-        # 输入里有 trigger 词，直接匹配
-        if trigger in query:
-            relevant_memories.extend(memory_manager.search_memory(query=trigger, search_type="trigger"))
-    
-    return relevant_memories
+    # 混合检索：trigger（自动机一次扫描）、向量、关键词、标签并发召回后按 RRF 融合，超时的来源会被丢弃
+    results = memory_manager.hybrid_search(query, k=k)
+    for item in results:
+        logging.debug(f"memory {item.memory.id} score={item.score:.4f} sources={item.sources}")
+    return [item.memory for item in results]
 
 def fetch_info_from_environment(environment: dict, prompt: str) -> str:
     """从环境变量中提取信息"""
@@ -77,33 +101,58 @@ def fetch_info_from_environment(environment: dict, prompt: str) -> str:
             environment_info += f"{key} result: {value}\n"
     return environment_info
 
-def build_system_prompt_with_memory(query: str, plan: str) -> str:
-    """构建系统提示"""
-    # fetch long-term memories by query
-    relevant_memories = get_relevant_memories(query)
-    
-    # build relevant memories context
-    memory_context = "\n# 和用户有关的记忆：\n"
-    for memory in relevant_memories:
-        memory_context += f"\ncreated at [{memory.created_at}]\nsummary:\n{memory.original_text}\n"
-    
-    if plan:
-        memory_context += f"\n\n当前正在执行的计划：\n{plan}\n"
-    
+def render_tool_list() -> str:
+    """已注册能力的列表，按名称排序，每个能力一行（签名和文档字符串的第一行）
+
+    信息来自函数清单，不会为了生成提示词导入工具模块。
+    """
+    lines = []
+    for name in sorted(abilities):
+        info = describe_function(name)
+        lines.append(f"- {name}{info.signature}: {info.summary}" if info.summary else f"- {name}{info.signature}")
+    return "\n".join(lines) + "\n"
+
+def build_system_prompt_with_memory(query: str, plan: str, memory_manager: MemoryManager = None) -> str:
+    """构建系统提示；传入 memory_manager 时不访问 st.session_state，可以在其他线程中执行
 
-    prompt = april_prompt + memory_context
-    return prompt
+    各段从稳定到多变排列（静态前缀、工具列表、计划、记忆），让服务端的前缀缓存复用尽量长的前缀；
+    查询和记忆库版本不变时（例如 Streamlit 重新运行脚本）不重新检索记忆。
+    """
+    memory_manager = memory_manager or get_memory_manager()
 
-def chat_with_conversation(user_input: str, system_prompt: str = "", history: List[Dict] = None) -> str:
-    """与用户对话，包含记忆上下文"""
+    def memories_block():
+        # fetch long-term memories by query
+        relevant_memories = get_relevant_memories(query, k=MEMORY_CONTEXT_CANDIDATES, memory_manager=memory_manager)
+        # build relevant memories context, packed into a token budget (cached until memories change)
+        return "\n# 和用户有关的记忆：\n" + memory_manager.context_packer.pack(
+            relevant_memories, MEMORY_CONTEXT_TOKENS, memory_manager.version)
+
+    prompt = prompt_assembler.assemble([
+        prompt_assembler.segment("static", None, lambda: april_prompt),
+        prompt_assembler.segment("tools", tuple(sorted(abilities)), render_tool_list),
+        prompt_assembler.segment("plan", plan, lambda: f"\n当前正在执行的计划：\n{plan}\n" if plan else ""),
+        prompt_assembler.segment(
+            "memories", (id(memory_manager), memory_manager.version, query, MEMORY_CONTEXT_TOKENS), memories_block),
+    ])
+    return prompt.text
+
+def chat_with_conversation(user_input: str, system_prompt: Union[str, Callable[[], str]] = "",
+                           history: List[Dict] = None, use_cache: bool = False,
+                           on_action: Callable[[str], None] = None) -> str:
+    """与用户对话，包含记忆上下文
+
+    system_prompt 可以是构建提示词的函数：它在后台线程中执行，与建立模型服务连接同时进行。
+    use_cache 为 True 且配置了回复缓存时，相同的提示词和消息直接使用缓存的回复。
+    on_action 在回复中第一个 ```json 代码块闭合时（模型可能还在输出）以代码块的文本调用。
+    """
+    history = history or []
     # 添加用户消息
     with st.chat_message("user"):
         with st.expander("System Prompt"):
-            st.write(system_prompt)
+            system_prompt_box = st.empty()
         st.write(user_input)
     
-    messages =  [{"role": "system", "content": system_prompt}] + \
-        [{"role": m["role"], "content": m["content"]} for m in history] + \
+    messages = [{"role": m["role"], "content": m["content"]} for m in history] + \
         [{"role": "user", "content": user_input}]
     
     previous_ids = []
@@ -121,21 +170,34 @@ def chat_with_conversation(user_input: str, system_prompt: str = "", history: Li
     })
 
     # 生成并显示AI回复
+    turn = chat_pipeline.stream(system_prompt, messages, use_cache=use_cache)
+    parser = ToolCallParser()
+    action_ms = None
+
+    def tokens():
+        # 边输出边扫描，记录动作代码块闭合的时间
+        nonlocal action_ms
+        for token in turn:
+            block = parser.feed(token)
+            if block is not None:
+                action_ms = turn.elapsed_ms()
+                if on_action:
+                    try:
+                        on_action(block)
+                    except Exception as e:
+                        logging.error(f"Error dispatching action early: {e}")
+            yield token
+
     with st.chat_message("assistant"):
-        stream = chat_client.chat.completions.create(
-            model=os.getenv("CHAT_MODEL"),
-            messages=messages,
-            stream=True,
-        )
         try:
-            reasoning_response = ""
-            if hasattr(stream, "reasoning_content"):
-                reasoning_response += stream.reasoning_content
-                print(stream.reasoning_content, end="")
-            response = st.write_stream(stream)
+            st.write_stream(tokens())
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
             logging.error(f"Chat error: {str(e)}", exc_info=True)
+        response = turn.text
+        if turn.reasoning:
+            logging.debug(f"Reasoning: {turn.reasoning}")
+    system_prompt_box.write(turn.system_prompt)
     
     # 添加AI回复到消息记录
     st.session_state.session.conversation.append({
@@ -148,7 +210,15 @@ def chat_with_conversation(user_input: str, system_prompt: str = "", history: Li
         }
     })
     
-    st.session_state.session_manager.save(st.session_state.session)
+    # 交给后台写线程保存，界面不等待写盘
+    st.session_state.session_writer.submit(st.session_state.session)
+    metrics = turn.finish()
+    usage = prompt_assembler.record(turn.system_prompt, messages, metrics.cached_tokens)
+    logging.info(f"Chat turn: prompt {metrics.prompt_ms:.0f} ms, TTFT {metrics.ttft_ms or 0:.0f} ms, "
+                 f"last token {metrics.total_ms:.0f} ms, end of turn {metrics.end_of_turn_ms:.0f} ms, "
+                 f"action ready {action_ms or 0:.0f} ms; "
+                 f"prompt ~{usage.prompt_tokens} tokens, reusable prefix ~{usage.prefix_tokens}, "
+                 f"cached {usage.cached_tokens}, segments reused {usage.reused_segments}/{usage.segments}")
     
     # 清空被引用的对话历史
     clear_quotes()
@@ -157,44 +227,118 @@ def chat_with_conversation(user_input: str, system_prompt: str = "", history: Li
 def think(content: str, environment: dict) -> str:
     """LLM 调用
     """
-    system_prompt = build_system_prompt_with_memory(content, environment.get("plan", ""))
-    response = chat_with_conversation(content, system_prompt, environment.get("conversation", []))
+    memory_manager = get_memory_manager()
+    plan = environment.get("plan", "")
+    # 记忆检索和提示词拼装在管线的后台线程中执行
+    response = chat_with_conversation(
+        content, lambda: build_system_prompt_with_memory(content, plan, memory_manager),
+        environment.get("conversation", []), use_cache=True, on_action=environment.get("on_action"))
     return response
 
-def execute_action(action: str, environment: dict) -> str:
+def parse_actions(action: Union[str, Dict, List[Dict]]) -> List[Dict]:
+    """把模型输出的动作（```json 代码块，一个对象或对象数组）解析为动作列表
+
+    动作按已注册函数的签名校验，无法解析或不符合签名时抛出 ToolCallError；文本中没有代码块时返回 []。
+    """
+    if isinstance(action, str):
+        return parse_tool_calls(action, abilities)
+    return parse_tool_calls(f"```json\n{json.dumps(action, ensure_ascii=False)}\n```", abilities)
+
+def run_actions(actions: List[Dict], environment: dict, batch: Optional[ToolBatch] = None) -> List[ToolResult]:
+    """执行一组互不依赖的动作，按输入顺序返回结果
+
+    工具在执行器的线程池/进程池中同时执行；think 等需要 Streamlit 脚本线程的动作在工具完成之后依次执行。
+    batch 为已经提前提交的工具调用（见 core.tool_calls.Speculation），传入时只等待它的结果。
+    """
+    tools = [a for a in actions if a.get("action_name") not in SCRIPT_THREAD_ACTIONS]
+    results = iter(tool_executor.collect(batch) if batch else tool_executor.run(tools))
+    ordered = []
+    for action in actions:
+        function = action.get("action_name", "")
+        if function not in SCRIPT_THREAD_ACTIONS:
+            ordered.append(next(results))
+            continue
+        params = action.get("parameters", {}).copy()  # Create a copy to avoid modifying original
+        result = ToolResult(function, params)
+        try:
+            # Add environment to params for think
+            result.result = think(params["content"], environment) if function == "think" else abilities[function](**params)
+        except Exception as e:
+            logging.error(f"Error executing {function}: {e}")
+            result.error = str(e)
+        ordered.append(result)
+    return ordered
+
+def execute_action(action: Union[str, Dict, List[Dict]], environment: dict):
     """
     Execute action
     
     Args:
-        action (str): Action in workflow
+        action: Action in workflow, a single action or a list of independent actions
         environment (dict): Environment variables
         
     Returns:
-        dict: Function call
+        The result of a single action; for a list, the descriptions of all results in order
     """
     try:
-        action = json_exact(action)
+        actions = parse_actions(action)
     except Exception as e:
         logging.error(f"Error parsing action: {e}")
         return f"Error parsing action: {e}"
+    if not actions:
+        return "Error parsing action: no ```json action block found"
 
-    function = action.get("action_name", "")
-    params = action.get("parameters", {}).copy()  # Create a copy to avoid modifying original
-    
-    # Add environment to params for think
-    if function == "think":
-        return think(params["content"], environment)
+    results = run_actions(actions, environment)
+    if len(results) == 1 and not isinstance(action, list):
+        result = results[0]
+        return f"Error executing {result.name}: {result.error}" if result.error else result.result
+    return "\n\n".join(result.describe() for result in results)
+
+def remember_exchange(environment: dict, content: str, reply: str):
+    """把一问一答追加到计划的对话中"""
+    environment["conversation"].extend([
+        {"role": "user", "time": str(datetime.now()), "content": content, "id": str(datetime.now().timestamp())},
+        {"role": "assistant", "time": str(datetime.now()), "content": reply, "id": str(datetime.now().timestamp())},
+    ])
 
+def speculative_think(content: str, environment: dict) -> Tuple[str, Speculation]:
+    """think，同时在动作代码块闭合时提前执行其中的只读工具（PLAN_SPECULATIVE_TOOLS）"""
+    speculation = Speculation(tool_executor, abilities, PLAN_SPECULATIVE_TOOLS, exclude=SCRIPT_THREAD_ACTIONS)
+    environment["on_action"] = speculation
     try:
-        result = abilities.get(function)(**params)
-    except Exception as e:
-        logging.error(f"Error executing {function}: {e}")
-        result = f"Error executing {function}: {e}"
-    
-    return result
+        reply = think(content, environment)
+    finally:
+        environment.pop("on_action", None)
+    remember_exchange(environment, content, reply)
+    return reply, speculation
+
+def decide_next(content: str, environment: dict) -> Tuple[str, List[Dict], Optional[ToolBatch]]:
+    """think 并解析出下一步的动作
+
+    动作无法解析或不符合函数签名时，把错误反馈给模型让它修正，最多 PLAN_MAX_REPAIRS 次，仍然失败时抛出 ToolCallError。
+
+    Returns:
+        (模型的回复, 动作列表, 已经提前开始执行的工具调用)，没有动作时列表为空
+    """
+    reply, speculation = speculative_think(content, environment)
+    for attempt in range(PLAN_MAX_REPAIRS + 1):
+        try:
+            actions = parse_actions(reply)
+        except ToolCallError as e:
+            speculation.take([])
+            logging.warning(f"Invalid action (attempt {attempt + 1}): {e}")
+            if attempt == PLAN_MAX_REPAIRS:
+                raise
+            content = repair_prompt(e)
+            reply, speculation = speculative_think(content, environment)
+            continue
+        return reply, actions, speculation.take(actions)
 
 def run_plan(plan: str) -> str:
     """执行计划
+
+    模型每一步可以输出一个动作或一组互不依赖的动作，一组动作同时执行，结果合并后在一次 think 中反馈。
+    模型不再输出动作（或输出 finished）时结束；动作多次修正仍不合法或超过 PLAN_MAX_STEPS 步时停止。
     
     Args:
         plan (str): 计划
@@ -206,42 +350,35 @@ def run_plan(plan: str) -> str:
         "conversation": []
     }
     
-    # thinking
-    init_action = "`@plan_decide_next`\n`@function_description`\n开始执行第一步"
-    next_action = think(init_action, environment)
-    environment["conversation"].extend([
-        {"role": "user", "time": str(datetime.now()), "content": init_action, "id": str(datetime.now().timestamp())}, 
-        {"role": "assistant", "time": str(datetime.now()), "content": next_action, "id": str(datetime.now().timestamp())}
-    ])
+    response = ""
+    content = "`@plan_decide_next`\n`@function_description`\n开始执行第一步"
+    for step in range(PLAN_MAX_STEPS):
+        # thinking
+        try:
+            next_action, actions, batch = decide_next(content, environment)
+        except ToolCallError as e:
+            response = f"Plan stopped: invalid action after {PLAN_MAX_REPAIRS} repairs: {e}"
+            st.error(response)
+            break
+        if step:
+            # Show as assistant called the function
+            with st.chat_message("assistant"):
+                st.markdown(next_action)
+        if not actions or "finished" in next_action.lower():
+            if batch:
+                batch.cancel()
+            break
 
-    while isinstance(next_action, dict) or (isinstance(next_action, str) and "finished" not in next_action.lower()):
         # action
-        response = execute_action(next_action, environment)
+        results = run_actions(actions, environment, batch)
+        response = "\n\n".join(result.describe() for result in results)
         # Show as user called the function
         with st.chat_message("user"):
             st.markdown(response)
-        
-        # thinking
-        next_action = think(
-            "`@plan_decide_next`\n`@function_description`\n" + f"action_name: {next_action['action_name']}\nparameters: {next_action['parameters']}\nresult: {response}", 
-            environment)
-        # Show as assistant called the function
-        with st.chat_message("assistant"):
-            st.markdown(next_action)
-        
-        environment["conversation"].append({
-            "role": "user",
-            "time": str(datetime.now()),
-            "content": response,
-            "id": str(datetime.now().timestamp())
-        })
-        
-        environment["conversation"].append({
-            "role": "assistant",
-            "time": str(datetime.now()),
-            "content": next_action,
-            "id": str(datetime.now().timestamp())
-        })
+        content = "`@plan_decide_next`\n`@function_description`\n" + response
+    else:
+        response += f"\n\nPlan stopped after {PLAN_MAX_STEPS} steps"
+        st.warning(f"Plan stopped after {PLAN_MAX_STEPS} steps")
 
     return response
 
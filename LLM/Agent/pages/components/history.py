@@ -1,14 +1,37 @@
+import os
+
 import pyperclip
 import streamlit as st
 
-# 显示历史消息，按问答对分组
+# 默认显示最近多少轮问答，"Load older" 每次再多加载这么多轮
+HISTORY_PAGE_TURNS = int(os.getenv("HISTORY_PAGE_TURNS", "10"))
+# 折叠时只读取消息的前若干个字符，展开、引用或复制时才读取全文
+HISTORY_PREVIEW_CHARS = 80
+
+
+# 显示历史消息，按问答对分组；只从会话存储中读取最近的若干轮
 def show_conversation_history():
-    for i in range(0, len(st.session_state.session.conversation), 2):
-        if i + 1 >= len(st.session_state.session.conversation):
-            break
+    session_manager = st.session_state.session_manager
+    session_id = st.session_state.session.session_id
+    # 上一轮对话可能还在后台保存
+    st.session_state.session_writer.flush(session_id)
+    if "history_turns" not in st.session_state:
+        st.session_state.history_turns = {}
+
+    pairs = session_manager.message_count(session_id) // 2
+    turns = min(st.session_state.history_turns.get(session_id, HISTORY_PAGE_TURNS), pairs)
+    first = (pairs - turns) * 2
+
+    if first > 0:
+        if st.button(f"Load older ({first // 2} more turns)", key=f"load_older_{session_id}"):
+            st.session_state.history_turns[session_id] = turns + HISTORY_PAGE_TURNS
+            st.rerun()
 
-        user_msg = st.session_state.session.conversation[i]
-        assistant_msg = st.session_state.session.conversation[i + 1]
+    messages = session_manager.read_messages(session_id, first, pairs * 2, preview_chars=HISTORY_PREVIEW_CHARS)
+    for offset in range(0, len(messages) - 1, 2):
+        i = first + offset
+        user_msg, assistant_msg = messages[offset], messages[offset + 1]
+        full_pair = lambda i=i: session_manager.read_messages(session_id, i, i + 2)
 
         if i not in st.session_state.quotes:
             st.session_state.quotes[i] = False
@@ -17,10 +40,15 @@ def show_conversation_history():
         with st.container():
             col1, col2 = st.columns([0.9, 0.1])
             with col1:
+                truncated = user_msg.get("truncated") or assistant_msg.get("truncated")
+                # 短消息直接显示；长消息折叠，打开开关时才读取全文
+                expanded = not truncated or st.toggle(assistant_msg["content"], key=f"expand_{session_id}_{i}")
+                if truncated and expanded:
+                    user_msg, assistant_msg = full_pair()
                 with st.chat_message(user_msg["role"]):
-                    st.markdown(user_msg["content"])
-                with st.chat_message(assistant_msg["role"]):
-                    with st.expander(assistant_msg["content"][:80]):
+                    st.markdown(user_msg["content"] + ("…" if user_msg.get("truncated") else ""))
+                if expanded:
+                    with st.chat_message(assistant_msg["role"]):
                         st.markdown(assistant_msg["content"])
             with col2:
                 if st.checkbox("Quote", key=f"quote_{i}", value=st.session_state.quotes[i],
@@ -28,16 +56,16 @@ def show_conversation_history():
                                    {i: not st.session_state.quotes[i]})):
                     # 检查是否已经引用过
                     if user_msg["id"] not in st.session_state.quoted_ids:
-                        # 拼接被引用的对话历史
-                        st.session_state.quoted_history.extend([user_msg, assistant_msg])
+                        # 拼接被引用的对话历史（全文）
+                        st.session_state.quoted_history.extend(full_pair())
                         st.session_state.quoted_ids.add(user_msg["id"])
                 # Copy buttons
                 if st.button("Copy User Message", key=f"copy_user_{i}"):
-                    pyperclip.copy(user_msg["content"])  # Copy to clipboard
+                    pyperclip.copy(full_pair()[0]["content"])  # Copy to clipboard
                     st.success("User message copied to clipboard!")
 
                 if st.button("Copy Assistant Message", key=f"copy_assistant_{i}"):
-                    pyperclip.copy(assistant_msg["content"])  # Copy to clipboard
+                    pyperclip.copy(full_pair()[1]["content"])  # Copy to clipboard
                     st.success("Assistant message copied to clipboard!")
 
 
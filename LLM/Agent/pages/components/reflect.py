@@ -6,16 +6,13 @@ from typing import List, Dict
 import logging
 
 import streamlit as st
-from openai import OpenAI
 
-from core.memory import Environment
+from core.llm_client import get_llm_client, message_tokens
+from core.memory import Environment, get_memory_manager
 from .chat import think, run_plan
 
-# 初始化 OpenAI Chat 客户端
-chat_client = OpenAI(
-    base_url=os.getenv("MEM_BASE_URL"),
-    api_key=os.getenv("MEM_API_KEY")
-)
+# 共享的 mem 端点（MEM_* 配置）
+mem_client = get_llm_client("mem")
 
 prompt = """从以下对话中提取关键信息，重点关注用户(user)的表述。特别注意以下两点：
 1. 用户的积极反馈，例如称赞、认可等，表明助手(assistant)的回答效果良好，要记录下来。
@@ -46,23 +43,22 @@ def reflect_on_conversation(conversation_history: List[Dict], prompt: str) -> st
         env = Environment()
         env.publish("env://conversation_history", conversation_history)
         
-        reflection_stream = chat_client.chat.completions.create(
-            model=os.getenv("MEM_MODEL"),
-            messages=[
-                {"role": "system", "content": "你是一个专注于分析和总结的AI助手。"},
-                {"role": "user", "content": prompt.format(conversations="\n".join([f"{c['role']} - {c['content']}" for c in conversation_history]))},
-            ],
-            stream=True,
+        messages = [
+            {"role": "system", "content": "你是一个专注于分析和总结的AI助手。"},
+            {"role": "user", "content": prompt.format(conversations="\n".join([f"{c['role']} - {c['content']}" for c in conversation_history]))},
+        ]
+        reflection_stream = mem_client.call(
+            lambda client: client.chat.completions.create(
+                model=mem_client.endpoint.model, messages=messages, stream=True),
+            tokens=message_tokens(messages),
         )
         reflection = st.write_stream(reflection_stream)
         
         # 保存反思结果到记忆
         mem_json = json.loads(re.match(r"```json\n(.*)\n```", reflection, re.DOTALL).group(1))
-        memory_manager = st.session_state.get('memory_manager')
-        if memory_manager:
-            for mem in mem_json:
-                mem["labels"] = mem["labels"] + ["reflection"]
-                memory_manager.add_memory(**mem)
+        for mem in mem_json:
+            mem["labels"] = mem["labels"] + ["reflection"]
+        get_memory_manager().add_memories(mem_json)
         
         clear_quotes()
         return reflection
@@ -1,15 +1,34 @@
 import logging
 import streamlit as st
+from core.session_manager import PERIODS
 from .reflect import reflect_on_conversation
 
+SESSIONS_PER_PAGE = 50
+
 @st.dialog("Select Session")
 def select_session_dialog():
-    session_name = st.selectbox("Select Session", ["New Session"] + [s["session_name"] for s in st.session_state.session_manager.list()])
-    if st.button("Select"):
-        if session_name == "New Session":
-            st.session_state.session = st.session_state.session_manager.new({"session_name": "New Session"})
+    session_manager = st.session_state.session_manager
+    period = st.selectbox("Period", ["All"] + list(PERIODS))
+    page = st.number_input("Page", min_value=1, value=1)
+    sessions = session_manager.list(period=None if period == "All" else period,
+                                    offset=(page - 1) * SESSIONS_PER_PAGE, limit=SESSIONS_PER_PAGE)
+    names = {s["session_id"]: s["session_name"] for s in sessions}
+    session_id = st.selectbox("Select Session", [None] + list(names),
+                              format_func=lambda i: "New Session" if i is None else names[i])
+    col1, col2 = st.columns(2)
+    if col1.button("Select"):
+        if session_id is None:
+            st.session_state.session = session_manager.new({"session_name": "New Session"})
         else:
-            st.session_state.session = st.session_state.session_manager.get({"session_name": session_name})
+            st.session_state.session_writer.flush(session_id)
+            st.session_state.session = session_manager.get({"session_id": session_id})
+        st.rerun()
+    if col2.button("Delete", disabled=session_id is None):
+        # 只做删除标记，保留期过后由后台的回收任务删除文件
+        st.session_state.session_writer.flush(session_id)
+        session_manager.delete(session_id)
+        if st.session_state.session.session_id == session_id:
+            st.session_state.session = session_manager.new({"session_name": "New Session"})
         st.rerun()
 
 def render_sidebar():
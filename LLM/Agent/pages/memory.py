@@ -1,4 +1,4 @@
-from core.memory import MemoryManager
+from core.memory import get_memory_manager
 # Streamlit UI
 import streamlit as st
 
@@ -114,9 +114,17 @@ def delete_trigger_dialog():
 def show_memory_dialog():
     memory_manager = st.session_state.memory_manager
  
-    search_type = st.selectbox("选择查询类型", ["vector", "keyword", "label", "trigger"], key="search_type")
- 
-    if search_type == "vector":
+    search_type = st.selectbox("选择查询类型", ["hybrid", "vector", "keyword", "label", "trigger"], key="search_type")
+ 
+    if search_type == "hybrid":
+        query = st.text_input("输入查询文本", key="hybrid_query")
+        k = st.number_input("选择返回结果数量", min_value=1, max_value=100, value=5, key="hybrid_k")
+        if st.button("查询", key="hybrid_search"):
+            results = memory_manager.hybrid_search(query, k=k)
+            st.dataframe([{"id": item.memory.id, "score": round(item.score, 4), "sources": item.sources}
+                          for item in results])
+            display_memories([item.memory for item in results], memory_manager)
+    elif search_type == "vector":
         query = st.text_input("输入查询文本", key="vector_query")
         k = st.number_input("选择返回结果数量", min_value=1, max_value=100, value=5, key="vector_k")
         if st.button("查询", key="vector_search"):
@@ -126,8 +134,10 @@ def show_memory_dialog():
         query = st.text_input("输入关键词", key="keyword_query")
         exact_match = st.checkbox("精确匹配", key="exact_match")
         k = st.number_input("选择返回结果数量", min_value=1, max_value=100, value=5, key="keyword_k")
+        page = st.number_input("页码", min_value=1, value=1, key="keyword_page")
         if st.button("查询", key="keyword_search"):
-            memories = memory_manager.search_memory(query, k=k, search_type=search_type, exact_match=exact_match)
+            memories = memory_manager.search_memory(query, k=k, search_type=search_type, exact_match=exact_match,
+                                                    offset=(page - 1) * k)
             display_memories(memories, memory_manager)
     elif search_type == "label":
         labels = st.multiselect("选择标签", list(memory_manager.labels), default=[], key="label_select")
@@ -236,12 +246,16 @@ def display_buttons(memory_manager):
     st.sidebar.title("Memory Option")
     # """操作按钮"""
     with st.sidebar:
-        search_type = st.selectbox("选择查询类型", ["label", "trigger", "keyword", "vector"], key="search_type")
+        search_type = st.selectbox("选择查询类型", ["label", "trigger", "keyword", "vector", "hybrid"], key="search_type")
         search_query = ""
         k = 1
         labels = []
         exact_match = None
-        if search_type == "vector":
+        if search_type == "hybrid":
+            search_query = st.text_input("输入查询文本", key="hybrid_query")
+            k = st.number_input("选择返回结果数量", min_value=1, max_value=100, value=5, key="hybrid_k")
+
+        elif search_type == "vector":
             search_query = st.text_input("输入查询文本", key="vector_query")
             k = st.number_input("选择返回结果数量", min_value=1, max_value=100, value=5, key="vector_k")
  
@@ -292,9 +306,9 @@ def display_buttons(memory_manager):
 
  
 def init_memory_management():
-    # 初始化 MemoryManager 实例
+    # MemoryManager 在进程内共享
     if 'memory_manager' not in st.session_state:
-        st.session_state.memory_manager = MemoryManager()
+        st.session_state.memory_manager = get_memory_manager()
     if 'memories' not in st.session_state:
         st.session_state.memories = (
             st.session_state.memory_manager.search_memory(query='', k=20, search_type="keyword"))
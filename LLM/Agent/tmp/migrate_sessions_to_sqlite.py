@@ -0,0 +1,56 @@
+"""
+Import sessions stored by LocalSessionManager (JSON / JSON Lines files) into SqliteSessionManager.
+
+Run from LLM/Agent:
+    python -m tmp.migrate_sessions_to_sqlite [--source ./data/sessions] [--target ./data/sessions.db] [--overwrite]
+
+Creation time, names and the deleted flag are preserved. Sessions already present in the
+target database are skipped unless --overwrite is given, so the tool can be re-run safely.
+"""
+import argparse
+import glob
+import os
+
+from core.session_manager import LocalSessionManager, Session, SqliteSessionManager
+
+
+def migrate_sessions(source: str, target: str, overwrite: bool = False):
+    """Copy every session file under `source` into the SQLite database `target`"""
+    local = LocalSessionManager(source)
+    sqlite = SqliteSessionManager(target)
+    ctimes = {session_id: ctime for session_id, _, ctime in local.index.list(include_deleted=True)}
+    existing = {row[0] for row in sqlite.pool.reader().execute("SELECT session_id FROM Sessions;")}
+
+    # 同一会话可能同时存在旧的 .json 和 .jsonl，.jsonl 更新
+    files = {}
+    for path in sorted(glob.glob(os.path.join(source, "*.json"))) + sorted(glob.glob(os.path.join(source, "*.jsonl"))):
+        files[os.path.basename(path).rsplit(".", 1)[0]] = path
+
+    imported = skipped = failed = 0
+    for session_id, path in files.items():
+        if session_id in existing and not overwrite:
+            skipped += 1
+            continue
+        session_data = local.read_file(path)
+        if session_data is None:
+            failed += 1
+            continue
+        session_data.setdefault("session_id", session_id)
+        session_data.setdefault("session_name", "Default Session")
+        session_data["session_path"] = sqlite.root
+        sqlite.save(Session.from_dict(session_data), ctime=ctimes.get(session_id, os.path.getctime(path)))
+        imported += 1
+
+    local.close()
+    sqlite.close()
+    return imported, skipped, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import JSON sessions into SQLite")
+    parser.add_argument("--source", default="./data/sessions")
+    parser.add_argument("--target", default="./data/sessions.db")
+    parser.add_argument("--overwrite", action="store_true", help="replace sessions already in the database")
+    args = parser.parse_args()
+    imported, skipped, failed = migrate_sessions(args.source, args.target, args.overwrite)
+    print(f"Imported {imported} sessions, skipped {skipped} existing, {failed} unreadable")